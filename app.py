@@ -3,6 +3,8 @@ import re
 import streamlit as st
 from pathlib import Path
 
+import utils_profiler
+
 
 # =========================
 # CONFIG (SIEMPRE PRIMERO)
@@ -82,6 +84,8 @@ def _title_from_filename(fn: str) -> str:
         return "🧠 NLP Operación"
     if "tipos_de_cambio" in name or "cambio" in name:
         return "💱 Tipos de cambio"
+    if "telemetr" in name:
+        return "📊 Telemetría IA"
 
 
     # fallback: limpia prefijo numérico
@@ -91,8 +95,9 @@ def _title_from_filename(fn: str) -> str:
     return stem[:1].upper() + stem[1:]
 
 
+@st.cache_resource(show_spinner=False)
 def discover_pages():
-    """Auto-detecta archivos .py dentro de /pages para evitar PageNotFoundError."""
+    """Auto-detecta archivos .py dentro de /pages (una vez por proceso) para evitar PageNotFoundError."""
     if not os.path.isdir(PAGES_DIR):
         return []
 
@@ -140,6 +145,9 @@ if logo_path:
 else:
     st.sidebar.caption("⚠️ No se encontró el logo (Imemsa_logo.png).")
 
+# Perfilador (solo admin): perfila la siguiente ejecución, incluido el router de abajo
+utils_profiler.run_hook()
+
 with st.sidebar:
     st.markdown("## Menú")
 
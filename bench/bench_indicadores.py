@@ -0,0 +1,162 @@
+"""
+Benchmark end-to-end de "Generar Excel" (pages/7_tipos_de_cambio.py).
+
+Corre la página completa con streamlit.testing (AppTest) contra respuestas
+grabadas (cassette) y latencias inyectadas por host, y reporta tiempos por
+etapa, pico de memoria y tráfico HTTP por host.
+
+1) Grabar una vez (requiere red y tokens reales en el entorno):
+     BANXICO_TOKEN=... INEGI_TOKEN=... FRED_TOKEN=... \\
+     python bench/bench_indicadores.py --record
+
+2) Repetir offline con perfiles de latencia:
+     python bench/bench_indicadores.py --profile all --repeat 3
+     python bench/bench_indicadores.py --profile typical --json resultados.json
+
+Los tokens se redactan del cassette; en replay se usan tokens ficticios.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Dict, List
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+PAGE = "pages/7_tipos_de_cambio.py"
+SHEET_FLAGS = ("want_fred", "want_news", "want_charts", "want_raw", "want_fx")
+
+
+def _run_once(timeout: float) -> Dict:
+    import streamlit as st
+    from streamlit.testing.v1 import AppTest
+
+    import utils_cache_backend
+    import utils_http_replay as replay
+    import utils_timing
+
+    st.cache_data.clear()
+    utils_cache_backend.clear("fx")
+    replay.reset_stats()
+
+    at = AppTest.from_file(str(ROOT / "app.py"), default_timeout=timeout)
+    at.session_state["auth"] = True
+    for k in ("BANXICO_TOKEN", "INEGI_TOKEN", "FRED_TOKEN"):
+        at.secrets[k] = os.getenv(k) or "bench-token"
+    for k in SHEET_FLAGS:
+        at.session_state[k] = True
+    at.switch_page(PAGE)
+    at.run()
+    if at.exception:
+        raise RuntimeError(f"La página falló al cargar: {at.exception[0].value}")
+
+    btn = next((b for b in at.button if b.label == "Generar Excel"), None)
+    if btn is None:
+        raise RuntimeError("No se encontró el botón 'Generar Excel'.")
+
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    btn.click()
+    at.run()
+    wall = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    if at.exception:
+        raise RuntimeError(f"'Generar Excel' falló: {at.exception[0].value}")
+
+    runs = utils_timing.last_runs("Generar Excel")
+    stages = [(s.name, s.seconds, s.peak_kb) for s in runs[-1].stages] if runs else []
+    return {
+        "wall_s": wall,
+        "peak_mb": peak / (1024 * 1024),
+        "stages": stages,
+        "hosts": replay.stats(),
+        "misses": replay.misses(),
+    }
+
+
+def _print_run(profile: str, res: Dict) -> None:
+    print(f"\n== perfil: {profile} | total {res['wall_s']:.2f} s | pico memoria {res['peak_mb']:.1f} MB")
+    for name, secs, peak_kb in res["stages"]:
+        mem = f"{peak_kb / 1024:8.1f} MB" if peak_kb is not None else ""
+        print(f"   {name:<32} {secs:8.3f} s {mem}")
+    for host, st_ in sorted(res["hosts"].items()):
+        print(f"   [http] {host:<28} {int(st_['requests']):4d} req {st_['seconds']:8.2f} s")
+    if res["misses"]:
+        print(f"   [http] {len(res['misses'])} peticiones sin grabar (cassette miss), p. ej. {res['misses'][0]}")
+
+
+def _summary(results: List[Dict]) -> Dict:
+    walls = [r["wall_s"] for r in results]
+    stage_names = [n for n, _, _ in results[0]["stages"]]
+    stages = {}
+    for i, name in enumerate(stage_names):
+        vals = [r["stages"][i][1] for r in results if len(r["stages"]) > i]
+        stages[name] = statistics.median(vals)
+    return {
+        "runs": len(results),
+        "wall_median_s": statistics.median(walls),
+        "wall_min_s": min(walls),
+        "peak_mb_max": max(r["peak_mb"] for r in results),
+        "stages_median_s": stages,
+        "misses": sorted({m for r in results for m in r["misses"]}),
+    }
+
+
+def main(argv=None) -> int:
+    from utils_http_replay import DEFAULT_CASSETTE, LATENCY_PROFILES
+
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--cassette", default=str(DEFAULT_CASSETTE), help="ruta del cassette JSON")
+    ap.add_argument("--record", action="store_true", help="llamar a las APIs reales y grabar el cassette")
+    ap.add_argument("--profile", default="none", help=f"{', '.join(LATENCY_PROFILES)} o 'all'")
+    ap.add_argument("--repeat", type=int, default=1)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--timeout", type=float, default=600.0)
+    ap.add_argument("--json", dest="json_out", default="", help="guardar resultados en JSON")
+    args = ap.parse_args(argv)
+
+    os.environ["IMEMSA_HTTP_CASSETTE"] = args.cassette
+    os.environ["IMEMSA_HTTP_SEED"] = str(args.seed)
+
+    if args.record:
+        os.environ["IMEMSA_HTTP_MODE"] = "record"
+        os.environ["IMEMSA_HTTP_LATENCY"] = ""
+        res = _run_once(args.timeout)
+        _print_run("record (live)", res)
+        print(f"\nCassette guardado en {args.cassette}")
+        return 0
+
+    if not Path(args.cassette).exists():
+        print(f"No existe el cassette {args.cassette}; grábalo primero con --record.", file=sys.stderr)
+        return 2
+
+    profiles = list(LATENCY_PROFILES) if args.profile == "all" else [args.profile]
+    os.environ["IMEMSA_HTTP_MODE"] = "replay"
+    report: Dict[str, Dict] = {}
+    for profile in profiles:
+        os.environ["IMEMSA_HTTP_LATENCY"] = profile
+        results = []
+        for _ in range(max(1, args.repeat)):
+            res = _run_once(args.timeout)
+            _print_run(profile, res)
+            results.append(res)
+        report[profile] = _summary(results)
+        print(f"-- {profile}: mediana {report[profile]['wall_median_s']:.2f} s "
+              f"(mín {report[profile]['wall_min_s']:.2f} s, pico {report[profile]['peak_mb_max']:.1f} MB)")
+
+    if args.json_out:
+        Path(args.json_out).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,338 @@
+"""
+Benchmark de throughput de las herramientas de IA contra el mock local de OpenAI.
+
+Arranca bench/mock_openai.py en un proceso aparte (así el CPU/memoria medidos
+son solo del lado cliente), apunta OPENAI_BASE_URL al mock y ejecuta cada
+herramienta N veces con C hilos:
+
+  svc:*   funciones de services/*.py (SDK de OpenAI, cliente compartido)
+  asvc:*  variantes async de services/*.py, todas en un solo event loop
+          (--concurrency = corrutinas simultáneas, no hilos)
+  page:*  funciones de cómputo de las páginas (gateway utils_llm), cargadas
+          sin ejecutar la UI de Streamlit
+
+Reporta solicitudes/s, latencia p50/p95/p99, CPU del cliente por llamada y
+pico de memoria (tracemalloc, en una pasada aparte de una sola llamada).
+
+  python bench/bench_tools.py
+  python bench/bench_tools.py --tools page:traduccion,svc:traduccion --requests 50 --concurrency 8
+  python bench/bench_tools.py --ttft-ms 800 --tps 40 --error-rate 0.05 --json resultados.json
+  python bench/bench_tools.py --base-url http://127.0.0.1:8089/v1   # mock ya levantado
+  python bench/bench_tools.py --tools svc:nlp,asvc:nlp --requests 400 --concurrency 200
+
+Por defecto el limitador de utils_ratelimit se abre (RPM/TPM muy altos) para
+medir la herramienta y no la cuota; usa --with-limits para conservarlo.
+"""
+from __future__ import annotations
+
+import argparse
+import ast
+import asyncio
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import types
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "bench"))
+
+from mock_openai import add_config_args  # noqa: E402
+
+PAGES = {
+    "transcripcion": "pages/1_transcripcion.py",
+    "traduccion": "pages/2_traduccion.py",
+    "minutas": "pages/3_minutas_y_acciones.py",
+    "documentos": "pages/4_documentos.py",
+    "nlp": "pages/6_nlp_Operacion.py",
+}
+
+
+# ==========================================================
+# Entradas sintéticas
+# ==========================================================
+def _text(chars: int) -> str:
+    base = (
+        "Buen día. Revisamos la producción de la semana: el molde de la lancha W-25 requiere reparación, "
+        "faltan 4 cubetas de gel coat y el proveedor pide pago de la factura A-1234 con OC 456. "
+        "Ingeniería propone infusión al vacío para la consola del T-top. "
+    )
+    return (base * (chars // len(base) + 1))[:chars]
+
+
+def _png(width: int = 1200, height: int = 1600) -> bytes:
+    from PIL import Image, ImageDraw
+
+    img = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(img)
+    for y in range(40, height - 40, 28):
+        draw.text((40, y), "Factura A-1234  Gel coat blanco  4  cubeta  2,600.00  10,400.00", fill="black")
+    bio = io.BytesIO()
+    img.save(bio, format="PNG")
+    return bio.getvalue()
+
+
+# ==========================================================
+# Funciones de página sin UI
+# ==========================================================
+def load_page_functions(rel_path: str) -> types.ModuleType:
+    """
+    Ejecuta solo imports, funciones, clases y constantes en MAYÚSCULAS de una
+    página (sin widgets ni login) y devuelve el módulo resultante.
+    """
+    path = ROOT / rel_path
+    tree = ast.parse(path.read_text(encoding="utf-8"), filename=str(path))
+
+    def keep(node: ast.stmt) -> bool:
+        if isinstance(node, (ast.Import, ast.ImportFrom, ast.FunctionDef, ast.ClassDef)):
+            return True
+        if isinstance(node, (ast.Assign, ast.AnnAssign)):
+            targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+            return all(isinstance(t, ast.Name) and t.id.isupper() for t in targets)
+        return False
+
+    tree.body = [n for n in tree.body if keep(n)]
+    name = "bench_page_" + path.stem
+    mod = types.ModuleType(name)
+    mod.__file__ = str(path)
+    sys.modules[name] = mod
+    exec(compile(tree, str(path), "exec"), mod.__dict__)
+    return mod
+
+
+def build_tools(text: str, png: bytes, audio: bytes) -> Dict[str, Callable[[], Any]]:
+    from services import docs_ocr_openai, minutes_openai, nlp_ops_openai, transcribe_openai, translate_openai
+
+    pages = {k: load_page_functions(v) for k, v in PAGES.items()}
+    noop = lambda _obj: None  # noqa: E731
+
+    return {
+        "svc:transcripcion": lambda: transcribe_openai.transcribe_audio_bytes(audio, "bench.mp3", language_hint="es"),
+        "svc:traduccion": lambda: translate_openai.translate_en_es(text, "ES->EN"),
+        "svc:minutas": lambda: minutes_openai.generate_minutes(text),
+        "svc:documentos": lambda: docs_ocr_openai.ocr_and_extract_from_images(
+            [{"bytes": png, "mime": "image/png"}], "factura"
+        ),
+        "svc:nlp": lambda: nlp_ops_openai.analyze_ticket(text),
+        "asvc:transcripcion": lambda: transcribe_openai.atranscribe_audio_bytes(audio, "bench.mp3", language_hint="es"),
+        "asvc:traduccion": lambda: translate_openai.atranslate_en_es(text, "ES->EN"),
+        "asvc:minutas": lambda: minutes_openai.agenerate_minutes(text),
+        "asvc:documentos": lambda: docs_ocr_openai.aocr_and_extract_from_images(
+            [{"bytes": png, "mime": "image/png"}], "factura"
+        ),
+        "asvc:nlp": lambda: nlp_ops_openai.aanalyze_ticket(text),
+        "page:transcripcion": lambda: pages["transcripcion"].transcribe_openai(audio, "bench.mp3"),
+        "page:traduccion": lambda: pages["traduccion"].translate_text(text, "ES → EN", "técnico", ""),
+        "page:traduccion-stream": lambda: pages["traduccion"].translate_text(
+            text, "ES → EN", "técnico", "", on_partial=noop
+        ),
+        "page:minutas": lambda: pages["minutas"].generate_minutes(text, "técnico", on_partial=noop),
+        "page:documentos": lambda: pages["documentos"].ocr_and_extract([(png, "image/png", "p1.png")], "Factura"),
+        "page:nlp": lambda: pages["nlp"].analyze_ticket(text, "", on_partial=noop),
+    }
+
+
+# ==========================================================
+# Medición
+# ==========================================================
+def _pct(values: List[float], q: float) -> float:
+    if not values:
+        return float("nan")
+    s = sorted(values)
+    return s[min(len(s) - 1, int(round(q * (len(s) - 1))))]
+
+
+def _summary(lat: List[float], errors: Dict[str, int], wall: float, cpu: float, requests: int, peak: int) -> Dict[str, Any]:
+    ok = len(lat)
+    return {
+        "ok": ok,
+        "errors": errors,
+        "wall_s": wall,
+        "rps": ok / wall if wall else 0.0,
+        "p50_ms": _pct(lat, 0.50) * 1000,
+        "p95_ms": _pct(lat, 0.95) * 1000,
+        "p99_ms": _pct(lat, 0.99) * 1000,
+        "mean_ms": statistics.fmean(lat) * 1000 if lat else float("nan"),
+        "cpu_ms_per_req": cpu / max(1, requests) * 1000,
+        "peak_kb": peak / 1024,
+    }
+
+
+def run_tool(fn: Callable[[], Any], requests: int, concurrency: int) -> Dict[str, Any]:
+    fn()  # calentamiento: imports, conexiones, clientes
+
+    lat: List[float] = []
+    errors: Dict[str, int] = {}
+    lock = threading.Lock()
+
+    def one(_i: int) -> None:
+        t0 = time.perf_counter()
+        try:
+            fn()
+        except Exception as e:  # noqa: BLE001 - se reporta por clase
+            with lock:
+                errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+            return
+        with lock:
+            lat.append(time.perf_counter() - t0)
+
+    cpu0 = time.process_time()
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as ex:
+        list(ex.map(one, range(requests)))
+    wall = time.perf_counter() - t0
+    cpu = time.process_time() - cpu0
+
+    # Memoria en una pasada aparte (tracemalloc distorsiona CPU y latencia)
+    tracemalloc.start()
+    try:
+        fn()
+    except Exception:
+        pass
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return _summary(lat, errors, wall, cpu, requests, peak)
+
+
+def run_tool_async(factory: Callable[[], Any], requests: int, concurrency: int) -> Dict[str, Any]:
+    """Como run_tool(), pero `factory()` devuelve una corrutina y todo corre en un solo event loop."""
+    lat: List[float] = []
+    errors: Dict[str, int] = {}
+
+    async def main() -> Dict[str, Any]:
+        await factory()  # calentamiento: cliente del loop y conexiones
+        sem = asyncio.Semaphore(concurrency)
+
+        async def one() -> None:
+            async with sem:
+                t0 = time.perf_counter()
+                try:
+                    await factory()
+                except Exception as e:  # noqa: BLE001 - se reporta por clase
+                    errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+                    return
+                lat.append(time.perf_counter() - t0)
+
+        cpu0 = time.process_time()
+        t0 = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(requests)))
+        wall = time.perf_counter() - t0
+        cpu = time.process_time() - cpu0
+
+        tracemalloc.start()
+        try:
+            await factory()
+        except Exception:
+            pass
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return _summary(lat, errors, wall, cpu, requests, peak)
+
+    return asyncio.run(main())
+
+
+def _start_mock(args: argparse.Namespace) -> subprocess.Popen:
+    cmd = [
+        sys.executable, str(ROOT / "bench" / "mock_openai.py"), "--port", "0",
+        "--ttft-ms", str(args.ttft_ms), "--tps", str(args.tps), "--prefill-tps", str(args.prefill_tps),
+        "--jitter", str(args.jitter), "--out-ratio", str(args.out_ratio), "--audio-rtf", str(args.audio_rtf),
+        "--error-rate", str(args.error_rate), "--error-status", str(args.error_status),
+        "--retry-after", str(args.retry_after), "--stream-cut-rate", str(args.stream_cut_rate),
+        "--tail-rate", str(args.tail_rate), "--tail-ms", str(args.tail_ms),
+    ]
+    if args.mock_seed is not None:
+        cmd += ["--mock-seed", str(args.mock_seed)]
+    if args.no_prefix_cache:
+        cmd += ["--no-prefix-cache"]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True)
+    line = proc.stdout.readline().strip() if proc.stdout else ""
+    if not line.startswith("MOCK_OPENAI_URL="):
+        proc.kill()
+        raise RuntimeError(f"No arrancó el mock: {line!r}")
+    args.base_url = line.split("=", 1)[1]
+    return proc
+
+
+def _print(rows: List[Dict[str, Any]]) -> None:
+    head = f"{'herramienta':<24}{'ok':>5}{'err':>5}{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'cpu ms':>8}{'pico KB':>9}"
+    print(head)
+    print("-" * len(head))
+    for r in rows:
+        err = sum(r["errors"].values())
+        print(
+            f"{r['tool']:<24}{r['ok']:>5}{err:>5}{r['rps']:>8.2f}{r['p50_ms']:>9.0f}{r['p95_ms']:>9.0f}"
+            f"{r['p99_ms']:>9.0f}{r['cpu_ms_per_req']:>8.1f}{r['peak_kb']:>9.0f}"
+        )
+        if r["errors"]:
+            print(f"{'':<24}errores: {r['errors']}")
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--tools", default="all", help="lista separada por comas (p. ej. page:traduccion,svc:nlp)")
+    ap.add_argument("--requests", type=int, default=20, help="llamadas por herramienta")
+    ap.add_argument("--concurrency", type=int, default=4)
+    ap.add_argument("--input-chars", type=int, default=3000)
+    ap.add_argument("--audio-kb", type=int, default=480, help="tamaño del audio sintético (~30 s)")
+    ap.add_argument("--base-url", default="", help="usar un mock ya levantado en vez de arrancar uno")
+    ap.add_argument("--with-limits", action="store_true", help="conservar los límites de utils_ratelimit")
+    ap.add_argument("--json", dest="json_out", default="", help="guardar resultados en JSON")
+    add_config_args(ap)
+    args = ap.parse_args(argv)
+
+    proc: Optional[subprocess.Popen] = None
+    if not args.base_url:
+        proc = _start_mock(args)
+
+    # Antes de importar utils_llm / services: todo apunta al mock y nada se queda en .data/
+    os.environ["OPENAI_BASE_URL"] = args.base_url
+    os.environ["OPENAI_API_KEY"] = os.getenv("BENCH_OPENAI_KEY", "sk-bench")
+    os.environ["IMEMSA_LLM_CACHE"] = "0"
+    os.environ.setdefault("IMEMSA_DATA_DIR", tempfile.mkdtemp(prefix="imemsa-bench-"))
+    if not args.with_limits:
+        os.environ["IMEMSA_OPENAI_RPM"] = "1000000"
+        os.environ["IMEMSA_OPENAI_TPM"] = "1000000000"
+        os.environ["IMEMSA_OPENAI_CONCURRENCY"] = str(max(64, args.concurrency))
+
+    try:
+        tools = build_tools(_text(args.input_chars), _png(), os.urandom(args.audio_kb * 1024))
+        selected = list(tools) if args.tools == "all" else [t.strip() for t in args.tools.split(",") if t.strip()]
+        unknown = [t for t in selected if t not in tools]
+        if unknown:
+            print(f"Herramientas desconocidas: {unknown}. Disponibles: {', '.join(tools)}", file=sys.stderr)
+            return 2
+
+        print(f"mock: {args.base_url} · {args.requests} llamadas × {args.concurrency} hilos · "
+              f"ttft {args.ttft_ms:g} ms · {args.tps:g} tok/s · errores {args.error_rate:g}")
+        rows = []
+        for name in selected:
+            runner = run_tool_async if name.startswith("asvc:") else run_tool
+            res = runner(tools[name], args.requests, args.concurrency)
+            res["tool"] = name
+            rows.append(res)
+            print(f"  {name}: {res['rps']:.2f} req/s, p95 {res['p95_ms']:.0f} ms", flush=True)
+        print()
+        _print(rows)
+
+        if args.json_out:
+            Path(args.json_out).write_text(json.dumps({"args": vars(args), "results": rows}, indent=2, ensure_ascii=False))
+            print(f"\nResultados en {args.json_out}")
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(timeout=5)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,149 @@
+"""
+Perfil de arranque en frío por página (imports + primera ejecución).
+
+Cada página corre en un proceso nuevo con `python -X importtime`: se importa
+streamlit y el arnés de AppTest, se deja una marca en stderr y luego se
+ejecuta la página (con sesión iniciada). Todo lo que se importe después de la
+marca es costo propio de la página.
+
+Reporta por página: ms de la primera ejecución, de la segunda (ya caliente),
+ms totales de imports propios y los paquetes más caros.
+
+  python bench/import_profile.py
+  python bench/import_profile.py --pages pages/7_tipos_de_cambio.py --top 15
+  python bench/import_profile.py --live --json arranque.json
+
+Por defecto las llamadas HTTP van en modo replay (utils_http_replay), así el
+tiempo medido no depende de Banxico/INEGI; --live usa la red real.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, List
+
+ROOT = Path(__file__).resolve().parents[1]
+MARK = "import_profile: page-start"
+
+
+# ==========================================================
+# Proceso hijo: ejecuta UNA página
+# ==========================================================
+def _child(page: str) -> None:
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(str(ROOT / "app.py"), default_timeout=300)
+    at.session_state["auth"] = True
+    at.secrets["OPENAI_API_KEY"] = "sk-profile"
+    at.secrets["BANXICO_TOKEN"] = "profile"
+    at.secrets["INEGI_TOKEN"] = "profile"
+    at.switch_page(page)
+
+    print(MARK, file=sys.stderr, flush=True)
+    t0 = time.perf_counter()
+    at.run()
+    first_ms = (time.perf_counter() - t0) * 1000
+    t0 = time.perf_counter()
+    at.run()
+    warm_ms = (time.perf_counter() - t0) * 1000
+
+    print(json.dumps({
+        "first_run_ms": round(first_ms, 1),
+        "warm_run_ms": round(warm_ms, 1),
+        "exceptions": [str(e.value)[:200] for e in at.exception],
+    }))
+
+
+# ==========================================================
+# Proceso padre
+# ==========================================================
+def parse_importtime(stderr: str) -> Dict[str, float]:
+    """ms acumulados por paquete raíz, solo de imports de primer nivel posteriores a la marca."""
+    lines = stderr.splitlines()
+    try:
+        lines = lines[lines.index(MARK) + 1:]
+    except ValueError:
+        return {}
+    rows = []
+    for line in lines:
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|", 2)
+        depth = len(name) - len(name.lstrip(" "))
+        rows.append((depth, name.strip(), int(cumulative)))
+    if not rows:
+        return {}
+    top = min(r[0] for r in rows)
+    out: Dict[str, float] = defaultdict(float)
+    for depth, name, us in rows:
+        if depth == top:
+            out[name.split(".")[0]] += us / 1000
+    return dict(out)
+
+
+def profile_page(page: str, live: bool) -> Dict[str, Any]:
+    env = dict(os.environ)
+    env.setdefault("IMEMSA_DATA_DIR", tempfile.mkdtemp(prefix="imemsa-profile-"))
+    if not live:
+        env["IMEMSA_HTTP_MODE"] = "replay"
+    t0 = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", __file__, "--child", page],
+        cwd=ROOT, env=env, capture_output=True, text=True,
+    )
+    wall_ms = (time.perf_counter() - t0) * 1000
+    result: Dict[str, Any] = {"page": page, "process_ms": round(wall_ms, 1)}
+    try:
+        result.update(json.loads(proc.stdout.strip().splitlines()[-1]))
+    except (IndexError, ValueError):
+        result["exceptions"] = [proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else f"exit {proc.returncode}"]
+    imports = parse_importtime(proc.stderr)
+    result["imports_ms"] = round(sum(imports.values()), 1)
+    result["top_imports"] = sorted(((k, round(v, 1)) for k, v in imports.items()), key=lambda kv: -kv[1])
+    return result
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--pages", default="", help="rutas separadas por coma (default: todas las de pages/)")
+    ap.add_argument("--top", type=int, default=8, help="paquetes a listar por página")
+    ap.add_argument("--live", action="store_true", help="usar la red real en lugar del replay HTTP")
+    ap.add_argument("--json", default="", help="guardar resultados en este archivo")
+    ap.add_argument("--child", default="", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.child:
+        sys.path.insert(0, str(ROOT))
+        _child(args.child)
+        return
+
+    pages = [p.strip() for p in args.pages.split(",") if p.strip()] or sorted(
+        str(p.relative_to(ROOT)) for p in (ROOT / "pages").glob("*.py")
+    )
+    results: List[Dict[str, Any]] = []
+    for page in pages:
+        r = profile_page(page, args.live)
+        results.append(r)
+        print(f"\n{r['page']}")
+        print(
+            f"  1a ejecución {r.get('first_run_ms', float('nan')):>8.0f} ms · caliente {r.get('warm_run_ms', float('nan')):>6.0f} ms"
+            f" · imports propios {r['imports_ms']:>6.0f} ms · proceso {r['process_ms']:>6.0f} ms"
+        )
+        for name, ms in r["top_imports"][: args.top]:
+            print(f"    {ms:>8.1f} ms  {name}")
+        for e in r.get("exceptions") or []:
+            print(f"  ! {e}")
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
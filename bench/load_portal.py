@@ -0,0 +1,756 @@
+"""
+Prueba de carga del portal con N sesiones simultáneas contra un servidor real.
+
+Levanta `streamlit run app.py` (o usa uno ya corriendo con --url) y abre N
+sesiones "de navegador" sin interfaz: cada una habla el protocolo de Streamlit
+por websocket (BackMsg/ForwardMsg en protobuf), sube archivos por
+/_stcore/upload_file y baja exportaciones de /media, igual que el frontend.
+Así el servidor comparte de verdad cachés, limitador, pool de trabajos y GIL
+entre sesiones. (AppTest no sirve para esto: cada run() reemplaza el Runtime
+global del proceso y vuelve a compilar la página, así que varias instancias en
+hilos se pisan entre sí.)
+
+Cada sesión entra por el login de app.py y repite flujos en orden aleatorio:
+
+  traduccion     texto → Traducir (trabajo) → Preparar DOCX → descarga
+  minutas        transcripción → Generar minuta (trabajo) → Preparar DOCX → descarga
+  nlp            correo → Analizar (trabajo) → descarga
+  documentos     sube PDF (2 páginas) → Procesar documento (trabajo) → descarga JSON
+  transcripcion  sube audio → Transcribir (trabajo) → Preparar DOCX → descarga
+  forecast       sube CSV → Generar forecast y anomalías → descarga (sin API)
+  fx             Generar Excel de tipos de cambio (HTTP en replay; requiere cassette) → descarga
+
+Los trabajos en segundo plano se siguen como lo hace el navegador: el
+servidor pide reejecutar el fragmento cada `interval` s (auto_rerun) hasta que
+el trabajo termina. Las llamadas al modelo van al mock local
+(bench/mock_openai.py).
+
+Reporta por etapa de carga: flujos/s, p50/p95/p99 por paso (tiempo hasta
+script_finished, visto por el cliente), tasa de errores y, del proceso del
+servidor, CPU (núcleos), hilos y memoria (RSS inicial, pico y final;
+crecimiento por cada 100 flujos).
+
+  python bench/load_portal.py --sessions 1,4,8 --duration 60
+  python bench/load_portal.py --sessions 16 --flows traduccion,minutas,nlp --ttft-ms 800
+  python bench/load_portal.py --sessions 8 --same-input     # todos piden lo mismo (caché / single-flight)
+  python bench/load_portal.py --url http://127.0.0.1:8501 --pid 4242
+  python bench/load_portal.py --sessions 4 --json carga.json
+
+Cada sesión usa textos distintos (salvo --same-input) para que la caché de
+resultados, la de respuestas LLM y el single-flight no oculten la carga.
+Requiere el paquete `websockets` (lo instala uvicorn[standard]).
+"""
+from __future__ import annotations
+
+import argparse
+import ast
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from contextlib import ExitStack
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import requests
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "bench"))
+
+from bench_tools import _pct, _png, _start_mock, _text  # noqa: E402
+from mock_openai import add_config_args  # noqa: E402
+
+PAGES = {
+    "traduccion": "pages/2_traduccion.py",
+    "minutas": "pages/3_minutas_y_acciones.py",
+    "nlp": "pages/6_nlp_Operacion.py",
+    "documentos": "pages/4_documentos.py",
+    "transcripcion": "pages/1_transcripcion.py",
+    "forecast": "pages/5_forecast_y_Anomalias.py",
+    "fx": "pages/7_tipos_de_cambio.py",
+}
+RUN_TIMEOUT = 300.0  # s esperando script_finished
+JOB_TIMEOUT = 300.0  # s esperando un trabajo en segundo plano
+
+
+class FlowError(Exception):
+    """El flujo no llegó al estado esperado (widget ausente, error en la página, tiempo agotado)."""
+
+
+# ==========================================================
+# Entradas sintéticas
+# ==========================================================
+def _pdf(pages: int = 2) -> bytes:
+    import fitz  # PyMuPDF (lo usa la página de documentos para rasterizar)
+
+    png = _png()
+    doc = fitz.open()
+    for _ in range(pages):
+        page = doc.new_page(width=612, height=792)
+        page.insert_image(page.rect, stream=png)
+    return doc.tobytes()
+
+
+def _csv(days: int = 540) -> bytes:
+    rng = random.Random(7)
+    start = time.time() - days * 86400
+    rows = ["fecha,ventas"]
+    for i in range(days):
+        day = time.strftime("%Y-%m-%d", time.localtime(start + i * 86400))
+        value = 1000 + 200 * ((i % 7) in (5, 6)) + rng.gauss(0, 60) + (900 if rng.random() < 0.01 else 0)
+        rows.append(f"{day},{value:.1f}")
+    return ("\n".join(rows) + "\n").encode("utf-8")
+
+
+def portal_password() -> str:
+    """PORTAL_PASSWORD de app.py (sin ejecutar la app)."""
+    tree = ast.parse((ROOT / "app.py").read_text(encoding="utf-8"))
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(getattr(t, "id", "") == "PORTAL_PASSWORD" for t in node.targets):
+            return ast.literal_eval(node.value)
+    raise RuntimeError("No se encontró PORTAL_PASSWORD en app.py")
+
+
+class Inputs:
+    """Archivos compartidos (se generan una vez) + contenido distinto por sesión y flujo."""
+
+    def __init__(self, input_chars: int, audio_kb: int, same_input: bool) -> None:
+        self.input_chars = input_chars
+        self.same_input = same_input
+        self.pdf = _pdf()
+        self.csv = _csv()
+        self.audio = os.urandom(audio_kb * 1024)
+
+    def text(self, session: int, n: int) -> str:
+        tag = "" if self.same_input else f"[sesión {session} · flujo {n}] "
+        return tag + _text(self.input_chars)
+
+    def unique(self, data: bytes, session: int, n: int) -> bytes:
+        return data if self.same_input else data + f"\n%{session}-{n}".encode()
+
+
+# ==========================================================
+# Cliente de Streamlit por websocket (lo mínimo que hace el frontend)
+# ==========================================================
+def _page_name(script: str) -> str:
+    """pages/3_minutas_y_acciones.py → 'minutas y acciones' (como el page_name que reporta Streamlit)."""
+    return _norm(re.sub(r"^\d+[_\- ]*", "", Path(script).stem))
+
+
+def _norm(name: str) -> str:
+    return name.replace("_", " ").strip().lower()
+
+
+class Browser:
+    def __init__(self, base_url: str) -> None:
+        self.base = base_url.rstrip("/")
+        self.http = requests.Session()
+        self.ws: Any = None
+        self._conn = ExitStack()
+        self.session_id = ""
+        self.pages: Dict[str, str] = {}  # page_name → page_script_hash
+        self.page_hash = ""
+        self.query = ""
+        self.elements: Dict[Tuple[int, ...], Any] = {}
+        self.values: Dict[str, Any] = {}  # WidgetState que el "usuario" ya llenó en la página
+        self.auto: Any = None  # AutoRerun pendiente (fragmento que sondea un trabajo)
+        self._request_id = 0
+
+    # ---------- conexión
+    def connect(self) -> None:
+        try:
+            from websockets.sync.client import connect
+        except ImportError as e:  # pragma: no cover - depende del entorno
+            raise RuntimeError("Falta el paquete 'websockets' (pip install websockets).") from e
+
+        url = re.sub(r"^http", "ws", self.base) + "/_stcore/stream"
+        self.ws = self._conn.enter_context(
+            connect(url, subprotocols=["streamlit"], max_size=None, open_timeout=30, compression=None)
+        )
+
+    def close(self) -> None:
+        self._conn.close()
+        self.ws = None
+        self.http.close()
+
+    # ---------- mensajes
+    def _recv(self, timeout: float) -> Any:
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+        try:
+            raw = self.ws.recv(timeout=timeout)
+        except TimeoutError as e:
+            raise FlowError(f"Sin respuesta del servidor en {timeout:.0f} s.") from e
+        msg = ForwardMsg()
+        msg.ParseFromString(raw)
+        kind = msg.WhichOneof("type")
+        if kind == "new_session":
+            ns = msg.new_session
+            if ns.HasField("initialize"):
+                self.session_id = ns.initialize.session_id
+            if ns.app_pages:
+                self.pages = {_norm(p.page_name): p.page_script_hash for p in ns.app_pages}
+            self.page_hash = ns.page_script_hash
+            if not ns.fragment_ids_this_run:  # corrida completa: la página se vuelve a pintar
+                self.elements = {}
+                self.auto = None
+        elif kind == "delta" and msg.delta.WhichOneof("type") == "new_element":
+            self.elements[tuple(msg.metadata.delta_path)] = msg.delta.new_element
+        elif kind == "page_info_changed":
+            self.query = msg.page_info_changed.query_string
+        elif kind == "auto_rerun":
+            self.auto = msg.auto_rerun
+        return msg
+
+    def rerun(self, triggers: Tuple[Any, ...] = (), page_hash: Optional[str] = None, fragment_id: str = "") -> None:
+        """Manda rerun_script con el estado de los widgets y espera a que la corrida termine."""
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+
+        back = BackMsg()
+        cs = back.rerun_script
+        cs.query_string = self.query
+        cs.page_script_hash = self.page_hash if page_hash is None else page_hash
+        if fragment_id:
+            cs.fragment_id = fragment_id
+            cs.is_auto_rerun = True
+        cs.widget_states.widgets.extend(list(self.values.values()) + list(triggers))
+        self.ws.send(back.SerializeToString())
+        self._wait_finished()
+
+    def _wait_finished(self) -> None:
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+        done = (ForwardMsg.FINISHED_SUCCESSFULLY, ForwardMsg.FINISHED_FRAGMENT_RUN_SUCCESSFULLY,
+                ForwardMsg.FINISHED_WITH_COMPILE_ERROR)
+        deadline = time.monotonic() + RUN_TIMEOUT
+        while True:
+            msg = self._recv(max(0.1, deadline - time.monotonic()))
+            if msg.WhichOneof("type") == "script_finished" and msg.script_finished in done:
+                return
+
+    # ---------- página actual
+    def find(self, kind: str, label: Optional[str] = None) -> Any:
+        for path in sorted(self.elements):
+            el = self.elements[path]
+            if el.WhichOneof("type") == kind:
+                w = getattr(el, kind)
+                if label is None or w.label == label:
+                    return w
+        return None
+
+    def require(self, kind: str, label: Optional[str] = None) -> Any:
+        w = self.find(kind, label)
+        if w is None:
+            raise FlowError(f"No se encontró {kind} '{label or '*'}'.")
+        return w
+
+    def problem(self) -> Optional[str]:
+        """Primera excepción o st.error visible en la página, si hay."""
+        from streamlit.proto.Alert_pb2 import Alert
+
+        for path in sorted(self.elements):
+            el = self.elements[path]
+            kind = el.WhichOneof("type")
+            if kind == "exception":
+                return f"{el.exception.type}: {(el.exception.message.splitlines() or [''])[0][:120]}"
+            if kind == "alert" and el.alert.format == Alert.ERROR:
+                return "st.error: " + (el.alert.body.splitlines() or [""])[0][:120]
+        return None
+
+    # ---------- acciones del usuario
+    def navigate(self, script: str) -> None:
+        page_hash = self.pages.get(_page_name(script))
+        if page_hash is None:
+            raise FlowError(f"El servidor no expone la página {script}.")
+        self.values.clear()
+        self.query = ""
+        self.rerun(page_hash=page_hash)
+
+    def type_text(self, kind: str, label: str, text: str) -> None:
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+        w = self.require(kind, label)
+        self.values[w.id] = WidgetState(id=w.id, string_value=text)
+        self.rerun()
+
+    def click(self, label: str) -> None:
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+        w = self.require("button", label)
+        if w.disabled:
+            raise FlowError(f"El botón '{label}' está deshabilitado.")
+        self.rerun(triggers=(WidgetState(id=w.id, trigger_value=True),))
+
+    def upload(self, name: str, data: bytes, mime: str) -> None:
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+        from streamlit.proto.Common_pb2 import UploadedFileInfo
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+        uploader = self.require("file_uploader")
+        self._request_id += 1
+        request_id = f"req-{self._request_id}"
+        back = BackMsg()
+        back.file_urls_request.request_id = request_id
+        back.file_urls_request.file_names.append(name)
+        back.file_urls_request.session_id = self.session_id
+        self.ws.send(back.SerializeToString())
+        while True:
+            msg = self._recv(RUN_TIMEOUT)
+            if msg.WhichOneof("type") == "file_urls_response" and msg.file_urls_response.response_id == request_id:
+                break
+        resp = msg.file_urls_response
+        if resp.error_msg or not resp.file_urls:
+            raise FlowError(f"Subida rechazada: {resp.error_msg or 'sin URL'}")
+        urls = resp.file_urls[0]
+        r = self.http.put(self.base + urls.upload_url, files={"file": (name, data, mime)}, timeout=RUN_TIMEOUT)
+        if r.status_code >= 400:
+            raise FlowError(f"PUT {urls.upload_url} → HTTP {r.status_code}")
+        state = WidgetState(id=uploader.id)
+        state.file_uploader_state_value.uploaded_file_info.append(
+            UploadedFileInfo(name=name, size=len(data), file_id=urls.file_id, file_urls=urls)
+        )
+        self.values[uploader.id] = state
+        self.rerun()
+
+    def wait_job(self, ready: Callable[[], bool]) -> None:
+        """Atiende los auto_rerun del fragmento que sondea el trabajo hasta que `ready()`."""
+        deadline = time.monotonic() + JOB_TIMEOUT
+        while not ready():
+            problem = self.problem()
+            if problem:
+                raise FlowError(problem)
+            if self.auto is None:
+                raise FlowError("La página no mostró resultado ni un trabajo en curso.")
+            if time.monotonic() > deadline:
+                raise FlowError("El trabajo en segundo plano no terminó a tiempo.")
+            time.sleep(self.auto.interval)
+            self.rerun(fragment_id=self.auto.fragment_id)
+
+    def download(self, label: Optional[str] = None) -> int:
+        """Descarga como el navegador (GET a /media + rerun del botón); "Preparar X" primero si hace falta."""
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+        if label and self.find("download_button", label) is None and self.find("button", f"Preparar {label}") is not None:
+            self.click(f"Preparar {label}")
+        button = self.require("download_button", label)
+        r = self.http.get(self.base + button.url, timeout=RUN_TIMEOUT)
+        if r.status_code != 200 or not r.content:
+            raise FlowError(f"GET {button.url} → HTTP {r.status_code} ({len(r.content)} bytes)")
+        if not button.ignore_rerun:
+            self.rerun(triggers=(WidgetState(id=button.id, trigger_value=True),))
+        return len(r.content)
+
+
+# ==========================================================
+# Sesión virtual
+# ==========================================================
+class Session:
+    def __init__(self, sid: int, base_url: str, inputs: Inputs, password: str,
+                 record: Callable[[str, float, Optional[str]], None]) -> None:
+        self.sid = sid
+        self.inputs = inputs
+        self.password = password
+        self.record = record
+        self.n = 0
+        self.browser = Browser(base_url)
+
+    def step(self, name: str, action: Callable[[], Any]) -> None:
+        t0 = time.perf_counter()
+        error: Optional[str] = None
+        try:
+            action()
+            error = self.browser.problem()
+        except FlowError as e:
+            error = f"FlowError: {e}"
+        except Exception as e:  # noqa: BLE001 - se reporta, la sesión sigue
+            error = f"{type(e).__name__}: {str(e)[:120]}"
+        self.record(name, time.perf_counter() - t0, error)
+        if error:
+            raise FlowError(error)
+
+    # ---------- login (app.py)
+    def login(self) -> None:
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+        b = self.browser
+
+        def go() -> None:
+            b.connect()
+            b.rerun(page_hash="")
+            pw = b.require("text_input", "Contraseña")
+            submit = b.require("button", "Entrar")
+            b.rerun(triggers=(WidgetState(id=pw.id, string_value=self.password),
+                              WidgetState(id=submit.id, trigger_value=True)))
+            if b.find("text_input", "Contraseña") is not None:
+                raise FlowError("Login rechazado.")
+
+        self.step("login", go)
+
+    # ---------- flujos
+    def flow(self, name: str) -> None:
+        self.n += 1
+        self.step(f"{name}:abrir", lambda: self.browser.navigate(PAGES[name]))
+        getattr(self, f"_flow_{name}")()
+
+    def _job(self, name: str, button: str, ready: Callable[[], bool]) -> None:
+        def go() -> None:
+            self.browser.click(button)
+            self.browser.wait_job(ready)
+
+        self.step(name, go)
+
+    def _text_job(self, flow: str, field: str, button: str, ready: Callable[[], bool], export: Optional[str]) -> None:
+        b = self.browser
+        text = self.inputs.text(self.sid, self.n)
+        self.step(f"{flow}:escribir", lambda: b.type_text("text_area", field, text))
+        self._job(f"{flow}:procesar", button, ready)
+        self.step(f"{flow}:descargar", lambda: b.download(export))
+
+    def _flow_traduccion(self) -> None:
+        b = self.browser
+        self._text_job("traduccion", "Texto a traducir", "Traducir", lambda: b.find("text_area", "Traducción") is not None, "DOCX")
+
+    def _flow_minutas(self) -> None:
+        b = self.browser
+        self._text_job("minutas", "Transcripción", "Generar minuta", lambda: b.find("download_button") is not None, "DOCX")
+
+    def _flow_nlp(self) -> None:
+        b = self.browser
+        self._text_job("nlp", "Pega aquí el correo o solicitud", "Analizar", lambda: b.find("download_button") is not None, None)
+
+    def _flow_documentos(self) -> None:
+        b = self.browser
+        pdf = self.inputs.unique(self.inputs.pdf, self.sid, self.n)
+        self.step("documentos:subir", lambda: b.upload(f"factura_{self.sid}_{self.n}.pdf", pdf, "application/pdf"))
+        self._job("documentos:procesar", "Procesar documento", lambda: b.find("text_area", "Texto extraído") is not None)
+        self.step("documentos:descargar", lambda: b.download("JSON"))
+
+    def _flow_transcripcion(self) -> None:
+        b = self.browser
+        audio = self.inputs.unique(self.inputs.audio, self.sid, self.n)
+        self.step("transcripcion:subir", lambda: b.upload(f"junta_{self.sid}_{self.n}.mp3", audio, "audio/mpeg"))
+        self._job("transcripcion:procesar", "Transcribir", lambda: b.find("text_area", "Resultado") is not None)
+        self.step("transcripcion:descargar", lambda: b.download("DOCX"))
+
+    def _flow_forecast(self) -> None:
+        b = self.browser
+        self.step("forecast:subir", lambda: b.upload("ventas.csv", self.inputs.csv, "text/csv"))
+        self.step("forecast:procesar", lambda: b.click("Generar forecast y anomalías"))
+        self.step("forecast:descargar", lambda: b.download())
+
+    def _flow_fx(self) -> None:
+        b = self.browser
+        self.step("fx:procesar", lambda: b.click("Generar Excel"))
+        self.step("fx:descargar", lambda: b.download())
+
+
+# ==========================================================
+# Servidor: arranque y muestreo de /proc
+# ==========================================================
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(log_path: Path) -> Tuple[subprocess.Popen, str]:
+    port = _free_port()
+    cmd = [
+        sys.executable, "-m", "streamlit", "run", str(ROOT / "app.py"),
+        "--server.headless", "true", "--server.address", "127.0.0.1", "--server.port", str(port),
+        "--server.fileWatcherType", "none", "--server.enableXsrfProtection", "false",
+        "--browser.gatherUsageStats", "false",
+    ]
+    log = open(log_path, "wb")
+    proc = subprocess.Popen(cmd, cwd=str(ROOT), stdout=log, stderr=subprocess.STDOUT)
+    base = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"streamlit terminó al arrancar; ver {log_path}")
+        try:
+            if requests.get(base + "/_stcore/health", timeout=1).status_code == 200:
+                return proc, base
+        except requests.RequestException:
+            pass
+        time.sleep(0.3)
+    proc.terminate()
+    raise RuntimeError(f"streamlit no respondió en 60 s; ver {log_path}")
+
+
+class ProcStats:
+    """RSS, hilos y CPU acumulada de un proceso (Linux, /proc/<pid>)."""
+
+    def __init__(self, pid: Optional[int]) -> None:
+        self.pid = pid
+        self.tick = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+    def sample(self) -> Dict[str, float]:
+        if self.pid is None:
+            return {}
+        try:
+            status = Path(f"/proc/{self.pid}/status").read_text(encoding="ascii")
+            stat = Path(f"/proc/{self.pid}/stat").read_text(encoding="ascii")
+        except OSError:
+            return {}
+        fields = dict(line.split(":", 1) for line in status.splitlines() if ":" in line)
+        utime, stime = stat.rsplit(")", 1)[1].split()[11:13]
+        return {
+            "rss_mb": int(fields["VmRSS"].split()[0]) / 1024,
+            "threads": int(fields["Threads"]),
+            "cpu_s": (int(utime) + int(stime)) / self.tick,
+        }
+
+
+# ==========================================================
+# Calentamiento + etapas de carga: N sesiones durante D segundos
+# ==========================================================
+def warm_up(flows: List[str], base_url: str, inputs: Inputs, password: str) -> float:
+    """Una sesión recorre cada flujo sin medir: imports, cachés y pools quedan fuera de las etapas."""
+    t0 = time.perf_counter()
+    s = Session(-1, base_url, inputs, password, lambda *_: None)
+    try:
+        s.login()
+        for name in flows:
+            try:
+                s.flow(name)
+            except FlowError:
+                pass
+    except FlowError:
+        pass
+    finally:
+        s.browser.close()
+    return time.perf_counter() - t0
+
+
+def run_stage(sessions: int, duration: float, ramp: float, flows: List[str], base_url: str,
+              inputs: Inputs, password: str, server: ProcStats, log_path: Optional[Path]) -> Dict[str, Any]:
+    lock = threading.Lock()
+    steps: Dict[str, List[float]] = defaultdict(list)
+    errors: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+    counts = {"flows_ok": 0, "flows_failed": 0}
+
+    def record(name: str, seconds: float, error: Optional[str]) -> None:
+        with lock:
+            if error:
+                errors[name][error] += 1
+            else:
+                steps[name].append(seconds)
+
+    samples: List[Dict[str, float]] = []
+    stop = threading.Event()
+
+    def sample() -> None:
+        while not stop.wait(0.5):
+            s = server.sample()
+            if s:
+                samples.append(s)
+
+    def user(sid: int) -> None:
+        time.sleep(ramp * sid / max(1, sessions))
+        s = Session(sid, base_url, inputs, password, record)
+        rng = random.Random(sid)
+        deadline = time.monotonic() + duration
+        try:
+            s.login()
+            order = flows[:]
+            while time.monotonic() < deadline:
+                rng.shuffle(order)
+                for name in order:
+                    if time.monotonic() >= deadline:
+                        break
+                    try:
+                        s.flow(name)
+                        ok = True
+                    except FlowError:
+                        ok = False
+                    with lock:
+                        counts["flows_ok" if ok else "flows_failed"] += 1
+        except FlowError:
+            with lock:
+                counts["flows_failed"] += 1
+        finally:
+            s.browser.close()
+
+    log_start = log_path.stat().st_size if log_path else 0
+    before = server.sample()
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    t0 = time.perf_counter()
+    threads = [threading.Thread(target=user, args=(i,), name=f"sesion-{i}") for i in range(sessions)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - t0
+    stop.set()
+    sampler.join()
+    after = server.sample()
+
+    total = counts["flows_ok"] + counts["flows_failed"]
+    result: Dict[str, Any] = {
+        "sessions": sessions,
+        "wall_s": round(wall, 1),
+        "flows_ok": counts["flows_ok"],
+        "flows_failed": counts["flows_failed"],
+        "flows_per_s": round(counts["flows_ok"] / wall, 3) if wall else 0.0,
+        "error_rate_%": round(100 * counts["flows_failed"] / total, 1) if total else 0.0,
+    }
+    if before and after:
+        result.update({
+            "server_cpu_cores": round((after["cpu_s"] - before["cpu_s"]) / wall, 2),
+            "server_threads_peak": max(int(s["threads"]) for s in samples + [after]),
+            "server_rss_start_mb": round(before["rss_mb"], 1),
+            "server_rss_peak_mb": round(max(s["rss_mb"] for s in samples + [after]), 1),
+            "server_rss_end_mb": round(after["rss_mb"], 1),
+            "server_rss_growth_mb_per_100_flows": round(100 * (after["rss_mb"] - before["rss_mb"]) / total, 2) if total else 0.0,
+        })
+    if log_path:
+        with open(log_path, "rb") as f:
+            f.seek(log_start)
+            result["server_tracebacks"] = f.read().count(b"Traceback (most recent call last)")
+    result["steps"] = {
+        name: {
+            "ok": len(lat),
+            "errors": sum(errors[name].values()),
+            "p50_ms": round(_pct(lat, 0.50) * 1000, 0),
+            "p95_ms": round(_pct(lat, 0.95) * 1000, 0),
+            "p99_ms": round(_pct(lat, 0.99) * 1000, 0),
+        }
+        for name, lat in sorted({**{k: [] for k in errors}, **steps}.items())
+    }
+    result["errors"] = {name: dict(e) for name, e in errors.items()}
+    return result
+
+
+def _print(stage: Dict[str, Any]) -> None:
+    line = (
+        f"\n== {stage['sessions']} sesiones · {stage['wall_s']:.0f} s · {stage['flows_ok']} flujos ok"
+        f" ({stage['flows_per_s']:.2f}/s) · errores {stage['error_rate_%']:.1f} %"
+    )
+    if "server_rss_start_mb" in stage:
+        line += (
+            f"\n   servidor: CPU {stage['server_cpu_cores']:.2f} núcleos · hilos pico {stage['server_threads_peak']}"
+            f" · RSS {stage['server_rss_start_mb']:.0f} → pico {stage['server_rss_peak_mb']:.0f}"
+            f" → {stage['server_rss_end_mb']:.0f} MB ({stage['server_rss_growth_mb_per_100_flows']:+.1f} MB / 100 flujos)"
+        )
+    if stage.get("server_tracebacks"):
+        line += f" · {stage['server_tracebacks']} trazas en el log"
+    print(line)
+    print(f"  {'paso':<28}{'ok':>6}{'err':>5}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for name, s in stage["steps"].items():
+        print(f"  {name:<28}{s['ok']:>6}{s['errors']:>5}{s['p50_ms']:>9.0f}{s['p95_ms']:>9.0f}{s['p99_ms']:>9.0f}")
+    for name, errs in stage["errors"].items():
+        for msg, n in errs.items():
+            print(f"  ! {name}: {n} × {msg}")
+
+
+def main(argv=None) -> int:
+    from utils_http_replay import DEFAULT_CASSETTE
+
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--sessions", default="1,4,8", help="sesiones simultáneas por etapa, separadas por coma")
+    ap.add_argument("--duration", type=float, default=60, help="segundos por etapa")
+    ap.add_argument("--ramp", type=float, default=5, help="segundos para escalonar la llegada de sesiones")
+    ap.add_argument("--no-warmup", action="store_true", help="medir también la primera visita a cada página")
+    ap.add_argument("--flows", default="", help=f"subconjunto de {','.join(PAGES)} (default: todos)")
+    ap.add_argument("--input-chars", type=int, default=3000)
+    ap.add_argument("--audio-kb", type=int, default=480)
+    ap.add_argument("--same-input", action="store_true", help="todas las sesiones mandan el mismo contenido")
+    ap.add_argument("--url", default="", help="portal ya levantado (métricas del servidor solo con --pid)")
+    ap.add_argument("--pid", type=int, default=None, help="PID del portal de --url para medir CPU/memoria")
+    ap.add_argument("--base-url", default="", help="usar un mock ya levantado en vez de arrancar uno")
+    ap.add_argument("--with-limits", action="store_true", help="conservar los límites de utils_ratelimit")
+    ap.add_argument("--cassette", default="", help="cassette de fx (default el de utils_http_replay)")
+    ap.add_argument("--live-http", action="store_true", help="fx contra Banxico/INEGI reales (default: replay)")
+    ap.add_argument("--json", dest="json_out", default="", help="guardar resultados en JSON")
+    add_config_args(ap)
+    args = ap.parse_args(argv)
+
+    flows = [f.strip() for f in args.flows.split(",") if f.strip()] or list(PAGES)
+    unknown = [f for f in flows if f not in PAGES]
+    if unknown:
+        print(f"Flujos desconocidos: {unknown}. Disponibles: {', '.join(PAGES)}", file=sys.stderr)
+        return 2
+    cassette = Path(args.cassette or DEFAULT_CASSETTE)
+    if "fx" in flows and not (args.live_http or args.url) and not cassette.exists():
+        if args.flows:
+            print(f"No existe el cassette {cassette}; grábalo con bench/bench_indicadores.py --record.", file=sys.stderr)
+            return 2
+        print(f"(sin cassette en {cassette}: se omite el flujo fx)")
+        flows.remove("fx")
+    stages = [int(n) for n in args.sessions.split(",") if n.strip()]
+
+    mock: Optional[subprocess.Popen] = None
+    server: Optional[subprocess.Popen] = None
+    log_path: Optional[Path] = None
+    try:
+        if args.url:
+            # El portal ya tiene su OPENAI_BASE_URL; aquí solo se manejan las sesiones
+            base_url, pid = args.url, args.pid
+        else:
+            if not args.base_url:
+                mock = _start_mock(args)
+            # El servidor hereda el entorno: todo apunta al mock y nada se queda en .data/
+            data_dir = Path(os.environ.get("IMEMSA_DATA_DIR") or tempfile.mkdtemp(prefix="imemsa-load-"))
+            os.environ["IMEMSA_DATA_DIR"] = str(data_dir)
+            os.environ["OPENAI_BASE_URL"] = args.base_url
+            os.environ["OPENAI_API_KEY"] = os.getenv("BENCH_OPENAI_KEY", "sk-bench")
+            os.environ["IMEMSA_LLM_CACHE"] = "0"
+            for k in ("BANXICO_TOKEN", "INEGI_TOKEN", "FRED_TOKEN"):
+                os.environ.setdefault(k, "bench-token")
+            if not args.live_http:
+                os.environ["IMEMSA_HTTP_MODE"] = "replay"
+                os.environ["IMEMSA_HTTP_CASSETTE"] = str(cassette)
+            if not args.with_limits:
+                os.environ["IMEMSA_OPENAI_RPM"] = "1000000"
+                os.environ["IMEMSA_OPENAI_TPM"] = "1000000000"
+                os.environ["IMEMSA_OPENAI_CONCURRENCY"] = str(max(64, max(stages) * 2))
+            log_path = data_dir / "streamlit.log"
+            server, base_url = start_server(log_path)
+            pid = server.pid
+
+        inputs = Inputs(args.input_chars, args.audio_kb, args.same_input)
+        password = portal_password()
+        stats = ProcStats(pid)
+        print(f"portal: {base_url} · flujos: {', '.join(flows)} · {args.duration:g} s por etapa"
+              f" · ttft {args.ttft_ms:g} ms · {args.tps:g} tok/s")
+        if log_path:
+            print(f"log del servidor: {log_path}")
+        if not args.no_warmup:
+            print(f"calentamiento: {warm_up(flows, base_url, inputs, password):.1f} s")
+        results = []
+        for n in stages:
+            stage = run_stage(n, args.duration, args.ramp, flows, base_url, inputs, password, stats, log_path)
+            results.append(stage)
+            _print(stage)
+
+        print(f"\n{'sesiones':>9}{'flujos/s':>10}{'err %':>7}{'CPU':>6}{'RSS pico':>10}")
+        for r in results:
+            print(f"{r['sessions']:>9}{r['flows_per_s']:>10.2f}{r['error_rate_%']:>7.1f}"
+                  f"{r.get('server_cpu_cores', float('nan')):>6.2f}{r.get('server_rss_peak_mb', float('nan')):>10.0f}")
+
+        if args.json_out:
+            Path(args.json_out).write_text(json.dumps({"args": vars(args), "stages": results}, indent=2, ensure_ascii=False))
+            print(f"\nResultados en {args.json_out}")
+    finally:
+        for proc in (server, mock):
+            if proc is not None:
+                proc.terminate()
+                try:
+                    proc.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
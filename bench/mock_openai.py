@@ -0,0 +1,448 @@
+"""
+Servidor local que imita la API de OpenAI para benchmarks (sin costo).
+
+Endpoints:
+  POST /v1/chat/completions     (JSON o SSE con stream=true; usage al final)
+  POST /v1/responses            (Responses API, sin streaming)
+  POST /v1/audio/transcriptions (multipart; json o text)
+  GET  /v1/models, GET /stats
+
+Modelo de latencia por solicitud:
+  ttft (± jitter) + tokens_entrada_no_cacheados / prefill_tps + tokens_salida / tps
+  (audio: segundos estimados por tamaño × rtf)
+  + con probabilidad --tail-rate, --tail-ms extra antes del primer token (cola lenta)
+
+Caché de prompts simulada como la del proveedor: si el prompt mide ≥1024
+tokens, el prefijo común más largo ya visto (en pasos de 128 tokens) se
+reporta en usage.*_tokens_details.cached_tokens y no paga prefill.
+
+El contenido se arma según el esquema que pide el prompt (minuta, ticket,
+OCR o texto libre) para que los parsers de páginas y servicios lo acepten;
+el tamaño de salida es proporcional a la entrada (--out-ratio).
+
+Uso:
+  python bench/mock_openai.py --port 8089 --ttft-ms 400 --tps 60 --error-rate 0.05
+  OPENAI_BASE_URL=http://127.0.0.1:8089/v1 OPENAI_API_KEY=sk-mock streamlit run app.py
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+CHARS_PER_TOKEN = 4
+PREFIX_CACHE_MIN = 1024
+PREFIX_CACHE_STEP = 128
+AUDIO_BYTES_PER_S = 16_000  # ~128 kbps
+FILLER = (
+    "Se revisó el avance de producción de la línea de lanchas, el estado de los moldes y la "
+    "disponibilidad de gel coat y fibra de vidrio; se acordó dar seguimiento semanal. "
+)
+
+
+@dataclass
+class MockConfig:
+    ttft_ms: float = 300.0          # tiempo al primer token
+    tps: float = 80.0               # tokens de salida por segundo
+    prefill_tps: float = 5000.0     # tokens de entrada por segundo
+    jitter: float = 0.2             # ± fracción aleatoria sobre la latencia
+    out_ratio: float = 0.6          # tokens de salida / tokens de entrada
+    max_out_tokens: int = 2048
+    chunk_tokens: int = 4           # tokens por evento SSE
+    audio_rtf: float = 0.05         # segundos de proceso por segundo de audio
+    error_rate: float = 0.0         # probabilidad de error HTTP por solicitud
+    error_statuses: List[int] = field(default_factory=lambda: [429])
+    retry_after: float = 0.2        # encabezado Retry-After en 429
+    stream_cut_rate: float = 0.0    # probabilidad de cortar un stream a la mitad
+    tail_rate: float = 0.0          # probabilidad de una solicitud lenta (cola de latencia)
+    tail_ms: float = 3000.0         # retraso extra de esas solicitudes
+    prefix_cache: bool = True       # simula la caché de prompts (≥1024 tokens, pasos de 128)
+    seed: Optional[int] = None
+
+
+class _Stats:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.counts: Dict[str, int] = {}
+
+    def add(self, key: str) -> None:
+        with self.lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def snapshot(self) -> Dict[str, int]:
+        with self.lock:
+            return dict(self.counts)
+
+
+# ==========================================================
+# Contenido
+# ==========================================================
+def _texts(obj: Any, out: List[str]) -> List[str]:
+    """Todo el texto del payload (mensajes, input, instructions) sin imágenes en base64."""
+    if isinstance(obj, str):
+        if not obj.startswith("data:"):
+            out.append(obj)
+    elif isinstance(obj, list):
+        for v in obj:
+            _texts(v, out)
+    elif isinstance(obj, dict):
+        for k, v in obj.items():
+            if k in ("content", "text", "input", "instructions", "messages"):
+                _texts(v, out)
+    return out
+
+
+def _count_images(obj: Any) -> int:
+    if isinstance(obj, list):
+        return sum(_count_images(v) for v in obj)
+    if isinstance(obj, dict):
+        kind = obj.get("type")
+        if kind in ("image_url", "input_image"):
+            return 1
+        return sum(_count_images(v) for v in obj.values())
+    return 0
+
+
+def _filler(tokens: int) -> str:
+    n = max(1, tokens) * CHARS_PER_TOKEN
+    return (FILLER * (n // len(FILLER) + 1))[:n].rsplit(" ", 1)[0]
+
+
+def _content_for(prompt: str, out_tokens: int) -> str:
+    """Respuesta con la forma que espera cada herramienta."""
+    if '"full_text"' in prompt:
+        return json.dumps(
+            {
+                "full_text": _filler(out_tokens),
+                "fields": {
+                    "tipo_documento": "Factura", "folio": "A-1234", "fecha": "2024-05-02", "empresa": "IMEMSA",
+                    "proveedor": "Resinas del Golfo", "total": "15,080.00", "moneda": "MXN",
+                    "items": [
+                        {"descripcion": "Gel coat blanco", "cantidad": "4", "unidad": "cubeta",
+                         "precio_unitario": "2,600.00", "importe": "10,400.00"},
+                        {"descripcion": "Catalizador", "cantidad": "6", "unidad": "kg",
+                         "precio_unitario": "780.00", "importe": "4,680.00"},
+                    ],
+                    "notas": "",
+                },
+            },
+            ensure_ascii=False,
+        )
+    if '"tipo_solicitud"' in prompt:
+        return json.dumps(
+            {
+                "area": "Tesoreria", "tipo_solicitud": "Pago", "prioridad": "Alta",
+                "motivo_prioridad": "Impacta embarque", "resumen": _filler(out_tokens),
+                "datos_clave": {"proveedor": "Resinas del Golfo", "factura": "A-1234", "oc": "456", "monto": "15,080",
+                                "moneda": "MXN", "fecha_limite": "", "cliente": "", "contacto": ""},
+                "faltantes": [],
+                "acciones": [{"accion": "Programar pago", "responsable_sugerido": "Tesorería",
+                              "prioridad": "Alta", "plazo_sugerido": "Hoy"}],
+            },
+            ensure_ascii=False,
+        )
+    if '"agreements"' in prompt:
+        return json.dumps(
+            {
+                "title": "Junta de producción", "summary": _filler(out_tokens),
+                "agreements": ["Seguimiento semanal de moldes", "Compra de gel coat"],
+                "actions": [
+                    {"accion": "Revisar moldes", "responsable": "Producción", "fecha_compromiso": "",
+                     "prioridad": "media", "area": "Producción", "notas": ""},
+                    {"accion": "Cotizar gel coat", "responsable": "Compras", "fecha_compromiso": "",
+                     "prioridad": "alta", "area": "Compras", "notas": ""},
+                ],
+            },
+            ensure_ascii=False,
+        )
+    return _filler(out_tokens)
+
+
+# ==========================================================
+# Servidor
+# ==========================================================
+class MockOpenAI(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024  # el backlog por defecto (5) tira conexiones en ráfagas de cientos
+
+    def __init__(self, addr: Tuple[str, int], config: MockConfig) -> None:
+        super().__init__(addr, _Handler)
+        self.config = config
+        self.stats = _Stats()
+        self._rng = random.Random(config.seed)
+        self._rng_lock = threading.Lock()
+        self._prefixes: set = set()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def rand(self) -> float:
+        with self._rng_lock:
+            return self._rng.random()
+
+    def jittered(self, seconds: float) -> float:
+        j = self.config.jitter
+        return max(0.0, seconds * (1 + (self.rand() * 2 - 1) * j))
+
+    def cached_tokens(self, prompt: str) -> int:
+        """Tokens del prefijo más largo ya visto (múltiplos de 128, mínimo 1024); registra los nuevos."""
+        total = len(prompt) // CHARS_PER_TOKEN
+        if not self.config.prefix_cache or total < PREFIX_CACHE_MIN:
+            return 0
+        marks = [(n, hash(prompt[: n * CHARS_PER_TOKEN])) for n in range(PREFIX_CACHE_MIN, total + 1, PREFIX_CACHE_STEP)]
+        cached = 0
+        with self._rng_lock:
+            for n, h in marks:
+                if h not in self._prefixes:
+                    break
+                cached = n
+            self._prefixes.update(h for _, h in marks)
+        return cached
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: MockOpenAI
+
+    def log_message(self, *args: Any) -> None:
+        pass
+
+    # ---------- utilidades
+    def _send_json(self, status: int, obj: Any, headers: Optional[Dict[str, str]] = None) -> None:
+        body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _maybe_error(self, endpoint: str) -> bool:
+        cfg = self.server.config
+        if cfg.error_rate <= 0 or self.server.rand() >= cfg.error_rate:
+            return False
+        status = cfg.error_statuses[int(self.server.rand() * len(cfg.error_statuses))]
+        self.server.stats.add(f"{endpoint}:error_{status}")
+        kind = "rate_limit_exceeded" if status == 429 else "server_error"
+        headers = {"Retry-After": f"{cfg.retry_after:g}"} if status == 429 else {}
+        self._send_json(status, {"error": {"message": f"mock {status}", "type": kind, "code": kind}}, headers)
+        return True
+
+    def _sizes(self, payload: Dict[str, Any]) -> Tuple[str, int, int]:
+        cfg = self.server.config
+        prompt = "\n".join(_texts(payload, []))
+        in_tokens = len(prompt) // CHARS_PER_TOKEN + 1100 * _count_images(payload)
+        cap = int(payload.get("max_tokens") or payload.get("max_output_tokens") or cfg.max_out_tokens)
+        out_tokens = max(8, min(cap, int(in_tokens * cfg.out_ratio)))
+        return prompt, in_tokens, out_tokens
+
+    def _latency(self, in_tokens: int, out_tokens: int) -> Tuple[float, float]:
+        """(segundos antes del primer token, segundos de generación)."""
+        cfg = self.server.config
+        first = self.server.jittered(cfg.ttft_ms / 1000 + in_tokens / max(1.0, cfg.prefill_tps))
+        if cfg.tail_rate > 0 and self.server.rand() < cfg.tail_rate:
+            first += cfg.tail_ms / 1000
+        return first, self.server.jittered(out_tokens / max(1.0, cfg.tps))
+
+    # ---------- rutas
+    def do_GET(self) -> None:  # noqa: N802
+        if self.path.rstrip("/") == "/stats":
+            self._send_json(200, {"config": asdict(self.server.config), "counts": self.server.stats.snapshot()})
+        elif self.path.rstrip("/") == "/v1/models":
+            self._send_json(200, {"object": "list", "data": [{"id": "gpt-4o-mini", "object": "model"}]})
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self) -> None:  # noqa: N802
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        path = self.path.split("?", 1)[0].rstrip("/")
+        if path.endswith("/chat/completions"):
+            self._chat(json.loads(raw or b"{}"))
+        elif path.endswith("/responses"):
+            self._responses(json.loads(raw or b"{}"))
+        elif path.endswith("/audio/transcriptions"):
+            self._transcription(raw)
+        else:
+            self._send_json(404, {"error": {"message": f"ruta no soportada: {path}"}})
+
+    def _chat(self, payload: Dict[str, Any]) -> None:
+        if self._maybe_error("chat"):
+            return
+        prompt, in_tokens, out_tokens = self._sizes(payload)
+        content = _content_for(prompt, out_tokens)
+        out_tokens = len(content) // CHARS_PER_TOKEN
+        cached = self.server.cached_tokens(prompt)
+        usage = {
+            "prompt_tokens": in_tokens, "completion_tokens": out_tokens, "total_tokens": in_tokens + out_tokens,
+            "prompt_tokens_details": {"cached_tokens": cached},
+        }
+        if cached:
+            self.server.stats.add("chat:prefix_cached")
+        first, gen = self._latency(in_tokens - cached, out_tokens)
+        model = payload.get("model", "gpt-4o-mini")
+        cid = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+
+        if not payload.get("stream"):
+            self.server.stats.add("chat")
+            time.sleep(first + gen)
+            self._send_json(200, {
+                "id": cid, "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+            return
+
+        self.server.stats.add("chat:stream")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def event(obj: Any) -> None:
+            data = f"data: {obj if isinstance(obj, str) else json.dumps(obj, ensure_ascii=False)}\n\n".encode("utf-8")
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+
+        cfg = self.server.config
+        step = max(1, cfg.chunk_tokens) * CHARS_PER_TOKEN
+        pieces = [content[i:i + step] for i in range(0, len(content), step)] or [""]
+        cut_at = len(pieces) // 2 if self.server.rand() < cfg.stream_cut_rate else None
+        time.sleep(first)
+        for i, piece in enumerate(pieces):
+            if cut_at is not None and i == cut_at:
+                self.server.stats.add("chat:stream_cut")
+                self.close_connection = True
+                return
+            event({"id": cid, "object": "chat.completion.chunk", "model": model,
+                   "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]})
+            time.sleep(gen / len(pieces))
+        if (payload.get("stream_options") or {}).get("include_usage"):
+            event({"id": cid, "object": "chat.completion.chunk", "model": model, "choices": [], "usage": usage})
+        event("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _responses(self, payload: Dict[str, Any]) -> None:
+        if self._maybe_error("responses"):
+            return
+        if payload.get("stream"):
+            self._send_json(400, {"error": {"message": "stream no soportado en /responses del mock"}})
+            return
+        self.server.stats.add("responses")
+        prompt, in_tokens, out_tokens = self._sizes(payload)
+        content = _content_for(prompt, out_tokens)
+        out_tokens = len(content) // CHARS_PER_TOKEN
+        cached = self.server.cached_tokens(prompt)
+        first, gen = self._latency(in_tokens - cached, out_tokens)
+        time.sleep(first + gen)
+        self._send_json(200, {
+            "id": f"resp_{uuid.uuid4().hex[:12]}", "object": "response", "created_at": int(time.time()),
+            "status": "completed", "model": payload.get("model", "gpt-4o-mini"),
+            "output": [{
+                "id": f"msg_{uuid.uuid4().hex[:12]}", "type": "message", "role": "assistant", "status": "completed",
+                "content": [{"type": "output_text", "text": content, "annotations": []}],
+            }],
+            "parallel_tool_calls": True, "tool_choice": "auto", "tools": [],
+            "usage": {
+                "input_tokens": in_tokens, "output_tokens": out_tokens, "total_tokens": in_tokens + out_tokens,
+                "input_tokens_details": {"cached_tokens": cached}, "output_tokens_details": {"reasoning_tokens": 0},
+            },
+        })
+
+    def _transcription(self, raw: bytes) -> None:
+        if self._maybe_error("audio"):
+            return
+        self.server.stats.add("audio")
+        cfg = self.server.config
+        audio_s = len(raw) / AUDIO_BYTES_PER_S
+        out_tokens = max(8, int(audio_s * 2.5))  # ~150 palabras por minuto
+        text = _filler(out_tokens)
+        time.sleep(self.server.jittered(cfg.ttft_ms / 1000 + audio_s * cfg.audio_rtf))
+        m = re.search(rb'name="response_format"\r\n\r\n([a-z_]+)', raw)
+        if m and m.group(1) == b"text":
+            body = text.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        in_tokens = int(audio_s * 10)
+        self._send_json(200, {"text": text, "usage": {"type": "tokens", "input_tokens": in_tokens,
+                                                      "output_tokens": out_tokens,
+                                                      "total_tokens": in_tokens + out_tokens}})
+
+
+def serve(config: Optional[MockConfig] = None, host: str = "127.0.0.1", port: int = 0) -> MockOpenAI:
+    """Arranca el mock en un hilo; devuelve el servidor (server.base_url, server.shutdown())."""
+    srv = MockOpenAI((host, port), config or MockConfig())
+    threading.Thread(target=srv.serve_forever, name="mock-openai", daemon=True).start()
+    return srv
+
+
+def add_config_args(ap: argparse.ArgumentParser) -> None:
+    d = MockConfig()
+    ap.add_argument("--ttft-ms", type=float, default=d.ttft_ms, help="latencia al primer token (ms)")
+    ap.add_argument("--tps", type=float, default=d.tps, help="tokens de salida por segundo")
+    ap.add_argument("--prefill-tps", type=float, default=d.prefill_tps, help="tokens de entrada por segundo")
+    ap.add_argument("--jitter", type=float, default=d.jitter)
+    ap.add_argument("--out-ratio", type=float, default=d.out_ratio, help="tokens salida / entrada")
+    ap.add_argument("--audio-rtf", type=float, default=d.audio_rtf, help="s de proceso por s de audio")
+    ap.add_argument("--error-rate", type=float, default=d.error_rate)
+    ap.add_argument("--error-status", default="429", help="lista separada por comas (p. ej. 429,500,503)")
+    ap.add_argument("--retry-after", type=float, default=d.retry_after)
+    ap.add_argument("--stream-cut-rate", type=float, default=d.stream_cut_rate)
+    ap.add_argument("--tail-rate", type=float, default=d.tail_rate, help="fracción de solicitudes lentas")
+    ap.add_argument("--tail-ms", type=float, default=d.tail_ms, help="retraso extra de las solicitudes lentas (ms)")
+    ap.add_argument("--no-prefix-cache", action="store_true", help="no simular la caché de prompts")
+    ap.add_argument("--mock-seed", type=int, default=None)
+
+
+def config_from_args(args: argparse.Namespace) -> MockConfig:
+    return MockConfig(
+        ttft_ms=args.ttft_ms,
+        tps=args.tps,
+        prefill_tps=args.prefill_tps,
+        jitter=args.jitter,
+        out_ratio=args.out_ratio,
+        audio_rtf=args.audio_rtf,
+        error_rate=args.error_rate,
+        error_statuses=[int(s) for s in str(args.error_status).split(",") if s.strip()],
+        retry_after=args.retry_after,
+        stream_cut_rate=args.stream_cut_rate,
+        tail_rate=args.tail_rate,
+        tail_ms=args.tail_ms,
+        prefix_cache=not args.no_prefix_cache,
+        seed=args.mock_seed,
+    )
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8089, help="0 = puerto libre")
+    add_config_args(ap)
+    args = ap.parse_args(argv)
+
+    srv = MockOpenAI((args.host, args.port), config_from_args(args))
+    print(f"MOCK_OPENAI_URL={srv.base_url}", flush=True)
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,252 @@
+"""
+Servidor local compatible con Redis (RESP2) para probar la caché compartida
+(utils_cache_backend) sin instalar Redis.
+
+Solo implementa lo que usa el portal:
+  PING, AUTH, SELECT, GET, SET (EX/PX/NX), DEL, EXISTS,
+  SCAN (MATCH/COUNT), DBSIZE, FLUSHDB, INFO
+Todo vive en memoria del proceso; cada base (SELECT n) es un dict aparte.
+
+Uso:
+  python bench/mock_redis.py --port 6380 --latency-ms 2
+  IMEMSA_CACHE_BACKEND=redis IMEMSA_CACHE_URL=redis://127.0.0.1:6380/0 streamlit run app.py
+
+Con dos `streamlit run` apuntando al mismo mock se comprueba que una réplica
+reutiliza lo que calculó la otra (tipos de cambio, UMA, respuestas del modelo).
+"""
+from __future__ import annotations
+
+import argparse
+import re
+import socketserver
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class _Err(Exception):
+    """Error que se devuelve al cliente como respuesta RESP (-ERR ...)."""
+
+
+class MockRedis(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, addr: Tuple[str, int], latency_ms: float = 0.0, password: str = "") -> None:
+        self.latency_s = max(0.0, latency_ms) / 1000
+        self.password = password
+        self.lock = threading.Lock()
+        self.dbs: Dict[int, Dict[bytes, Tuple[bytes, Optional[float]]]] = {}
+        self.commands = 0
+        super().__init__(addr, _Handler)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"redis://127.0.0.1:{port}/0" if host in ("0.0.0.0", "") else f"redis://{host}:{port}/0"
+
+    def db(self, n: int) -> Dict[bytes, Tuple[bytes, Optional[float]]]:
+        return self.dbs.setdefault(n, {})
+
+    def live(self, db: Dict[bytes, Tuple[bytes, Optional[float]]], key: bytes) -> Optional[bytes]:
+        item = db.get(key)
+        if item is None:
+            return None
+        value, exp = item
+        if exp is not None and exp <= time.monotonic():
+            del db[key]
+            return None
+        return value
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    server: MockRedis
+
+    def setup(self) -> None:
+        super().setup()
+        self.dbn = 0
+        self.authed = not self.server.password
+
+    def handle(self) -> None:
+        while True:
+            try:
+                args = self._read_command()
+            except (ConnectionError, ValueError):
+                return
+            if args is None:
+                return
+            if self.server.latency_s:
+                time.sleep(self.server.latency_s)
+            try:
+                reply = self._dispatch(args)
+            except _Err as e:
+                self.wfile.write(f"-ERR {e}\r\n".encode())
+            else:
+                self.wfile.write(_encode(reply))
+            self.wfile.flush()
+
+    def _read_command(self) -> Optional[List[bytes]]:
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            return line.split()  # comando en línea (p. ej. `PING` desde nc)
+        args = []
+        for _ in range(int(line[1:])):
+            header = self.rfile.readline()
+            if not header.startswith(b"$"):
+                raise ValueError("Se esperaba un bulk string.")
+            n = int(header[1:])
+            data = self.rfile.read(n + 2)
+            if len(data) != n + 2:
+                raise ConnectionError("Comando incompleto.")
+            args.append(data[:-2])
+        return args
+
+    def _dispatch(self, args: List[bytes]) -> Any:
+        if not args:
+            raise _Err("comando vacío")
+        cmd, rest = args[0].decode().upper(), args[1:]
+        srv = self.server
+        with srv.lock:
+            srv.commands += 1
+        if cmd == "AUTH":
+            if rest and rest[-1].decode() == srv.password:
+                self.authed = True
+                return "+OK"
+            raise _Err("invalid password")
+        if not self.authed:
+            return _Raw(b"-NOAUTH Authentication required.\r\n")
+        if cmd == "PING":
+            return rest[0] if rest else "+PONG"
+        if cmd == "SELECT":
+            self.dbn = int(rest[0])
+            return "+OK"
+        with srv.lock:
+            db = srv.db(self.dbn)
+            if cmd == "GET":
+                return srv.live(db, rest[0])
+            if cmd == "SET":
+                return self._set(db, rest)
+            if cmd == "DEL":
+                found = [k for k in dict.fromkeys(rest) if srv.live(db, k) is not None]
+                for k in found:
+                    del db[k]
+                return len(found)
+            if cmd == "EXISTS":
+                return sum(1 for k in rest if srv.live(db, k) is not None)
+            if cmd == "SCAN":
+                return self._scan(db, rest)
+            if cmd == "DBSIZE":
+                return sum(1 for k in list(db) if srv.live(db, k) is not None)
+            if cmd == "FLUSHDB":
+                db.clear()
+                return "+OK"
+            if cmd == "INFO":
+                keys = sum(len(d) for d in srv.dbs.values())
+                return f"# Server\r\nredis_version:mock\r\nkeys:{keys}\r\ncommands:{srv.commands}\r\n".encode()
+        raise _Err(f"unknown command '{cmd}'")
+
+    def _set(self, db: Dict[bytes, Tuple[bytes, Optional[float]]], rest: List[bytes]) -> Any:
+        key, value, opts = rest[0], rest[1], [o.decode().upper() for o in rest[2:]]
+        exp: Optional[float] = None
+        i = 0
+        while i < len(opts):
+            if opts[i] in ("EX", "PX"):
+                amount = float(opts[i + 1])
+                exp = time.monotonic() + (amount if opts[i] == "EX" else amount / 1000)
+                i += 2
+            elif opts[i] == "NX":
+                if self.server.live(db, key) is not None:
+                    return None
+                i += 1
+            else:
+                raise _Err("syntax error")
+        db[key] = (value, exp)
+        return "+OK"
+
+    def _scan(self, db: Dict[bytes, Tuple[bytes, Optional[float]]], rest: List[bytes]) -> Any:
+        # Cursor = posición en la lista ordenada de llaves; suficiente para un mock
+        cursor, pattern, count = int(rest[0]), "*", 10
+        opts = rest[1:]
+        for i in range(0, len(opts) - 1, 2):
+            name = opts[i].decode().upper()
+            if name == "MATCH":
+                pattern = opts[i + 1].decode("utf-8", "replace")
+            elif name == "COUNT":
+                count = max(1, int(opts[i + 1]))
+        keys = sorted(k for k in list(db) if self.server.live(db, k) is not None)
+        page = keys[cursor:cursor + count]
+        nxt = cursor + count if cursor + count < len(keys) else 0
+        regex = _glob_regex(pattern)
+        return [str(nxt).encode(), [k for k in page if regex.match(k.decode("utf-8", "replace"))]]
+
+
+class _Raw(bytes):
+    """Respuesta ya codificada."""
+
+
+def _glob_regex(pattern: str) -> "re.Pattern[str]":
+    """Patrón glob de Redis (*, ?, [..] y escapes con '\\') a expresión regular."""
+    out, i = [], 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == "\\" and i + 1 < len(pattern):
+            out.append(re.escape(pattern[i + 1]))
+            i += 1
+        elif c == "*":
+            out.append(".*")
+        elif c == "?":
+            out.append(".")
+        elif c == "[" and "]" in pattern[i + 1:]:
+            j = pattern.index("]", i + 1)
+            out.append("[" + pattern[i + 1:j].replace("\\", "\\\\") + "]")
+            i = j
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return re.compile("".join(out) + r"\Z", re.DOTALL)
+
+
+def _encode(reply: Any) -> bytes:
+    if isinstance(reply, _Raw):
+        return bytes(reply)
+    if reply is None:
+        return b"$-1\r\n"
+    if isinstance(reply, str):
+        return (reply if reply[:1] in "+-" else "+" + reply).encode() + b"\r\n"
+    if isinstance(reply, bool) or isinstance(reply, int):
+        return b":%d\r\n" % int(reply)
+    if isinstance(reply, (bytes, bytearray)):
+        return b"$%d\r\n%s\r\n" % (len(reply), bytes(reply))
+    if isinstance(reply, list):
+        return b"*%d\r\n" % len(reply) + b"".join(_encode(r) for r in reply)
+    raise TypeError(f"Respuesta no soportada: {type(reply).__name__}")
+
+
+def serve(host: str = "127.0.0.1", port: int = 0, latency_ms: float = 0.0, password: str = "") -> MockRedis:
+    """Arranca el mock en un hilo; devuelve el servidor (server.url, server.shutdown())."""
+    srv = MockRedis((host, port), latency_ms=latency_ms, password=password)
+    threading.Thread(target=srv.serve_forever, name="mock-redis", daemon=True).start()
+    return srv
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=6380, help="0 = puerto libre")
+    ap.add_argument("--latency-ms", type=float, default=0.0, help="retraso por comando (simula red entre réplicas)")
+    ap.add_argument("--password", default="", help="exige AUTH con esta contraseña")
+    args = ap.parse_args(argv)
+
+    srv = MockRedis((args.host, args.port), latency_ms=args.latency_ms, password=args.password)
+    print(f"MOCK_REDIS_URL={srv.url}", flush=True)
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,341 @@
+"""
+Presupuestos de latencia de render por página: detecta regresiones (un import
+pesado, una consulta de red de más al cargar) antes de que lleguen al portal.
+
+Para app.py y cada archivo de pages/ corre un proceso nuevo con
+streamlit.testing (AppTest) y mide:
+
+  frío      primera ejecución de la página en el proceso (imports propios,
+            cachés vacías)
+  caliente  mediana de --warm ejecuciones siguientes (sin interacción)
+  flujo     una ejecución simulada completa, de la acción al resultado:
+            login, texto → botón → trabajo terminado, archivo → botón,
+            Generar Excel…
+  http      peticiones HTTP externas durante la carga en frío
+
+Todo va contra dobles locales: el modelo en bench/mock_openai.py (rápido y sin
+jitter por defecto) y el HTTP externo en replay (utils_http_replay; sin
+cassette cada petición es un 404 inmediato, igual se cuenta). Los datos van a
+una carpeta temporal (IMEMSA_DATA_DIR).
+
+Compara contra bench/render_budgets.json y termina con código 1 si alguna
+página excede un presupuesto o falla; útil como verificación en CI.
+
+  python bench/render_budgets.py
+  python bench/render_budgets.py --pages pages/7_tipos_de_cambio.py --warm 10
+  python bench/render_budgets.py --scale 2          # máquina lenta: presupuestos × 2
+  python bench/render_budgets.py --update           # presupuestos = medido × --headroom
+  python bench/render_budgets.py --json render.json
+
+El flujo de tipos de cambio necesita el cassette de bench_indicadores.py
+(--record); sin él ese flujo se omite.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "bench"))
+
+from bench_tools import _start_mock, _text  # noqa: E402
+from mock_openai import add_config_args  # noqa: E402
+
+BUDGETS_FILE = Path(__file__).resolve().with_suffix(".json")
+METRICS = ("cold_ms", "warm_ms", "flow_ms", "http")
+FLOORS = {"cold_ms": 300.0, "warm_ms": 60.0, "flow_ms": 300.0}  # piso de --update (ruido de la máquina)
+FLOW_TIMEOUT = 120.0
+POLL_S = 0.05
+FX_PAGE = "pages/7_tipos_de_cambio.py"
+
+
+class FlowError(Exception):
+    """El flujo simulado no llegó a su resultado (widget ausente, error en la página, tiempo agotado)."""
+
+
+# ==========================================================
+# Proceso hijo: UNA página
+# ==========================================================
+def _find(at: Any, kind: str, label: Optional[str] = None) -> Any:
+    for el in at.get(kind):
+        if label is None or getattr(el, "label", None) == label:
+            return el
+    return None
+
+
+def _require(at: Any, kind: str, label: Optional[str] = None) -> Any:
+    el = _find(at, kind, label)
+    if el is None:
+        raise FlowError(f"No se encontró {kind} {label!r}.")
+    return el
+
+
+def _check(at: Any) -> None:
+    if at.exception:
+        raise FlowError(str(at.exception[0].value)[:200])
+
+
+def _until(at: Any, ready: Callable[[], bool]) -> None:
+    """Reejecuta la página (como el fragmento de utils_jobs.watch) hasta que `ready()`."""
+    deadline = time.monotonic() + FLOW_TIMEOUT
+    while True:
+        _check(at)
+        if ready():
+            return
+        if time.monotonic() > deadline:
+            raise FlowError(f"Sin resultado tras {FLOW_TIMEOUT:.0f} s.")
+        time.sleep(POLL_S)
+        at.run()
+
+
+def _text_job(field: str, button: str, result: str, result_label: Optional[str] = None) -> Callable[[Any], None]:
+    def flow(at: Any) -> None:
+        _require(at, "text_area", field).input(_text(3000))
+        at.run()
+        _require(at, "button", button).click()
+        at.run()
+        _until(at, lambda: _find(at, result, result_label) is not None)
+
+    return flow
+
+
+def _upload_job(name: str, data: Callable[[], bytes], mime: str, button: str,
+                result: str, result_label: Optional[str] = None) -> Callable[[Any], None]:
+    def flow(at: Any) -> None:
+        _require(at, "file_uploader").upload(name, data(), mime)
+        at.run()
+        _require(at, "button", button).click()
+        at.run()
+        _until(at, lambda: _find(at, result, result_label) is not None)
+
+    return flow
+
+
+def _flow_login(at: Any) -> None:
+    from load_portal import portal_password
+
+    _require(at, "text_input", "Contraseña").input(portal_password())
+    _require(at, "button", "Entrar").click()
+    at.run()
+    _check(at)
+    if not at.session_state["auth"]:
+        raise FlowError("Login rechazado.")
+
+
+def _flow_fx(at: Any) -> None:
+    _require(at, "button", "Generar Excel").click()
+    at.run()
+    _until(at, lambda: _find(at, "download_button") is not None)
+
+
+def _pdf() -> bytes:
+    from load_portal import _pdf as pdf
+
+    return pdf()
+
+
+def _csv() -> bytes:
+    from load_portal import _csv as csv
+
+    return csv()
+
+
+FLOWS: Dict[str, Callable[[Any], None]] = {
+    "app.py": _flow_login,
+    "pages/1_transcripcion.py": _upload_job(
+        "junta.mp3", lambda: os.urandom(160 * 1024), "audio/mpeg", "Transcribir", "text_area", "Resultado"),
+    "pages/2_traduccion.py": _text_job("Texto a traducir", "Traducir", "text_area", "Traducción"),
+    "pages/3_minutas_y_acciones.py": _text_job("Transcripción", "Generar minuta", "download_button"),
+    "pages/4_documentos.py": _upload_job(
+        "factura.pdf", _pdf, "application/pdf", "Procesar documento", "text_area", "Texto extraído"),
+    "pages/5_forecast_y_Anomalias.py": _upload_job(
+        "ventas.csv", _csv, "text/csv", "Generar forecast y anomalías", "download_button"),
+    "pages/6_nlp_Operacion.py": _text_job("Pega aquí el correo o solicitud", "Analizar", "download_button"),
+    FX_PAGE: _flow_fx,
+}
+
+
+def _child(page: str, warm: int) -> Dict[str, Any]:
+    import utils_http_replay as replay
+
+    # Todas las páginas en replay (no solo la 7, que lo instala por su cuenta)
+    replay.install_from_env()
+    from streamlit.testing.v1 import AppTest
+
+    out: Dict[str, Any] = {"page": page, "errors": []}
+    at = AppTest.from_file(str(ROOT / "app.py"), default_timeout=FLOW_TIMEOUT)
+    for k in ("OPENAI_API_KEY", "BANXICO_TOKEN", "INEGI_TOKEN", "FRED_TOKEN"):
+        at.secrets[k] = os.environ.get("OPENAI_API_KEY", "sk-bench") if k == "OPENAI_API_KEY" else "bench-token"
+    if page != "app.py":
+        at.session_state["auth"] = True
+        at.session_state["admin"] = page.startswith("pages/8_")  # require_admin sin contraseña
+        at.switch_page(page)
+
+    replay.reset_stats()
+    t0 = time.perf_counter()
+    at.run()
+    out["cold_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+    out["http"] = int(sum(h["requests"] for h in replay.stats().values()))
+    out["errors"] += [f"carga: {str(e.value)[:200]}" for e in at.exception]
+
+    samples = []
+    for _ in range(max(1, warm)):
+        t0 = time.perf_counter()
+        at.run()
+        samples.append((time.perf_counter() - t0) * 1000)
+    out["warm_ms"] = round(statistics.median(samples), 1)
+
+    flow = FLOWS.get(page)
+    out["flow_ms"] = None
+    cassette = Path(os.getenv("IMEMSA_HTTP_CASSETTE") or replay.DEFAULT_CASSETTE)
+    if page == FX_PAGE and not cassette.exists():
+        # Sin respuestas grabadas el Excel terminaría en 404: se omite en vez de fallar
+        out["skipped"] = "flujo omitido: sin cassette (bench/bench_indicadores.py --record)"
+    elif flow is not None and not out["errors"]:
+        t0 = time.perf_counter()
+        try:
+            flow(at)
+            out["flow_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        except FlowError as e:
+            out["errors"].append(f"flujo: {e}")
+    return out
+
+
+# ==========================================================
+# Proceso padre
+# ==========================================================
+def measure(page: str, warm: int, base_url: str, data_dir: str) -> Dict[str, Any]:
+    env = dict(os.environ)
+    env.update({
+        "IMEMSA_DATA_DIR": data_dir,
+        "IMEMSA_HTTP_MODE": "replay",
+        "IMEMSA_LLM_CACHE": "0",  # cada proceso es nuevo, pero la caché en disco sería compartida
+        "OPENAI_BASE_URL": base_url,
+        "OPENAI_API_KEY": os.getenv("BENCH_OPENAI_KEY", "sk-bench"),
+    })
+    proc = subprocess.run(
+        [sys.executable, __file__, "--child", page, "--warm", str(warm)],
+        cwd=ROOT, env=env, capture_output=True, text=True,
+    )
+    try:
+        return json.loads(proc.stdout.strip().splitlines()[-1])
+    except (IndexError, ValueError):
+        tail = proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else f"exit {proc.returncode}"
+        return {"page": page, "errors": [f"proceso: {tail}"], "cold_ms": None, "warm_ms": None,
+                "flow_ms": None, "http": None}
+
+
+def load_budgets(path: Path) -> Dict[str, Dict[str, float]]:
+    if not path.exists():
+        return {}
+    data = json.loads(path.read_text(encoding="utf-8"))
+    return {k: v for k, v in data.items() if not k.startswith("_")}
+
+
+def over_budget(result: Dict[str, Any], budget: Dict[str, float], scale: float) -> List[str]:
+    out = []
+    for metric in METRICS:
+        value, limit = result.get(metric), budget.get(metric)
+        if value is None or limit is None:
+            continue
+        limit = limit if metric == "http" else limit * scale
+        if value > limit:
+            out.append(f"{metric} {value:g} > {limit:g}")
+    return out
+
+
+def updated_budget(result: Dict[str, Any], old: Dict[str, float], headroom: float) -> Dict[str, float]:
+    new = dict(old)
+    for metric in METRICS:
+        value = result.get(metric)
+        if value is None:
+            continue
+        # http es exacto: una consulta nueva al cargar debe notarse
+        new[metric] = int(value) if metric == "http" else float(math.ceil(max(value * headroom, FLOORS[metric]) / 10) * 10)
+    return new
+
+
+def _fmt(value: Optional[float]) -> str:
+    return "—" if value is None else f"{value:,.0f}"
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--pages", default="", help="rutas separadas por coma (default: app.py y todas las de pages/)")
+    ap.add_argument("--warm", type=int, default=5, help="ejecuciones calientes por página (se reporta la mediana)")
+    ap.add_argument("--budgets", default=str(BUDGETS_FILE), help="archivo JSON de presupuestos")
+    ap.add_argument("--scale", type=float, default=1.0, help="multiplica los presupuestos de tiempo (máquinas lentas)")
+    ap.add_argument("--update", action="store_true", help="reescribir presupuestos con lo medido × --headroom")
+    ap.add_argument("--headroom", type=float, default=1.5)
+    ap.add_argument("--base-url", default="", help="usar un mock de OpenAI ya levantado")
+    ap.add_argument("--json", dest="json_out", default="", help="guardar resultados en JSON")
+    ap.add_argument("--child", default="", help=argparse.SUPPRESS)
+    add_config_args(ap)
+    # Mock rápido y sin jitter: el flujo mide la página, no la latencia simulada del modelo
+    ap.set_defaults(ttft_ms=20.0, tps=4000.0, jitter=0.0, audio_rtf=0.0, mock_seed=7)
+    args = ap.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(_child(args.child, args.warm), ensure_ascii=False))
+        return 0
+
+    pages = [p.strip() for p in args.pages.split(",") if p.strip()] or ["app.py"] + sorted(
+        str(p.relative_to(ROOT)) for p in (ROOT / "pages").glob("*.py")
+    )
+    budgets_path = Path(args.budgets)
+    budgets = load_budgets(budgets_path)
+
+    proc = None if args.base_url else _start_mock(args)
+    results: List[Dict[str, Any]] = []
+    failed = 0
+    try:
+        with tempfile.TemporaryDirectory(prefix="imemsa-render-") as data_dir:
+            head = f"{'página':<34}{'frío ms':>9}{'cal. ms':>9}{'flujo ms':>10}{'http':>6}  estado"
+            print(head)
+            print("-" * len(head))
+            for page in pages:
+                r = measure(page, args.warm, args.base_url, data_dir)
+                budget = budgets.get(page, {})
+                r["over"] = [] if args.update else over_budget(r, budget, args.scale)
+                ok = not r["errors"] and not r["over"]
+                failed += not ok
+                status = "ok" if ok else "FALLA"
+                if not budget and not args.update:
+                    status += " (sin presupuesto)"
+                print(f"{page:<34}{_fmt(r['cold_ms']):>9}{_fmt(r['warm_ms']):>9}{_fmt(r['flow_ms']):>10}"
+                      f"{_fmt(r['http']):>6}  {status}")
+                for line in r["over"] + r["errors"] + ([r["skipped"]] if r.get("skipped") else []):
+                    print(f"{'':<4}· {line}")
+                results.append(r)
+    finally:
+        if proc is not None:
+            proc.kill()
+
+    if args.update:
+        data = json.loads(budgets_path.read_text(encoding="utf-8")) if budgets_path.exists() else {}
+        for r in results:
+            if not r["errors"]:
+                data[r["page"]] = updated_budget(r, budgets.get(r["page"], {}), args.headroom)
+        budgets_path.write_text(json.dumps(data, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+        print(f"\nPresupuestos actualizados en {budgets_path}")
+
+    if args.json_out:
+        Path(args.json_out).write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    if failed:
+        print(f"\n{failed} página(s) fuera de presupuesto o con error.")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,12 +1,12 @@
-import io
-import os
-import time
-from typing import Optional, Tuple
-
-import requests
 import streamlit as st
 from imemsa_ui import render_title
+from utils_llm import transcribe
+from utils_export import text_download_button
+from utils_jobs import current_job, get, owner_id, recent_jobs_sidebar, set_current_job, settle, submit, watch
 from utils_portal_auth import require_login_redirect
+from utils_results import file_fingerprint, input_key, load_result
+import utils_profiler
+import utils_tracing
 
 # ==========================================================
 # PÁGINA: Transcripción (Audio → Texto)
@@ -16,6 +16,7 @@ from utils_portal_auth import require_login_redirect
 # - Exporta TXT siempre; DOCX/PDF si tienes dependencias
 # ==========================================================
 require_login_redirect()
+utils_profiler.run_hook()
 
 # --------- Login guard (misma llave que app.py del proyecto base)
 #def require_login() -> None:
@@ -38,8 +39,9 @@ if hasattr(st, "page_link"):
 with st.expander("🔒 Privacidad (cómo funciona)", expanded=False):
     st.write(
         "- El audio se envía al servicio de transcripción y se devuelve el texto.\n"
-        "- Esta app no guarda el archivo ni la transcripción.\n"
-        "- En Streamlit Cloud, el archivo vive solo en memoria durante la ejecución."
+        "- El audio no se guarda: vive solo en memoria mientras se transcribe.\n"
+        "- La transcripción se guarda en el servidor de la app (cola de trabajos) para recuperarla "
+        "si se cae la conexión, y se borra a los 7 días (IMEMSA_JOB_KEEP_DAYS)."
     )
 
 # --------- Config
@@ -55,16 +57,9 @@ MAX_FILE_MB = 25
 
 
 # ==========================================================
-# OpenAI Transcription via HTTP (estable, sin depender del SDK)
+# OpenAI Transcription vía gateway HTTP compartido (utils_llm)
 # Docs: POST /audio/transcriptions
 # ==========================================================
-def _get_openai_api_key() -> Optional[str]:
-    # Prioriza secrets (Streamlit Cloud) y luego variables de entorno
-    return (
-        st.secrets.get("OPENAI_API_KEY") if hasattr(st, "secrets") else None
-    ) or os.getenv("OPENAI_API_KEY")
-
-
 def _guess_mime(filename: str) -> str:
     name = filename.lower()
     if name.endswith(".mp3"):
@@ -84,111 +79,19 @@ def _guess_mime(filename: str) -> str:
     return "application/octet-stream"
 
 
-def transcribe_openai(audio_bytes: bytes, filename: str) -> Tuple[str, Optional[dict]]:
-    api_key = _get_openai_api_key()
-    if not api_key:
-        st.error("Falta la API Key.")
-        st.info(
-            "En Streamlit Cloud agrega un Secret llamado **OPENAI_API_KEY** "
-            "o define la variable de entorno `OPENAI_API_KEY`."
-        )
-        st.stop()
-
-    url = "https://api.openai.com/v1/audio/transcriptions"
-    headers = {"Authorization": f"Bearer {api_key}"}
-
-    files = {
-        "file": (filename, io.BytesIO(audio_bytes), _guess_mime(filename)),
-    }
-    data = {
-        "model": MODEL,
-        "language": LANGUAGE,
-        "prompt": PROMPT,
-        "response_format": "json",  # gpt-4o-mini-transcribe soporta json
-    }
-
-    resp = requests.post(url, headers=headers, files=files, data=data, timeout=180)
-
-    if resp.status_code >= 400:
-        # Muestra error con contexto (sin filtrar key)
-        st.error(f"Error en transcripción (HTTP {resp.status_code}).")
-        try:
-            st.code(resp.json())
-        except Exception:
-            st.code(resp.text[:2000])
-        st.stop()
-
-    payload = resp.json()
-    text = payload.get("text", "").strip()
-    if not text:
-        st.warning("La respuesta no trajo texto. Revisa si el audio tiene voz clara.")
-    return text, payload
-
-
-# ==========================================================
-# Export helpers (opcionales)
-# ==========================================================
-def to_docx_bytes(title: str, body: str) -> Optional[bytes]:
-    try:
-        from docx import Document
-    except Exception:
-        return None
-
-    doc = Document()
-    doc.add_heading(title, level=1)
-    for para in body.split("\n"):
-        doc.add_paragraph(para)
-    bio = io.BytesIO()
-    doc.save(bio)
-    return bio.getvalue()
-
-
-def to_pdf_bytes(title: str, body: str) -> Optional[bytes]:
-    try:
-        from reportlab.lib.pagesizes import LETTER
-        from reportlab.pdfgen import canvas
-    except Exception:
-        return None
-
-    bio = io.BytesIO()
-    c = canvas.Canvas(bio, pagesize=LETTER)
-    width, height = LETTER
-
-    # Simple layout
-    x = 50
-    y = height - 60
-    c.setFont("Helvetica-Bold", 14)
-    c.drawString(x, y, title)
-    y -= 25
-    c.setFont("Helvetica", 11)
-
-    # Wrap lines
-    max_chars = 95
-    lines = []
-    for raw in body.split("\n"):
-        raw = raw.rstrip()
-        if not raw:
-            lines.append("")
-            continue
-        while len(raw) > max_chars:
-            cut = raw[:max_chars]
-            # intenta cortar por espacio
-            if " " in cut:
-                cut = cut.rsplit(" ", 1)[0]
-            lines.append(cut)
-            raw = raw[len(cut):].lstrip()
-        lines.append(raw)
-
-    for line in lines:
-        if y < 60:
-            c.showPage()
-            y = height - 60
-            c.setFont("Helvetica", 11)
-        c.drawString(x, y, line)
-        y -= 14
-
-    c.save()
-    return bio.getvalue()
+def transcribe_openai(audio_bytes: bytes, filename: str) -> str:
+    # Corre en un trabajo en segundo plano (utils_jobs): sin st.*; los errores (LLMError) quedan en el trabajo
+    payload = transcribe(
+        audio_bytes,
+        filename,
+        _guess_mime(filename),
+        model=MODEL,
+        timeout=180,
+        language=LANGUAGE,
+        prompt=PROMPT,
+        response_format="json",  # gpt-4o-mini-transcribe soporta json
+    )
+    return payload.get("text", "").strip()
 
 
 # ==========================================================
@@ -204,19 +107,46 @@ if audio_file is not None:
 
 btn = st.button("Transcribir", type="primary", disabled=(audio_file is None), use_container_width=True)
 
+# El resultado se guarda por sesión: las descargas (rerun) no vuelven a transcribir
+result_key = input_key(file_fingerprint(audio_file), MODEL, LANGUAGE, PROMPT)
+
+# La transcripción corre como trabajo en segundo plano (id en la sesión: sobrevive a reconexiones)
+owner = owner_id()
+job = current_job("transcripcion")
+
 if btn and audio_file is not None:
-    t0 = time.time()
-    audio_bytes = audio_file.read()
+    audio_bytes = audio_file.getvalue()
 
     if len(audio_bytes) > MAX_FILE_MB * 1024 * 1024:
         st.warning(f"El archivo supera {MAX_FILE_MB} MB. Por favor divide el audio o usa un formato más comprimido.")
         st.stop()
 
-    with st.spinner("Transcribiendo…"):
-        transcript_text, _payload = transcribe_openai(audio_bytes, audio_file.name)
+    with utils_tracing.span("transcripcion", archivo=audio_file.name, bytes=len(audio_bytes)):
+        job_id = submit(
+            "transcripcion", transcribe_openai, audio_bytes, audio_file.name,
+            owner=owner, input_key=result_key, label=audio_file.name,
+        )
+    set_current_job("transcripcion", job_id)
+    job = get(job_id)
+
+recent_jobs_sidebar("transcripcion")
+
+show_key = result_key
+if job is not None and job.active:
+    watch(job)
+else:
+    show_key = settle(
+        "transcripcion", job, result_key, has_inputs=audio_file is not None,
+        convert=lambda j: (j.result, round(j.elapsed, 2)), error_title="Error en transcripción",
+    )
 
+last = load_result("transcripcion", show_key)
+if last is not None:
+    transcript_text, elapsed = last
     st.success("Listo ✅")
-    st.caption(f"Tiempo: {round(time.time() - t0, 2)} s")
+    st.caption(f"Tiempo: {elapsed} s")
+    if not transcript_text:
+        st.warning("La respuesta no trajo texto. Revisa si el audio tiene voz clara.")
 
     st.subheader("Transcripción")
     st.text_area("Resultado", value=transcript_text, height=360)
@@ -225,36 +155,8 @@ if btn and audio_file is not None:
     c1, c2, c3 = st.columns(3)
 
     with c1:
-        st.download_button(
-            "TXT",
-            data=transcript_text.encode("utf-8"),
-            file_name="transcripcion.txt",
-            mime="text/plain",
-            use_container_width=True,
-        )
-
+        text_download_button("txt", "Transcripción", transcript_text, "transcripcion.txt", key="tr_txt")
     with c2:
-        docx_bytes = to_docx_bytes("Transcripción", transcript_text)
-        if docx_bytes is None:
-            st.info("Para exportar DOCX agrega `python-docx` a requirements.txt.")
-        else:
-            st.download_button(
-                "DOCX",
-                data=docx_bytes,
-                file_name="transcripcion.docx",
-                mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-                use_container_width=True,
-            )
-
+        text_download_button("docx", "Transcripción", transcript_text, "transcripcion.docx", key="tr_docx")
     with c3:
-        pdf_bytes = to_pdf_bytes("Transcripción", transcript_text)
-        if pdf_bytes is None:
-            st.info("Para exportar PDF agrega `reportlab` a requirements.txt.")
-        else:
-            st.download_button(
-                "PDF",
-                data=pdf_bytes,
-                file_name="transcripcion.pdf",
-                mime="application/pdf",
-                use_container_width=True,
-            )
+        text_download_button("pdf", "Transcripción", transcript_text, "transcripcion.pdf", key="tr_pdf")
@@ -1,11 +1,14 @@
-import io
-import os
-from typing import Optional, Tuple
-
-import requests
 import streamlit as st
 from imemsa_ui import render_title
+from utils_llm import chat, chat_stream_text
+from utils_export import text_download_button
+from utils_jobs import current_job, get, owner_id, recent_jobs_sidebar, set_current_job, settle, submit, watch
 from utils_portal_auth import require_login_redirect
+from utils_llm_routing import route_for, signature
+from utils_prompts import static_prefix
+from utils_results import input_key, load_result
+import utils_profiler
+import utils_tracing
 
 # ==========================================================
 # PÁGINA: Traducción (Texto → Texto)
@@ -22,6 +25,7 @@ from utils_portal_auth import require_login_redirect
 #            st.page_link("app.py", label="Ir al Login", icon="🔐", use_container_width=True)
 #        st.stop()
 require_login_redirect()
+utils_profiler.run_hook()
 
 
 #require_login()
@@ -42,26 +46,27 @@ with st.expander("Consejos de traducción (industrial/técnico)", expanded=False
 
 
 # ==========================================================
-# OpenAI Chat Completions via HTTP (sin SDK)
+# OpenAI Chat Completions vía gateway HTTP compartido (utils_llm)
 # ==========================================================
-MODEL = "gpt-4o-mini"
-
-def _get_openai_api_key() -> Optional[str]:
-    return (
-        st.secrets.get("OPENAI_API_KEY") if hasattr(st, "secrets") else None
-    ) or os.getenv("OPENAI_API_KEY")
-
-
-def translate_text(text: str, direction: str, tone: str, glossary: str) -> str:
-    api_key = _get_openai_api_key()
-    if not api_key:
-        st.error("Falta la API Key.")
-        st.info(
-            "En Streamlit Cloud agrega un Secret llamado **OPENAI_API_KEY** "
-            "o define la variable de entorno `OPENAI_API_KEY`."
-        )
-        st.stop()
+SCHEMA_VERSION = "2"
+
+# Prefijo estático (idéntico en cada llamada → caché de prompts del proveedor); lo variable va en el mensaje user
+PROMPT = static_prefix(
+    "traduccion",
+    "Eres un traductor profesional. Devuelve SOLO la traducción final, sin explicaciones. "
+    "Conserva el formato (saltos de línea, viñetas, tablas simples), números, unidades y nombres propios. "
+    "No inventes información.",
+    "Reglas:\n"
+    "1) Mantén siglas y términos técnicos.\n"
+    "2) Conserva el formato y los saltos de línea.\n"
+    "3) Si hay texto dentro de comillas, tradúcelo respetando las comillas.\n"
+    "4) Devuelve solo la traducción.\n"
+    "5) Si el mensaje incluye un glosario, respétalo estrictamente: si aparece exactamente uno de esos "
+    "términos, mantén o traduce según se indique.",
+)
 
+def translate_text(text: str, direction: str, tone: str, glossary: str, on_partial=None) -> str:
+    """Traduce el texto; con `on_partial(texto)` entrega la traducción parcial conforme llega (streaming)."""
     # Dirección
     if direction == "ES → EN":
         src, tgt = "español", "inglés"
@@ -70,126 +75,25 @@ def translate_text(text: str, direction: str, tone: str, glossary: str) -> str:
 
     # Glosario (opcional)
     glossary = (glossary or "").strip()
-    glossary_block = ""
-    if glossary:
-        glossary_block = (
-            "\n\nGlosario (respétalo estrictamente):\n"
-            "- Si aparece exactamente uno de estos términos, mantén o traduce según se indique.\n"
-            f"{glossary}\n"
-        )
-
-    system = (
-        "Eres un traductor profesional. Devuelve SOLO la traducción final, sin explicaciones. "
-        "Conserva el formato (saltos de línea, viñetas, tablas simples), números, unidades y nombres propios. "
-        "No inventes información."
-    )
+    glossary_block = f"Glosario:\n{glossary}\n\n" if glossary else ""
 
     user = (
-        f"Traduce del {src} al {tgt} con tono {tone}.\n"
-        "Reglas:\n"
-        "1) Mantén siglas y términos técnicos.\n"
-        "2) Conserva el formato y los saltos de línea.\n"
-        "3) Si hay texto dentro de comillas, tradúcelo respetando las comillas.\n"
-        "4) Devuelve solo la traducción.\n"
-        f"{glossary_block}\n"
+        f"Traduce del {src} al {tgt} con tono {tone}.\n\n"
+        f"{glossary_block}"
         "TEXTO:\n"
         f"{text}"
     )
 
-    url = "https://api.openai.com/v1/chat/completions"
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json",
-    }
-    payload = {
-        "model": MODEL,
-        "messages": [
-            {"role": "system", "content": system},
-            {"role": "user", "content": user},
-        ],
-        "temperature": 0.2,
-    }
-
-    resp = requests.post(url, headers=headers, json=payload, timeout=120)
-
-    if resp.status_code >= 400:
-        st.error(f"Error en traducción (HTTP {resp.status_code}).")
-        try:
-            st.code(resp.json())
-        except Exception:
-            st.code(resp.text[:2000])
-        st.stop()
-
-    data = resp.json()
-    try:
-        return data["choices"][0]["message"]["content"].strip()
-    except Exception:
-        st.error("Respuesta inesperada del servicio de traducción.")
-        st.code(data)
-        st.stop()
-
-
-# ==========================================================
-# Export helpers (opcionales)
-# ==========================================================
-def to_docx_bytes(title: str, body: str) -> Optional[bytes]:
-    try:
-        from docx import Document
-    except Exception:
-        return None
-
-    doc = Document()
-    doc.add_heading(title, level=1)
-    for para in body.split("\n"):
-        doc.add_paragraph(para)
-    bio = io.BytesIO()
-    doc.save(bio)
-    return bio.getvalue()
-
-
-def to_pdf_bytes(title: str, body: str) -> Optional[bytes]:
-    try:
-        from reportlab.lib.pagesizes import LETTER
-        from reportlab.pdfgen import canvas
-    except Exception:
-        return None
-
-    bio = io.BytesIO()
-    c = canvas.Canvas(bio, pagesize=LETTER)
-    width, height = LETTER
-
-    x = 50
-    y = height - 60
-    c.setFont("Helvetica-Bold", 14)
-    c.drawString(x, y, title)
-    y -= 25
-    c.setFont("Helvetica", 11)
-
-    max_chars = 95
-    lines = []
-    for raw in body.split("\n"):
-        raw = raw.rstrip()
-        if not raw:
-            lines.append("")
-            continue
-        while len(raw) > max_chars:
-            cut = raw[:max_chars]
-            if " " in cut:
-                cut = cut.rsplit(" ", 1)[0]
-            lines.append(cut)
-            raw = raw[len(cut):].lstrip()
-        lines.append(raw)
-
-    for line in lines:
-        if y < 60:
-            c.showPage()
-            y = height - 60
-            c.setFont("Helvetica", 11)
-        c.drawString(x, y, line)
-        y -= 14
-
-    c.save()
-    return bio.getvalue()
+    messages = PROMPT.messages(user)
+    route = route_for(PROMPT.tool, messages)  # modelo y timeout según el tamaño del texto
+    opts = dict(
+        model=route.model, temperature=0.2, timeout=route.timeout, cache=True, schema_version=SCHEMA_VERSION,
+        prompt_cache_key=PROMPT.cache_key,
+    )
+    with route.recorded():
+        if on_partial is None:
+            return chat(messages, **opts)
+        return chat_stream_text(messages, on_partial, **opts)
 
 
 # ==========================================================
@@ -215,15 +119,38 @@ text = st.text_area(
 
 btn = st.button("Traducir", type="primary", disabled=(not text.strip()), use_container_width=True)
 
+# El resultado se guarda por sesión: las descargas (rerun) no vuelven a traducir
+result_key = input_key(text, direction, tone, glossary, signature(PROMPT.tool), SCHEMA_VERSION)
+
+# La traducción corre como trabajo en segundo plano (id en la sesión: sobrevive a reconexiones)
+owner = owner_id()
+job = current_job("traduccion")
+
 if btn:
     # guard simple contra entradas enormes (para evitar timeouts)
     if len(text) > 18000:
         st.warning("El texto es muy largo. Divide en partes (recomendado: < 18,000 caracteres).")
         st.stop()
 
-    with st.spinner("Traduciendo…"):
-        result = translate_text(text=text, direction=direction, tone=tone, glossary=glossary)
+    with utils_tracing.span("traduccion", caracteres=len(text), direccion=direction):
+        job_id = submit(
+            "traduccion", translate_text, text=text, direction=direction, tone=tone, glossary=glossary,
+            owner=owner, input_key=result_key, label=f"{direction} · {text[:40]}", partial=True,
+        )
+    set_current_job("traduccion", job_id)
+    job = get(job_id)
+
+recent_jobs_sidebar("traduccion")
 
+show_key = result_key
+if job is not None and job.active:
+    # La traducción se va mostrando mientras llega; al terminar se pinta el resultado normal
+    watch(job, lambda partial: st.container(border=True).markdown(partial))
+else:
+    show_key = settle("traduccion", job, result_key, has_inputs=bool(text.strip()), error_title="Error en traducción")
+
+result = load_result("traduccion", show_key)
+if result is not None:
     st.success("Listo ✅")
     st.subheader("Resultado")
     st.text_area("Traducción", value=result, height=320)
@@ -232,36 +159,8 @@ if btn:
     c1, c2, c3 = st.columns(3)
 
     with c1:
-        st.download_button(
-            "TXT",
-            data=result.encode("utf-8"),
-            file_name="traduccion.txt",
-            mime="text/plain",
-            use_container_width=True,
-        )
-
+        text_download_button("txt", "Traducción", result, "traduccion.txt", key="trad_txt")
     with c2:
-        docx_bytes = to_docx_bytes("Traducción", result)
-        if docx_bytes is None:
-            st.info("Para exportar DOCX agrega `python-docx` a requirements.txt.")
-        else:
-            st.download_button(
-                "DOCX",
-                data=docx_bytes,
-                file_name="traduccion.docx",
-                mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-                use_container_width=True,
-            )
-
+        text_download_button("docx", "Traducción", result, "traduccion.docx", key="trad_docx")
     with c3:
-        pdf_bytes = to_pdf_bytes("Traducción", result)
-        if pdf_bytes is None:
-            st.info("Para exportar PDF agrega `reportlab` a requirements.txt.")
-        else:
-            st.download_button(
-                "PDF",
-                data=pdf_bytes,
-                file_name="traduccion.pdf",
-                mime="application/pdf",
-                use_container_width=True,
-            )
+        text_download_button("pdf", "Traducción", result, "traduccion.pdf", key="trad_pdf")
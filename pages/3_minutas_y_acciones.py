@@ -1,13 +1,18 @@
-import io
 import json
-import os
 import re
-from dataclasses import dataclass
-from typing import Any, Dict, List, Optional, Tuple
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from utils_llm import chat, chat_stream_json
+from utils_export import content_token, lazy_download_button, text_download_button, to_xlsx_bytes
+from utils_jobs import current_job, get, owner_id, recent_jobs_sidebar, set_current_job, settle, submit, watch
 from utils_portal_auth import require_login_redirect
+from utils_llm_routing import route_for, signature
+from utils_prompts import static_prefix
+from utils_results import input_key, load_result
+import utils_profiler
+import utils_tracing
 
 import pandas as pd
-import requests
 import streamlit as st
 from imemsa_ui import render_title
 
@@ -26,6 +31,7 @@ from imemsa_ui import render_title
 #            st.page_link("app.py", label="Ir al Login", icon="🔐", use_container_width=True)
 #        st.stop()
 require_login_redirect()
+utils_profiler.run_hook()
 
 
 #require_login()
@@ -40,21 +46,19 @@ if hasattr(st, "page_link"):
 with st.expander("🔒 Privacidad (cómo funciona)", expanded=False):
     st.write(
         "- El texto se envía al servicio de IA para estructurarlo.\n"
-        "- Esta app no guarda tu transcripción ni la minuta.\n"
+        "- La minuta se guarda en el servidor de la app: en la cola de trabajos (se borra a los 7 días, "
+        "IMEMSA_JOB_KEEP_DAYS) y en la caché de respuestas para no repetir la llamada con el mismo texto "
+        "(expira a los 7 días, IMEMSA_LLM_CACHE_TTL; IMEMSA_LLM_CACHE=0 la desactiva). "
+        "De la transcripción solo se guardan sus primeros 40 caracteres (nombre del trabajo) y un hash como llave.\n"
         "- Puedes exportar los resultados en TXT/CSV/Excel (y DOCX/PDF si tienes dependencias)."
     )
 
 # ==========================================================
-# OpenAI Chat Completions via HTTP (sin SDK)
+# OpenAI Chat Completions vía gateway HTTP compartido (utils_llm)
 # ==========================================================
-MODEL = "gpt-4o-mini"
-
-def _get_openai_api_key() -> Optional[str]:
-    return (
-        st.secrets.get("OPENAI_API_KEY") if hasattr(st, "secrets") else None
-    ) or os.getenv("OPENAI_API_KEY")
-
+SCHEMA_VERSION = "2"
 
+@utils_tracing.traced("extraer_json")
 def _extract_json(text: str) -> Dict[str, Any]:
     """
     El modelo debe devolver JSON, pero si trae texto extra,
@@ -83,72 +87,60 @@ class MinutesResult:
     actions: List[Dict[str, Any]]
 
 
-def generate_minutes(transcript: str, tone: str = "técnico") -> MinutesResult:
-    api_key = _get_openai_api_key()
-    if not api_key:
-        st.error("Falta la API Key.")
-        st.info(
-            "En Streamlit Cloud agrega un Secret llamado **OPENAI_API_KEY** "
-            "o define la variable de entorno `OPENAI_API_KEY`."
-        )
-        st.stop()
-
-    system = (
-        "Eres un asistente experto en redacción de minutas para contexto industrial y administrativo. "
-        "Devuelve SOLO un JSON válido (sin markdown, sin texto extra). "
-        "Si algún dato no existe en la transcripción, usa cadena vacía o null; no inventes."
-    )
+# Prefijo estático (idéntico en cada llamada → caché de prompts del proveedor); tono y transcripción van después
+MINUTES_SCHEMA = {
+    "title": "string (título corto de la reunión)",
+    "summary": "string (resumen ejecutivo 5-10 líneas)",
+    "agreements": ["string (acuerdo)"],
+    "actions": [
+        {
+            "accion": "string",
+            "responsable": "string o ''",
+            "fecha_compromiso": "string o '' (si se menciona, formato libre)",
+            "prioridad": "alta|media|baja o ''",
+            "area": "string o ''",
+            "notas": "string o ''",
+        }
+    ],
+}
+
+PROMPT = static_prefix(
+    "minutas",
+    "Eres un asistente experto en redacción de minutas para contexto industrial y administrativo. "
+    "Devuelve SOLO un JSON válido (sin markdown, sin texto extra). "
+    "Si algún dato no existe en la transcripción, usa cadena vacía o null; no inventes.",
+    "Genera la minuta en español con el tono que se indique. Reglas:\n"
+    "1) No inventes responsables, fechas o prioridades.\n"
+    "2) Si detectas varias acciones, separa una por registro.\n"
+    "3) Mantén términos técnicos (IMEMSA, fibra de vidrio, gel coat, infusión al vacío, T-top).\n"
+    "4) Devuelve JSON con el esquema EXACTO de abajo.",
+    schema=MINUTES_SCHEMA,
+)
 
-    schema = {
-        "title": "string (título corto de la reunión)",
-        "summary": "string (resumen ejecutivo 5-10 líneas)",
-        "agreements": ["string (acuerdo)"],
-        "actions": [
-            {
-                "accion": "string",
-                "responsable": "string o ''",
-                "fecha_compromiso": "string o '' (si se menciona, formato libre)",
-                "prioridad": "alta|media|baja o ''",
-                "area": "string o ''",
-                "notas": "string o ''",
-            }
-        ],
-    }
 
+def generate_minutes(
+    transcript: str,
+    tone: str = "técnico",
+    on_partial: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> MinutesResult:
+    """Genera la minuta; con on_partial recibe el JSON parcial (streaming) conforme se completa."""
     user = (
-        f"Genera una minuta en español con tono {tone} a partir de la siguiente transcripción.\n"
-        "Reglas:\n"
-        "1) No inventes responsables, fechas o prioridades.\n"
-        "2) Si detectas varias acciones, separa una por registro.\n"
-        "3) Mantén términos técnicos (IMEMSA, fibra de vidrio, gel coat, infusión al vacío, T-top).\n"
-        "4) Devuelve JSON con este esquema EXACTO:\n"
-        f"{json.dumps(schema, ensure_ascii=False)}\n\n"
+        f"Genera la minuta con tono {tone} a partir de la siguiente transcripción.\n\n"
         "TRANSCRIPCIÓN:\n"
         f"{transcript}"
     )
+    messages = PROMPT.messages(user)
+    route = route_for(PROMPT.tool, messages)  # modelo y timeout según el largo de la transcripción
+    opts = dict(
+        model=route.model, temperature=0.2, timeout=route.timeout, cache=True, schema_version=SCHEMA_VERSION,
+        prompt_cache_key=PROMPT.cache_key,
+    )
+    with route.recorded():
+        if on_partial is None:
+            content = chat(messages, **opts)
+        else:
+            content = chat_stream_json(messages, on_partial, **opts)
 
-    url = "https://api.openai.com/v1/chat/completions"
-    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
-    payload = {
-        "model": MODEL,
-        "messages": [
-            {"role": "system", "content": system},
-            {"role": "user", "content": user},
-        ],
-        "temperature": 0.2,
-    }
-
-    resp = requests.post(url, headers=headers, json=payload, timeout=180)
-    if resp.status_code >= 400:
-        st.error(f"Error al generar minuta (HTTP {resp.status_code}).")
-        try:
-            st.code(resp.json())
-        except Exception:
-            st.code(resp.text[:2000])
-        st.stop()
-
-    data = resp.json()
-    content = data["choices"][0]["message"]["content"]
     obj = _extract_json(content)
 
     title = (obj.get("title") or "").strip() or "Minuta"
@@ -190,86 +182,30 @@ def generate_minutes(transcript: str, tone: str = "técnico") -> MinutesResult:
     )
 
 
-# ==========================================================
-# Export helpers (opcionales)
-# ==========================================================
-def to_docx_bytes(title: str, body: str) -> Optional[bytes]:
-    try:
-        from docx import Document
-    except Exception:
-        return None
-
-    doc = Document()
-    doc.add_heading(title, level=1)
-    for para in body.split("\n"):
-        doc.add_paragraph(para)
-    bio = io.BytesIO()
-    doc.save(bio)
-    return bio.getvalue()
-
-
-def to_pdf_bytes(title: str, body: str) -> Optional[bytes]:
-    try:
-        from reportlab.lib.pagesizes import LETTER
-        from reportlab.pdfgen import canvas
-    except Exception:
-        return None
-
-    bio = io.BytesIO()
-    c = canvas.Canvas(bio, pagesize=LETTER)
-    width, height = LETTER
-
-    x = 50
-    y = height - 60
-    c.setFont("Helvetica-Bold", 14)
-    c.drawString(x, y, title)
-    y -= 25
-    c.setFont("Helvetica", 11)
-
-    max_chars = 95
-    lines = []
-    for raw in body.split("\n"):
-        raw = raw.rstrip()
-        if not raw:
-            lines.append("")
-            continue
-        while len(raw) > max_chars:
-            cut = raw[:max_chars]
-            if " " in cut:
-                cut = cut.rsplit(" ", 1)[0]
-            lines.append(cut)
-            raw = raw[len(cut):].lstrip()
-        lines.append(raw)
-
-    for line in lines:
-        if y < 60:
-            c.showPage()
-            y = height - 60
-            c.setFont("Helvetica", 11)
-        c.drawString(x, y, line)
-        y -= 14
-
-    c.save()
-    return bio.getvalue()
-
-
-def actions_to_xlsx_bytes(df: pd.DataFrame) -> Optional[bytes]:
-    try:
-        from openpyxl import Workbook
-        from openpyxl.utils.dataframe import dataframe_to_rows
-    except Exception:
-        return None
-
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Acciones"
-
-    for r_idx, row in enumerate(dataframe_to_rows(df, index=False, header=True), start=1):
-        ws.append(row)
-
-    bio = io.BytesIO()
-    wb.save(bio)
-    return bio.getvalue()
+def minutes_job(transcript: str, tone: str, on_partial=None) -> Dict[str, Any]:
+    """Trabajo en segundo plano (utils_jobs): el resultado viaja como dict JSON."""
+    return asdict(generate_minutes(transcript, tone=tone, on_partial=on_partial))
+
+
+def render_partial_minutes(slot, obj: Dict[str, Any]) -> None:
+    """Vista previa mientras llega la respuesta: solo secciones y acciones ya completas."""
+    with slot.container(border=True):
+        st.caption("Generando minuta… (vista previa)")
+        if obj.get("title"):
+            st.subheader(str(obj["title"]))
+        if obj.get("summary"):
+            st.markdown("### Resumen")
+            st.write(str(obj["summary"]))
+        agreements = [str(a) for a in (obj.get("agreements") or []) if str(a).strip()]
+        if agreements:
+            st.markdown("### Acuerdos")
+            for i, a in enumerate(agreements, start=1):
+                st.write(f"{i}. {a}")
+        # La última acción puede venir a medias: se muestra hasta que llegue la siguiente
+        actions = [a for a in (obj.get("actions") or [])[:-1] if isinstance(a, dict) and a.get("accion")]
+        if actions:
+            st.markdown("### Acciones")
+            st.dataframe(pd.DataFrame(actions), use_container_width=True, hide_index=True)
 
 
 # ==========================================================
@@ -285,15 +221,40 @@ transcript = st.text_area(
 
 btn = st.button("Generar minuta", type="primary", disabled=(not transcript.strip()), use_container_width=True)
 
+# El resultado se guarda por sesión: descargas y ediciones (rerun) no vuelven a llamar al modelo
+result_key = input_key(transcript.strip(), tone, signature(PROMPT.tool), SCHEMA_VERSION)
+
+# La minuta corre como trabajo en segundo plano (id en la sesión: sobrevive a reconexiones)
+owner = owner_id()
+job = current_job("minutas")
+
 if btn:
     # guard simple contra entradas enormes (evita timeouts)
     if len(transcript) > 35000:
         st.warning("La transcripción es muy larga. Divide en partes (recomendado: < 35,000 caracteres).")
         st.stop()
 
-    with st.spinner("Generando minuta…"):
-        result = generate_minutes(transcript.strip(), tone=tone)
+    with utils_tracing.span("minutas", caracteres=len(transcript)):
+        job_id = submit(
+            "minutas", minutes_job, transcript.strip(), tone,
+            owner=owner, input_key=result_key, label=transcript.strip()[:40], partial=True,
+        )
+    set_current_job("minutas", job_id)
+    job = get(job_id)
+
+recent_jobs_sidebar("minutas")
+
+show_key = result_key
+if job is not None and job.active:
+    watch(job, lambda obj: render_partial_minutes(st, obj))
+else:
+    show_key = settle(
+        "minutas", job, result_key, has_inputs=bool(transcript.strip()),
+        convert=lambda j: MinutesResult(**j.result), error_title="Error al generar minuta",
+    )
 
+result = load_result("minutas", show_key)
+if result is not None:
     st.success("Listo ✅")
 
     # ---- Presentación
@@ -356,38 +317,11 @@ if btn:
     c1, c2, c3, c4, c5 = st.columns(5)
 
     with c1:
-        st.download_button(
-            "TXT",
-            data=txt_out.encode("utf-8"),
-            file_name="minuta.txt",
-            mime="text/plain",
-            use_container_width=True,
-        )
-
+        text_download_button("txt", result.title, txt_out, "minuta.txt", key="min_txt")
     with c2:
-        docx_bytes = to_docx_bytes(result.title, txt_out)
-        if docx_bytes is None:
-            st.info("DOCX: agrega `python-docx` a requirements.txt.")
-        else:
-            st.download_button(
-                "DOCX",
-                data=docx_bytes,
-                file_name="minuta.docx",
-                use_container_width=True,
-            )
-
+        text_download_button("docx", result.title, txt_out, "minuta.docx", key="min_docx")
     with c3:
-        pdf_bytes = to_pdf_bytes(result.title, txt_out)
-        if pdf_bytes is None:
-            st.info("PDF: agrega `reportlab` a requirements.txt.")
-        else:
-            st.download_button(
-                "PDF",
-                data=pdf_bytes,
-                file_name="minuta.pdf",
-                mime="application/pdf",
-                use_container_width=True,
-            )
+        text_download_button("pdf", result.title, txt_out, "minuta.pdf", key="min_pdf")
 
     with c4:
         st.download_button(
@@ -399,14 +333,10 @@ if btn:
         )
 
     with c5:
-        xlsx_bytes = actions_to_xlsx_bytes(edited_df)
-        if xlsx_bytes is None:
-            st.info("Excel: agrega `openpyxl` a requirements.txt.")
-        else:
-            st.download_button(
-                "Excel (acciones)",
-                data=xlsx_bytes,
-                file_name="acciones.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                use_container_width=True,
-            )
+        lazy_download_button(
+            "Excel (acciones)",
+            lambda: to_xlsx_bytes({"Acciones": edited_df}),
+            file_name="acciones.xlsx",
+            key="min_xlsx",
+            token=content_token(edited_df),
+        )
@@ -1,16 +1,21 @@
 import base64
 import io
 import json
-import os
-from dataclasses import dataclass
-from typing import Any, Dict, List, Optional, Tuple
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List, Tuple
+from utils_llm import chat
+from utils_export import text_download_button
+from utils_jobs import current_job, get, owner_id, recent_jobs_sidebar, set_current_job, settle, submit, watch
 from utils_portal_auth import require_login_redirect
+from utils_llm_routing import route_for, signature
+from utils_prompts import static_prefix
+from utils_results import file_fingerprint, input_key, load_result
+import utils_profiler
+import utils_tracing
 
 import pandas as pd
-import requests
 import streamlit as st
 from imemsa_ui import render_title
-from PIL import Image
 
 # ==========================================================
 # PÁGINA: Documentos (OCR + extracción)
@@ -28,6 +33,7 @@ from PIL import Image
 #        st.stop()
 
 require_login_redirect()
+utils_profiler.run_hook()
 
 #require_login()
 
@@ -42,22 +48,19 @@ with st.expander("🔒 Privacidad (cómo funciona)", expanded=False):
     st.write(
         "- El documento se envía a la IA para **leerlo** y devolver texto/campos.\n"
         "- La app no guarda el archivo.\n"
+        "- El texto y los campos extraídos se guardan en el servidor de la app: en la cola de trabajos "
+        "(se borran a los 7 días, IMEMSA_JOB_KEEP_DAYS) y en la caché de respuestas para no repetir la "
+        "llamada con el mismo documento (expira a los 7 días, IMEMSA_LLM_CACHE_TTL; IMEMSA_LLM_CACHE=0 la desactiva).\n"
         "- Puedes exportar el resultado (TXT/JSON/CSV y opcional DOCX/PDF)."
     )
 
 # ==========================================================
 # Config y helpers
 # ==========================================================
-MODEL = "gpt-4o-mini"  # multimodal
+SCHEMA_VERSION = "2"
 MAX_FILE_MB = 25
 
 
-def _get_openai_api_key() -> Optional[str]:
-    return (
-        st.secrets.get("OPENAI_API_KEY") if hasattr(st, "secrets") else None
-    ) or os.getenv("OPENAI_API_KEY")
-
-
 def _b64_data_url(img_bytes: bytes, mime: str) -> str:
     b64 = base64.b64encode(img_bytes).decode("utf-8")
     return f"data:{mime};base64,{b64}"
@@ -65,6 +68,8 @@ def _b64_data_url(img_bytes: bytes, mime: str) -> str:
 
 def _img_to_png_bytes(file) -> Tuple[bytes, str]:
     """Normaliza imágenes a PNG (mejor lectura)."""
+    from PIL import Image
+
     img = Image.open(file).convert("RGB")
 
     # Downscale suave para evitar requests gigantes (mantiene proporción)
@@ -104,33 +109,16 @@ def _pdf_to_png_pages(pdf_bytes: bytes, dpi: int = 150, max_pages: int = 6) -> L
     return pages
 
 
-def _openai_chat(messages: List[Dict[str, Any]], temperature: float = 0.2, timeout: int = 180) -> str:
-    api_key = _get_openai_api_key()
-    if not api_key:
-        st.error("Falta la API Key.")
-        st.info(
-            "En Streamlit Cloud agrega un Secret llamado **OPENAI_API_KEY** "
-            "o define la variable de entorno `OPENAI_API_KEY`."
+def _openai_chat(messages: List[Dict[str, Any]], temperature: float = 0.2, cache: bool = False, **extra: Any) -> str:
+    route = route_for(PROMPT.tool, messages)  # modelo (multimodal) y timeout según páginas/imágenes
+    with route.recorded():
+        return chat(
+            messages, model=route.model, temperature=temperature, timeout=route.timeout, cache=cache,
+            schema_version=SCHEMA_VERSION, **extra,
         )
-        st.stop()
-
-    url = "https://api.openai.com/v1/chat/completions"
-    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
-    payload = {"model": MODEL, "messages": messages, "temperature": temperature}
-
-    resp = requests.post(url, headers=headers, json=payload, timeout=timeout)
-    if resp.status_code >= 400:
-        st.error(f"Error del servicio (HTTP {resp.status_code}).")
-        try:
-            st.code(resp.json())
-        except Exception:
-            st.code(resp.text[:2000])
-        st.stop()
-
-    data = resp.json()
-    return data["choices"][0]["message"]["content"].strip()
 
 
+@utils_tracing.traced("extraer_json")
 def _extract_json(text: str) -> Dict[str, Any]:
     text = (text or "").strip()
     try:
@@ -151,53 +139,59 @@ class DocResult:
     fields: Dict[str, Any]
 
 
+# Prefijo estático (idéntico en cada llamada → caché de prompts del proveedor)
+DOC_SCHEMA = {
+    "full_text": "string",
+    "fields": {
+        "tipo_documento": "Factura | Orden de compra | Reporte | Checklist | Otro | ''",
+        "folio": "string o ''",
+        "fecha": "string o ''",
+        "empresa": "string o ''",
+        "proveedor": "string o ''",
+        "total": "string o ''",
+        "moneda": "string o ''",
+        "items": [
+            {
+                "descripcion": "string",
+                "cantidad": "string o ''",
+                "unidad": "string o ''",
+                "precio_unitario": "string o ''",
+                "importe": "string o ''",
+            }
+        ],
+        "notas": "string o ''",
+    },
+}
+
+PROMPT = static_prefix(
+    "documentos",
+    "Eres un asistente experto en OCR y extracción de datos.\n"
+    "Devuelve SOLO un JSON válido (sin markdown, sin texto extra).",
+    "Reglas:\n"
+    "1) No inventes datos: si no aparece, deja '' o lista vacía.\n"
+    "2) Conserva números, unidades y el texto tal cual.\n"
+    "3) Si el documento es tabla, intenta extraer items.\n"
+    "4) Si el usuario indicó un tipo_documento, úsalo como pista.",
+    schema=DOC_SCHEMA,
+)
+
+
 def ocr_and_extract(images: List[Tuple[bytes, str, str]], doc_type: str) -> DocResult:
     """
     En un solo paso:
     - OCR (texto completo)
     - Extracción estructurada (campos + items)
     """
-    schema = {
-        "full_text": "string",
-        "fields": {
-            "tipo_documento": "Factura | Orden de compra | Reporte | Checklist | Otro | ''",
-            "folio": "string o ''",
-            "fecha": "string o ''",
-            "empresa": "string o ''",
-            "proveedor": "string o ''",
-            "total": "string o ''",
-            "moneda": "string o ''",
-            "items": [
-                {
-                    "descripcion": "string",
-                    "cantidad": "string o ''",
-                    "unidad": "string o ''",
-                    "precio_unitario": "string o ''",
-                    "importe": "string o ''",
-                }
-            ],
-            "notas": "string o ''",
-        },
-    }
-
-    instruction = (
-        "Eres un asistente experto en OCR y extracción de datos.\n"
-        "Devuelve SOLO un JSON válido (sin markdown, sin texto extra).\n"
-        "Reglas:\n"
-        "1) No inventes datos: si no aparece, deja '' o lista vacía.\n"
-        "2) Conserva números, unidades y el texto tal cual.\n"
-        "3) Si el documento es tabla, intenta extraer items.\n"
-        f"4) Si el usuario indicó tipo_documento='{doc_type}', úsalo como pista.\n"
-        "Esquema EXACTO:\n"
-        f"{json.dumps(schema, ensure_ascii=False)}"
-    )
-
-    content: List[Dict[str, Any]] = [{"type": "text", "text": instruction}]
-    for img_bytes, mime, _name in images:
-        content.append({"type": "image_url", "image_url": {"url": _b64_data_url(img_bytes, mime)}})
-
-    messages = [{"role": "user", "content": content}]
-    raw = _openai_chat(messages, temperature=0.1, timeout=240)
+    # Lo variable (pista de tipo + imágenes) va después del prefijo estático
+    content: List[Dict[str, Any]] = [
+        {"type": "text", "text": f"tipo_documento indicado por el usuario: '{doc_type}'"}
+    ]
+    with utils_tracing.span("codificar_base64", imagenes=len(images), bytes=sum(len(b) for b, _m, _n in images)):
+        for img_bytes, mime, _name in images:
+            content.append({"type": "image_url", "image_url": {"url": _b64_data_url(img_bytes, mime)}})
+
+    messages = PROMPT.messages(content)
+    raw = _openai_chat(messages, temperature=0.1, cache=True, prompt_cache_key=PROMPT.cache_key)
     obj = _extract_json(raw)
 
     full_text = (obj.get("full_text") or "").strip()
@@ -232,67 +226,9 @@ def ocr_and_extract(images: List[Tuple[bytes, str, str]], doc_type: str) -> DocR
     return DocResult(full_text=full_text, fields=fields)
 
 
-# ==========================================================
-# Export helpers (opcionales)
-# ==========================================================
-def to_docx_bytes(title: str, body: str) -> Optional[bytes]:
-    try:
-        from docx import Document
-    except Exception:
-        return None
-
-    doc = Document()
-    doc.add_heading(title, level=1)
-    for para in body.split("\n"):
-        doc.add_paragraph(para)
-    bio = io.BytesIO()
-    doc.save(bio)
-    return bio.getvalue()
-
-
-def to_pdf_bytes(title: str, body: str) -> Optional[bytes]:
-    try:
-        from reportlab.lib.pagesizes import LETTER
-        from reportlab.pdfgen import canvas
-    except Exception:
-        return None
-
-    bio = io.BytesIO()
-    c = canvas.Canvas(bio, pagesize=LETTER)
-    _, height = LETTER
-
-    x = 50
-    y = height - 60
-    c.setFont("Helvetica-Bold", 14)
-    c.drawString(x, y, title)
-    y -= 25
-    c.setFont("Helvetica", 11)
-
-    max_chars = 95
-    lines: List[str] = []
-    for raw in body.split("\n"):
-        raw = raw.rstrip()
-        if not raw:
-            lines.append("")
-            continue
-        while len(raw) > max_chars:
-            cut = raw[:max_chars]
-            if " " in cut:
-                cut = cut.rsplit(" ", 1)[0]
-            lines.append(cut)
-            raw = raw[len(cut):].lstrip()
-        lines.append(raw)
-
-    for line in lines:
-        if y < 60:
-            c.showPage()
-            y = height - 60
-            c.setFont("Helvetica", 11)
-        c.drawString(x, y, line)
-        y -= 14
-
-    c.save()
-    return bio.getvalue()
+def ocr_job(images: List[Tuple[bytes, str, str]], doc_type: str) -> Dict[str, Any]:
+    """Trabajo en segundo plano (utils_jobs): el resultado viaja como dict JSON."""
+    return asdict(ocr_and_extract([tuple(img) for img in images], doc_type=doc_type))
 
 
 # ==========================================================
@@ -319,6 +255,14 @@ if uploaded is not None:
     if size_mb > MAX_FILE_MB:
         st.warning(f"El archivo pesa {size_mb:.1f} MB. Recomendado: ≤ {MAX_FILE_MB} MB.")
 
+# El resultado se guarda por sesión: las descargas (rerun) no vuelven a procesar el documento
+result_key = input_key(file_fingerprint(uploaded), doc_type, max_pages, dpi, signature(PROMPT.tool), SCHEMA_VERSION)
+
+# El OCR corre como trabajo en segundo plano (id en la sesión: sobrevive a reconexiones);
+# la conversión PDF/imagen → PNG se hace aquí para reportar errores de inmediato
+owner = owner_id()
+job = current_job("documentos")
+
 if btn and uploaded is not None:
     file_bytes = uploaded.getvalue()
     ext = uploaded.name.lower().split(".")[-1]
@@ -326,13 +270,19 @@ if btn and uploaded is not None:
     hint = "" if doc_type == "Auto" else doc_type
 
     try:
-        with st.spinner("Procesando…"):
+        # Un clic = una traza; el trabajo de OCR (otro hilo) queda bajo este span
+        with st.spinner("Preparando páginas…"), utils_tracing.span(
+            "documentos", archivo=uploaded.name, bytes=len(file_bytes), dpi=dpi, paginas_max=max_pages,
+        ):
             images: List[Tuple[bytes, str, str]] = []
 
             if ext == "pdf":
-                images = _pdf_to_png_pages(file_bytes, dpi=dpi, max_pages=max_pages)
+                with utils_tracing.span("pdf_a_png") as sp:
+                    images = _pdf_to_png_pages(file_bytes, dpi=dpi, max_pages=max_pages)
+                    sp.set(paginas=len(images))
             else:
-                img_bytes, mime = _img_to_png_bytes(uploaded)
+                with utils_tracing.span("imagen_a_png"):
+                    img_bytes, mime = _img_to_png_bytes(uploaded)
                 images = [(img_bytes, mime, uploaded.name)]
 
             # Preview
@@ -340,8 +290,31 @@ if btn and uploaded is not None:
                 for b, _m, name in images[:4]:
                     st.image(b, caption=name, use_column_width=True)
 
-            result = ocr_and_extract(images, doc_type=hint)
+            job_id = submit(
+                "documentos", ocr_job, images, hint,
+                owner=owner, input_key=result_key, label=uploaded.name,
+            )
+        set_current_job("documentos", job_id)
+        job = get(job_id)
+    except Exception as e:
+        st.error("Ocurrió un error al procesar el documento.")
+        with st.expander("🛠️ Detalle técnico (solo admin)", expanded=False):
+            st.exception(e)
+
+recent_jobs_sidebar("documentos")
 
+show_key = result_key
+if job is not None and job.active:
+    watch(job)
+else:
+    show_key = settle(
+        "documentos", job, result_key, has_inputs=uploaded is not None,
+        convert=lambda j: DocResult(**j.result), error_title="Ocurrió un error al procesar el documento",
+    )
+
+result = load_result("documentos", show_key)
+if result is not None:
+    try:
         st.success("Listo ✅")
 
         st.subheader("Texto (OCR)")
@@ -365,27 +338,13 @@ if btn and uploaded is not None:
         c1, c2, c3, c4, c5 = st.columns(5)
 
         with c1:
-            st.download_button("TXT", txt_out.encode("utf-8"), "documento_ocr.txt", "text/plain", use_container_width=True)
+            text_download_button("txt", "Documento (OCR)", txt_out, "documento_ocr.txt", key="doc_txt")
 
         with c2:
-            docx_bytes = to_docx_bytes("Documento (OCR)", txt_out)
-            if docx_bytes is None:
-                st.info("DOCX: agrega `python-docx` a requirements.txt.")
-            else:
-                st.download_button(
-                    "DOCX",
-                    docx_bytes,
-                    "documento_ocr.docx",
-                    "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-                    use_container_width=True,
-                )
+            text_download_button("docx", "Documento (OCR)", txt_out, "documento_ocr.docx", key="doc_docx")
 
         with c3:
-            pdf_bytes = to_pdf_bytes("Documento (OCR)", txt_out)
-            if pdf_bytes is None:
-                st.info("PDF: agrega `reportlab` a requirements.txt.")
-            else:
-                st.download_button("PDF", pdf_bytes, "documento_ocr.pdf", "application/pdf", use_container_width=True)
+            text_download_button("pdf", "Documento (OCR)", txt_out, "documento_ocr.pdf", key="doc_pdf")
 
         with c4:
             st.download_button("JSON", json_out.encode("utf-8"), "campos.json", "application/json", use_container_width=True)
@@ -1,13 +1,16 @@
-import io
 import os
 from dataclasses import dataclass
-from typing import Dict, Optional, Tuple
+from typing import Tuple
 
 import pandas as pd
 import requests
 import streamlit as st
 from imemsa_ui import render_title
+from utils_export import lazy_download_button, to_xlsx_bytes
 from utils_portal_auth import require_login_redirect
+from utils_results import file_fingerprint, input_key, load_result, save_result
+import utils_profiler
+import utils_tracing
 
 # ==========================================================
 # PÁGINA: 📈 Forecast y anomalías
@@ -25,6 +28,7 @@ from utils_portal_auth import require_login_redirect
 #        st.stop()
 
 require_login_redirect()
+utils_profiler.run_hook()
 
 #require_login()
 
@@ -52,6 +56,7 @@ class ForecastAnomalyOutput:
     series_df: pd.DataFrame
 
 
+@utils_tracing.traced("serie_regular")
 def _make_regular_series(
     df: pd.DataFrame,
     date_col: str,
@@ -84,6 +89,7 @@ def _make_regular_series(
     return s
 
 
+@utils_tracing.traced("holt")
 def _holt_forecast(series: pd.Series, periods: int, alpha: float, beta: float) -> Tuple[pd.Series, pd.Series]:
     """
     Holt (double exponential smoothing) sin dependencias externas.
@@ -184,23 +190,6 @@ def run_forecast_and_anomaly(
     return ForecastAnomalyOutput(forecast_df=forecast_df, anomalies_df=anomalies_df, series_df=series_df)
 
 
-# ==========================================================
-# Export helper (opcional Excel multi-hojas)
-# ==========================================================
-def to_xlsx_multiple_sheets(sheets: Dict[str, pd.DataFrame]) -> Optional[bytes]:
-    try:
-        import openpyxl  # noqa: F401
-    except Exception:
-        return None
-
-    bio = io.BytesIO()
-    with pd.ExcelWriter(bio, engine="openpyxl") as writer:
-        for name, df in sheets.items():
-            safe = str(name)[:31]  # limit Excel sheet name
-            df.to_excel(writer, index=False, sheet_name=safe)
-    return bio.getvalue()
-
-
 # ==========================================================
 # UI
 # ==========================================================
@@ -251,12 +240,18 @@ with c9:
 
 btn = st.button("Generar forecast y anomalías", type="primary", use_container_width=True)
 
+# El resultado se guarda por sesión: las descargas (rerun) no vuelven a calcular
+result_key = input_key(
+    file_fingerprint(uploaded), date_col, value_col, freq, agg, int(periods), int(ma_window),
+    float(z_threshold), fill_method, float(alpha), float(beta),
+)
+
 if btn:
     try:
         # Normaliza datos base sin modificar df original
         df_clean = df.copy()
 
-        with st.spinner("Calculando…"):
+        with st.spinner("Calculando…"), utils_tracing.span("forecast", filas=len(df_clean), frecuencia=freq):
             out = run_forecast_and_anomaly(
                 df=df_clean,
                 date_col=date_col,
@@ -270,7 +265,15 @@ if btn:
                 beta=float(beta),
                 fill_method=fill_method,
             )
+        save_result("forecast", result_key, out)
+    except Exception as e:
+        st.error("Ocurrió un error al procesar el archivo. Revisa el formato e intenta de nuevo.")
+        with st.expander("🛠️ Detalle técnico (admin)", expanded=False):
+            st.exception(e)
 
+out = load_result("forecast", result_key)
+if out is not None:
+    try:
         st.success("Listo ✅")
 
         # ----- Plots (matplotlib)
@@ -350,23 +353,19 @@ if btn:
             )
 
         with cC:
-            xlsx_bytes = to_xlsx_multiple_sheets(
-                {
-                    "Serie": out.series_df,
-                    "Forecast": out.forecast_df,
-                    "Anomalias": out.anomalies_df,
-                }
+            lazy_download_button(
+                "Excel (3 hojas)",
+                lambda: to_xlsx_bytes(
+                    {
+                        "Serie": out.series_df,
+                        "Forecast": out.forecast_df,
+                        "Anomalias": out.anomalies_df,
+                    }
+                ),
+                file_name="forecast_anomalias.xlsx",
+                key="fc_xlsx",
+                token=result_key,
             )
-            if xlsx_bytes is None:
-                st.info("Excel: agrega `openpyxl` a requirements.txt.")
-            else:
-                st.download_button(
-                    "Excel (3 hojas)",
-                    data=xlsx_bytes,
-                    file_name="forecast_anomalias.xlsx",
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                    use_container_width=True,
-                )
 
     except Exception as e:
         st.error("Ocurrió un error al procesar el archivo. Revisa el formato e intenta de nuevo.")
@@ -1,15 +1,20 @@
-import io
 import json
-import os
 import re
-from dataclasses import dataclass
-from typing import Any, Dict, List, Optional
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Dict, List, Optional
 
 import pandas as pd
-import requests
 import streamlit as st
 from imemsa_ui import render_title
+from utils_llm import chat, chat_stream_json
+from utils_export import content_token, lazy_download_button, to_xlsx_bytes
+from utils_jobs import current_job, get, owner_id, recent_jobs_sidebar, set_current_job, settle, submit, watch
 from utils_portal_auth import require_login_redirect
+from utils_llm_routing import route_for, signature
+from utils_prompts import static_prefix
+from utils_results import input_key, load_result
+import utils_profiler
+import utils_tracing
 
 
 # ==========================================================
@@ -29,6 +34,7 @@ from utils_portal_auth import require_login_redirect
 #            st.page_link("app.py", label="Ir al Login", icon="🔐", use_container_width=True)
 #        st.stop()
 require_login_redirect()
+utils_profiler.run_hook()
 
 
 #require_login()
@@ -48,16 +54,11 @@ with st.expander("📌 Qué hace y qué no hace", expanded=False):
     )
 
 # ==========================================================
-# OpenAI Chat Completions via HTTP (sin SDK)
+# OpenAI Chat Completions vía gateway HTTP compartido (utils_llm)
 # ==========================================================
-MODEL = "gpt-4o-mini"
-
-def _get_openai_api_key() -> Optional[str]:
-    return (
-        st.secrets.get("OPENAI_API_KEY") if hasattr(st, "secrets") else None
-    ) or os.getenv("OPENAI_API_KEY")
-
+SCHEMA_VERSION = "2"
 
+@utils_tracing.traced("extraer_json")
 def _extract_json(text: str) -> Dict[str, Any]:
     """
     El modelo debe devolver JSON. Si viene con texto extra,
@@ -85,81 +86,73 @@ class TicketResult:
     acciones: List[Dict[str, Any]]
 
 
-def analyze_ticket(texto: str, contexto: str = "") -> TicketResult:
-    api_key = _get_openai_api_key()
-    if not api_key:
-        st.error("Falta la API Key.")
-        st.info(
-            "En Streamlit Cloud agrega un Secret llamado **OPENAI_API_KEY** "
-            "o define la variable de entorno `OPENAI_API_KEY`."
-        )
-        st.stop()
-
-    schema = {
-        "area": "Tesorería | Compras | Producción | Calidad | Almacén | Logística | Ventas | Sistemas | RH | Dirección | Otro | ''",
-        "tipo_solicitud": "Pago | Cotización | Compra | Reclamo | Soporte TI | Envío | Producción | Calidad | Reporte | Otro | ''",
-        "prioridad": "alta | media | baja | ''",
-        "motivo_prioridad": "string o '' (por qué es alta/media/baja, basado en el texto)",
-        "resumen": "string (3-6 líneas)",
-        "datos_clave": {
-            "proveedor": "string o ''",
-            "cliente": "string o ''",
-            "monto": "string o ''",
-            "moneda": "string o ''",
-            "factura": "string o ''",
-            "oc": "string o ''",
-            "fecha_limite": "string o ''",
-            "proyecto": "string o ''",
-            "impacto": "string o ''",
-        },
-        "faltantes": ["string (dato faltante crítico)"],
-        "acciones": [
-            {
-                "accion": "string",
-                "responsable_sugerido": "string o ''",
-                "prioridad": "alta|media|baja o ''",
-                "plazo_sugerido": "string o ''",
-            }
-        ],
-    }
+# Prefijo estático (idéntico en cada llamada → caché de prompts del proveedor); contexto y texto van después
+TICKET_SCHEMA = {
+    "area": "Tesorería | Compras | Producción | Calidad | Almacén | Logística | Ventas | Sistemas | RH | Dirección | Otro | ''",
+    "tipo_solicitud": "Pago | Cotización | Compra | Reclamo | Soporte TI | Envío | Producción | Calidad | Reporte | Otro | ''",
+    "prioridad": "alta | media | baja | ''",
+    "motivo_prioridad": "string o '' (por qué es alta/media/baja, basado en el texto)",
+    "resumen": "string (3-6 líneas)",
+    "datos_clave": {
+        "proveedor": "string o ''",
+        "cliente": "string o ''",
+        "monto": "string o ''",
+        "moneda": "string o ''",
+        "factura": "string o ''",
+        "oc": "string o ''",
+        "fecha_limite": "string o ''",
+        "proyecto": "string o ''",
+        "impacto": "string o ''",
+    },
+    "faltantes": ["string (dato faltante crítico)"],
+    "acciones": [
+        {
+            "accion": "string",
+            "responsable_sugerido": "string o ''",
+            "prioridad": "alta|media|baja o ''",
+            "plazo_sugerido": "string o ''",
+        }
+    ],
+}
+
+PROMPT = static_prefix(
+    "nlp_operacion",
+    "Eres un analista de operaciones. Clasificas solicitudes internas y extraes información clave. "
+    "Devuelve SOLO un JSON válido (sin markdown, sin explicación). "
+    "Reglas: no inventes datos. Si no aparece, usa '' o lista vacía.",
+    "Analiza el texto (correo/ticket) del mensaje y devuelve el JSON con el esquema EXACTO de abajo. "
+    "Si se incluye contexto adicional, úsalo solo como apoyo.\n\n"
+    "Criterios de prioridad:\n"
+    "- alta: riesgo de paro/embarque, cliente crítico, fecha hoy/mañana, seguridad, impacto financiero fuerte.\n"
+    "- media: afecta operación pero no es urgente hoy.\n"
+    "- baja: informativo, mejora, sin fechas cercanas.\n\n"
+    "Regla Tesorería: si es pago, marca como faltantes si no hay proveedor, monto, factura/OC o fecha límite.",
+    schema=TICKET_SCHEMA,
+)
 
-    system = (
-        "Eres un analista de operaciones. Clasificas solicitudes internas y extraes información clave. "
-        "Devuelve SOLO un JSON válido (sin markdown, sin explicación). "
-        "Reglas: no inventes datos. Si no aparece, usa '' o lista vacía."
-    )
 
+def analyze_ticket(
+    texto: str,
+    contexto: str = "",
+    on_partial: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> TicketResult:
+    """Clasifica el ticket; con on_partial recibe el JSON parcial (streaming) conforme se completa."""
     user = (
-        "Analiza el siguiente texto (correo/ticket) y devuelve el JSON con el esquema EXACTO.\n\n"
-        "Criterios de prioridad:\n"
-        "- alta: riesgo de paro/embarque, cliente crítico, fecha hoy/mañana, seguridad, impacto financiero fuerte.\n"
-        "- media: afecta operación pero no es urgente hoy.\n"
-        "- baja: informativo, mejora, sin fechas cercanas.\n\n"
-        "Regla Tesorería: si es pago, marca como faltantes si no hay proveedor, monto, factura/OC o fecha límite.\n\n"
         f"Contexto adicional (si existe): {contexto}\n\n"
-        f"ESQUEMA:\n{json.dumps(schema, ensure_ascii=False)}\n\n"
         f"TEXTO:\n{texto}"
     )
+    messages = PROMPT.messages(user)
+    route = route_for(PROMPT.tool, messages)  # modelo y timeout según el largo del ticket
+    opts = dict(
+        model=route.model, temperature=0.2, timeout=route.timeout, cache=True, schema_version=SCHEMA_VERSION,
+        prompt_cache_key=PROMPT.cache_key,
+    )
+    with route.recorded():
+        if on_partial is None:
+            content = chat(messages, **opts)
+        else:
+            content = chat_stream_json(messages, on_partial, **opts)
 
-    url = "https://api.openai.com/v1/chat/completions"
-    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
-    payload = {
-        "model": MODEL,
-        "messages": [{"role": "system", "content": system}, {"role": "user", "content": user}],
-        "temperature": 0.2,
-    }
-
-    resp = requests.post(url, headers=headers, json=payload, timeout=120)
-    if resp.status_code >= 400:
-        st.error(f"Error al analizar (HTTP {resp.status_code}).")
-        try:
-            st.code(resp.json())
-        except Exception:
-            st.code(resp.text[:2000])
-        st.stop()
-
-    data = resp.json()
-    content = data["choices"][0]["message"]["content"]
     obj = _extract_json(content)
 
     # Normalización defensiva
@@ -210,20 +203,25 @@ def analyze_ticket(texto: str, contexto: str = "") -> TicketResult:
     )
 
 
-# ==========================================================
-# Export helper (Excel multi-hojas, opcional)
-# ==========================================================
-def to_xlsx_multiple_sheets(sheets: Dict[str, pd.DataFrame]) -> Optional[bytes]:
-    try:
-        import openpyxl  # noqa: F401
-    except Exception:
-        return None
+def ticket_job(texto: str, contexto: str, on_partial=None) -> Dict[str, Any]:
+    """Trabajo en segundo plano (utils_jobs): el resultado viaja como dict JSON."""
+    return asdict(analyze_ticket(texto, contexto=contexto, on_partial=on_partial))
+
 
-    bio = io.BytesIO()
-    with pd.ExcelWriter(bio, engine="openpyxl") as writer:
-        for name, df in sheets.items():
-            df.to_excel(writer, index=False, sheet_name=str(name)[:31])
-    return bio.getvalue()
+def render_partial_ticket(slot, obj: Dict[str, Any]) -> None:
+    """Vista previa mientras llega la respuesta: solo campos y acciones ya completos."""
+    with slot.container(border=True):
+        st.caption("Analizando… (vista previa)")
+        c1, c2, c3 = st.columns(3)
+        c1.metric("Área destino", str(obj.get("area") or "…"))
+        c2.metric("Tipo", str(obj.get("tipo_solicitud") or "…"))
+        c3.metric("Prioridad", str(obj.get("prioridad") or "…"))
+        if obj.get("resumen"):
+            st.write(str(obj["resumen"]))
+        # La última acción puede venir a medias: se muestra hasta que llegue la siguiente
+        acciones = [a for a in (obj.get("acciones") or [])[:-1] if isinstance(a, dict) and a.get("accion")]
+        if acciones:
+            st.dataframe(pd.DataFrame(acciones), use_container_width=True, hide_index=True)
 
 
 # ==========================================================
@@ -242,14 +240,39 @@ texto = st.text_area(
 
 btn = st.button("Analizar", type="primary", disabled=(not texto.strip()), use_container_width=True)
 
+# El resultado se guarda por sesión: descargas y ediciones (rerun) no vuelven a llamar al modelo
+result_key = input_key(texto.strip(), contexto.strip(), signature(PROMPT.tool), SCHEMA_VERSION)
+
+# El análisis corre como trabajo en segundo plano (id en la sesión: sobrevive a reconexiones)
+owner = owner_id()
+job = current_job("nlp_operacion")
+
 if btn:
     if len(texto) > 25000:
         st.warning("El texto es muy largo. Divide en partes (recomendado: < 25,000 caracteres).")
         st.stop()
 
-    with st.spinner("Analizando…"):
-        r = analyze_ticket(texto.strip(), contexto=contexto.strip())
+    with utils_tracing.span("nlp_operacion", caracteres=len(texto)):
+        job_id = submit(
+            "nlp_operacion", ticket_job, texto.strip(), contexto.strip(),
+            owner=owner, input_key=result_key, label=texto.strip()[:40], partial=True,
+        )
+    set_current_job("nlp_operacion", job_id)
+    job = get(job_id)
+
+recent_jobs_sidebar("nlp_operacion")
+
+show_key = result_key
+if job is not None and job.active:
+    watch(job, lambda obj: render_partial_ticket(st, obj))
+else:
+    show_key = settle(
+        "nlp_operacion", job, result_key, has_inputs=bool(texto.strip()),
+        convert=lambda j: TicketResult(**j.result), error_title="Error al analizar",
+    )
 
+r = load_result("nlp_operacion", show_key)
+if r is not None:
     st.success("Listo ✅")
 
     c1, c2, c3 = st.columns(3)
@@ -313,8 +336,6 @@ if btn:
         "Acciones": df_actions,
     }
 
-    xlsx_bytes = to_xlsx_multiple_sheets(sheets)
-
     cA, cB = st.columns(2)
     with cA:
         st.download_button(
@@ -325,13 +346,10 @@ if btn:
             use_container_width=True,
         )
     with cB:
-        if xlsx_bytes is None:
-            st.info("Excel: agrega `openpyxl` a requirements.txt.")
-        else:
-            st.download_button(
-                "Descargar Excel",
-                data=xlsx_bytes,
-                file_name="nlp_operacion.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                use_container_width=True,
-            )
+        lazy_download_button(
+            "Descargar Excel",
+            lambda: to_xlsx_bytes(sheets),
+            file_name="nlp_operacion.xlsx",
+            key="nlp_xlsx",
+            token=content_token(json_out),
+        )
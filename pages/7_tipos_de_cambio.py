@@ -7,24 +7,23 @@ import os
 import pytz
 import re
 import requests
-import feedparser
-import xlsxwriter
-from openpyxl import load_workbook
 import streamlit as st
 from imemsa_ui import render_title
 from datetime import datetime, timedelta, date
 from email.utils import parsedate_to_datetime
 from pathlib import Path
-from PIL import Image
 from urllib.parse import urlparse
-from openpyxl import Workbook
-from openpyxl.styles import Alignment, Font, PatternFill
 from requests.adapters import HTTPAdapter, Retry
+from services.fx_analytics import compute_fx_analytics, history_frame, monex_spreads
+from utils_cache_backend import cached
+from utils_excel_templates import load_bundle, registered_templates, render_all, zip_rendered
+from utils_http_replay import install_from_env as http_replay_from_env
+from utils_timing import StageClock
 from utils_portal_auth import require_login_redirect
+import utils_profiler
 
 
 BASE_DIR = Path(__file__).resolve().parents[1]  # repo root (../)
-TEMPLATE_DEFAULT = BASE_DIR / "Indicadores_template_2col.xlsx"
 
 # Logo preferido: imemsa_logo.png / Imemsa_logo.png, fallback a logo.png
 LOGO_CANDIDATES = [
@@ -50,9 +49,10 @@ LOGO_CANDIDATES = [
 #        st.stop()
 #require_login()
 require_login_redirect()
+utils_profiler.run_hook()
 
 
-@st.cache_data(ttl=60*60)
+@cached("fx", ttl=60*60)
 def get_uma(inegi_token: str, http_session=None) -> dict:
     """ Robust UMA retrieval with API -> Web -> 2025 fallback """
     import re, json
@@ -229,7 +229,10 @@ def _mx_news_get_v1(max_items=12):
         return items
     for source, url in feeds:
         try:
-            fp = _fp.parse(url)
+            # Descarga con requests (timeouts + record/replay) y parsea el XML ya descargado
+            r = http_session(10).get(url, headers={"User-Agent": "Mozilla/5.0"}, timeout=10)
+            r.raise_for_status()
+            fp = _fp.parse(r.content)
             for e in fp.get("entries", []):
                 title = (e.get("title") or "").strip()
                 link  = (e.get("link") or "").strip()
@@ -268,6 +271,73 @@ def _mx_news_write_v1(wb, news_list, sheet_name="Noticias_RSS"):
     ws.set_column(2, 2, 20); ws.set_column(3, 3, 18)
     return ws
 
+def _fx_analytics_write(wb, fx, spreads=None, sheet_name="Analítica FX"):
+    """Hoja de analítica FX: resumen por ventana, correlaciones vs tasas y volatilidad diaria."""
+    if fx is None or fx.summary.empty:
+        return None
+    from openpyxl.utils import get_column_letter
+
+    ws = wb.add_worksheet(sheet_name)
+    fmt_title = wb.add_format({'font_name': 'Arial', 'font_size': 14, 'bold': True, 'font_color': '#0D2356'})
+    fmt_bold  = wb.add_format({'font_name': 'Arial', "bold": True, "bg_color": "#F2F2F2"})
+    fmt_txt   = wb.add_format({'font_name': 'Arial'})
+    fmt_num4  = wb.add_format({'font_name': 'Arial', "num_format": "#,##0.0000"})
+    fmt_num2  = wb.add_format({'font_name': 'Arial', "num_format": "0.00"})
+    fmt_date  = wb.add_format({'font_name': 'Arial', "num_format": "yyyy-mm-dd"})
+    fmt_note  = wb.add_format({'font_name': 'Arial', 'font_size': 9, 'italic': True, 'font_color': '#666666'})
+
+    def _table(r0, df, num_fmts):
+        ws.write_row(r0, 0, list(df.columns), fmt_bold)
+        for i, rec in enumerate(df.itertuples(index=False), start=r0 + 1):
+            for j, v in enumerate(rec):
+                if isinstance(v, str):
+                    ws.write_string(i, j, v, fmt_txt)
+                elif v is None or v != v:
+                    ws.write_blank(i, j, None)
+                else:
+                    ws.write_number(i, j, float(v), num_fmts.get(df.columns[j], fmt_num2))
+        return r0 + len(df) + 2
+
+    ws.write(0, 0, "ANALÍTICA FX (Banxico SIE)", fmt_title)
+    as_of = fx.as_of.strftime("%Y-%m-%d") if fx.as_of is not None else "—"
+    ws.write(1, 0, f"Último dato: {as_of} · Volatilidad anualizada (√252) sobre rendimientos log diarios; tasas en cambios de pb.", fmt_note)
+
+    r = 3
+    ws.write(r, 0, "Resumen por ventana", fmt_title); r += 1
+    r = _table(r, fx.summary, {"Último": fmt_num4})
+    if spreads is not None and not spreads.empty:
+        ws.write(r, 0, "Spread Monex (USD)", fmt_title); r += 1
+        r = _table(r, spreads, {"Valor": fmt_num4})
+    if not fx.correlations.empty:
+        ws.write(r, 0, "Correlación FX vs. cambios en tasas", fmt_title); r += 1
+        r = _table(r, fx.correlations, {})
+
+    vol = fx.rolling_vol
+    if not vol.empty:
+        ws.write(r, 0, "Volatilidad móvil diaria (%)", fmt_title); r += 1
+        ws.write_row(r, 0, ["Fecha"] + list(vol.columns), fmt_bold)
+        first = r + 1
+        for i, (ts, row) in enumerate(vol.iterrows(), start=first):
+            ws.write_datetime(i, 0, ts.to_pydatetime(), fmt_date)
+            for j, v in enumerate(row.tolist(), start=1):
+                if v == v:
+                    ws.write_number(i, j, float(v), fmt_num2)
+        last = first + len(vol) - 1
+        ch = wb.add_chart({"type": "line"})
+        for j in range(1, len(vol.columns) + 1):
+            col = get_column_letter(j + 1)
+            ch.add_series({
+                "name":       f"='{sheet_name}'!${col}${r + 1}",
+                "categories": f"='{sheet_name}'!$A${first + 1}:$A${last + 1}",
+                "values":     f"='{sheet_name}'!${col}${first + 1}:${col}${last + 1}",
+            })
+        ch.set_title({"name": "Volatilidad móvil (%)"})
+        ws.insert_chart(3, 9, ch, {"x_scale": 1.4, "y_scale": 1.2})
+
+    ws.set_column(0, 0, 22)
+    ws.set_column(1, 8, 16)
+    return ws
+
 import warnings
 warnings.filterwarnings("ignore", category=DeprecationWarning)
 
@@ -324,6 +394,8 @@ def logo_base64(max_height_px: int = 40):
         p = next((p for p in LOGO_CANDIDATES if p.exists()), None)
         if p is None or (hasattr(p,'exists') and not p.exists()):
             return None
+        from PIL import Image
+
         im = Image.open(p)
         w, h = im.size
         if h > max_height_px:
@@ -338,6 +410,9 @@ def logo_base64(max_height_px: int = 40):
 BANXICO_TOKEN = (st.secrets.get("BANXICO_TOKEN") if hasattr(st, "secrets") else None) or os.getenv("BANXICO_TOKEN","")
 INEGI_TOKEN   = (st.secrets.get("INEGI_TOKEN") if hasattr(st, "secrets") else None) or os.getenv("INEGI_TOKEN","")
 FRED_TOKEN    = (st.secrets.get("FRED_TOKEN") if hasattr(st, "secrets") else None) or os.getenv("FRED_TOKEN","")
+
+# Record/replay de todo el HTTP de esta página (IMEMSA_HTTP_MODE=record|replay); en live no hace nada
+http_replay_from_env(redact=[BANXICO_TOKEN, INEGI_TOKEN, FRED_TOKEN])
 def fred_fetch_series(series_id: str, start: str | None = None, end: str | None = None, units: str = "lin"):
     """
     Consulta FRED 
@@ -409,7 +484,7 @@ def http_session(timeout=15):
 
 
 
-@st.cache_data(ttl=120)
+@cached("fx", ttl=120)
 def get_monex_usd_compra_venta():
     """
     Lee compra/venta de USD desde el portal público de Monex y devuelve (compra, venta, fuente).
@@ -421,10 +496,10 @@ def get_monex_usd_compra_venta():
     html = r.text
 
     
-    m = _re.search(r'USD\s*([0-9][0-9\.,]*)\s*/\s*([0-9][0-9\.,]*)', html)
+    m = re.search(r'USD\s*([0-9][0-9\.,]*)\s*/\s*([0-9][0-9\.,]*)', html)
     if not m:
-        plain = _re.sub(r'<[^>]+>', ' ', html)
-        m = _re.search(r'USD\s*([0-9][0-9\.,]*)\s*/\s*([0-9][0-9\.,]*)', plain)
+        plain = re.sub(r'<[^>]+>', ' ', html)
+        m = re.search(r'USD\s*([0-9][0-9\.,]*)\s*/\s*([0-9][0-9\.,]*)', plain)
     if not m:
         raise RuntimeError("No se encontró USD compra/venta en Monex.")
 
@@ -454,7 +529,7 @@ def _check_tokens():
         st.error("Faltan tokens: " + ", ".join(missing))
         st.stop()
 
-@st.cache_data(ttl=60*30)
+@cached("fx", ttl=60*30)
 def sie_opportuno(series_id):
     url = f"https://www.banxico.org.mx/SieAPIRest/service/v1/series/{series_id}/datos/oportuno"
     headers = {"Bmx-Token": BANXICO_TOKEN}
@@ -472,7 +547,7 @@ def sie_latest(series_id):
     except:
         return None, None
 
-@st.cache_data(ttl=60*30)
+@cached("fx", ttl=60*30)
 def sie_range(series_id: str, start_iso: str, end_iso: str):
     url = f"https://www.banxico.org.mx/SieAPIRest/service/v1/series/{series_id}/datos/{start_iso}/{end_iso}"
     headers = {"Bmx-Token": BANXICO_TOKEN}
@@ -629,6 +704,36 @@ def rolling_movex_for_last6(window:int=20):
         out.append(sum(sub)/len(sub) if sub else None)
     return out
 
+FX_ANALYTICS_YEARS = 3
+FX_ANALYTICS_WINDOWS = (20, 60, 120)
+
+def fx_analytics_from_history(years: int = FX_ANALYTICS_YEARS):
+    """Histórico de TODAS las SIE_SERIES (una consulta cacheada por serie) → analítica vectorizada."""
+    end = today_cdmx()
+    start = end - timedelta(days=365*years)
+    obs = {}
+    for key, sid in SIE_SERIES.items():
+        try:
+            obs[key] = sie_range(sid, start.isoformat(), end.isoformat())
+        except Exception:
+            obs[key] = []
+    return compute_fx_analytics(history_frame(obs), windows=FX_ANALYTICS_WINDOWS)
+
+def fx_monex_spreads(fx):
+    """Spread Monex contra el último FIX del histórico (vacío si Monex no responde)."""
+    try:
+        compra, venta, _src = get_monex_usd_compra_venta()
+    except (requests.RequestException, RuntimeError, ValueError):
+        # Red / HTTP, página sin la cotización o número ilegible; los errores de código sí se propagan
+        return monex_spreads(None, None, None)
+    fix = None
+    try:
+        usd = fx.summary[fx.summary["Serie"] == "USD/MXN"]
+        fix = float(usd["Último"].iloc[0]) if not usd.empty else None
+    except (KeyError, IndexError, TypeError, ValueError):
+        fix = None
+    return monex_spreads(compra, venta, fix)
+
 SIE_SERIES = {
     "USD_FIX":   "SF43718",
     "EUR_MXN":   "SF46410",
@@ -644,7 +749,7 @@ SIE_SERIES = {
     "CETES_364": "SF43945",
 }
 
-@st.cache_data(ttl=60*60)
+@cached("fx", ttl=60*60)
 def get_uma(inegi_token: str, http_session=None) -> dict:
     """
     Obtiene UMA (diaria, mensual, anual).
@@ -876,7 +981,7 @@ SIE_SERIES = {
     "CETES_364": "SF43945",
 }
 
-@st.cache_data(ttl=60*60)
+@cached("fx", ttl=60*60)
 def get_uma(inegi_token: str, http_session=None) -> dict:
     """
     Obtiene UMA (diaria, mensual, anual).
@@ -1060,9 +1165,10 @@ def _probe(fn, ok_condition):
     except Exception as e:
         return ("err", "Error", 0)
 
-def _render_sidebar_status():
-    st.sidebar.header("🔎 Estado de fuentes")
-    st.sidebar.caption(f"Última verificación: {now_ts()}")
+def _render_sidebar_status(box):
+    """Sondea Banxico/INEGI y pinta el estado en `box` (un contenedor reservado en el sidebar)."""
+    box.header("🔎 Estado de fuentes")
+    box.caption(f"Última verificación: {now_ts()}")
 
     b_status, b_msg, b_ms = _probe(lambda: sie_latest(SIE_SERIES["USD_FIX"]),
                                    lambda res: "ok" if isinstance(res, tuple) and res[0] and (res[1] is not None) else "err")
@@ -1072,13 +1178,13 @@ def _render_sidebar_status():
 
     def badge(status, label, msg, ms):
         dot = "🟢" if status=="ok" else ("🟡" if status=="warn" else "🔴")
-        st.sidebar.write(f"{dot} **{label}** — {msg} · {ms} ms")
+        box.write(f"{dot} **{label}** — {msg} · {ms} ms")
 
     badge(b_status, "Banxico (SIE)", b_msg, b_ms)
     badge(i_status, "INEGI (UMA)",  i_msg, i_ms)
     badge(f_status, "FRED (USA)",   f_msg, f_ms)
 
-    st.sidebar.divider()
+    box.divider()
 
 with st.sidebar.expander("🔑 Tokens de APIs", expanded=False):
     st.caption("Si ingresas un token aquí, la app lo usará en lugar del definido en el código.")
@@ -1111,16 +1217,19 @@ with st.expander("📄 Selecciona las Hojas del Excel que contendra tu archivo",
     want_news   = st.checkbox("Agregar hoja Noticias_RSS", value=st.session_state.get("want_news", False))
     want_charts = st.checkbox("Agregar hoja 'Gráficos' ", value=st.session_state.get("want_charts", False))
     want_raw    = st.checkbox("Agregar hoja 'Datos crudos' ", value=st.session_state.get("want_raw", False))
+    want_fx     = st.checkbox("Agregar hoja 'Analítica FX' ", value=st.session_state.get("want_fx", False))
     st.session_state["want_fred"] = want_fred
     st.session_state["want_news"] = want_news
     st.session_state["want_charts"] = want_charts
     st.session_state["want_raw"] = want_raw
+    st.session_state["want_fx"] = want_fx
 
 
 do_fred   = st.session_state.get("want_fred", False)
 do_news   = st.session_state.get("want_news", False)
 do_charts = st.session_state.get("want_charts", False)
 do_raw    = st.session_state.get("want_raw", False)
+do_fx     = st.session_state.get("want_fx", False)
 
 
 movex_win = 5
@@ -1135,9 +1244,38 @@ uma_manual = UMA_DIARIA
 
 
 _check_tokens()
-_render_sidebar_status()
+# El sondeo de fuentes hace red: se reserva su lugar en el sidebar y se pinta al final del script
+_sidebar_status_box = st.sidebar.container()
+
+with st.expander("📊 Analítica FX (volatilidad, spreads y correlaciones)", expanded=False):
+    st.caption(f"Histórico de {FX_ANALYTICS_YEARS} años de todas las series SIE; ventanas de {', '.join(str(w) for w in FX_ANALYTICS_WINDOWS)} días hábiles.")
+    if st.button("Calcular analítica"):
+        with st.spinner("Calculando…"):
+            _fx = fx_analytics_from_history()
+            st.session_state["fx_analytics"] = (_fx, fx_monex_spreads(_fx))
+    if st.session_state.get("fx_analytics"):
+        _fx, _spreads = st.session_state["fx_analytics"]
+        if _fx.summary.empty:
+            st.info("Sin histórico suficiente para calcular la analítica.")
+        else:
+            st.caption(f"Último dato: {_fx.as_of:%d/%m/%Y}")
+            st.dataframe(_fx.summary, use_container_width=True, hide_index=True)
+            if not _spreads.empty:
+                st.markdown("**Spread Monex (USD)**")
+                st.dataframe(_spreads, use_container_width=True, hide_index=True)
+            if not _fx.correlations.empty:
+                st.markdown("**Correlación FX vs. cambios en CETES/TIIE**")
+                st.dataframe(_fx.correlations.round(2), use_container_width=True, hide_index=True)
+            st.line_chart(_fx.rolling_vol)
+
+def _lap(name: str):
+    """Cierra una etapa del cronómetro de "Generar Excel" (solo si hay corrida activa)."""
+    c = globals().get("_stage_clock")
+    if c is not None:
+        c.lap(name)
 
 if st.button("Generar Excel"):
+    _stage_clock = StageClock("Generar Excel")
     prog = st.progress(0, text="Iniciando…")
     prog.progress(5, text="Preparando entorno…")
     def pad6(lst): return ([None]*(6-len(lst)))+lst if len(lst) < 6 else lst[-6:]
@@ -1148,11 +1286,13 @@ if st.button("Generar Excel"):
     eur6 = pad6([v for _, v in sie_last_n(SIE_SERIES["EUR_MXN"], n=6)])
     jpy6 = pad6([v for _, v in sie_last_n(SIE_SERIES["JPY_MXN"], n=6)])
     prog.progress(25, text="Consultando Banxico (FX)…")
+    _lap("Banxico FX")
 
     
     movex_series = rolling_movex_for_last6(window=movex_win)
     movex6 = pad6(movex_series)
     prog.progress(35, text="Calculando baseline MOVEX…")
+    _lap("MOVEX")
 
     
     cetes28_6 = pad6([v for _, v in sie_last_n(SIE_SERIES["CETES_28"], n=6)])
@@ -1160,8 +1300,10 @@ if st.button("Generar Excel"):
     cetes182_6 = pad6([v for _, v in sie_last_n(SIE_SERIES["CETES_182"], n=6)])
     cetes364_6 = pad6([v for _, v in sie_last_n(SIE_SERIES["CETES_364"], n=6)])
     prog.progress(50, text="Consultando CETES…")
+    _lap("CETES")
     uma = get_uma(INEGI_TOKEN)
     prog.progress(65, text="Obteniendo UMA (INEGI)…")
+    _lap("UMA (INEGI)")
 
     
     from math import isnan
@@ -1204,7 +1346,10 @@ if st.button("Generar Excel"):
     except NameError:
         fred_rows = None  
     prog.progress(80, text="Construyendo Excel…")
+    _lap("FRED")
     bio = io.BytesIO()
+    import xlsxwriter
+
     wb = xlsxwriter.Workbook(bio, {'in_memory': True})
 
 
@@ -1351,6 +1496,7 @@ if st.button("Generar Excel"):
     except Exception:
         pass
     
+    _lap("Banxico rangos + Monex + TIIE")
     ws = wb.add_worksheet("Indicadores")
     ws.merge_range('B1:G1', 'INDICADORES DE TIPO DE CAMBIO', fmt_title)
     ws.set_row(0, 42)
@@ -1735,6 +1881,8 @@ if st.button("Generar Excel"):
     
 
 
+_lap("Hoja Indicadores")
+
 do_raw = globals().get('do_raw', True)
 if do_raw and ('wb' in globals()):
     ws3 = wb.add_worksheet("Datos crudos")
@@ -1764,8 +1912,17 @@ if do_raw and ('wb' in globals()):
     r = _dump(ws3, r, "CETES 182d (%)",sie_last_n(SIE_SERIES["CETES_182"],6))
     r = _dump(ws3, r, "CETES 364d (%)",sie_last_n(SIE_SERIES["CETES_364"],6))
     ws3.set_column(0, 0, 18); ws3.set_column(1, 1, 12); ws3.set_column(2, 2, 16)
+_lap("Hoja Datos crudos")
+
+do_fx = globals().get('do_fx', False)
+if do_fx and ('wb' in globals()):
+    try:
+        _fx_sheet = fx_analytics_from_history()
+        _fx_analytics_write(wb, _fx_sheet, fx_monex_spreads(_fx_sheet), sheet_name="Analítica FX")
+    except Exception:
+        pass
+_lap("Hoja Analítica FX")
 
-    
 do_charts = globals().get('do_charts', True)
 if do_charts and ('wb' in globals()):
     ws4 = wb.add_worksheet("Gráficos")
@@ -1862,6 +2019,7 @@ if do_charts and ('wb' in globals()):
                 wsfred.insert_chart("D4", ch, {"x_scale": 1.2, "y_scale": 1.2})
     except Exception as _e:
         pass
+_lap("Hojas Gráficos + FRED")
 
 try:
     fred_key = ""
@@ -1892,14 +2050,17 @@ try:
             _fred_write_v1(wb, fred_data, sheet_name="FRED_v2")
 
     _news = []
-    try:
-        _news = _mx_news_get_v1(max_items=12)
-    except Exception:
-        _news = []
-    if _news and st.session_state.get('want_news', False):
+    if st.session_state.get('want_news', False) and ('wb' in globals()):
+        # Solo al generar el Excel con la hoja activada (antes se pedía el RSS en cada rerun)
+        try:
+            _news = _mx_news_get_v1(max_items=12)
+        except Exception:
+            _news = []
+    if _news:
         _mx_news_write_v1(wb, _news, sheet_name="Noticias_RSS")
 except Exception:
     pass
+_lap("FRED_v2 + Noticias")
 
 try:
     
@@ -2007,153 +2168,30 @@ try:
     except Exception:
         
         pass
+    _lap("Hojas Lógica + Metadatos")
     wb.close()
+    _lap("Cierre xlsxwriter")
     try:
         
-        # === Post-proceso plantilla: mapeo explícito (si hay plantilla, SIEMPRE se entrega la plantilla) ===
+        # === Post-proceso plantillas: un solo bundle de datos → todas las plantillas registradas ===
         try:
-            template_path = TEMPLATE_DEFAULT
-            if template_path.exists():
-                raw_bytes = bio.getvalue()
-
-                # Libros fuente (generado) y destino (plantilla)
-                wb_src = load_workbook(io.BytesIO(raw_bytes), data_only=False)
-                ws_src = wb_src["Indicadores"] if "Indicadores" in wb_src.sheetnames else wb_src[wb_src.sheetnames[0]]
-                wb_dst = load_workbook(template_path)
-                ws_dst = wb_dst["Indicadores"] if "Indicadores" in wb_dst.sheetnames else wb_dst[wb_dst.sheetnames[0]]
-
-                # --- Mapeos explícitos de Ariel ---
-                MAPPINGS = [
-                    ("F2","C2"), ("F7","C5"), ("F9","C6"), ("F10","C7"), ("F13","C10"), ("F14","C11"),
-                    ("F17","C14"), ("F18","C15"), ("F22","C18"), ("F26","C21"), ("F27","C22"), ("F28","C23"),
-                    ("F33","C27"), ("F34","C28"), ("F35","C29"), ("F36","C30"),
-                    ("F40","B33"), ("F41","B34"), ("F42","B35"),
-                    ("G2","D2"), ("G7","D5"), ("G9","D6"), ("G10","D7"), ("G13","D10"), ("G14","D11"),
-                    ("G17","D14"), ("G18","D15"), ("G22","D18"), ("G26","D21"), ("G27","D22"), ("G28","D23"),
-                    ("G33","D27"), ("G34","D28"), ("G35","D29"), ("G36","D30"),
-                ]
-
-                for src, dst in MAPPINGS:
-                    try:
-                        val = ws_src[src].value
-                        if val is not None:
-                            ws_dst[dst].value = val
-                    except Exception:
-                        pass
-
-                
-                # --- Copiar hoja "Noticias_RSS" completa (robusto: valores + estilos + vínculos) ---
-                try:
-                    # Localizar hoja fuente (preferir exacto, si no, por substring 'noticias')
-                    src_name = None
-                    for nm in wb_src.sheetnames:
-                        if nm == "Noticias_RSS":
-                            src_name = nm; break
-                    if src_name is None:
-                        for nm in wb_src.sheetnames:
-                            if "noticias" in nm.lower():
-                                src_name = nm; break
-
-                    # Localizar/crear hoja destino en plantilla
-                    dst_name = None
-                    for nm in wb_dst.sheetnames:
-                        if nm == "Noticias_RSS":
-                            dst_name = nm; break
-                    if dst_name is None:
-                        for nm in wb_dst.sheetnames:
-                            if "noticias" in nm.lower():
-                                dst_name = nm; break
-                    if dst_name is None:
-                        dst_name = "Noticias_RSS"
-                        wb_dst.create_sheet(dst_name)
-
-                    if src_name is not None and dst_name is not None:
-                        ws_src_rss = wb_src[src_name]
-                        ws_dst_rss = wb_dst[dst_name]
-
-                        max_r = ws_src_rss.max_row or 1
-                        max_c = ws_src_rss.max_column or 1
-
-                        # Limpiar merges previos en destino (para evitar solapamientos)
-                        try:
-                            for mr in list(ws_dst_rss.merged_cells.ranges):
-                                ws_dst_rss.unmerge_cells(range_string=str(mr))
-                        except Exception:
-                            pass
-
-                        # Copiar celdas (valor, estilos, vínculo) y alturas/anchos
-                        for rr in range(1, max_r + 1):
-                            # Altura de fila
-                            try:
-                                rd = ws_src_rss.row_dimensions.get(rr)
-                                if rd and rd.height:
-                                    ws_dst_rss.row_dimensions[rr].height = rd.height
-                            except Exception:
-                                pass
-                            for cc in range(1, max_c + 1):
-                                src_cell = ws_src_rss.cell(row=rr, column=cc)
-                                dst_cell = ws_dst_rss.cell(row=rr, column=cc)
-
-                                # Valor
-                                dst_cell.value = src_cell.value
-
-                                # Estilos
-                                try:
-                                    if src_cell.has_style:
-                                        dst_cell.font = src_cell.font
-                                        dst_cell.fill = src_cell.fill
-                                        dst_cell.alignment = src_cell.alignment
-                                        dst_cell.border = src_cell.border
-                                        dst_cell.number_format = src_cell.number_format
-                                        dst_cell.protection = src_cell.protection
-                                except Exception:
-                                    pass
-
-                                # Hipervínculo
-                                try:
-                                    if src_cell.hyperlink is not None:
-                                        target = getattr(src_cell.hyperlink, "target", None)
-                                        display = getattr(src_cell.hyperlink, "display", None)
-                                        if target:
-                                            dst_cell.hyperlink = target
-                                        if display and (dst_cell.value is None or dst_cell.value == ""):
-                                            dst_cell.value = display
-                                except Exception:
-                                    pass
-
-                        # Anchos de columnas
-                        try:
-                            for cc in range(1, max_c + 1):
-                                col_letter = get_column_letter(cc)
-                                src_dim = ws_src_rss.column_dimensions.get(col_letter)
-                                if src_dim and src_dim.width:
-                                    ws_dst_rss.column_dimensions[col_letter].width = src_dim.width
-                        except Exception:
-                            pass
-
-                        # Replicar merges
-                        try:
-                            for mr in ws_src_rss.merged_cells.ranges:
-                                ws_dst_rss.merge_cells(range_string=str(mr))
-                        except Exception:
-                            pass
-                except Exception:
-                    pass
-                # --- Fin copia Noticias_RSS ---
-
-
-                # Guardar SIEMPRE la plantilla (aunque no haya habido celdas copiadas)
-                _out = io.BytesIO()
-                wb_dst.save(_out)
-                _out.seek(0)
-                st.session_state['xlsx_bytes'] = _out.getvalue()
-                try:
-                    st.session_state['xlsx_filename'] = f"indicadores_template_{today_cdmx()}.xlsx"
-                except Exception:
-                    pass
+            raw_bytes = bio.getvalue()
+            _specs = registered_templates()
+            if _specs:
+                _rendered = render_all(_specs, load_bundle(raw_bytes), fecha=str(today_cdmx()))
+                st.session_state['xlsx_renders'] = _rendered
+                if _rendered[0].data:
+                    # La plantilla base (la primera registrada) es la descarga principal;
+                    # si falla se entrega el libro generado, nunca el layout de otra área
+                    st.session_state['xlsx_bytes'] = _rendered[0].data
+                    st.session_state['xlsx_filename'] = _rendered[0].filename
+                else:
+                    st.session_state['xlsx_bytes'] = raw_bytes
+                    st.session_state['xlsx_filename'] = f"indicadores_{today_cdmx()}.xlsx"
             else:
-                # Si no existe la plantilla, devolver el archivo generado original
-                st.session_state['xlsx_bytes'] = bio.getvalue()
+                # Si no existe ninguna plantilla, devolver el archivo generado original
+                st.session_state['xlsx_renders'] = []
+                st.session_state['xlsx_bytes'] = raw_bytes
                 try:
                     if 'xlsx_filename' not in st.session_state:
                         st.session_state['xlsx_filename'] = f"indicadores_{today_cdmx()}.xlsx"
@@ -2162,13 +2200,16 @@ try:
         except Exception:
             # Ante cualquier error, devolvemos el archivo generado original
             try:
+                st.session_state['xlsx_renders'] = []
                 st.session_state['xlsx_bytes'] = bio.getvalue()
                 if 'xlsx_filename' not in st.session_state:
                     st.session_state['xlsx_filename'] = f"indicadores_{today_cdmx()}.xlsx"
             except Exception:
                 pass
         # === Fin post-proceso plantilla ===
-        
+        _lap("Plantillas")
+        _stage_clock.finish()
+
         prog.progress(100, text="Listo ✅")
         time.sleep(0.3)
         try:
@@ -2201,6 +2242,32 @@ try:
             mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
             use_container_width=True
         )
+    # Adicionales = las registradas después de la base (posición 0), aunque la base haya fallado
+    _renders = st.session_state.get('xlsx_renders') or []
+    _extra = [r for r in _renders[1:] if r.data]
+    if _extra:
+        st.caption("Plantillas adicionales (mismos datos, distinto formato):")
+        _cols = st.columns(min(len(_extra) + 1, 4))
+        for _i, _r in enumerate(_extra, start=1):
+            _cols[_i % len(_cols)].download_button(
+                _r.name,
+                data=_r.data,
+                file_name=_r.filename,
+                mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+                key=f"dl_tpl_{_i}",
+                use_container_width=True,
+            )
+        _cols[0].download_button(
+            'Todas (ZIP)',
+            data=zip_rendered(_renders),
+            file_name=f"indicadores_plantillas_{today_cdmx()}.zip",
+            mime='application/zip',
+            key="dl_tpl_zip",
+            use_container_width=True,
+        )
+    for _r in _renders:
+        if _r.error:
+            st.warning(f"No se pudo generar la plantilla '{_r.name}': {_r.error}")
 except Exception:
     pass
 
@@ -2227,3 +2294,5 @@ except Exception:
             wsh.write(i,0,k, fmt_bold); wsh.write(i,1,v, fmt_wrap)
     except Exception:
         pass
+
+_render_sidebar_status(_sidebar_status_box)
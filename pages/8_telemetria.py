@@ -0,0 +1,236 @@
+from datetime import date, datetime, timedelta
+
+import pandas as pd
+import streamlit as st
+import utils_cache_backend
+import utils_ledger
+import utils_profiler
+import utils_tracing
+from imemsa_ui import render_title
+from utils_hedge import stats as hedge_stats
+from utils_portal_auth import require_admin
+from utils_prompts import prefix_stats
+from utils_ratelimit import governor
+from utils_singleflight import stats as singleflight_stats
+from utils_telemetry import load, summarize
+
+# ==========================================================
+# PÁGINA: 📊 Telemetría IA (solo administradores)
+# - Latencia, throughput, tokens y costo por herramienta y por día
+# - Fuente: registros locales de utils_telemetry (un JSONL por día)
+# - SIN st.set_page_config() (solo en app.py)
+# - SIN st.switch_page() / st.rerun() (evita loops)
+# ==========================================================
+require_admin()
+utils_profiler.run_hook()
+
+# --------- UI Header
+render_title('📊 Telemetría IA', 'Uso, latencia y costo de las llamadas al modelo por herramienta.')
+
+if hasattr(st, "page_link"):
+    st.page_link("app.py", label="⬅️ Volver al Portafolio", icon="🏠", use_container_width=True)
+
+
+@st.cache_data(ttl=30, show_spinner=False)
+def _load(days: int) -> pd.DataFrame:
+    return load(days)
+
+
+with st.sidebar:
+    st.markdown("### Opciones")
+    days = st.slider("Días", min_value=1, max_value=90, value=14, step=1)
+    if st.button("Actualizar", use_container_width=True):
+        _load.clear()
+
+df = _load(days)
+
+# ==========================================================
+# Limitador (este proceso, en vivo)
+# ==========================================================
+st.subheader("Limitador OpenAI (ahora)")
+g = governor().stats()
+c1, c2, c3, c4, c5 = st.columns(5)
+c1.metric("En vuelo", g["active"])
+c2.metric("En cola", g["queued"])
+c3.metric("Espera promedio", f"{g['avg_wait_s']:.2f} s")
+c4.metric("RPM disponibles", f"{g['rpm_available']:,.0f}")
+c5.metric("TPM disponibles", f"{g['tpm_available']:,.0f}")
+
+# ==========================================================
+# Libro de consumo (histórico persistente, utils_ledger)
+# ==========================================================
+st.subheader("Libro de consumo")
+today = date.today()
+l1, l2, l3 = st.columns([1, 1, 2])
+ledger_from = l1.date_input("Desde", value=today - timedelta(days=89), key="ledger_from")
+ledger_to = l2.date_input("Hasta", value=today, key="ledger_to")
+info = utils_ledger.stats()
+l3.caption(
+    f"{info.get('rows', 0):,} llamadas registradas desde {info.get('since') or '—'}"
+    f" · {info.get('bytes', 0) / 1e6:,.1f} MB" + ("" if info["enabled"] else " · desactivado (IMEMSA_LEDGER=0)")
+)
+
+lt1, lt2, lt3, lt4 = st.tabs(["Semanal por herramienta", "Por sesión", "Entradas más pesadas", "Exportar"])
+with lt1:
+    weekly = pd.DataFrame(utils_ledger.weekly(ledger_from, ledger_to, by=("tool",)))
+    if weekly.empty:
+        st.caption("Sin registros en el rango.")
+    else:
+        weekly["audio_min"] = (weekly["audio_seconds"] / 60).round(1)
+        st.bar_chart(weekly.pivot_table(index="week", columns="tool", values="cost_usd", aggfunc="sum").fillna(0))
+        st.dataframe(weekly.drop(columns=["audio_seconds"]), use_container_width=True, hide_index=True)
+with lt2:
+    st.caption("Sesión de Streamlit (el portal no tiene usuarios con nombre).")
+    st.dataframe(pd.DataFrame(utils_ledger.totals(ledger_from, ledger_to, by=("session", "tool"))), use_container_width=True, hide_index=True)
+with lt3:
+    metric = st.selectbox("Ordenar por", utils_ledger.HEAVY_METRICS, key="ledger_metric")
+    st.dataframe(pd.DataFrame(utils_ledger.top_inputs(ledger_from, ledger_to, metric=metric)), use_container_width=True, hide_index=True)
+with lt4:
+    e1, e2 = st.columns(2)
+    e1.download_button(
+        "CSV finanzas (día × herramienta × modelo)",
+        utils_ledger.export_csv(ledger_from, ledger_to),
+        f"consumo_ia_{ledger_from}_{ledger_to}.csv",
+        "text/csv",
+        use_container_width=True,
+    )
+    # El detalle de meses puede pesar varios MB: se arma solo si se pide
+    if e2.checkbox("Preparar detalle (una fila por llamada)", key="ledger_detail"):
+        e2.download_button(
+            "CSV detalle",
+            utils_ledger.export_csv(ledger_from, ledger_to, detail=True),
+            f"consumo_ia_detalle_{ledger_from}_{ledger_to}.csv",
+            "text/csv",
+            use_container_width=True,
+        )
+
+with st.expander("Trazas (desglose de una solicitud)", expanded=False):
+    st.caption("Cada clic deja una traza con sus etapas, trabajos en segundo plano, llamadas al modelo y exportaciones.")
+    ident = st.text_input("Id de solicitud o de trabajo", key="trace_id").strip()
+    if ident:
+        rows = utils_tracing.tree(utils_tracing.find(ident))
+        if not rows:
+            st.caption("Sin spans para ese id en los últimos 7 días.")
+        else:
+            st.dataframe(
+                pd.DataFrame([
+                    {"etapa": "· " * r["depth"] + r["name"], "inicio_ms": r["offset_ms"], "duracion_ms": r["duration_ms"],
+                     "estado": r["status"], "detalle": r["error"] or ", ".join(f"{k}={v}" for k, v in r["attrs"].items())}
+                    for r in rows
+                ]),
+                use_container_width=True,
+                hide_index=True,
+            )
+    else:
+        slow = pd.DataFrame(utils_tracing.slowest_roots(days=1))
+        if slow.empty:
+            st.caption("Sin trazas hoy.")
+        else:
+            slow["start"] = slow["start"].map(lambda t: datetime.fromtimestamp(t).strftime("%H:%M:%S"))
+            st.caption("Más lentas de hoy (copia el trace_id arriba para ver el desglose).")
+            st.dataframe(slow, use_container_width=True, hide_index=True)
+
+if df.empty:
+    st.info("Aún no hay llamadas registradas en el periodo.")
+    st.stop()
+
+# ==========================================================
+# Resumen del periodo
+# ==========================================================
+st.subheader("Resumen del periodo")
+live = df[df["ok"] & ~df["cache_hit"] & (df["hedge"] != "perdedor")]
+k1, k2, k3, k4, k5 = st.columns(5)
+k1.metric("Llamadas", f"{len(df):,}")
+k2.metric("Costo estimado", f"${df['cost_usd'].sum():,.2f} USD")
+k3.metric("p50 / p95", f"{live['latency_ms'].quantile(0.5):,.0f} / {live['latency_ms'].quantile(0.95):,.0f} ms" if not live.empty else "—")
+k4.metric("Aciertos de caché", f"{100 * df['cache_hit'].mean():.1f} %")
+k5.metric("Errores", f"{100 * (~df['ok']).mean():.1f} %")
+
+st.markdown("### Por herramienta")
+by_tool = summarize(df, ["tool"]).sort_values("costo_usd", ascending=False)
+st.dataframe(by_tool, use_container_width=True, hide_index=True)
+flights = singleflight_stats()
+st.caption(
+    f"Solicitudes idénticas simultáneas (este proceso): {flights['shared']:,} atendidas con la llamada de otra sesión"
+    f" · {flights['leaders']:,} llamadas reales · {flights['in_flight']:,} en curso."
+)
+cache = utils_cache_backend.stats(["llm", "fx"])
+st.caption(
+    f"Caché compartida ({cache['backend']}): "
+    + " · ".join(
+        f"{ns} {row.get('entries', '—')} entradas"
+        + (f", {row.get('shared_hits', 0):,} aciertos de otra sesión/réplica" if "shared_hits" in row else "")
+        + (f", sin conexión ({row['error']})" if "error" in row else "")
+        for ns, row in cache["namespaces"].items()
+    )
+)
+
+routed = df[df["route"] != ""]
+if not routed.empty:
+    st.markdown("### Por ruta (tier/cubeta de tamaño)")
+    by_route = summarize(routed, ["tool", "route", "model"]).sort_values(["tool", "route"])
+    st.dataframe(by_route, use_container_width=True, hide_index=True)
+
+with st.expander("Prefijos estáticos (caché de prompts del proveedor)", expanded=False):
+    st.caption("Hash del prefijo fijo de cada herramienta en este proceso; una desviación rompe la caché del proveedor.")
+    prefixes = prefix_stats()
+    if prefixes:
+        st.dataframe(
+            pd.DataFrame([{"tool": t, **v} for t, v in sorted(prefixes.items())]),
+            use_container_width=True,
+            hide_index=True,
+        )
+    else:
+        st.caption("Aún no se han hecho llamadas en este proceso.")
+
+with st.expander("Solicitudes duplicadas (hedging)", expanded=False):
+    hedges = hedge_stats()
+    losers = df[df["hedge"] == "perdedor"]
+    st.caption(
+        ("Activo" if hedges["enabled"] else "Inactivo (IMEMSA_HEDGE=1 para activarlo)")
+        + f" · créditos disponibles {hedges['credits']:g} · perdedores en el periodo {len(losers):,}"
+        + f" (costo extra ${losers['cost_usd'].sum():,.4f} USD)"
+    )
+    if hedges["keys"]:
+        st.dataframe(
+            pd.DataFrame([{"llave": k, **v} for k, v in hedges["keys"].items()]),
+            use_container_width=True,
+            hide_index=True,
+        )
+
+# ==========================================================
+# Serie diaria
+# ==========================================================
+st.markdown("### Por día")
+by_day = summarize(df, ["day", "tool"])
+
+t1, t2, t3 = st.tabs(["Costo (USD)", "Llamadas", "Latencia p95 (ms)"])
+with t1:
+    st.bar_chart(by_day.pivot_table(index="day", columns="tool", values="costo_usd", aggfunc="sum").fillna(0))
+with t2:
+    st.bar_chart(by_day.pivot_table(index="day", columns="tool", values="llamadas", aggfunc="sum").fillna(0))
+with t3:
+    st.line_chart(by_day.pivot_table(index="day", columns="tool", values="p95_ms", aggfunc="max"))
+
+with st.expander("Tabla diaria", expanded=False):
+    st.dataframe(by_day.sort_values(["day", "tool"], ascending=[False, True]), use_container_width=True, hide_index=True)
+
+# ==========================================================
+# Errores recientes + datos crudos
+# ==========================================================
+errors = df[~df["ok"]]
+if not errors.empty:
+    st.markdown("### Errores recientes")
+    st.dataframe(
+        errors.sort_values("ts", ascending=False)[["time", "tool", "model", "error", "status", "latency_ms"]].head(50),
+        use_container_width=True,
+        hide_index=True,
+    )
+
+st.download_button(
+    "CSV (registros)",
+    df.drop(columns=["ok"]).to_csv(index=False).encode("utf-8"),
+    "telemetria_llm.csv",
+    "text/csv",
+    use_container_width=True,
+)
@@ -0,0 +1,18 @@
+"""
+Punto de entrada para producción: el portal (app.py) más rutas de operación
+en el mismo puerto.
+
+  streamlit run serve.py
+  curl localhost:8501/metrics   # texto Prometheus
+  curl localhost:8501/readyz    # JSON; 503 si la réplica no está lista
+
+Ver utils_metrics para las series y las variables IMEMSA_METRICS_*.
+Requiere una versión de Streamlit con st.App (servidor Starlette).
+"""
+from pathlib import Path
+
+import streamlit as st
+
+import utils_metrics
+
+app = st.App(Path(__file__).resolve().parent / "app.py", routes=utils_metrics.routes())
@@ -1,10 +1,9 @@
 import base64
 import json
-import os
 from dataclasses import dataclass
 from typing import Any, Dict, List, Optional
 
-from openai import OpenAI
+from services.openai_client import get_async_client, get_client
 
 
 @dataclass
@@ -14,11 +13,30 @@ class DocExtractResult:
     model: str
 
 
-def _get_api_key() -> str:
-    key = os.getenv("OPENAI_API_KEY", "").strip()
-    if not key:
-        raise RuntimeError("Falta OPENAI_API_KEY. Configuralo en Streamlit Secrets.")
-    return key
+MODEL = "gpt-4o-mini"
+
+INSTRUCTIONS = (
+    "Eres un asistente para OCR y extraccion estructurada.\n"
+    "Devuelve SOLO JSON valido con este formato:\n"
+    "{\n"
+    '  "full_text": "...",\n'
+    '  "fields": {\n'
+    '    "tipo_documento": "...",\n'
+    '    "folio": "...",\n'
+    '    "fecha": "...",\n'
+    '    "cliente_proveedor": "...",\n'
+    '    "total": "...",\n'
+    '    "moneda": "...",\n'
+    '    "notas": "...",\n'
+    '    "items": [\n'
+    '      {"descripcion":"...","cantidad":"...","unidad":"...","precio_unitario":"...","importe":"..."}\n'
+    "    ]\n"
+    "  }\n"
+    "}\n"
+    "Reglas:\n"
+    "- No inventes datos. Si no existe, usa null o cadena vacia.\n"
+    "- Conserva numeros, unidades, fechas y nombres.\n"
+)
 
 
 def _to_data_url(img_bytes: bytes, mime: str) -> str:
@@ -26,53 +44,26 @@ def _to_data_url(img_bytes: bytes, mime: str) -> str:
     return f"data:{mime};base64,{b64}"
 
 
-def ocr_and_extract_from_images(
-    images: List[Dict[str, Any]],
-    document_type_hint: Optional[str] = None,
-) -> DocExtractResult:
-    client = OpenAI(api_key=_get_api_key())
-
+def _build_request(images: List[Dict[str, Any]], document_type_hint: Optional[str]) -> Dict[str, Any]:
     hint = document_type_hint or "documento"
 
-    instructions = (
-        "Eres un asistente para OCR y extraccion estructurada.\n"
-        "Devuelve SOLO JSON valido con este formato:\n"
-        "{\n"
-        '  "full_text": "...",\n'
-        '  "fields": {\n'
-        '    "tipo_documento": "...",\n'
-        '    "folio": "...",\n'
-        '    "fecha": "...",\n'
-        '    "cliente_proveedor": "...",\n'
-        '    "total": "...",\n'
-        '    "moneda": "...",\n'
-        '    "notas": "...",\n'
-        '    "items": [\n'
-        '      {"descripcion":"...","cantidad":"...","unidad":"...","precio_unitario":"...","importe":"..."}\n'
-        "    ]\n"
-        "  }\n"
-        "}\n"
-        "Reglas:\n"
-        "- No inventes datos. Si no existe, usa null o cadena vacia.\n"
-        "- Conserva numeros, unidades, fechas y nombres.\n"
-        f"Contexto: el documento es un {hint}."
-    )
-
-    # ✅ Formato correcto para Responses API
-    content = [{"type": "input_text", "text": "Realiza OCR y devuelve SOLO JSON."}]
+    # ✅ Formato correcto para Responses API (lo variable va en input, no en las instrucciones fijas)
+    content = [{"type": "input_text", "text": f"Contexto: el documento es un {hint}. Realiza OCR y devuelve SOLO JSON."}]
     for im in images:
         data_url = _to_data_url(im["bytes"], im["mime"])
         content.append({"type": "input_image", "image_url": data_url})
 
-    resp = client.responses.create(
-        model="gpt-4o-mini",
-        instructions=instructions,
-        input=[{"role": "user", "content": content}],
+    return {
+        "model": MODEL,
+        "instructions": INSTRUCTIONS,
+        "input": [{"role": "user", "content": content}],
         # ✅ obliga salida JSON válida
-        text={"format": {"type": "json_object"}},
-    )
+        "text": {"format": {"type": "json_object"}},
+    }
 
-    raw = (resp.output_text or "").strip()
+
+def _parse(output_text: str) -> DocExtractResult:
+    raw = (output_text or "").strip()
     if not raw:
         raise RuntimeError("Respuesta vacia del modelo (output_text).")
 
@@ -84,6 +75,22 @@ def ocr_and_extract_from_images(
     return DocExtractResult(
         full_text=str(data.get("full_text", "") or ""),
         fields=dict(data.get("fields", {}) or {}),
-        model="gpt-4o-mini",
+        model=MODEL,
     )
 
+
+def ocr_and_extract_from_images(
+    images: List[Dict[str, Any]],
+    document_type_hint: Optional[str] = None,
+) -> DocExtractResult:
+    resp = get_client().responses.create(**_build_request(images, document_type_hint))
+    return _parse(resp.output_text)
+
+
+async def aocr_and_extract_from_images(
+    images: List[Dict[str, Any]],
+    document_type_hint: Optional[str] = None,
+) -> DocExtractResult:
+    """Igual que ocr_and_extract_from_images(), sobre el cliente asíncrono compartido."""
+    resp = await get_async_client().responses.create(**_build_request(images, document_type_hint))
+    return _parse(resp.output_text)
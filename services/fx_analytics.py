@@ -0,0 +1,166 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+
+# Series de tipo de cambio (rendimientos logarítmicos) y de tasas (cambios en pb)
+FX_LABELS = {
+    "USD_FIX": "USD/MXN",
+    "EUR_MXN": "EUR/MXN",
+    "JPY_MXN": "JPY/MXN",
+}
+RATE_LABELS = {
+    "CETES_28": "CETES 28",
+    "CETES_91": "CETES 91",
+    "CETES_182": "CETES 182",
+    "CETES_364": "CETES 364",
+    "TIIE_28": "TIIE 28",
+    "TIIE_91": "TIIE 91",
+    "TIIE_182": "TIIE 182",
+}
+
+
+@dataclass
+class FxAnalytics:
+    summary: pd.DataFrame
+    correlations: pd.DataFrame
+    rolling_vol: pd.DataFrame
+    as_of: Optional[pd.Timestamp]
+
+
+def history_frame(obs_by_key: Dict[str, List[dict]]) -> pd.DataFrame:
+    """
+    Convierte las observaciones SIE ({"fecha": "dd/mm/aaaa", "dato": "..."})
+    de varias series a un DataFrame ancho (índice fecha, una columna por serie).
+    """
+    cols: Dict[str, pd.Series] = {}
+    for key, obs in obs_by_key.items():
+        if not obs:
+            continue
+        d = pd.DataFrame(obs)
+        if "fecha" not in d or "dato" not in d:
+            continue
+        idx = pd.to_datetime(d["fecha"], format="%d/%m/%Y", errors="coerce")
+        val = pd.to_numeric(d["dato"].astype(str).str.replace(",", "", regex=False), errors="coerce")
+        s = pd.Series(val.to_numpy(dtype=float), index=idx)
+        s = s[s.index.notna()].dropna()
+        cols[key] = s[~s.index.duplicated(keep="last")]
+
+    if not cols:
+        return pd.DataFrame()
+    return pd.DataFrame(cols).sort_index()
+
+
+def _rolling_mean(a: np.ndarray, window: int) -> np.ndarray:
+    """Media móvil por columnas con suma acumulada (una sola pasada)."""
+    out = np.full(a.shape, np.nan)
+    if a.shape[0] < window:
+        return out
+    cs = np.cumsum(a, axis=0)
+    out[window - 1] = cs[window - 1]
+    out[window:] = cs[window:] - cs[:-window]
+    return out / window
+
+
+def compute_fx_analytics(
+    hist: pd.DataFrame,
+    windows: Sequence[int] = (20, 60, 120),
+    periods_per_year: int = 252,
+) -> FxAnalytics:
+    """
+    Volatilidad móvil, rendimientos y correlaciones FX vs. tasas.
+
+    - FX: rendimientos logarítmicos diarios.
+    - Tasas (CETES/TIIE): cambios diarios en puntos base (las subastas
+      semanales se arrastran, así que su cambio es 0 entre publicaciones).
+    - Por cada ventana se hace UNA sola pasada vectorizada sobre la matriz
+      [x, y, x², y², x·y] de todas las series a la vez.
+    """
+    fx_keys = [k for k in FX_LABELS if k in hist.columns and hist[k].notna().any()]
+    rate_keys = [k for k in RATE_LABELS if k in hist.columns and hist[k].notna().any()]
+    empty = FxAnalytics(pd.DataFrame(), pd.DataFrame(), pd.DataFrame(), None)
+    if not fx_keys:
+        return empty
+
+    # Días con publicación FIX; el resto de series se arrastra (máx. una semana)
+    frame = hist[fx_keys + rate_keys].ffill(limit=5)
+    frame = frame[frame[fx_keys].notna().all(axis=1)]
+    if len(frame) < 3:
+        return empty
+
+    levels = frame[fx_keys].to_numpy(dtype=float)
+    x = np.diff(np.log(levels), axis=0)
+    y = np.diff(frame[rate_keys].to_numpy(dtype=float), axis=0) * 100.0 if rate_keys else np.empty((len(x), 0))
+    y = np.nan_to_num(y, nan=0.0)
+    dates = frame.index[1:]
+    n_fx, n_rt = x.shape[1], y.shape[1]
+
+    xy = (x[:, :, None] * y[:, None, :]).reshape(len(x), n_fx * n_rt)
+    z = np.hstack([x, y, x * x, y * y, xy])
+
+    summary_rows: List[dict] = []
+    corr_rows: List[dict] = []
+    rolling_vol = pd.DataFrame(index=dates)
+    ann = np.sqrt(periods_per_year)
+
+    for w in sorted({int(w) for w in windows if int(w) >= 2}):
+        if len(z) < w:
+            continue
+        m = _rolling_mean(z, w)
+        mx = m[:, :n_fx]
+        my = m[:, n_fx:n_fx + n_rt]
+        mxx = m[:, n_fx + n_rt:2 * n_fx + n_rt]
+        myy = m[:, 2 * n_fx + n_rt:2 * n_fx + 2 * n_rt]
+        mxy = m[:, 2 * n_fx + 2 * n_rt:].reshape(len(z), n_fx, n_rt)
+
+        var_x = np.clip(mxx - mx * mx, 0.0, None)
+        var_y = np.clip(myy - my * my, 0.0, None)
+        vol = np.sqrt(var_x * w / (w - 1)) * ann
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            denom = np.sqrt(var_x[:, :, None] * var_y[:, None, :])
+            corr = np.where(denom > 0, (mxy - mx[:, :, None] * my[:, None, :]) / denom, np.nan)
+
+        if not len(rolling_vol.columns):
+            for j, k in enumerate(fx_keys):
+                rolling_vol[f"{FX_LABELS[k]} vol {w}d (%)"] = vol[:, j] * 100.0
+
+        ret_w = mx[-1] * w
+        for j, k in enumerate(fx_keys):
+            summary_rows.append(
+                {
+                    "Serie": FX_LABELS[k],
+                    "Ventana (días)": w,
+                    "Último": float(levels[-1, j]),
+                    "Rendimiento (%)": float(np.expm1(ret_w[j]) * 100.0),
+                    "Volatilidad anualizada (%)": float(vol[-1, j] * 100.0),
+                }
+            )
+            row = {"Serie": FX_LABELS[k], "Ventana (días)": w}
+            for r, rk in enumerate(rate_keys):
+                row[RATE_LABELS[rk]] = float(corr[-1, j, r])
+            corr_rows.append(row)
+
+    return FxAnalytics(
+        summary=pd.DataFrame(summary_rows),
+        correlations=pd.DataFrame(corr_rows),
+        rolling_vol=rolling_vol.dropna(how="all"),
+        as_of=dates[-1] if len(dates) else None,
+    )
+
+
+def monex_spreads(compra: Optional[float], venta: Optional[float], fix: Optional[float]) -> pd.DataFrame:
+    """Spread de ventanilla Monex y su distancia contra el FIX."""
+    rows: List[dict] = []
+    if compra is None or venta is None:
+        return pd.DataFrame(rows)
+    rows.append({"Concepto": "Spread venta - compra", "Valor": venta - compra})
+    if fix:
+        rows.append({"Concepto": "Compra vs FIX (%)", "Valor": (compra / fix - 1.0) * 100.0})
+        rows.append({"Concepto": "Venta vs FIX (%)", "Valor": (venta / fix - 1.0) * 100.0})
+    return pd.DataFrame(rows)
+
@@ -1,9 +1,8 @@
 import json
-import os
 from dataclasses import dataclass
 from typing import Any, Dict, List
 
-from openai import OpenAI
+from services.openai_client import get_async_client, get_client
 
 
 @dataclass
@@ -19,17 +18,9 @@ class NlpOpsResult:
     modelo: str
 
 
-def _get_api_key() -> str:
-    key = os.getenv("OPENAI_API_KEY", "").strip()
-    if not key:
-        raise RuntimeError("Falta OPENAI_API_KEY. Configúralo en Streamlit Secrets.")
-    return key
+MODEL = "gpt-4o-mini"
 
-
-def analyze_ticket(texto: str) -> NlpOpsResult:
-    client = OpenAI(api_key=_get_api_key())
-
-    instructions = (
+INSTRUCTIONS = (
     "Eres un asistente NLP para corporativo.\n"
     "Analiza solicitudes (correo/ticket) y devuelve SOLO JSON valido (formato json).\n"
     "IMPORTANTE: responde en JSON (json) estricto, sin texto extra.\n\n"
@@ -60,29 +51,31 @@ def analyze_ticket(texto: str) -> NlpOpsResult:
     '     {"accion":"...", "responsable_sugerido":"...", "prioridad":"Alta|Media|Baja", "plazo_sugerido":"..."}\n'
     "  ]\n"
     "}\n"
-    )
-
-
-    resp = client.responses.create(
-    model="gpt-4o-mini",
-    instructions=instructions,
-    input=[
-        {
-            "role": "system",
-            "content": [
-                {"type": "input_text", "text": "Responde en formato json (JSON) estricto, sin texto extra."}
-            ],
-        },
-        {
-            "role": "user",
-            "content": [{"type": "input_text", "text": f"Solicitud:\n{texto}"}],
-        },
-    ],
-    text={"format": {"type": "json_object"}},
-    )
-
-
-    raw = (resp.output_text or "").strip()
+)
+
+
+def _build_request(texto: str) -> Dict[str, Any]:
+    return {
+        "model": MODEL,
+        "instructions": INSTRUCTIONS,
+        "input": [
+            {
+                "role": "system",
+                "content": [
+                    {"type": "input_text", "text": "Responde en formato json (JSON) estricto, sin texto extra."}
+                ],
+            },
+            {
+                "role": "user",
+                "content": [{"type": "input_text", "text": f"Solicitud:\n{texto}"}],
+            },
+        ],
+        "text": {"format": {"type": "json_object"}},
+    }
+
+
+def _parse(output_text: str) -> NlpOpsResult:
+    raw = (output_text or "").strip()
     if not raw:
         raise RuntimeError("Respuesta vacía del modelo (output_text).")
 
@@ -121,6 +114,16 @@ def analyze_ticket(texto: str) -> NlpOpsResult:
         datos_clave=datos,
         faltantes=faltantes,
         acciones=acciones,
-        modelo="gpt-4o-mini",
+        modelo=MODEL,
     )
 
+
+def analyze_ticket(texto: str) -> NlpOpsResult:
+    resp = get_client().responses.create(**_build_request(texto))
+    return _parse(resp.output_text)
+
+
+async def aanalyze_ticket(texto: str) -> NlpOpsResult:
+    """Igual que analyze_ticket(), sobre el cliente asíncrono compartido."""
+    resp = await get_async_client().responses.create(**_build_request(texto))
+    return _parse(resp.output_text)
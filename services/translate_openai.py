@@ -1,8 +1,9 @@
 from __future__ import annotations
 
-import os
 from dataclasses import dataclass
-from openai import OpenAI
+from typing import Any, Dict
+
+from services.openai_client import get_async_client, get_client
 
 
 @dataclass
@@ -11,42 +12,46 @@ class TranslationResult:
     model: str
 
 
-def _get_api_key() -> str:
-    key = os.getenv("OPENAI_API_KEY", "").strip()
-    if not key:
-        raise RuntimeError("Falta OPENAI_API_KEY. Configúralo en Streamlit Secrets.")
-    return key
+MODEL = "gpt-4o-mini"
 
+# Instrucciones fijas (prefijo estable para la caché de prompts); la dirección va con el texto
+SYSTEM = (
+    "Eres un traductor profesional. Traduce en la dirección que indique el mensaje.\n"
+    "- Mantén el significado exacto y el tono.\n"
+    "- Conserva nombres propios, siglas y unidades.\n"
+    "- No agregues explicaciones ni notas.\n"
+    "- Devuelve únicamente la traducción."
+)
 
-def translate_en_es(text: str, direction: str) -> TranslationResult:
-    """
-    direction:
-      - "EN->ES"
-      - "ES->EN"
-    """
-    client = OpenAI(api_key=_get_api_key())
 
+def _build_request(text: str, direction: str) -> Dict[str, Any]:
     if direction not in ("EN->ES", "ES->EN"):
         raise ValueError("direction debe ser 'EN->ES' o 'ES->EN'.")
 
     source = "inglés" if direction == "EN->ES" else "español"
     target = "español" if direction == "EN->ES" else "inglés"
 
-    system = (
-        f"Eres un traductor profesional. Traduce del {source} al {target}.\n"
-        "- Mantén el significado exacto y el tono.\n"
-        "- Conserva nombres propios, siglas y unidades.\n"
-        "- No agregues explicaciones ni notas.\n"
-        "- Devuelve únicamente la traducción."
-    )
-
     # Responses API (recomendada para nuevos proyectos)
-    response = client.responses.create(
-        model="gpt-4o-mini",
-        input=[
-            {"role": "system", "content": system},
-            {"role": "user", "content": text},
+    return {
+        "model": MODEL,
+        "input": [
+            {"role": "system", "content": SYSTEM},
+            {"role": "user", "content": f"Traduce del {source} al {target}:\n\n{text}"},
         ],
-    )
+    }
+
+
+def translate_en_es(text: str, direction: str) -> TranslationResult:
+    """
+    direction:
+      - "EN->ES"
+      - "ES->EN"
+    """
+    response = get_client().responses.create(**_build_request(text, direction))
+    return TranslationResult(text=response.output_text.strip(), model=MODEL)
+
 
-    return TranslationResult(text=response.output_text.strip(), model="gpt-4o-mini")
+async def atranslate_en_es(text: str, direction: str) -> TranslationResult:
+    """Igual que translate_en_es(), sobre el cliente asíncrono compartido."""
+    response = await get_async_client().responses.create(**_build_request(text, direction))
+    return TranslationResult(text=response.output_text.strip(), model=MODEL)
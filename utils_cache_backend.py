@@ -0,0 +1,557 @@
+from __future__ import annotations
+
+import functools
+import hashlib
+import json
+import os
+import socket
+import sqlite3
+import ssl
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
+from urllib.parse import unquote, urlparse
+
+import utils_singleflight
+from utils_storage import data_dir
+
+
+# ==========================================================
+# Backend de caché compartido entre réplicas del portal
+#
+# Con dos o tres réplicas detrás de un balanceador, st.cache_data (memoria de
+# un proceso) hace que cada una caliente su propia caché y consulte a
+# Banxico/INEGI por separado. Aquí las cachés se guardan en un backend común:
+#
+#   sqlite  (default) un archivo por espacio en la carpeta de datos; lo
+#           comparten los procesos que montan el mismo IMEMSA_DATA_DIR.
+#   redis   cualquier servidor compatible con Redis (Redis, Valkey, KeyDB…);
+#           cliente RESP mínimo incluido, sin dependencias.
+#
+#   backend = get_backend("llm")           # get / set / delete / clear / stats
+#
+#   @cached("fx", ttl=60 * 30)             # reemplazo de st.cache_data
+#   def sie_range(series_id, start, end): ...
+#   sie_range.clear()
+#
+# - Cada espacio ("llm", "fx", …) es independiente: llaves, límite y limpieza.
+# - cached(): los valores se guardan como JSON (tuplas → listas) y cada
+#   llamada recibe una copia; hay una capa en memoria del proceso delante del
+#   backend que respeta la misma expiración. Las llamadas idénticas
+#   simultáneas se hacen una sola vez (utils_singleflight).
+# - Si el backend falla (Redis caído, disco lleno) la caché se comporta como
+#   vacía: la función se ejecuta normal. Tras un error de red, Redis se omite
+#   unos segundos para no pagar el timeout en cada llamada.
+# - Con Redis, el límite de tamaño lo pone el servidor (maxmemory +
+#   maxmemory-policy allkeys-lru); en SQLite se desaloja por LRU.
+#
+# Variables de entorno:
+#   IMEMSA_CACHE_BACKEND   sqlite (default) | redis
+#   IMEMSA_CACHE_URL       redis://[:clave@]host:6379/0 (rediss:// para TLS)
+#   IMEMSA_CACHE_PREFIX    prefijo de llaves en Redis (default "imemsa")
+#   IMEMSA_CACHE_TIMEOUT   segundos por operación de red (default 0.5)
+# ==========================================================
+DEFAULT_PREFIX = "imemsa"
+DEFAULT_TIMEOUT = 0.5
+COOLDOWN_S = 30.0  # tras un error de red, Redis se omite este tiempo
+POOL_MAX = 16  # conexiones ociosas a Redis que se conservan
+EVICT_TO = 0.9  # al desalojar (SQLite), baja al 90 % del límite
+MEMORY_MAX_BYTES = 32 * 1024 * 1024  # capa en memoria de cached(), por proceso
+
+T = TypeVar("T")
+
+
+class CacheError(Exception):
+    """Falla del backend; quien llama la trata como fallo de caché, nunca como error de la herramienta."""
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, "") or default)
+    except ValueError:
+        return default
+
+
+def backend_kind() -> str:
+    return (os.getenv("IMEMSA_CACHE_BACKEND", "sqlite").strip().lower() or "sqlite")
+
+
+def _valid_namespace(namespace: str) -> str:
+    if not namespace or not namespace.replace("_", "").isalnum():
+        raise ValueError(f"Espacio de caché inválido: {namespace!r} (solo letras, números y _).")
+    return namespace
+
+
+# ==========================================================
+# Interfaz
+# ==========================================================
+class CacheBackend:
+    """Valores en bytes con TTL, dentro de un espacio de nombres."""
+
+    kind = ""
+
+    def __init__(self, namespace: str) -> None:
+        self.namespace = _valid_namespace(namespace)
+
+    def get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def clear(self, prefix: str = "") -> int:
+        """Borra las llaves del espacio que empiezan con `prefix`; devuelve cuántas."""
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, Any]:
+        """Entradas y bytes (si el backend los puede contar barato)."""
+        raise NotImplementedError
+
+
+# ==========================================================
+# SQLite (un archivo por espacio)
+# ==========================================================
+class SQLiteBackend(CacheBackend):
+    """
+    <data_dir>/<espacio>_cache.sqlite3, tabla <espacio>_cache; WAL para que
+    lean y escriban varios procesos. TTL por entrada y desalojo LRU por tamaño.
+    """
+
+    kind = "sqlite"
+
+    def __init__(self, namespace: str, max_bytes: Optional[int] = None) -> None:
+        super().__init__(namespace)
+        self.max_bytes = max_bytes
+        self.table = f"{self.namespace}_cache"
+        self.evictions = 0  # este proceso
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        """Una conexión por hilo (sqlite3 no comparte conexiones entre hilos)."""
+        path = str(data_dir() / f"{self.table}.sqlite3")
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and getattr(self._local, "path", None) == path:
+            return conn
+        conn = sqlite3.connect(path, timeout=5.0, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {self.table} (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                expires REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_last_access ON {self.table}(last_access)")
+        self._local.conn, self._local.path = conn, path
+        return conn
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            conn = self._conn()
+            now = time.time()
+            row = conn.execute(f"SELECT value, expires FROM {self.table} WHERE key = ?", (key,)).fetchone()
+            if row is None or row[1] < now:
+                return None
+            conn.execute(f"UPDATE {self.table} SET last_access = ? WHERE key = ?", (now, key))
+        except sqlite3.Error as e:
+            raise CacheError(str(e)) from e
+        value = row[0]
+        return value.encode("utf-8") if isinstance(value, str) else bytes(value)
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        try:
+            now = time.time()
+            conn = self._conn()
+            conn.execute(
+                f"INSERT OR REPLACE INTO {self.table}(key, value, size, created, expires, last_access)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (key, sqlite3.Binary(value), len(value), now, now + ttl, now),
+            )
+            self.evictions += self._evict(conn, now)
+        except sqlite3.Error as e:
+            raise CacheError(str(e)) from e
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> int:
+        """Borra expiradas y, si aún se excede el tamaño, las menos usadas recientemente."""
+        evicted = conn.execute(f"DELETE FROM {self.table} WHERE expires < ?", (now,)).rowcount
+        if not self.max_bytes:
+            return evicted
+        total = conn.execute(f"SELECT COALESCE(SUM(size), 0) FROM {self.table}").fetchone()[0]
+        if total <= self.max_bytes:
+            return evicted
+        target = total - int(self.max_bytes * EVICT_TO)
+        freed, victims = 0, []
+        for key, size in conn.execute(f"SELECT key, size FROM {self.table} ORDER BY last_access ASC"):
+            victims.append((key,))
+            freed += size
+            if freed >= target:
+                break
+        conn.executemany(f"DELETE FROM {self.table} WHERE key = ?", victims)
+        return evicted + len(victims)
+
+    def delete(self, key: str) -> None:
+        try:
+            self._conn().execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+        except sqlite3.Error as e:
+            raise CacheError(str(e)) from e
+
+    def clear(self, prefix: str = "") -> int:
+        try:
+            if not prefix:
+                return self._conn().execute(f"DELETE FROM {self.table}").rowcount
+            # Rango en lugar de LIKE: sin comodines que escapar y usa la llave primaria
+            return self._conn().execute(
+                f"DELETE FROM {self.table} WHERE key >= ? AND key < ?", (prefix, prefix + "\U0010ffff")
+            ).rowcount
+        except sqlite3.Error as e:
+            raise CacheError(str(e)) from e
+
+    def stats(self) -> Dict[str, Any]:
+        try:
+            n, size = self._conn().execute(f"SELECT COUNT(*), COALESCE(SUM(size), 0) FROM {self.table}").fetchone()
+        except sqlite3.Error as e:
+            raise CacheError(str(e)) from e
+        return {"entries": n, "bytes": size, "evictions": self.evictions}
+
+
+# ==========================================================
+# Redis (protocolo RESP, cliente mínimo)
+# ==========================================================
+class _RespError(Exception):
+    """Respuesta de error del servidor (-ERR …)."""
+
+
+class _RespConnection:
+    """Una conexión; RESP2 con los pocos comandos que usa la caché."""
+
+    def __init__(self, url: str, timeout: float) -> None:
+        u = urlparse(url)
+        if u.scheme not in ("redis", "rediss"):
+            raise ValueError(f"URL de caché no soportada: {url!r} (usa redis:// o rediss://)")
+        sock = socket.create_connection((u.hostname or "127.0.0.1", u.port or 6379), timeout=timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if u.scheme == "rediss":
+            sock = ssl.create_default_context().wrap_socket(sock, server_hostname=u.hostname)
+        self.sock = sock
+        self.file = sock.makefile("rb")
+        if u.password:
+            args = ("AUTH", unquote(u.username), unquote(u.password)) if u.username else ("AUTH", unquote(u.password))
+            self.command(*args)
+        db = (u.path or "/").strip("/")
+        if db and db != "0":
+            self.command("SELECT", db)
+
+    def close(self) -> None:
+        try:
+            self.file.close()
+            self.sock.close()
+        except OSError:
+            pass
+
+    def command(self, *args: Any) -> Any:
+        out = [b"*%d\r\n" % len(args)]
+        for a in args:
+            b = a if isinstance(a, (bytes, bytearray)) else str(a).encode("utf-8")
+            out.append(b"$%d\r\n%s\r\n" % (len(b), b))
+        self.sock.sendall(b"".join(out))
+        return self._read()
+
+    def _read(self) -> Any:
+        line = self.file.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("Conexión cerrada por el servidor de caché.")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode("utf-8")
+        if kind == b"-":
+            raise _RespError(rest.decode("utf-8", "replace"))
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            n = int(rest)
+            if n < 0:
+                return None
+            data = self.file.read(n + 2)
+            if len(data) != n + 2:
+                raise ConnectionError("Respuesta incompleta del servidor de caché.")
+            return data[:-2]
+        if kind == b"*":
+            n = int(rest)
+            return None if n < 0 else [self._read() for _ in range(n)]
+        raise ConnectionError(f"Respuesta RESP inválida: {line[:40]!r}")
+
+
+class RedisBackend(CacheBackend):
+    """Llaves <prefijo>:<espacio>:<llave>; pool de conexiones compartido entre hilos."""
+
+    kind = "redis"
+
+    def __init__(self, namespace: str, url: str, prefix: str = DEFAULT_PREFIX, timeout: float = DEFAULT_TIMEOUT) -> None:
+        super().__init__(namespace)
+        self.url = url
+        self.timeout = timeout
+        self.key_prefix = f"{prefix}:{self.namespace}:"
+        self._lock = threading.Lock()
+        self._idle: List[_RespConnection] = []
+        self._down_until = 0.0
+
+    def _call(self, *args: Any) -> Any:
+        # Streamlit corre cada rerun en su propio hilo: conexiones por hilo se acumularían
+        if time.monotonic() < self._down_until:
+            raise CacheError("Servidor de caché no disponible (en espera tras un error).")
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        try:
+            if conn is None:
+                conn = _RespConnection(self.url, self.timeout)
+            result = conn.command(*args)
+        except _RespError as e:
+            self._release(conn)
+            raise CacheError(str(e)) from e
+        except (OSError, ConnectionError, ValueError) as e:
+            if conn is not None:
+                conn.close()
+            self._down_until = time.monotonic() + COOLDOWN_S
+            raise CacheError(f"{type(e).__name__}: {e}") from e
+        self._release(conn)
+        return result
+
+    def _release(self, conn: Optional[_RespConnection]) -> None:
+        if conn is None:
+            return
+        with self._lock:
+            if len(self._idle) < POOL_MAX:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def _scan(self, pattern: str) -> Iterator[bytes]:
+        cursor = "0"
+        while True:
+            cursor, keys = self._call("SCAN", cursor, "MATCH", pattern, "COUNT", 1000)
+            yield from keys
+            cursor = cursor.decode() if isinstance(cursor, bytes) else str(cursor)
+            if cursor == "0":
+                return
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._call("GET", self.key_prefix + key)
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        self._call("SET", self.key_prefix + key, value, "PX", max(1, int(ttl * 1000)))
+
+    def delete(self, key: str) -> None:
+        self._call("DEL", self.key_prefix + key)
+
+    def clear(self, prefix: str = "") -> int:
+        pattern = _glob_escape(self.key_prefix + prefix) + "*"
+        keys = list(self._scan(pattern))
+        removed = 0
+        for i in range(0, len(keys), 500):
+            removed += self._call("DEL", *keys[i:i + 500])
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        return {"entries": sum(1 for _ in self._scan(_glob_escape(self.key_prefix) + "*"))}
+
+
+def _glob_escape(text: str) -> str:
+    return "".join("\\" + c if c in "*?[]\\" else c for c in text)
+
+
+# ==========================================================
+# Selección del backend (uno por espacio y configuración)
+# ==========================================================
+_LOCK = threading.Lock()
+_BACKENDS: Dict[Tuple[Any, ...], CacheBackend] = {}
+
+
+def get_backend(namespace: str, max_bytes: Optional[int] = None) -> CacheBackend:
+    """Backend del espacio según IMEMSA_CACHE_*; `max_bytes` solo aplica a SQLite."""
+    kind = backend_kind()
+    if kind == "redis":
+        url = os.getenv("IMEMSA_CACHE_URL", "").strip()
+        if not url:
+            raise RuntimeError("IMEMSA_CACHE_BACKEND=redis requiere IMEMSA_CACHE_URL (redis://host:6379/0).")
+        prefix = os.getenv("IMEMSA_CACHE_PREFIX", "").strip() or DEFAULT_PREFIX
+        cfg: Tuple[Any, ...] = (namespace, kind, url, prefix, _env_float("IMEMSA_CACHE_TIMEOUT", DEFAULT_TIMEOUT))
+        factory: Callable[[], CacheBackend] = lambda: RedisBackend(namespace, url, prefix, cfg[-1])  # noqa: E731
+    elif kind == "sqlite":
+        cfg = (namespace, kind, max_bytes)
+        factory = lambda: SQLiteBackend(namespace, max_bytes)  # noqa: E731
+    else:
+        raise RuntimeError(f"IMEMSA_CACHE_BACKEND desconocido: {kind!r} (sqlite | redis).")
+    with _LOCK:
+        backend = _BACKENDS.get(cfg)
+        if backend is None:
+            backend = _BACKENDS[cfg] = factory()
+        return backend
+
+
+# ==========================================================
+# Memoización de funciones (reemplazo de st.cache_data)
+# ==========================================================
+class _Memory:
+    """Capa en memoria del proceso: llave → (expira, bytes JSON), LRU por tamaño."""
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.items: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+        self.size = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self.lock:
+            item = self.items.get(key)
+            if item is None:
+                return None
+            if item[0] < time.time():
+                self._pop(key)
+                return None
+            self.items.move_to_end(key)
+            return item[1]
+
+    def put(self, key: str, expires: float, raw: bytes) -> None:
+        with self.lock:
+            self._pop(key)
+            self.items[key] = (expires, raw)
+            self.size += len(raw)
+            while self.size > self.max_bytes and self.items:
+                self._pop(next(iter(self.items)))
+
+    def clear(self, prefix: str) -> None:
+        with self.lock:
+            for key in [k for k in self.items if k.startswith(prefix)]:
+                self._pop(key)
+
+    def _pop(self, key: str) -> None:
+        item = self.items.pop(key, None)
+        if item is not None:
+            self.size -= len(item[1])
+
+
+_MEMORY = _Memory(MEMORY_MAX_BYTES)
+_STATS: Dict[str, Dict[str, int]] = {}
+_STATS_LOCK = threading.Lock()
+
+
+def _bump(namespace: str, name: str) -> None:
+    with _STATS_LOCK:
+        row = _STATS.setdefault(namespace, {"memory_hits": 0, "shared_hits": 0, "misses": 0, "errors": 0})
+        row[name] += 1
+
+
+def _arg_default(obj: Any) -> Any:
+    # Funciones/sesiones como argumento (p. ej. http_session): cuentan por nombre, como en st.cache_data
+    return getattr(obj, "__qualname__", None) or type(obj).__name__
+
+
+def _call_key(fn_key: str, args: Tuple[Any, ...], kwargs: Dict[str, Any]) -> str:
+    blob = json.dumps([args, kwargs], sort_keys=True, ensure_ascii=False, default=_arg_default)
+    return fn_key + hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def cached(namespace: str, ttl: float) -> Callable[[Callable[..., T]], Callable[..., T]]:
+    """
+    Memoiza una función con resultado serializable a JSON en el backend
+    compartido (más una capa en memoria). El decorado expone .clear().
+    Las excepciones no se guardan.
+    """
+    _valid_namespace(namespace)
+
+    def deco(fn: Callable[..., T]) -> Callable[..., T]:
+        # Sin __module__: en Streamlit la página corre como __main__. La línea distingue
+        # redefiniciones con el mismo nombre (página 7 define get_uma más de una vez)
+        code = getattr(fn, "__code__", None)
+        fn_key = f"{fn.__qualname__}@{code.co_firstlineno if code else 0}:"
+        mem_prefix = f"{namespace}:{fn_key}"
+
+        def _load(key: str, args: Tuple[Any, ...], kwargs: Dict[str, Any]) -> Tuple[Optional[bytes], Any]:
+            """(bytes JSON del sobre {"exp", "v"}, o None si el valor no es JSON) + valor calculado."""
+            backend = None
+            try:
+                backend = get_backend(namespace)
+                raw = backend.get(key)
+            except (CacheError, RuntimeError):
+                _bump(namespace, "errors")
+                raw = None
+            if raw is not None:
+                _bump(namespace, "shared_hits")
+                return raw, None
+            _bump(namespace, "misses")
+            value = fn(*args, **kwargs)
+            try:
+                raw = json.dumps({"exp": time.time() + ttl, "v": value}, ensure_ascii=False).encode("utf-8")
+            except (TypeError, ValueError):
+                return None, value  # no serializable: se entrega sin guardar
+            if backend is not None:
+                try:
+                    backend.set(key, raw, ttl)
+                except CacheError:
+                    _bump(namespace, "errors")
+            return raw, None
+
+        @functools.wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> T:
+            key = _call_key(fn_key, args, kwargs)
+            raw = _MEMORY.get(f"{namespace}:{key}")
+            if raw is not None:
+                _bump(namespace, "memory_hits")
+            else:
+                (raw, value), _ = utils_singleflight.do(f"cache:{namespace}:{key}", lambda: _load(key, args, kwargs))
+                if raw is None:
+                    return value
+            envelope = json.loads(raw)  # copia propia para cada llamada (como st.cache_data)
+            _MEMORY.put(f"{namespace}:{key}", envelope["exp"], raw)
+            return envelope["v"]
+
+        def clear() -> None:
+            _MEMORY.clear(mem_prefix)
+            try:
+                get_backend(namespace).clear(fn_key)
+            except (CacheError, RuntimeError):
+                _bump(namespace, "errors")
+
+        wrapper.clear = clear  # type: ignore[attr-defined]
+        return wrapper
+
+    return deco
+
+
+def clear(namespace: str) -> None:
+    """Vacía un espacio completo (memoria de este proceso + backend compartido)."""
+    _MEMORY.clear(f"{namespace}:")
+    try:
+        get_backend(namespace).clear()
+    except (CacheError, RuntimeError):
+        _bump(namespace, "errors")
+
+
+def counters() -> Dict[str, Dict[str, int]]:
+    """Solo los contadores de cached() por espacio (sin consultar el backend)."""
+    with _STATS_LOCK:
+        return {ns: dict(row) for ns, row in _STATS.items()}
+
+
+def stats(namespaces: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Backend activo + contadores de cached() por espacio (este proceso) y tamaño compartido."""
+    counts = counters()
+    out: Dict[str, Any] = {"backend": backend_kind(), "namespaces": {}}
+    for ns in sorted(set(namespaces or []) | set(counts)):
+        row: Dict[str, Any] = dict(counts.get(ns, {}))
+        try:
+            row.update(get_backend(ns).stats())
+        except (CacheError, RuntimeError) as e:
+            row["error"] = str(e)
+        out["namespaces"][ns] = row
+    return out
@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from openai import APIStatusError, RateLimitError
+import sys
 
 
 MAINTENANCE_MSG = (
@@ -14,16 +14,20 @@ def show_maintenance_instead_of_api_error(e: Exception) -> bool:
     Devuelve True si el error es de cuota/billing/rate limit y ya fue manejado
     como "mantenimiento". False si conviene mostrar otro error.
     """
+    # El SDK de openai solo se consulta si alguien ya lo importó (importarlo aquí cuesta ~0.8 s
+    # en cada página); si no está cargado, el error no puede venir de él.
+    openai = sys.modules.get("openai")
+
     # RateLimitError suele mapearse a 429 también
-    if isinstance(e, RateLimitError):
+    if openai is not None and isinstance(e, openai.RateLimitError):
         return True
 
-    # Errores con status code (429, 402, etc.)
-    if isinstance(e, APIStatusError):
+    # Errores con status code (429, 402, etc.): SDK (APIStatusError) o gateway HTTP (utils_llm.LLMError)
+    if (openai is not None and isinstance(e, openai.APIStatusError)) or getattr(e, "status_code", None) is not None:
         status = getattr(e, "status_code", None)
 
         # Mensaje de OpenAI puede incluir "insufficient_quota", "billing", "quota", etc.
-        msg = str(e).lower()
+        msg = f"{e} {getattr(e, 'body', '') or ''}".lower()
 
         if status in (402, 429) and any(
             k in msg for k in ["insufficient_quota", "quota", "billing", "exceeded your current quota"]
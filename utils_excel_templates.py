@@ -0,0 +1,259 @@
+from __future__ import annotations
+
+import io
+import json
+import zipfile
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, List, Optional, Sequence, Tuple
+
+
+BASE_DIR = Path(__file__).resolve().parent
+TEMPLATES_DIR = BASE_DIR / "templates"
+
+
+# ==========================================================
+# Registro de plantillas
+# ==========================================================
+@dataclass
+class TemplateSpec:
+    """
+    Plantilla de reporte:
+    - mappings: (celda origen, celda destino). El origen puede ser "F2"
+      (hoja src_sheet del libro generado) o "Hoja!F2".
+    - copy_sheets: hojas completas a copiar (nombre exacto, substring de respaldo).
+    """
+
+    name: str
+    path: Path
+    mappings: List[Tuple[str, str]]
+    sheet: str = "Indicadores"
+    src_sheet: str = "Indicadores"
+    copy_sheets: Tuple[Tuple[str, str], ...] = (("Noticias_RSS", "noticias"), ("Analítica FX", "analítica"))
+    filename: str = "indicadores_template_{fecha}.xlsx"
+
+
+# --- Mapeos explícitos de Ariel (Indicadores_template_2col.xlsx) ---
+DEFAULT_MAPPINGS: List[Tuple[str, str]] = [
+    ("F2", "C2"), ("F7", "C5"), ("F9", "C6"), ("F10", "C7"), ("F13", "C10"), ("F14", "C11"),
+    ("F17", "C14"), ("F18", "C15"), ("F22", "C18"), ("F26", "C21"), ("F27", "C22"), ("F28", "C23"),
+    ("F33", "C27"), ("F34", "C28"), ("F35", "C29"), ("F36", "C30"),
+    ("F40", "B33"), ("F41", "B34"), ("F42", "B35"),
+    ("G2", "D2"), ("G7", "D5"), ("G9", "D6"), ("G10", "D7"), ("G13", "D10"), ("G14", "D11"),
+    ("G17", "D14"), ("G18", "D15"), ("G22", "D18"), ("G26", "D21"), ("G27", "D22"), ("G28", "D23"),
+    ("G33", "D27"), ("G34", "D28"), ("G35", "D29"), ("G36", "D30"),
+]
+
+TEMPLATE_DEFAULT = TemplateSpec(
+    name="Indicadores (2 columnas)",
+    path=BASE_DIR / "Indicadores_template_2col.xlsx",
+    mappings=DEFAULT_MAPPINGS,
+)
+
+
+def _spec_from_json(p: Path) -> Optional[TemplateSpec]:
+    """
+    Lee una plantilla declarada en templates/*.json:
+    {"name": "...", "file": "Mi_plantilla.xlsx", "sheet": "Indicadores",
+     "mappings": [["F2", "C2"], ["Indicadores!G7", "D5"]], "copy_sheets": [["Noticias_RSS", "noticias"]]}
+    """
+    try:
+        cfg = json.loads(p.read_text(encoding="utf-8"))
+        xlsx = (p.parent / cfg["file"]).resolve()
+        spec = TemplateSpec(
+            name=str(cfg.get("name") or p.stem),
+            path=xlsx,
+            mappings=[(str(a), str(b)) for a, b in cfg.get("mappings", [])],
+            sheet=str(cfg.get("sheet") or "Indicadores"),
+            src_sheet=str(cfg.get("src_sheet") or "Indicadores"),
+            filename=str(cfg.get("filename") or f"{p.stem}_{{fecha}}.xlsx"),
+        )
+        if "copy_sheets" in cfg:
+            spec.copy_sheets = tuple((str(a), str(b)) for a, b in cfg["copy_sheets"])
+        return spec
+    except Exception:
+        return None
+
+
+def registered_templates(templates_dir: Path = TEMPLATES_DIR) -> List[TemplateSpec]:
+    """
+    Plantilla base (siempre en la posición 0, aunque falte el archivo: su render falla
+    y la página entrega el libro generado) + las declaradas en templates/*.json que
+    existen en disco.
+    """
+    specs = [TEMPLATE_DEFAULT]
+    if templates_dir.is_dir():
+        for p in sorted(templates_dir.glob("*.json")):
+            spec = _spec_from_json(p)
+            if spec is not None and spec.path.exists():
+                specs.append(spec)
+    return specs
+
+
+# ==========================================================
+# Bundle de datos compartido (un solo fetch + build)
+# ==========================================================
+@dataclass
+class DataBundle:
+    """Libro generado, cargado UNA vez y compartido por todas las plantillas (se renderizan en secuencia)."""
+
+    workbook: Any
+    raw_bytes: bytes = field(repr=False)
+
+    def sheet(self, name: str):
+        wb = self.workbook
+        return wb[name] if name in wb.sheetnames else wb[wb.sheetnames[0]]
+
+    def value(self, ref: str, default_sheet: str = "Indicadores") -> Any:
+        sheet, _, cell = ref.rpartition("!")
+        return self.sheet(sheet.strip("'") or default_sheet)[cell].value
+
+    def find_sheet(self, exact: str, substr: str) -> Optional[str]:
+        names = self.workbook.sheetnames
+        if exact in names:
+            return exact
+        return next((nm for nm in names if substr and substr in nm.lower()), None)
+
+
+def load_bundle(raw_bytes: bytes) -> DataBundle:
+    from openpyxl import load_workbook  # diferido: openpyxl pesa ~200 ms al importar
+
+    return DataBundle(workbook=load_workbook(io.BytesIO(raw_bytes), data_only=False), raw_bytes=raw_bytes)
+
+
+# ==========================================================
+# Render
+# ==========================================================
+def _copy_sheet(ws_src, ws_dst) -> None:
+    """Copia completa de hoja: valores + estilos + vínculos + alturas/anchos + merges."""
+    max_r = ws_src.max_row or 1
+    max_c = ws_src.max_column or 1
+
+    # Limpiar merges previos en destino (para evitar solapamientos)
+    try:
+        for mr in list(ws_dst.merged_cells.ranges):
+            ws_dst.unmerge_cells(range_string=str(mr))
+    except Exception:
+        pass
+
+    for rr in range(1, max_r + 1):
+        try:
+            rd = ws_src.row_dimensions.get(rr)
+            if rd and rd.height:
+                ws_dst.row_dimensions[rr].height = rd.height
+        except Exception:
+            pass
+        for cc in range(1, max_c + 1):
+            src_cell = ws_src.cell(row=rr, column=cc)
+            dst_cell = ws_dst.cell(row=rr, column=cc)
+            dst_cell.value = src_cell.value
+            try:
+                if src_cell.has_style:
+                    dst_cell.font = src_cell.font
+                    dst_cell.fill = src_cell.fill
+                    dst_cell.alignment = src_cell.alignment
+                    dst_cell.border = src_cell.border
+                    dst_cell.number_format = src_cell.number_format
+                    dst_cell.protection = src_cell.protection
+            except Exception:
+                pass
+            try:
+                if src_cell.hyperlink is not None:
+                    target = getattr(src_cell.hyperlink, "target", None)
+                    display = getattr(src_cell.hyperlink, "display", None)
+                    if target:
+                        dst_cell.hyperlink = target
+                    if display and (dst_cell.value is None or dst_cell.value == ""):
+                        dst_cell.value = display
+            except Exception:
+                pass
+
+    try:
+        from openpyxl.utils import get_column_letter
+
+        for cc in range(1, max_c + 1):
+            col_letter = get_column_letter(cc)
+            src_dim = ws_src.column_dimensions.get(col_letter)
+            if src_dim and src_dim.width:
+                ws_dst.column_dimensions[col_letter].width = src_dim.width
+    except Exception:
+        pass
+
+    try:
+        for mr in ws_src.merged_cells.ranges:
+            ws_dst.merge_cells(range_string=str(mr))
+    except Exception:
+        pass
+
+
+def render_template(spec: TemplateSpec, bundle: DataBundle) -> bytes:
+    """Aplica el mapa de celdas de la plantilla sobre el bundle y devuelve el .xlsx."""
+    from openpyxl import load_workbook
+
+    wb_dst = load_workbook(spec.path)
+    ws_dst = wb_dst[spec.sheet] if spec.sheet in wb_dst.sheetnames else wb_dst[wb_dst.sheetnames[0]]
+
+    for src, dst in spec.mappings:
+        try:
+            val = bundle.value(src, default_sheet=spec.src_sheet)
+            if val is not None:
+                ws_dst[dst].value = val
+        except Exception:
+            pass
+
+    for exact, substr in spec.copy_sheets:
+        try:
+            src_name = bundle.find_sheet(exact, substr)
+            if src_name is None:
+                continue
+            dst_name = exact if exact in wb_dst.sheetnames else next(
+                (nm for nm in wb_dst.sheetnames if substr and substr in nm.lower()), None
+            )
+            if dst_name is None:
+                dst_name = exact
+                wb_dst.create_sheet(dst_name)
+            _copy_sheet(bundle.workbook[src_name], wb_dst[dst_name])
+        except Exception:
+            pass
+
+    out = io.BytesIO()
+    wb_dst.save(out)
+    return out.getvalue()
+
+
+@dataclass
+class RenderedTemplate:
+    name: str
+    filename: str
+    data: Optional[bytes]
+    error: str = ""
+
+
+def render_all(
+    specs: Sequence[TemplateSpec],
+    bundle: DataBundle,
+    fecha: str = "",
+) -> List[RenderedTemplate]:
+    """
+    Renderiza todas las plantillas contra el mismo bundle, una tras otra (orden estable).
+    Secuencial a propósito: openpyxl agrega celdas al leer (ws.cell) y no es seguro
+    compartir el libro entre hilos; además es Python puro y no gana nada con el GIL.
+    """
+    out: List[RenderedTemplate] = []
+    for spec in specs:
+        fn = spec.filename.format(fecha=fecha)
+        try:
+            out.append(RenderedTemplate(spec.name, fn, render_template(spec, bundle)))
+        except Exception as e:
+            out.append(RenderedTemplate(spec.name, fn, None, error=str(e)))
+    return out
+
+
+def zip_rendered(rendered: Sequence[RenderedTemplate]) -> bytes:
+    """Empaqueta en un ZIP las plantillas renderizadas sin error."""
+    bio = io.BytesIO()
+    with zipfile.ZipFile(bio, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for r in rendered:
+            if r.data:
+                zf.writestr(r.filename, r.data)
+    return bio.getvalue()
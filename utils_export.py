@@ -1,47 +1,201 @@
-from io import BytesIO
-from reportlab.lib.pagesizes import LETTER
-from reportlab.pdfgen import canvas
-from docx import Document
+from __future__ import annotations
 
+import hashlib
+import importlib.util
+import io
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional
+
+import streamlit as st
+
+import utils_tracing
+
+
+# ==========================================================
+# Exportables compartidos (TXT / DOCX / PDF / XLSX)
+#
+# - Dependencias opcionales (python-docx, reportlab, openpyxl): se importan
+#   solo al generar; si faltan, la función devuelve None.
+# - Generación bajo demanda: DOCX/PDF/XLSX se construyen al pulsar "Preparar …"
+#   y los bytes se guardan por sesión con un token del contenido, así que los
+#   reruns (otra descarga, editar una tabla) no vuelven a generarlos.
+# - Cada "Preparar …" queda como span en utils_tracing (cuánto tardó el render).
+# ==========================================================
+MIME = {
+    "txt": "text/plain",
+    "csv": "text/csv",
+    "json": "application/json",
+    "pdf": "application/pdf",
+    "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+# formato → (módulo requerido, mensaje si falta)
+REQUIREMENTS = {
+    "docx": ("docx", "DOCX: agrega `python-docx` a requirements.txt."),
+    "pdf": ("reportlab", "PDF: agrega `reportlab` a requirements.txt."),
+    "xlsx": ("openpyxl", "Excel: agrega `openpyxl` a requirements.txt."),
+}
+
+_MEMO_PREFIX = "_export::"
+
+
+@lru_cache(maxsize=None)
+def available(fmt: str) -> bool:
+    """True si la dependencia del formato está instalada (sin importarla)."""
+    req = REQUIREMENTS.get(fmt)
+    return req is None or importlib.util.find_spec(req[0]) is not None
+
+
+# ==========================================================
+# Generadores
+# ==========================================================
+def to_docx_bytes(title: str, body: str) -> Optional[bytes]:
+    try:
+        from docx import Document
+    except Exception:
+        return None
 
-def to_docx_bytes(title: str, text: str) -> bytes:
     doc = Document()
     if title:
         doc.add_heading(title, level=1)
-    for para in (text or "").split("\n"):
+    for para in (body or "").split("\n"):
         doc.add_paragraph(para)
-    bio = BytesIO()
+    bio = io.BytesIO()
     doc.save(bio)
     return bio.getvalue()
 
 
-def to_pdf_bytes(title: str, text: str) -> bytes:
-    bio = BytesIO()
+def _wrap_lines(body: str, max_chars: int = 95) -> List[str]:
+    lines: List[str] = []
+    for raw in (body or "").split("\n"):
+        raw = raw.rstrip()
+        if not raw:
+            lines.append("")
+            continue
+        while len(raw) > max_chars:
+            cut = raw[:max_chars]
+            # intenta cortar por espacio
+            if " " in cut:
+                cut = cut.rsplit(" ", 1)[0]
+            lines.append(cut)
+            raw = raw[len(cut):].lstrip()
+        lines.append(raw)
+    return lines
+
+
+def to_pdf_bytes(title: str, body: str) -> Optional[bytes]:
+    try:
+        from reportlab.lib.pagesizes import LETTER
+        from reportlab.pdfgen import canvas
+    except Exception:
+        return None
+
+    bio = io.BytesIO()
     c = canvas.Canvas(bio, pagesize=LETTER)
-    width, height = LETTER
+    _, height = LETTER
 
-    y = height - 72
+    x = 50
+    y = height - 60
     if title:
         c.setFont("Helvetica-Bold", 14)
-        c.drawString(72, y, title[:120])
-        y -= 24
-
+        c.drawString(x, y, title[:120])
+        y -= 25
     c.setFont("Helvetica", 11)
-    for line in (text or "").split("\n"):
-        while len(line) > 95:
-            c.drawString(72, y, line[:95])
-            line = line[95:]
-            y -= 14
-            if y < 72:
-                c.showPage()
-                c.setFont("Helvetica", 11)
-                y = height - 72
-        c.drawString(72, y, line)
-        y -= 14
-        if y < 72:
+
+    for line in _wrap_lines(body):
+        if y < 60:
             c.showPage()
+            y = height - 60
             c.setFont("Helvetica", 11)
-            y = height - 72
+        c.drawString(x, y, line)
+        y -= 14
 
     c.save()
     return bio.getvalue()
+
+
+def to_xlsx_bytes(sheets: Dict[str, Any]) -> Optional[bytes]:
+    """{nombre hoja: DataFrame} → .xlsx (nombres recortados a 31 caracteres)."""
+    if not available("xlsx"):
+        return None
+    import pandas as pd
+
+    bio = io.BytesIO()
+    with pd.ExcelWriter(bio, engine="openpyxl") as writer:
+        for name, df in sheets.items():
+            df.to_excel(writer, index=False, sheet_name=str(name)[:31])
+    return bio.getvalue()
+
+
+# ==========================================================
+# UI: descargas bajo demanda
+# ==========================================================
+def content_token(*parts: object) -> str:
+    """Token corto del contenido exportado (str/bytes/DataFrame)."""
+    h = hashlib.sha256()
+    for p in parts:
+        if isinstance(p, (bytes, bytearray)):
+            h.update(p)
+        elif hasattr(p, "to_csv"):
+            h.update(p.to_csv(index=False).encode("utf-8"))
+        else:
+            h.update(str(p).encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()[:32]
+
+
+def lazy_download_button(
+    label: str,
+    build: Callable[[], Optional[bytes]],
+    file_name: str,
+    key: str,
+    token: str,
+    fmt: str = "",
+) -> None:
+    """
+    Botón "Preparar <label>" → genera con build() y muestra la descarga.
+    Los bytes quedan memorizados en la sesión mientras token (contenido) no cambie.
+    """
+    fmt = fmt or file_name.rsplit(".", 1)[-1].lower()
+    if not available(fmt):
+        st.info(REQUIREMENTS[fmt][1])
+        return
+
+    memo_key = _MEMO_PREFIX + key
+    memo = st.session_state.get(memo_key)
+    data = memo[1] if memo and memo[0] == token else None
+
+    slot = st.empty()
+    if data is None:
+        if not slot.button(f"Preparar {label}", key=f"{memo_key}::prep", use_container_width=True):
+            return
+        with st.spinner(f"Generando {label}…"), utils_tracing.span(f"exportar {fmt}", archivo=file_name) as sp:
+            data = build()
+            sp.set(bytes=len(data or b""))
+        if data is None:
+            slot.info(REQUIREMENTS.get(fmt, ("", f"No se pudo generar {label}."))[1])
+            return
+        st.session_state[memo_key] = (token, data)
+
+    slot.download_button(
+        label,
+        data=data,
+        file_name=file_name,
+        mime=MIME.get(fmt, "application/octet-stream"),
+        key=f"{memo_key}::dl",
+        use_container_width=True,
+    )
+
+
+def text_download_button(fmt: str, title: str, body: str, file_name: str, key: str, label: str = "") -> None:
+    """TXT directo; DOCX/PDF bajo demanda y memorizados por contenido."""
+    label = label or fmt.upper()
+    if fmt == "txt":
+        st.download_button(
+            label, data=(body or "").encode("utf-8"), file_name=file_name, mime=MIME["txt"], key=f"{_MEMO_PREFIX}{key}::dl",
+            use_container_width=True,
+        )
+        return
+    render = {"docx": to_docx_bytes, "pdf": to_pdf_bytes}[fmt]
+    lazy_download_button(label, lambda: render(title, body), file_name, key, content_token(fmt, title, body), fmt)
@@ -0,0 +1,230 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from contextlib import ExitStack
+from typing import Any, Callable, Deque, Dict, Optional, Tuple, TypeVar
+
+import utils_ratelimit
+import utils_telemetry
+import utils_tracing
+
+
+# ==========================================================
+# Solicitudes duplicadas ("hedging") contra la cola larga de latencia
+#
+# Si un intento tarda más que el percentil p (default p95) de su llave
+# (herramienta + ruta + endpoint + fase), se lanza un duplicado; gana el
+# primero que responda bien y el otro se descarta (su respuesta se cierra en
+# cuanto llega y se registra en telemetría como "perdedor").
+#
+# - El percentil sale de una ventana móvil de latencias del proceso; sin
+#   suficientes muestras no se duplica.
+# - Presupuesto: cada solicitud abona `IMEMSA_HEDGE_BUDGET` créditos y cada
+#   duplicado cuesta 1 (≈ tope de gasto extra como fracción de solicitudes).
+# - El duplicado solo sale si el limitador (utils_ratelimit) tiene turno
+#   inmediato; nunca se forma en la cola.
+#
+# Variables de entorno:
+#   IMEMSA_HEDGE              "1" para activar (default "0")
+#   IMEMSA_HEDGE_PERCENTILE   percentil que dispara el duplicado (default 0.95)
+#   IMEMSA_HEDGE_BUDGET       fracción de solicitudes que se pueden duplicar (default 0.05)
+#   IMEMSA_HEDGE_MIN_SAMPLES  muestras mínimas por llave (default 20)
+#   IMEMSA_HEDGE_MIN_DELAY    segundos mínimos antes de duplicar (default 1.0)
+# ==========================================================
+WINDOW = 200
+BURST = 3.0  # créditos acumulables
+
+T = TypeVar("T")
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, "") or default)
+    except ValueError:
+        return default
+
+
+def enabled() -> bool:
+    return os.getenv("IMEMSA_HEDGE", "0") == "1"
+
+
+class HedgeSkipped(Exception):
+    """El duplicado no salió (sin turno inmediato en el limitador)."""
+
+
+# ==========================================================
+# Latencias por llave + presupuesto
+# ==========================================================
+class _State:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.samples: Dict[str, Deque[float]] = {}
+        self.credits = 0.0
+        self.requests = 0
+        self.hedged: Dict[str, int] = {}
+        self.won: Dict[str, int] = {}
+
+    def observe(self, key: str, seconds: float) -> None:
+        with self.lock:
+            self.samples.setdefault(key, deque(maxlen=WINDOW)).append(seconds)
+
+    def threshold(self, key: str) -> Optional[float]:
+        min_samples = int(_env_float("IMEMSA_HEDGE_MIN_SAMPLES", 20))
+        q = min(0.999, max(0.5, _env_float("IMEMSA_HEDGE_PERCENTILE", 0.95)))
+        with self.lock:
+            values = sorted(self.samples.get(key) or ())
+        if len(values) < max(1, min_samples):
+            return None
+        return max(_env_float("IMEMSA_HEDGE_MIN_DELAY", 1.0), values[min(len(values) - 1, int(q * len(values)))])
+
+    def deposit(self) -> None:
+        with self.lock:
+            self.requests += 1
+            self.credits = min(BURST, self.credits + _env_float("IMEMSA_HEDGE_BUDGET", 0.05))
+
+    def spend(self, key: str) -> bool:
+        with self.lock:
+            if self.credits < 1.0:
+                return False
+            self.credits -= 1.0
+            self.hedged[key] = self.hedged.get(key, 0) + 1
+            return True
+
+    def refund(self, key: str) -> None:
+        with self.lock:
+            self.credits = min(BURST, self.credits + 1.0)
+            self.hedged[key] = max(0, self.hedged.get(key, 0) - 1)
+
+    def record_win(self, key: str) -> None:
+        with self.lock:
+            self.won[key] = self.won.get(key, 0) + 1
+
+
+_STATE = _State()
+
+
+def hedge_key(endpoint: str, phase: str = "total") -> str:
+    """Llave de latencias: herramienta | ruta | endpoint | fase (p. ej. "ttft" en streaming)."""
+    return "|".join((utils_telemetry.current_tool(), utils_telemetry.current_route() or "-", endpoint, phase))
+
+
+def stats() -> Dict[str, Any]:
+    """Umbral, muestras, duplicados y victorias del duplicado por llave (este proceso)."""
+    with _STATE.lock:
+        keys = sorted(set(_STATE.samples) | set(_STATE.hedged))
+        rows = {k: {"samples": len(_STATE.samples.get(k) or ()), "hedged": _STATE.hedged.get(k, 0), "won": _STATE.won.get(k, 0)} for k in keys}
+        credits, requests = _STATE.credits, _STATE.requests
+    for k, row in rows.items():
+        row["threshold_s"] = _STATE.threshold(k)
+    return {"enabled": enabled(), "credits": round(credits, 2), "requests": requests, "keys": rows}
+
+
+# ==========================================================
+# Ejecución
+# ==========================================================
+class _Attempt:
+    """Un intento en su propio hilo, con el contexto (herramienta, ruta, dueño, traza) del hilo que llama."""
+
+    def __init__(self, role: str, fn: Callable[[str], Any], on_loser: Callable[[Any], None]) -> None:
+        self.role = role
+        self.future: Future = Future()
+        self.t0 = time.perf_counter()
+        self.elapsed: Optional[float] = None
+        self._fn = fn
+        self._on_loser = on_loser
+        self._lock = threading.Lock()
+        self._lost = False
+        self._handled = False
+        self._ctx = (
+            utils_telemetry.current_tool(), utils_telemetry.current_route(), utils_ratelimit.current_owner(),
+            utils_tracing.current(),
+        )
+
+    def start(self) -> "_Attempt":
+        threading.Thread(target=self._run, name=f"imemsa-hedge-{self.role}", daemon=True).start()
+        return self
+
+    def _run(self) -> None:
+        tool, route, owner, trace = self._ctx
+        with ExitStack() as stack:
+            stack.enter_context(utils_telemetry.tool_scope(tool))
+            stack.enter_context(utils_telemetry.route_scope(route))
+            stack.enter_context(utils_ratelimit.owner_scope(owner))
+            stack.enter_context(utils_tracing.attach(trace))
+            try:
+                result = self._fn(self.role)
+            except BaseException as e:  # noqa: BLE001 - se entrega por el Future
+                self.elapsed = time.perf_counter() - self.t0
+                self.future.set_exception(e)
+            else:
+                self.elapsed = time.perf_counter() - self.t0
+                self.future.set_result(result)
+            self._discard_if_lost()
+
+    def lose(self) -> None:
+        """Marca el intento como perdedor; su resultado se descarta al llegar (o ya mismo si llegó)."""
+        with self._lock:
+            self._lost = True
+        self._discard_if_lost()
+
+    def _discard_if_lost(self) -> None:
+        with self._lock:
+            if not self._lost or self._handled or not self.future.done():
+                return
+            self._handled = True
+        if self.future.exception() is None:
+            try:
+                self._on_loser(self.future.result())
+            except Exception:
+                pass
+
+
+def run(
+    key: str,
+    fn: Callable[[str], T],
+    on_loser: Callable[[T], None],
+) -> Tuple[T, str]:
+    """
+    Ejecuta fn("original") y, si tarda más que el umbral de `key` y hay
+    presupuesto, también fn("duplicado"). Devuelve (resultado, estado) con
+    estado "" (no se duplicó), "original" o "duplicado" (quién ganó).
+    `fn("duplicado")` debe lanzar HedgeSkipped si no hay turno inmediato.
+    """
+    _STATE.deposit()
+    delay = _STATE.threshold(key) if enabled() else None
+    if delay is None:
+        t0 = time.perf_counter()
+        result = fn("original")
+        _STATE.observe(key, time.perf_counter() - t0)
+        return result, ""
+
+    first = _Attempt("original", fn, on_loser).start()
+    done, _ = wait([first.future], timeout=delay)
+    if done or not _STATE.spend(key):
+        result = first.future.result()
+        _STATE.observe(key, first.elapsed or 0.0)
+        return result, ""
+
+    second = _Attempt("duplicado", fn, on_loser).start()
+    pending = {first.future: first, second.future: second}
+    errors: Dict[str, BaseException] = {}
+    while pending:
+        done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+        for fut in done:
+            attempt = pending.pop(fut)
+            exc = fut.exception()
+            if exc is None:
+                for other in pending.values():
+                    other.lose()
+                if attempt is second:
+                    _STATE.record_win(key)
+                _STATE.observe(key, attempt.elapsed or 0.0)
+                return fut.result(), (attempt.role if "duplicado" not in errors else "")
+            if isinstance(exc, HedgeSkipped):
+                _STATE.refund(key)
+            errors[attempt.role] = exc
+    raise errors.get("original") or next(iter(errors.values()))
@@ -0,0 +1,261 @@
+from __future__ import annotations
+
+import base64
+import json
+import os
+import random
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+
+# ==========================================================
+# Record / replay de HTTP saliente (requests)
+#
+# Se controla por variables de entorno (sin tocar el código de la página):
+#   IMEMSA_HTTP_MODE      live (default) | record | replay
+#   IMEMSA_HTTP_CASSETTE  ruta del cassette JSON (default bench/cassettes/indicadores.json)
+#   IMEMSA_HTTP_LATENCY   perfil de LATENCY_PROFILES o JSON {"host": segundos, "*": segundos}
+#   IMEMSA_HTTP_SEED      semilla del jitter (repetible)
+#
+# Todo lo que pasa por requests (Session, requests.get, feeds) usa HTTPAdapter.send,
+# así que basta con parchear ese único punto. Los hosts locales (mocks de
+# bench/: OpenAI, Redis…) siempre van en vivo: ni se graban ni se reproducen.
+# ==========================================================
+BASE_DIR = Path(__file__).resolve().parent
+DEFAULT_CASSETTE = BASE_DIR / "bench" / "cassettes" / "indicadores.json"
+
+# Latencia base por host (segundos); "*" aplica al resto
+LATENCY_PROFILES: Dict[str, Dict[str, float]] = {
+    "none": {},
+    "lan": {"*": 0.005},
+    "typical": {
+        "www.banxico.org.mx": 0.35,
+        "www.inegi.org.mx": 0.60,
+        "api.stlouisfed.org": 0.25,
+        "www.monex.com.mx": 0.80,
+        "news.google.com": 0.30,
+        "*": 0.20,
+    },
+    "degraded": {
+        "www.banxico.org.mx": 1.50,
+        "www.inegi.org.mx": 3.00,
+        "api.stlouisfed.org": 1.00,
+        "www.monex.com.mx": 4.00,
+        "news.google.com": 1.20,
+        "*": 1.00,
+    },
+}
+
+REDACT_QUERY_KEYS = {"api_key", "apikey", "token", "key"}
+LOCAL_HOSTS = {"127.0.0.1", "localhost", "::1"}
+# Las URLs llevan la fecha de hoy (rangos SIE, FRED, INEGI): en replay se
+# cae a una llave sin fechas para que un cassette sirva cualquier otro día.
+_DATE_RE = re.compile(r"\d{4}-\d{2}-\d{2}|\d{2}/\d{2}/\d{4}|\d{2}%2F\d{2}%2F\d{4}")
+JITTER = 0.2  # ±20 %
+
+
+class _State:
+    def __init__(self) -> None:
+        self.mode = "live"
+        self.cassette: Optional[Path] = None
+        self.latency: Dict[str, float] = {}
+        self.redact: List[str] = []
+        self.interactions: Dict[str, List[dict]] = {}
+        self.loose: Dict[str, List[dict]] = {}
+        self.cursor: Dict[str, int] = {}
+        self.stats: Dict[str, Dict[str, float]] = {}
+        self.misses: List[str] = []
+        self.rng = random.Random(0)
+        self.config: tuple = ()
+        self.lock = threading.Lock()
+
+
+_STATE = _State()
+_ORIG_SEND = HTTPAdapter.send
+
+
+def _redact_url(url: str) -> str:
+    parts = urlsplit(url)
+    query = [(k, ("<redacted>" if k.lower() in REDACT_QUERY_KEYS else v)) for k, v in parse_qsl(parts.query, keep_blank_values=True)]
+    out = urlunsplit((parts.scheme, parts.netloc, parts.path, urlencode(sorted(query)), ""))
+    for secret in _STATE.redact:
+        out = out.replace(secret, "<redacted>")
+    return out
+
+
+def _key(request: requests.PreparedRequest) -> str:
+    return f"{request.method} {_redact_url(request.url or '')}"
+
+
+def _loose_key(key: str) -> str:
+    return _DATE_RE.sub("<date>", key)
+
+
+def _delay_for(host: str) -> float:
+    base = _STATE.latency.get(host, _STATE.latency.get("*", 0.0))
+    if base <= 0:
+        return 0.0
+    with _STATE.lock:
+        return base * (1.0 + _STATE.rng.uniform(-JITTER, JITTER))
+
+
+def _observe(host: str, seconds: float) -> None:
+    with _STATE.lock:
+        st = _STATE.stats.setdefault(host, {"requests": 0, "seconds": 0.0})
+        st["requests"] += 1
+        st["seconds"] += seconds
+
+
+def _save_cassette() -> None:
+    if _STATE.cassette is None:
+        return
+    _STATE.cassette.parent.mkdir(parents=True, exist_ok=True)
+    tmp = _STATE.cassette.with_suffix(".tmp")
+    tmp.write_text(json.dumps({"version": 1, "interactions": _STATE.interactions}, ensure_ascii=False, indent=1), encoding="utf-8")
+    tmp.replace(_STATE.cassette)
+
+
+def _build_response(request: requests.PreparedRequest, rec: dict, adapter: HTTPAdapter) -> requests.Response:
+    resp = requests.Response()
+    resp.status_code = int(rec.get("status", 200))
+    resp.reason = rec.get("reason", "")
+    resp.headers = CaseInsensitiveDict(rec.get("headers") or {})
+    resp._content = base64.b64decode(rec.get("body_b64", ""))
+    resp.encoding = get_encoding_from_headers(resp.headers)
+    resp.url = request.url
+    resp.request = request
+    resp.connection = adapter
+    return resp
+
+
+def _send(self: HTTPAdapter, request: requests.PreparedRequest, **kwargs):
+    host = urlsplit(request.url or "").hostname or ""
+    if host in LOCAL_HOSTS:
+        return _ORIG_SEND(self, request, **kwargs)
+    key = _key(request)
+    t0 = time.perf_counter()
+    delay = _delay_for(host)
+    if delay:
+        time.sleep(delay)
+
+    if _STATE.mode == "replay":
+        with _STATE.lock:
+            recs = _STATE.interactions.get(key) or _STATE.loose.get(_loose_key(key)) or []
+            i = _STATE.cursor.get(key, 0)
+            _STATE.cursor[key] = i + 1
+        if recs:
+            resp = _build_response(request, recs[min(i, len(recs) - 1)], self)
+        else:
+            with _STATE.lock:
+                _STATE.misses.append(key)
+            resp = _build_response(request, {"status": 404, "reason": "Cassette miss", "body_b64": ""}, self)
+        _observe(host, time.perf_counter() - t0)
+        return resp
+
+    resp = _ORIG_SEND(self, request, **kwargs)
+    if _STATE.mode == "record":
+        body = resp.content  # se lee aquí; requests la deja cacheada en _content
+        rec = {
+            "status": resp.status_code,
+            "reason": resp.reason,
+            "headers": {k: v for k, v in resp.headers.items() if k.lower() in ("content-type", "date")},
+            "body_b64": base64.b64encode(body or b"").decode("ascii"),
+        }
+        with _STATE.lock:
+            _STATE.interactions.setdefault(key, []).append(rec)
+            _save_cassette()
+    _observe(host, time.perf_counter() - t0)
+    return resp
+
+
+def install(
+    mode: str = "live",
+    cassette: Optional[Path] = None,
+    latency: Optional[Dict[str, float]] = None,
+    redact: Iterable[str] = (),
+    seed: int = 0,
+) -> None:
+    """Activa record/replay (idempotente). En modo live sin latencia no parchea nada."""
+    mode = (mode or "live").lower()
+    config = (mode, str(cassette or DEFAULT_CASSETTE), tuple(sorted((latency or {}).items())), tuple(redact), seed)
+    with _STATE.lock:
+        if config == _STATE.config:
+            return
+        _STATE.config = config
+        _STATE.mode = mode
+        _STATE.cassette = Path(cassette) if cassette else DEFAULT_CASSETTE
+        _STATE.latency = dict(latency or {})
+        _STATE.redact = [r for r in redact if r and len(r) >= 4]
+        _STATE.rng = random.Random(seed)
+        _STATE.cursor = {}
+        _STATE.misses = []
+        _STATE.interactions = {}
+        _STATE.loose = {}
+        if mode in ("record", "replay") and _STATE.cassette.exists():
+            try:
+                data = json.loads(_STATE.cassette.read_text(encoding="utf-8"))
+                _STATE.interactions = data.get("interactions", {}) if mode == "replay" else {}
+            except Exception:
+                _STATE.interactions = {}
+        for k, recs in _STATE.interactions.items():
+            _STATE.loose.setdefault(_loose_key(k), recs)
+
+    if mode == "live" and not _STATE.latency:
+        HTTPAdapter.send = _ORIG_SEND
+    else:
+        HTTPAdapter.send = _send
+
+
+def latency_from_spec(spec: str) -> Dict[str, float]:
+    """Nombre de perfil ("typical") o JSON con segundos por host."""
+    spec = (spec or "").strip()
+    if not spec:
+        return {}
+    if spec in LATENCY_PROFILES:
+        return dict(LATENCY_PROFILES[spec])
+    try:
+        return {str(k): float(v) for k, v in json.loads(spec).items()}
+    except Exception:
+        return {}
+
+
+def install_from_env(redact: Iterable[str] = ()) -> str:
+    """Lee IMEMSA_HTTP_* y llama install(); devuelve el modo activo."""
+    mode = os.getenv("IMEMSA_HTTP_MODE", "live").strip().lower() or "live"
+    cassette = os.getenv("IMEMSA_HTTP_CASSETTE", "").strip() or None
+    latency = latency_from_spec(os.getenv("IMEMSA_HTTP_LATENCY", ""))
+    try:
+        seed = int(os.getenv("IMEMSA_HTTP_SEED", "0"))
+    except ValueError:
+        seed = 0
+    if mode == "live" and not latency and HTTPAdapter.send is _ORIG_SEND:
+        return mode
+    install(mode, Path(cassette) if cassette else None, latency, redact, seed)
+    return mode
+
+
+def stats() -> Dict[str, Dict[str, float]]:
+    """Peticiones y segundos acumulados por host desde install()/reset_stats()."""
+    with _STATE.lock:
+        return {h: dict(v) for h, v in _STATE.stats.items()}
+
+
+def misses() -> List[str]:
+    with _STATE.lock:
+        return list(_STATE.misses)
+
+
+def reset_stats() -> None:
+    with _STATE.lock:
+        _STATE.stats = {}
+        _STATE.misses = []
+        _STATE.cursor = {}
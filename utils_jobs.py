@@ -0,0 +1,390 @@
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+import streamlit as st
+
+import utils_ratelimit
+import utils_telemetry
+import utils_tracing
+from utils_results import save_result
+from utils_storage import data_dir
+
+
+# ==========================================================
+# Cola local de trabajos (tabla SQLite + hilos trabajadores)
+#
+# - La página llama submit(...) y guarda el job_id en la sesión: si se cae el
+#   websocket, el trabajo sigue y el resultado se recupera por id al reconectar.
+# - Cada trabajo pertenece a la sesión que lo lanzó (owner_id, solo en
+#   st.session_state): nunca se muestra el trabajo de otra sesión, aunque se
+#   conozca su id.
+# - El resultado se guarda como JSON (las páginas convierten sus dataclasses).
+# - Con partial=True la función recibe on_partial(obj) y la vista previa queda
+#   en la tabla para que la UI la muestre mientras corre.
+#
+# Variables de entorno:
+#   IMEMSA_JOB_WORKERS   hilos trabajadores por proceso (default 4)
+#   IMEMSA_JOB_KEEP_DAYS días que se conservan trabajos terminados, con su
+#                        resultado (default 7; se purgan al encolar, máx. 1 vez/hora)
+# ==========================================================
+DB_NAME = "jobs.sqlite3"
+QUEUED, RUNNING, DONE, ERROR = "queued", "running", "done", "error"
+ACTIVE = (QUEUED, RUNNING)
+PARTIAL_MIN_INTERVAL = 0.5  # s entre escrituras de vista previa
+PURGE_EVERY = 3600.0  # s entre purgas de trabajos viejos (por proceso)
+
+_LOCAL = threading.local()
+_EXECUTOR: Optional[ThreadPoolExecutor] = None
+_EXECUTOR_LOCK = threading.Lock()
+_PURGE_LOCK = threading.Lock()
+_LAST_PURGE = 0.0
+
+
+@dataclass
+class Job:
+    id: str
+    kind: str
+    owner: str
+    status: str
+    created: float
+    started: Optional[float]
+    finished: Optional[float]
+    input_key: str
+    label: str
+    result: Any
+    partial: Any
+    error: str
+    error_type: str
+    error_status: Optional[int]
+    error_body: Any
+
+    @property
+    def active(self) -> bool:
+        return self.status in ACTIVE
+
+    @property
+    def elapsed(self) -> float:
+        if not self.started:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+
+def _workers() -> int:
+    try:
+        return max(1, int(os.getenv("IMEMSA_JOB_WORKERS", "4")))
+    except ValueError:
+        return 4
+
+
+def _conn() -> sqlite3.Connection:
+    """Una conexión por hilo; la tabla se crea (y se limpian huérfanos) al abrir."""
+    path = str(data_dir() / DB_NAME)
+    conn = getattr(_LOCAL, "conn", None)
+    if conn is not None and getattr(_LOCAL, "path", None) == path:
+        return conn
+    conn = sqlite3.connect(path, timeout=10.0, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            owner TEXT NOT NULL,
+            status TEXT NOT NULL,
+            pid INTEGER NOT NULL,
+            created REAL NOT NULL,
+            started REAL,
+            finished REAL,
+            input_key TEXT NOT NULL DEFAULT '',
+            label TEXT NOT NULL DEFAULT '',
+            result TEXT,
+            partial TEXT,
+            error TEXT NOT NULL DEFAULT '',
+            error_type TEXT NOT NULL DEFAULT '',
+            error_status INTEGER,
+            error_body TEXT
+        )
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS jobs_owner_created ON jobs(owner, created)")
+    _LOCAL.conn, _LOCAL.path = conn, path
+    _recover_orphans(conn)
+    return conn
+
+
+def _pid_alive(pid: int) -> bool:
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        return True
+    return True
+
+
+def _recover_orphans(conn: sqlite3.Connection) -> None:
+    """Trabajos activos de procesos que ya no existen → error (no quedan 'corriendo' para siempre)."""
+    rows = conn.execute("SELECT id, pid FROM jobs WHERE status IN (?, ?)", ACTIVE).fetchall()
+    dead = [(r["id"],) for r in rows if not _pid_alive(int(r["pid"]))]
+    if dead:
+        conn.executemany(
+            "UPDATE jobs SET status = 'error', error = 'El servidor se reinició antes de terminar.', finished = ? WHERE id = ?",
+            [(time.time(), d[0]) for d in dead],
+        )
+
+
+def _executor() -> ThreadPoolExecutor:
+    global _EXECUTOR
+    if _EXECUTOR is None:
+        with _EXECUTOR_LOCK:
+            if _EXECUTOR is None:
+                _EXECUTOR = ThreadPoolExecutor(max_workers=_workers(), thread_name_prefix="imemsa-job")
+    return _EXECUTOR
+
+
+def _dumps(obj: Any) -> Optional[str]:
+    return None if obj is None else json.dumps(obj, ensure_ascii=False, default=str)
+
+
+def _loads(raw: Optional[str]) -> Any:
+    return None if raw is None else json.loads(raw)
+
+
+def _row_to_job(r: sqlite3.Row) -> Job:
+    return Job(
+        id=r["id"],
+        kind=r["kind"],
+        owner=r["owner"],
+        status=r["status"],
+        created=r["created"],
+        started=r["started"],
+        finished=r["finished"],
+        input_key=r["input_key"],
+        label=r["label"],
+        result=_loads(r["result"]),
+        partial=_loads(r["partial"]),
+        error=r["error"],
+        error_type=r["error_type"],
+        error_status=r["error_status"],
+        error_body=_loads(r["error_body"]),
+    )
+
+
+# ==========================================================
+# API
+# ==========================================================
+def _run(
+    job_id: str, kind: str, owner: str, fn: Callable[..., Any], args: tuple, kwargs: Dict[str, Any], partial: bool,
+    trace: Optional[utils_tracing.Context], queued_at: float,
+) -> None:
+    # Las llamadas LLM del trabajo cuentan para la sesión dueña en la cola justa (utils_ratelimit),
+    # para la herramienta (`kind`) en la telemetría (utils_telemetry) y quedan bajo el clic que
+    # lanzó el trabajo en las trazas (utils_tracing)
+    with utils_ratelimit.owner_scope(owner), utils_telemetry.tool_scope(kind), utils_tracing.attach(trace):
+        with utils_tracing.span(f"trabajo {kind}", job_id=job_id, queue_ms=round((time.time() - queued_at) * 1000, 1)):
+            _execute(job_id, fn, args, kwargs, partial)
+
+
+def _execute(job_id: str, fn: Callable[..., Any], args: tuple, kwargs: Dict[str, Any], partial: bool) -> None:
+    conn = _conn()
+    conn.execute("UPDATE jobs SET status = ?, started = ? WHERE id = ?", (RUNNING, time.time(), job_id))
+    if partial:
+        last = [0.0]
+
+        def on_partial(obj: Any) -> None:
+            now = time.monotonic()
+            if now - last[0] >= PARTIAL_MIN_INTERVAL:
+                last[0] = now
+                _conn().execute("UPDATE jobs SET partial = ? WHERE id = ?", (_dumps(obj), job_id))
+
+        kwargs = {**kwargs, "on_partial": on_partial}
+    try:
+        result = fn(*args, **kwargs)
+        conn.execute(
+            "UPDATE jobs SET status = ?, finished = ?, result = ?, partial = NULL WHERE id = ?",
+            (DONE, time.time(), _dumps(result), job_id),
+        )
+    except BaseException as e:  # noqa: BLE001 - cualquier fallo queda registrado en el trabajo
+        conn.execute(
+            "UPDATE jobs SET status = ?, finished = ?, error = ?, error_type = ?, error_status = ?, error_body = ? "
+            "WHERE id = ?",
+            (ERROR, time.time(), str(e) or type(e).__name__, type(e).__name__, getattr(e, "status_code", None),
+             _dumps(getattr(e, "body", None)), job_id),
+        )
+
+
+def submit(
+    kind: str,
+    fn: Callable[..., Any],
+    *args: Any,
+    owner: str = "",
+    input_key: str = "",
+    label: str = "",
+    partial: bool = False,
+    **kwargs: Any,
+) -> str:
+    """Encola fn(*args, **kwargs) y devuelve el id. El resultado debe ser serializable a JSON."""
+    _maybe_purge()
+    job_id = uuid.uuid4().hex[:16]
+    created = time.time()
+    _conn().execute(
+        "INSERT INTO jobs(id, kind, owner, status, pid, created, input_key, label) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (job_id, kind, owner, QUEUED, os.getpid(), created, input_key, label[:120]),
+    )
+    _executor().submit(_run, job_id, kind, owner, fn, args, kwargs, partial, utils_tracing.current(), created)
+    return job_id
+
+
+def get(job_id: str) -> Optional[Job]:
+    if not job_id:
+        return None
+    r = _conn().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    return _row_to_job(r) if r else None
+
+
+def list_jobs(owner: str, kind: Optional[str] = None, limit: int = 10) -> List[Job]:
+    sql = "SELECT * FROM jobs WHERE owner = ?"
+    params: List[Any] = [owner]
+    if kind:
+        sql += " AND kind = ?"
+        params.append(kind)
+    sql += " ORDER BY created DESC LIMIT ?"
+    params.append(limit)
+    return [_row_to_job(r) for r in _conn().execute(sql, params).fetchall()]
+
+
+def counts() -> Dict[str, int]:
+    """Trabajos en cola y corriendo (todos los procesos que comparten la carpeta de datos)."""
+    rows = _conn().execute("SELECT status, COUNT(*) FROM jobs WHERE status IN (?, ?) GROUP BY status", ACTIVE).fetchall()
+    return {QUEUED: 0, RUNNING: 0, **{r[0]: int(r[1]) for r in rows}}
+
+
+def purge(keep_days: Optional[float] = None) -> int:
+    """Borra trabajos terminados más viejos que keep_days."""
+    if keep_days is None:
+        try:
+            keep_days = float(os.getenv("IMEMSA_JOB_KEEP_DAYS", "7"))
+        except ValueError:
+            keep_days = 7.0
+    cur = _conn().execute(
+        "DELETE FROM jobs WHERE status IN (?, ?) AND created < ?", (DONE, ERROR, time.time() - keep_days * 86400)
+    )
+    return cur.rowcount
+
+
+def _maybe_purge() -> None:
+    """purge() a lo más cada PURGE_EVERY s; un fallo no impide encolar."""
+    global _LAST_PURGE
+    now = time.monotonic()
+    with _PURGE_LOCK:
+        if _LAST_PURGE and now - _LAST_PURGE < PURGE_EVERY:
+            return
+        _LAST_PURGE = now
+    try:
+        purge()
+    except sqlite3.Error:
+        pass
+
+
+# ==========================================================
+# UI
+# ==========================================================
+def owner_id() -> str:
+    """Dueño de los trabajos: id aleatorio de la sesión (solo en st.session_state, nunca en la URL)."""
+    sid = st.session_state.get("_jobs_owner")
+    if not sid:
+        sid = st.session_state["_jobs_owner"] = uuid.uuid4().hex
+    return sid
+
+
+def current_job(kind: str) -> Optional[Job]:
+    """Trabajo activo de la página, si es de este tipo y de esta sesión."""
+    job_id = st.session_state.get(f"_job::{kind}")
+    job = get(job_id) if job_id else None
+    if job is None or job.kind != kind or job.owner != owner_id():
+        return None
+    return job
+
+
+def set_current_job(kind: str, job_id: str) -> None:
+    st.session_state[f"_job::{kind}"] = job_id
+
+
+def watch(job: Job, render_partial: Optional[Callable[[Any], None]] = None, every: float = 1.0) -> None:
+    """
+    Mientras el trabajo corre: estado + vista previa, refrescando cada `every` s
+    (st.fragment). Al terminar se reejecuta la página para pintar el resultado.
+    """
+
+    def _body() -> None:
+        j = get(job.id) or job
+        if not j.active:
+            st.rerun()
+        label = "En cola…" if j.status == QUEUED else f"Procesando… {j.elapsed:0.0f} s"
+        st.info(f"⏳ {label} (trabajo `{j.id}`). Puedes cambiar de página y volver: el resultado se conserva.")
+        if j.partial is not None and render_partial is not None:
+            render_partial(j.partial)
+
+    fragment = getattr(st, "fragment", None)
+    if fragment is None:
+        _body()
+        st.button("Actualizar estado", key=f"_job_refresh::{job.id}")
+        return
+    fragment(run_every=every)(_body)()
+
+
+def show_job_error(job: Job, title: str = "Error del servicio") -> None:
+    """Pinta el error de un trabajo con el mismo render que las llamadas directas (show_llm_error)."""
+    from utils_llm import LLMError, MissingAPIKeyError, show_llm_error
+
+    cls = MissingAPIKeyError if job.error_type == MissingAPIKeyError.__name__ else LLMError
+    show_llm_error(cls(job.error, status_code=job.error_status, body=job.error_body), title)
+
+
+def settle(
+    tool: str,
+    job: Optional[Job],
+    key: str,
+    has_inputs: bool = True,
+    convert: Optional[Callable[[Job], Any]] = None,
+    error_title: str = "Error del servicio",
+) -> str:
+    """
+    Trabajo terminado → resultado de la herramienta (utils_results); devuelve la llave a pintar.
+    Sin entradas en la página (p. ej. al volver a ella) se adopta el trabajo de la sesión.
+    """
+    if job is None or job.active or (has_inputs and job.input_key != key):
+        return key
+    if job.status == ERROR:
+        show_job_error(job, error_title)
+        return key
+    save_result(tool, job.input_key, convert(job) if convert else job.result)
+    return job.input_key
+
+
+def recent_jobs_sidebar(kind: str, title: str = "🗂️ Mis trabajos") -> None:
+    """Lista de los últimos trabajos de esta sesión para esta herramienta (botón: lo abre en la página)."""
+    jobs = list_jobs(owner_id(), kind=kind, limit=8)
+    if not jobs:
+        return
+    icons = {QUEUED: "🕒", RUNNING: "⏳", DONE: "✅", ERROR: "⚠️"}
+    with st.sidebar:
+        st.markdown(f"### {title}")
+        for j in jobs:
+            when = time.strftime("%H:%M", time.localtime(j.created))
+            st.button(
+                f"{icons.get(j.status, '•')} {when} · {j.label or j.id}", key=f"_job_open::{j.id}",
+                on_click=set_current_job, args=(kind, j.id), use_container_width=True,
+            )
@@ -0,0 +1,322 @@
+from __future__ import annotations
+
+import csv
+import io
+import os
+import sqlite3
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from utils_storage import data_dir
+
+
+# ==========================================================
+# Libro de consumo (ledger) persistente: una fila por llamada al modelo
+#
+# - SQLite en la carpeta de datos, solo se agrega (triggers impiden UPDATE/DELETE).
+# - Índices por tiempo, herramienta y sesión para consultar meses de historia.
+# - En la misma transacción se acumulan `usage_daily` (día × herramienta ×
+#   modelo) y `usage_session_daily` (día × sesión × herramienta): los
+#   agregados diarios/semanales leen esas tablas y responden en milisegundos
+#   sin recorrer el detalle.
+# - Unidades de capacidad además de tokens: minutos de audio transcritos e
+#   imágenes/páginas enviadas a OCR.
+#
+# Lo escribe utils_telemetry.record() (todas las llamadas pasan por ahí).
+# "Sesión" = sesión de Streamlit (o dueño del trabajo en segundo plano): el
+# portal usa una contraseña compartida, no hay usuarios con nombre.
+#
+# Variables de entorno:
+#   IMEMSA_LEDGER  "0" para desactivar (default "1")
+# ==========================================================
+DB_NAME = "usage_ledger.sqlite3"
+
+# Métricas que se pueden sumar / ordenar (también son las columnas de usage_daily)
+# calls = llamadas reales a la API; local_hits = respuestas de la caché o compartidas (sin consumo)
+METRICS = ("calls", "local_hits", "errors", "input_tokens", "output_tokens", "cached_tokens", "audio_seconds", "images", "cost_usd")
+HEAVY_METRICS = ("input_tokens", "output_tokens", "audio_seconds", "images", "cost_usd")  # con índice propio
+GROUPS = ("tool", "session", "model")  # session y model no se combinan (acumulados distintos)
+
+_LOCAL = threading.local()
+
+
+def enabled() -> bool:
+    return os.getenv("IMEMSA_LEDGER", "1").strip().lower() not in ("0", "false", "no", "off")
+
+
+_METRIC_COLS = """calls INTEGER NOT NULL DEFAULT 0,
+    local_hits INTEGER NOT NULL DEFAULT 0,
+    errors INTEGER NOT NULL DEFAULT 0,
+    input_tokens INTEGER NOT NULL DEFAULT 0,
+    output_tokens INTEGER NOT NULL DEFAULT 0,
+    cached_tokens INTEGER NOT NULL DEFAULT 0,
+    audio_seconds REAL NOT NULL DEFAULT 0,
+    images INTEGER NOT NULL DEFAULT 0,
+    cost_usd REAL NOT NULL DEFAULT 0"""
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage_ledger (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    day TEXT NOT NULL,
+    tool TEXT NOT NULL,
+    route TEXT NOT NULL DEFAULT '',
+    session TEXT NOT NULL,
+    endpoint TEXT NOT NULL,
+    model TEXT NOT NULL,
+    input_tokens INTEGER NOT NULL DEFAULT 0,
+    output_tokens INTEGER NOT NULL DEFAULT 0,
+    cached_tokens INTEGER NOT NULL DEFAULT 0,
+    audio_seconds REAL NOT NULL DEFAULT 0,
+    images INTEGER NOT NULL DEFAULT 0,
+    bytes_out INTEGER NOT NULL DEFAULT 0,
+    latency_ms REAL NOT NULL DEFAULT 0,
+    cost_usd REAL NOT NULL DEFAULT 0,
+    cache_hit INTEGER NOT NULL DEFAULT 0,
+    coalesced INTEGER NOT NULL DEFAULT 0,
+    hedge TEXT NOT NULL DEFAULT '',
+    error TEXT NOT NULL DEFAULT '',
+    input_hash TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS usage_ledger_ts ON usage_ledger(ts);
+CREATE INDEX IF NOT EXISTS usage_ledger_tool_ts ON usage_ledger(tool, ts);
+CREATE INDEX IF NOT EXISTS usage_ledger_session_ts ON usage_ledger(session, ts);
+CREATE INDEX IF NOT EXISTS usage_ledger_input_tokens ON usage_ledger(input_tokens);
+CREATE INDEX IF NOT EXISTS usage_ledger_output_tokens ON usage_ledger(output_tokens);
+CREATE INDEX IF NOT EXISTS usage_ledger_audio_seconds ON usage_ledger(audio_seconds);
+CREATE INDEX IF NOT EXISTS usage_ledger_images ON usage_ledger(images);
+CREATE INDEX IF NOT EXISTS usage_ledger_cost_usd ON usage_ledger(cost_usd);
+CREATE TRIGGER IF NOT EXISTS usage_ledger_no_update BEFORE UPDATE ON usage_ledger
+BEGIN SELECT RAISE(ABORT, 'usage_ledger es solo de inserción'); END;
+CREATE TRIGGER IF NOT EXISTS usage_ledger_no_delete BEFORE DELETE ON usage_ledger
+BEGIN SELECT RAISE(ABORT, 'usage_ledger es solo de inserción'); END;
+
+CREATE TABLE IF NOT EXISTS usage_daily (
+    day TEXT NOT NULL,
+    tool TEXT NOT NULL,
+    model TEXT NOT NULL,
+    {metrics},
+    PRIMARY KEY (day, tool, model)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS usage_session_daily (
+    day TEXT NOT NULL,
+    session TEXT NOT NULL,
+    tool TEXT NOT NULL,
+    {metrics},
+    PRIMARY KEY (day, session, tool)
+) WITHOUT ROWID;
+""".format(metrics=_METRIC_COLS)
+
+
+def _conn() -> sqlite3.Connection:
+    """Una conexión por hilo (sqlite3 no comparte conexiones entre hilos)."""
+    path = str(data_dir() / DB_NAME)
+    conn = getattr(_LOCAL, "conn", None)
+    if conn is not None and getattr(_LOCAL, "path", None) == path:
+        return conn
+    conn = sqlite3.connect(path, timeout=5.0, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(_SCHEMA)
+    _LOCAL.conn, _LOCAL.path = conn, path
+    return conn
+
+
+# ==========================================================
+# Escritura
+# ==========================================================
+_ROLLUP_SQL = (
+    "INSERT INTO {table}({keys}, " + ", ".join(METRICS) + ") VALUES (?, ?, ?, " + ", ".join("?" * len(METRICS)) + ") "
+    "ON CONFLICT({keys}) DO UPDATE SET " + ", ".join(f"{m} = {m} + excluded.{m}" for m in METRICS)
+)
+
+
+def append(row: Dict[str, Any]) -> None:
+    """Agrega una llamada (fila de utils_telemetry) al detalle y al acumulado diario. Nunca lanza."""
+    if not enabled():
+        return
+    ts = float(row.get("ts") or time.time())
+    rec = {
+        "ts": ts,
+        "day": date.fromtimestamp(ts).isoformat(),
+        "tool": str(row.get("tool") or "otro"),
+        "route": str(row.get("route") or ""),
+        "session": str(row.get("session") or "anon"),
+        "endpoint": str(row.get("endpoint") or ""),
+        "model": str(row.get("model") or ""),
+        "input_tokens": int(row.get("input_tokens") or 0),
+        "output_tokens": int(row.get("output_tokens") or 0),
+        "cached_tokens": int(row.get("cached_tokens") or 0),
+        "audio_seconds": float(row.get("audio_seconds") or 0.0),
+        "images": int(row.get("images") or 0),
+        "bytes_out": int(row.get("bytes_out") or 0),
+        "latency_ms": float(row.get("latency_ms") or 0.0),
+        "cost_usd": float(row.get("cost_usd") or 0.0),
+        "cache_hit": int(bool(row.get("cache_hit"))),
+        "coalesced": int(bool(row.get("coalesced"))),
+        "hedge": str(row.get("hedge") or ""),
+        "error": str(row.get("error") or ""),
+        "input_hash": str(row.get("input_hash") or ""),
+    }
+    cols = list(rec)
+    # Al acumulado solo entra lo que consumió cuota del proveedor; las unidades de
+    # capacidad (tokens, audio, imágenes) solo si la llamada se procesó: en un error
+    # el audio/las imágenes son estimados de la subida, no minutos ni páginas cobrados.
+    # La fila de detalle y el conteo de errores se conservan igual.
+    api = 0 if rec["cache_hit"] or rec["coalesced"] else 1
+    units = 0 if rec["error"] else api
+    try:
+        conn = _conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                f"INSERT INTO usage_ledger({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})",
+                [rec[c] for c in cols],
+            )
+            amounts = (
+                api, 1 - api, int(bool(rec["error"])),
+                units * rec["input_tokens"], units * rec["output_tokens"], units * rec["cached_tokens"],
+                units * rec["audio_seconds"], units * rec["images"], rec["cost_usd"],
+            )
+            conn.execute(_ROLLUP_SQL.format(table="usage_daily", keys="day, tool, model"), (rec["day"], rec["tool"], rec["model"], *amounts))
+            conn.execute(
+                _ROLLUP_SQL.format(table="usage_session_daily", keys="day, session, tool"),
+                (rec["day"], rec["session"], rec["tool"], *amounts),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    except sqlite3.Error:
+        pass
+
+
+# ==========================================================
+# Consultas (fechas locales "YYYY-MM-DD", ambos extremos incluidos)
+# ==========================================================
+def _range(start: Optional[date], end: Optional[date]) -> Sequence[str]:
+    end = end or date.today()
+    start = start or (end - timedelta(days=29))
+    return start.isoformat(), end.isoformat()
+
+
+def _rows(sql: str, params: Sequence[Any]) -> List[Dict[str, Any]]:
+    try:
+        cur = _conn().execute(sql, params)
+    except sqlite3.Error:
+        return []
+    names = [d[0] for d in cur.description]
+    return [dict(zip(names, r)) for r in cur.fetchall()]
+
+
+def _sums() -> str:
+    return ", ".join(f"SUM({m}) AS {m}" for m in METRICS)
+
+
+def _grouping(by: Sequence[str]) -> Tuple[str, List[str]]:
+    """(tabla de acumulados, columnas de agrupación): con "session" se usa usage_session_daily (sin modelo)."""
+    cols = [c for c in dict.fromkeys(by) if c in GROUPS] or ["tool"]
+    if "session" in cols:
+        return "usage_session_daily", [c for c in cols if c != "model"]
+    return "usage_daily", cols
+
+
+def daily(start: Optional[date] = None, end: Optional[date] = None, by: Sequence[str] = ("tool",)) -> List[Dict[str, Any]]:
+    """Totales por día y `by` (tool / session / model) desde los acumulados diarios."""
+    table, cols = _grouping(by)
+    keys = ", ".join(["day", *cols])
+    return _rows(
+        f"SELECT {keys}, {_sums()} FROM {table} WHERE day BETWEEN ? AND ? GROUP BY {keys} ORDER BY {keys}",
+        _range(start, end),
+    )
+
+
+def weekly(start: Optional[date] = None, end: Optional[date] = None, by: Sequence[str] = ("tool",)) -> List[Dict[str, Any]]:
+    """Totales por semana (columna `week` = lunes de la semana) y `by`."""
+    table, cols = _grouping(by)
+    keys = ", ".join(["week", *cols])
+    return _rows(
+        f"SELECT date(day, '-6 days', 'weekday 1') AS week, {', '.join(cols)}, {_sums()} "
+        f"FROM {table} WHERE day BETWEEN ? AND ? GROUP BY {keys} ORDER BY {keys}",
+        _range(start, end),
+    )
+
+
+def totals(start: Optional[date] = None, end: Optional[date] = None, by: Sequence[str] = ("tool",)) -> List[Dict[str, Any]]:
+    """Totales del periodo por `by` (p. ej. ("session",) para ver quién consume más)."""
+    table, cols = _grouping(by)
+    keys = ", ".join(cols)
+    return _rows(
+        f"SELECT {keys}, {_sums()} FROM {table} WHERE day BETWEEN ? AND ? GROUP BY {keys} ORDER BY cost_usd DESC",
+        _range(start, end),
+    )
+
+
+def top_inputs(
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    metric: str = "input_tokens",
+    tool: Optional[str] = None,
+    limit: int = 20,
+) -> List[Dict[str, Any]]:
+    """Las llamadas más pesadas del periodo según `metric` (solo metadatos y huella de la entrada)."""
+    if metric not in HEAVY_METRICS:
+        raise ValueError(f"metric debe ser una de {HEAVY_METRICS}")
+    lo, hi = _range(start, end)
+    t0 = datetime.combine(date.fromisoformat(lo), datetime.min.time()).timestamp()
+    t1 = datetime.combine(date.fromisoformat(hi) + timedelta(days=1), datetime.min.time()).timestamp()
+    # "+ts"/"+tool": SQLite recorre el índice de `metric` de mayor a menor y se detiene en `limit`
+    # (por el índice de ts tendría que ordenar todo el rango: cientos de ms en meses de historia)
+    where, params = "+ts >= ? AND +ts < ? AND cache_hit = 0 AND coalesced = 0", [t0, t1]
+    if tool:
+        where += " AND +tool = ?"
+        params.append(tool)
+    return _rows(
+        f"SELECT datetime(ts, 'unixepoch', 'localtime') AS time, tool, route, session, model, endpoint, input_tokens, "
+        f"output_tokens, audio_seconds, images, bytes_out, latency_ms, cost_usd, error, input_hash "
+        f"FROM usage_ledger WHERE {where} ORDER BY {metric} DESC LIMIT ?",
+        [*params, int(limit)],
+    )
+
+
+def export_csv(start: Optional[date] = None, end: Optional[date] = None, detail: bool = False) -> bytes:
+    """
+    CSV para finanzas (UTF-8 con BOM, abre bien en Excel). Por defecto, un
+    renglón por día × herramienta × modelo con minutos de audio y costo;
+    detail=True exporta cada llamada del periodo.
+    """
+    if detail:
+        lo, hi = _range(start, end)
+        rows = _rows(
+            "SELECT datetime(ts, 'unixepoch', 'localtime') AS time, day, tool, route, session, endpoint, model, "
+            "input_tokens, output_tokens, cached_tokens, audio_seconds, images, cost_usd, cache_hit, coalesced, "
+            "hedge, error FROM usage_ledger WHERE day BETWEEN ? AND ? ORDER BY ts",
+            (lo, hi),
+        )
+    else:
+        rows = daily(start, end, by=("tool", "model"))
+    buf = io.StringIO()
+    fields = list(rows[0]) if rows else ["day", "tool", "model", *METRICS]
+    if "audio_seconds" in fields:
+        fields.insert(fields.index("audio_seconds") + 1, "audio_minutes")
+    writer = csv.DictWriter(buf, fieldnames=fields)
+    writer.writeheader()
+    for r in rows:
+        r["audio_minutes"] = round(float(r.get("audio_seconds") or 0.0) / 60, 2)
+        r["cost_usd"] = round(float(r.get("cost_usd") or 0.0), 6)
+        writer.writerow(r)
+    return ("\ufeff" + buf.getvalue()).encode("utf-8")
+
+
+def stats() -> Dict[str, Any]:
+    """Filas en el detalle, primer día registrado y tamaño del archivo."""
+    out: Dict[str, Any] = {"enabled": enabled()}
+    try:
+        n, first = _conn().execute("SELECT COUNT(*), MIN(day) FROM usage_ledger").fetchone()
+        out.update(rows=n, since=first, bytes=(data_dir() / DB_NAME).stat().st_size)
+    except (sqlite3.Error, OSError):
+        pass
+    return out
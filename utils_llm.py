@@ -0,0 +1,599 @@
+from __future__ import annotations
+
+import copy
+import json as _json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from itertools import chain
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import requests
+import streamlit as st
+from requests.adapters import HTTPAdapter
+
+import utils_hedge
+import utils_ledger
+import utils_llm_cache
+import utils_ratelimit
+import utils_singleflight
+import utils_telemetry
+import utils_tracing
+from utils_errors import MAINTENANCE_MSG, show_maintenance_instead_of_api_error
+from utils_partial_json import parse_partial_json
+
+
+# ==========================================================
+# Gateway LLM (OpenAI vía HTTP, sin SDK) compartido por todas las páginas
+#
+# - Una sola requests.Session por proceso (keep-alive + pool de conexiones):
+#   el handshake TLS se paga una vez, no en cada clic.
+# - Timeouts por defecto, reintentos con jitter en 429/5xx y errores de conexión.
+# - Errores uniformes (LLMError) y un solo render en UI (show_llm_error).
+# - Toda llamada pasa por el limitador del proceso (utils_ratelimit): RPM/TPM,
+#   concurrencia máxima y cola justa entre sesiones; un 429 pausa a todos.
+# - chat(cache=True): respuestas repetidas salen de la caché en disco (utils_llm_cache).
+# - Cada llamada (o acierto de caché) queda en la telemetría local (utils_telemetry),
+#   en el libro de consumo persistente (utils_ledger) y como span en la traza del clic (utils_tracing).
+# - chat_stream / chat_stream_text / chat_stream_json: tokens por SSE conforme llegan.
+# - Opcional (IMEMSA_HEDGE=1): si una llamada tarda más que el p95 de su
+#   herramienta/ruta, sale un duplicado y gana el primero (utils_hedge).
+# - Solicitudes idénticas simultáneas se hacen una sola vez (utils_singleflight).
+# ==========================================================
+# Mismo nombre que usa el SDK de OpenAI (services/): apunta ambos a un mock local (bench/mock_openai.py)
+OPENAI_BASE_URL = (os.getenv("OPENAI_BASE_URL") or "https://api.openai.com/v1").rstrip("/")
+
+CONNECT_TIMEOUT = 10
+DEFAULT_TIMEOUT = 120
+MAX_RETRIES = 3
+BACKOFF_BASE = 0.5   # segundos
+BACKOFF_CAP = 8.0
+RETRY_STATUS = {429, 500, 502, 503, 504}
+POOL_MAXSIZE = 16
+AUDIO_BYTES_PER_S = 16_000  # ~128 kbps: estimación de minutos cuando el proveedor factura por tokens
+
+API_KEY_HELP = (
+    "En Streamlit Cloud agrega un Secret llamado **OPENAI_API_KEY** "
+    "o define la variable de entorno `OPENAI_API_KEY`."
+)
+
+
+class LLMError(Exception):
+    """Error del servicio LLM con status HTTP (None si fue de red) y cuerpo de respuesta."""
+
+    def __init__(self, message: str, status_code: Optional[int] = None, body: Any = None) -> None:
+        super().__init__(message)
+        self.status_code = status_code
+        self.body = body
+
+
+class MissingAPIKeyError(LLMError):
+    pass
+
+
+_SESSION: Optional[requests.Session] = None
+_SESSION_LOCK = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """Session única del proceso (thread-safe; urllib3 reparte conexiones del pool)."""
+    global _SESSION
+    if _SESSION is None:
+        with _SESSION_LOCK:
+            if _SESSION is None:
+                s = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_MAXSIZE, max_retries=0)
+                s.mount("https://", adapter)
+                s.mount("http://", adapter)
+                _SESSION = s
+    return _SESSION
+
+
+def get_api_key() -> Optional[str]:
+    # Prioriza secrets (Streamlit Cloud) y luego variables de entorno
+    try:
+        key = st.secrets.get("OPENAI_API_KEY") if hasattr(st, "secrets") else None
+    except Exception:
+        key = None
+    return key or os.getenv("OPENAI_API_KEY")
+
+
+def _is_quota_error(resp: requests.Response) -> bool:
+    # 429 por cuota agotada no se arregla reintentando
+    try:
+        return "insufficient_quota" in resp.text
+    except Exception:
+        return False
+
+
+def _backoff(attempt: int, resp: Optional[requests.Response] = None) -> float:
+    if resp is not None:
+        try:
+            retry_after = float(resp.headers.get("Retry-After", ""))
+            return min(BACKOFF_CAP, max(0.0, retry_after))
+        except ValueError:
+            pass
+    # "Full jitter": evita que varias sesiones reintenten al mismo tiempo
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * (2 ** attempt)))
+
+
+def _error_body(resp: requests.Response) -> Any:
+    try:
+        return resp.json()
+    except Exception:
+        return resp.text[:2000]
+
+
+def _post(
+    path: str,
+    *,
+    json: Optional[Dict[str, Any]] = None,
+    data: Optional[Dict[str, Any]] = None,
+    files: Optional[Dict[str, Any]] = None,
+    timeout: float = DEFAULT_TIMEOUT,
+    max_retries: int = MAX_RETRIES,
+    stream: bool = False,
+) -> requests.Response:
+    """
+    POST a {OPENAI_BASE_URL}/{path} con reintentos; devuelve la respuesta 2xx.
+    En streaming solo se reintenta antes del primer byte (status de la respuesta).
+    """
+    api_key = get_api_key()
+    if not api_key:
+        raise MissingAPIKeyError("Falta la API Key.")
+
+    url = f"{OPENAI_BASE_URL}/{path.lstrip('/')}"
+    headers = {"Authorization": f"Bearer {api_key}"}
+    sess = get_session()
+
+    for attempt in range(max_retries + 1):
+        try:
+            resp = sess.post(
+                url, headers=headers, json=json, data=data, files=files, timeout=(CONNECT_TIMEOUT, timeout), stream=stream
+            )
+        except (requests.ConnectionError, requests.exceptions.ChunkedEncodingError) as e:
+            if attempt < max_retries:
+                time.sleep(_backoff(attempt))
+                continue
+            raise LLMError(f"No se pudo conectar con el servicio: {e}") from e
+        except requests.Timeout as e:
+            raise LLMError(f"El servicio no respondió en {timeout} s.") from e
+
+        if resp.status_code in RETRY_STATUS and attempt < max_retries and not _is_quota_error(resp):
+            delay = _backoff(attempt, resp)
+            if resp.status_code == 429:
+                utils_ratelimit.governor().pause(delay)
+            time.sleep(delay)
+            continue
+        if resp.status_code >= 400:
+            raise LLMError(f"HTTP {resp.status_code}", status_code=resp.status_code, body=_error_body(resp))
+        return resp
+
+    raise LLMError("Reintentos agotados.")  # no debería alcanzarse
+
+
+@dataclass
+class _Reply:
+    """Respuesta de un intento (no streaming), con lo necesario para su telemetría."""
+    out: Any
+    usage: Any
+    t0: float
+    ticket: utils_ratelimit.Ticket
+    bytes_in: int
+
+
+def request(
+    path: str,
+    *,
+    json: Optional[Dict[str, Any]] = None,
+    data: Optional[Dict[str, Any]] = None,
+    files: Optional[Dict[str, Any]] = None,
+    timeout: float = DEFAULT_TIMEOUT,
+    max_retries: int = MAX_RETRIES,
+) -> Dict[str, Any]:
+    """
+    POST a {OPENAI_BASE_URL}/{path} con reintentos. Devuelve el JSON de respuesta.
+    En multipart, `files` debe llevar bytes (no streams) para poder reintentar
+    (y para poder duplicar la solicitud).
+    """
+    model = str((json or data or {}).get("model", ""))
+
+    def attempt(role: str) -> _Reply:
+        t0 = time.perf_counter()
+        ticket: Optional[utils_ratelimit.Ticket] = None
+        try:
+            with _slot(json, immediate=role == "duplicado") as ticket:
+                resp = _post(path, json=json, data=data, files=files, timeout=timeout, max_retries=max_retries)
+                try:
+                    out = resp.json()
+                except ValueError as e:
+                    raise LLMError("Respuesta inesperada del servicio.", status_code=resp.status_code, body=resp.text[:2000]) from e
+                usage = out.get("usage") if isinstance(out, dict) else None
+                if isinstance(usage, dict) and usage.get("total_tokens") is not None:
+                    ticket.used = int(usage["total_tokens"])
+        except LLMError as e:
+            hedge = "duplicado_error" if role == "duplicado" else ""
+            _record(path, model, t0, ticket, json=json, files=files, error=type(e).__name__, status=e.status_code, hedge=hedge)
+            raise
+        return _Reply(out=out, usage=usage, t0=t0, ticket=ticket, bytes_in=len(resp.content))
+
+    def record(reply: _Reply, t0: float, hedge: str) -> None:
+        _record(path, model, t0, reply.ticket, json=json, files=files, usage=reply.usage, bytes_in=reply.bytes_in, hedge=hedge)
+
+    def call() -> Dict[str, Any]:
+        # La latencia del ganador se mide desde el primer intento (lo que esperó el usuario)
+        t0 = time.perf_counter()
+        reply, hedge = utils_hedge.run(utils_hedge.hedge_key(path), attempt, lambda r: record(r, r.t0, "perdedor"))
+        record(reply, t0 if hedge else reply.t0, hedge)
+        return reply.out
+
+    # Otra sesión con la misma solicitud en curso: se espera su respuesta en vez de repetirla
+    t0 = time.perf_counter()
+    out, shared = utils_singleflight.do(utils_singleflight.make_key(path, {"json": json, "data": data}, files), call)
+    if shared:
+        _record(path, model, t0, None, coalesced=True)
+        out = copy.deepcopy(out)  # cada quien recibe su propia copia
+    return out
+
+
+def _record(
+    endpoint: str,
+    model: str,
+    t0: float,
+    ticket: Optional[utils_ratelimit.Ticket],
+    *,
+    json: Optional[Dict[str, Any]] = None,
+    files: Optional[Dict[str, Any]] = None,
+    usage: Any = None,
+    **fields: Any,
+) -> None:
+    """
+    Telemetría de una llamada: latencia sin la espera en cola, tokens, bytes enviados y unidades (audio, imágenes).
+    También deja el span de la llamada en la traza activa (utils_tracing).
+    """
+    queue_s = 0.0
+    if ticket is not None and ticket.granted is not None:
+        queue_s = ticket.granted - ticket.enqueued
+    utils_tracing.record_span(
+        f"llm {endpoint}", t0, error=str(fields.get("error") or ""), modelo=model, cola_ms=round(queue_s * 1000, 1),
+        **{k: v for k, v in fields.items() if k != "error" and v},
+    )
+    if not utils_telemetry.enabled() and not utils_ledger.enabled():
+        return
+    now = time.perf_counter()
+    bytes_out = len(_json.dumps(json, ensure_ascii=False).encode("utf-8")) if json else 0
+    audio_bytes = 0
+    for f in (files or {}).values():
+        if isinstance(f, tuple) and len(f) > 1 and isinstance(f[1], (bytes, bytearray)):
+            bytes_out += len(f[1])
+            audio_bytes += len(f[1])
+    inp, out = utils_telemetry.usage_tokens(usage)
+    utils_telemetry.record(
+        endpoint=endpoint,
+        model=model,
+        latency_ms=max(0.0, now - t0 - queue_s) * 1000,
+        queue_ms=queue_s * 1000,
+        input_tokens=inp,
+        output_tokens=out,
+        cached_tokens=utils_telemetry.usage_cached_tokens(usage),
+        bytes_out=bytes_out,
+        audio_seconds=_audio_seconds(usage, audio_bytes) if endpoint.startswith("audio/") else 0.0,
+        images=_count_images((json or {}).get("messages")),
+        input_hash=utils_singleflight.make_key(endpoint, json, files)[:16] if (json or files) else "",
+        **fields,
+    )
+
+
+def _audio_seconds(usage: Any, audio_bytes: int) -> float:
+    """Duración facturada (usage.seconds) o, si el modelo factura por tokens, estimada por tamaño."""
+    if isinstance(usage, dict) and usage.get("type") == "duration" and usage.get("seconds") is not None:
+        return float(usage["seconds"])
+    return audio_bytes / AUDIO_BYTES_PER_S
+
+
+def _count_images(content: Any) -> int:
+    """Imágenes (páginas) enviadas en los mensajes."""
+    if isinstance(content, list):
+        return sum(_count_images(part) for part in content)
+    if isinstance(content, dict):
+        if content.get("type") in ("image_url", "input_image"):
+            return 1
+        return _count_images(content.get("content"))
+    return 0
+
+
+def _acquire(payload: Optional[Dict[str, Any]], immediate: bool = False) -> utils_ratelimit.Ticket:
+    """
+    Turno en el limitador compartido; si la cola no avanza a tiempo se reporta como 429.
+    immediate=True (duplicados): sin turno libre en este instante no se espera (HedgeSkipped).
+    """
+    gov = utils_ratelimit.governor()
+    owner, tokens = utils_ratelimit.current_owner(), utils_ratelimit.estimate_tokens(payload)
+    if immediate:
+        ticket = gov.try_acquire(owner, tokens)
+        if ticket is None:
+            raise utils_hedge.HedgeSkipped("Sin turno inmediato en el limitador.")
+        return ticket
+    try:
+        return gov.acquire(owner, tokens)
+    except utils_ratelimit.RateLimitTimeout as e:
+        raise LLMError(f"Demasiadas solicitudes en curso. {e}", status_code=429) from e
+
+
+@contextmanager
+def _slot(payload: Optional[Dict[str, Any]], immediate: bool = False) -> Iterator[utils_ratelimit.Ticket]:
+    ticket = _acquire(payload, immediate=immediate)
+    try:
+        yield ticket
+    finally:
+        utils_ratelimit.governor().release(ticket)
+
+
+def chat(
+    messages: List[Dict[str, Any]],
+    model: str = "gpt-4o-mini",
+    temperature: float = 0.2,
+    timeout: float = DEFAULT_TIMEOUT,
+    cache: bool = False,
+    schema_version: str = "",
+    **extra: Any,
+) -> str:
+    """
+    Chat Completions → contenido del primer mensaje (sin espacios en los extremos).
+    Con cache=True, la llave incluye modelo, mensajes normalizados, temperatura y
+    schema_version (súbela cuando cambie el esquema/prompt que espera la página).
+    """
+    payload = {"model": model, "messages": messages, "temperature": temperature, **extra}
+    key = None
+    if cache:
+        key = utils_llm_cache.make_key("chat/completions", model, {"messages": messages, **extra}, temperature, schema_version)
+        t0 = time.perf_counter()
+        data = utils_llm_cache.get(key)
+        if data is not None:
+            _record("chat/completions", model, t0, None, usage=data.get("usage"), cache_hit=True)
+            return _content(data)
+
+    data = request("chat/completions", json=payload, timeout=timeout)
+    content = _content(data)
+    if key is not None:
+        utils_llm_cache.put(key, data)
+    return content
+
+
+def chat_stream(
+    messages: List[Dict[str, Any]],
+    model: str = "gpt-4o-mini",
+    temperature: float = 0.2,
+    timeout: float = DEFAULT_TIMEOUT,
+    cache: bool = False,
+    schema_version: str = "",
+    **extra: Any,
+) -> Iterator[str]:
+    """
+    Igual que chat(), pero va entregando fragmentos de texto (SSE, stream=True).
+    `timeout` aplica entre fragmentos, no al total. Con cache=True, un acierto
+    se entrega completo en un solo fragmento y lo recibido se guarda al terminar.
+    """
+    key = None
+    if cache:
+        key = utils_llm_cache.make_key("chat/completions", model, {"messages": messages, **extra}, temperature, schema_version)
+        t0 = time.perf_counter()
+        data = utils_llm_cache.get(key)
+        if data is not None:
+            _record("chat/completions", model, t0, None, usage=data.get("usage"), cache_hit=True, stream=True)
+            yield _content(data)
+            return
+
+    payload = {
+        "model": model,
+        "messages": messages,
+        "temperature": temperature,
+        "stream": True,
+        "stream_options": {"include_usage": True},  # último evento trae `usage` (telemetría)
+        **extra,
+    }
+    # Una sesión que pide exactamente lo mismo mientras esto corre recibe los mismos fragmentos
+    t0 = time.perf_counter()
+    shared = False
+    flight = utils_singleflight.make_key("chat/completions", payload)
+    for delta, shared in utils_singleflight.stream(flight, lambda: _stream_deltas(payload, timeout, key)):
+        yield delta
+    if shared:
+        _record("chat/completions", model, t0, None, stream=True, coalesced=True)
+
+
+def _stream_deltas(payload: Dict[str, Any], timeout: float, key: Optional[str]) -> Iterator[str]:
+    """Una llamada real con stream=True (con duplicado opcional): fragmentos, telemetría y caché."""
+    model = str(payload.get("model", ""))
+    parts: List[str] = []
+    finished = False
+    usage: Any = None
+    bytes_in = 0
+    t0 = time.perf_counter()
+    opened: Optional[_OpenStream] = None
+    try:
+        # El duplicado (si lo hay) compite hasta el primer evento; el turno del
+        # limitador del ganador se conserva hasta terminar de leer el stream
+        opened, hedge = utils_hedge.run(
+            utils_hedge.hedge_key("chat/completions", "ttft"),
+            lambda role: _open_stream(payload, timeout, role),
+            lambda lost: lost.discard(model, payload),
+        )
+        ticket, resp = opened.ticket, opened.resp
+        if not hedge:
+            t0 = opened.t0
+        try:
+            for line in opened.lines:
+                if not line or not line.startswith("data:"):
+                    continue
+                bytes_in += len(line)
+                chunk = line[5:].strip()
+                if chunk == "[DONE]":
+                    # Se sigue leyendo hasta el cierre del cuerpo para devolver la conexión al pool
+                    finished = True
+                    continue
+                try:
+                    event = _json.loads(chunk)
+                except ValueError:
+                    continue
+                if isinstance(event, dict) and event.get("usage"):
+                    usage = event["usage"]
+                    ticket.used = usage.get("total_tokens", ticket.used)
+                try:
+                    delta = event["choices"][0].get("delta", {}).get("content") or ""
+                except (KeyError, IndexError, TypeError, AttributeError):
+                    continue
+                if delta:
+                    parts.append(delta)
+                    yield delta
+        except (requests.ConnectionError, requests.exceptions.ChunkedEncodingError, requests.Timeout) as e:
+            raise LLMError(f"Se interrumpió la respuesta del servicio: {e}") from e
+        finally:
+            resp.close()
+            utils_ratelimit.governor().release(ticket)
+    except LLMError as e:
+        if opened is not None:  # los errores al abrir ya los registró _open_stream
+            _record(
+                "chat/completions", model, t0, opened.ticket, json=payload, stream=True, hedge=hedge,
+                error=type(e).__name__, status=e.status_code,
+            )
+        raise
+    _record(
+        "chat/completions", model, t0, ticket, json=payload, usage=usage, stream=True, bytes_in=bytes_in, hedge=hedge,
+        error="" if finished else "Incomplete",
+    )
+
+    if key is not None and finished:
+        message = {"role": "assistant", "content": "".join(parts)}
+        utils_llm_cache.put(key, {"choices": [{"message": message}], "usage": usage})
+
+
+@dataclass
+class _OpenStream:
+    """Stream abierto hasta su primer evento: el turno del limitador sigue tomado."""
+    t0: float
+    ticket: utils_ratelimit.Ticket
+    resp: requests.Response
+    lines: Iterator[str]
+
+    def discard(self, model: str, payload: Dict[str, Any]) -> None:
+        """Perdedor de un duplicado: se cierra sin leer el resto y se libera su turno."""
+        self.resp.close()
+        utils_ratelimit.governor().release(self.ticket)
+        _record("chat/completions", model, self.t0, self.ticket, json=payload, stream=True, hedge="perdedor")
+
+
+def _open_stream(payload: Dict[str, Any], timeout: float, role: str) -> _OpenStream:
+    """Turno + POST con stream=True + lectura hasta el primer evento `data:` (mide el TTFT)."""
+    t0 = time.perf_counter()
+    ticket: Optional[utils_ratelimit.Ticket] = None
+    resp: Optional[requests.Response] = None
+    try:
+        ticket = _acquire(payload, immediate=role == "duplicado")
+        resp = _post("chat/completions", json=payload, timeout=timeout, stream=True)
+        lines = resp.iter_lines(decode_unicode=True)
+        head: List[str] = []
+        try:
+            for line in lines:
+                head.append(line)
+                if line and line.startswith("data:"):
+                    break
+        except (requests.ConnectionError, requests.exceptions.ChunkedEncodingError, requests.Timeout) as e:
+            raise LLMError(f"Se interrumpió la respuesta del servicio: {e}") from e
+        return _OpenStream(t0=t0, ticket=ticket, resp=resp, lines=chain(head, lines))
+    except BaseException as e:
+        if resp is not None:
+            resp.close()
+        if ticket is not None:
+            utils_ratelimit.governor().release(ticket)
+        if isinstance(e, LLMError):
+            _record(
+                "chat/completions", str(payload.get("model", "")), t0, ticket, json=payload, stream=True,
+                hedge="duplicado_error" if role == "duplicado" else "", error=type(e).__name__, status=e.status_code,
+            )
+        raise
+
+
+def chat_stream_json(
+    messages: List[Dict[str, Any]],
+    on_partial: Callable[[Any], None],
+    min_interval: float = 0.25,
+    **kwargs: Any,
+) -> str:
+    """
+    Streaming para respuestas JSON: llama on_partial(obj) con el objeto parcial
+    (solo valores completos) como máximo cada min_interval s. Devuelve el texto completo.
+    """
+    buf: List[str] = []
+    last: Any = None
+    t_last = 0.0
+    for delta in chat_stream(messages, **kwargs):
+        buf.append(delta)
+        now = time.monotonic()
+        if now - t_last < min_interval:
+            continue
+        obj = parse_partial_json("".join(buf))
+        if obj and obj != last:
+            on_partial(obj)
+            last, t_last = obj, now
+    return "".join(buf).strip()
+
+
+def chat_stream_text(
+    messages: List[Dict[str, Any]],
+    on_partial: Callable[[str], None],
+    min_interval: float = 0.25,
+    **kwargs: Any,
+) -> str:
+    """Streaming de texto libre: on_partial(texto acumulado) como máximo cada min_interval s."""
+    buf: List[str] = []
+    t_last = 0.0
+    for delta in chat_stream(messages, **kwargs):
+        buf.append(delta)
+        now = time.monotonic()
+        if now - t_last >= min_interval:
+            on_partial("".join(buf))
+            t_last = now
+    return "".join(buf).strip()
+
+
+def _content(data: Dict[str, Any]) -> str:
+    try:
+        return (data["choices"][0]["message"]["content"] or "").strip()
+    except (KeyError, IndexError, TypeError) as e:
+        raise LLMError("Respuesta inesperada del servicio.", body=data) from e
+
+
+def transcribe(
+    audio_bytes: bytes,
+    filename: str,
+    mime: str,
+    model: str,
+    timeout: float = 180,
+    **fields: Any,
+) -> Dict[str, Any]:
+    """POST /audio/transcriptions (multipart). Devuelve el JSON completo."""
+    files = {"file": (filename, audio_bytes, mime)}
+    return request("audio/transcriptions", data={"model": model, **fields}, files=files, timeout=timeout)
+
+
+# ==========================================================
+# UI
+# ==========================================================
+def show_llm_error(e: Exception, title: str = "Error del servicio") -> None:
+    """Render único de errores LLM: falta de key, mantenimiento (cuota/rate limit) o detalle HTTP."""
+    if isinstance(e, MissingAPIKeyError):
+        st.error("Falta la API Key.")
+        st.info(API_KEY_HELP)
+        return
+    if show_maintenance_instead_of_api_error(e):
+        st.warning(MAINTENANCE_MSG)
+        return
+    status = getattr(e, "status_code", None)
+    st.error(f"{title} (HTTP {status})." if status else f"{title}: {e}")
+    body = getattr(e, "body", None)
+    if body:
+        st.code(body)
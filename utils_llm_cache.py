@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+from typing import Any, Dict, Optional
+
+import utils_cache_backend
+from utils_cache_backend import CacheError
+
+
+# ==========================================================
+# Caché persistente de respuestas LLM (direccionada por contenido)
+#
+# - Llave: sha256 de (endpoint, modelo, prompt normalizado, temperatura, versión de esquema).
+# - Se guarda en el backend compartido (utils_cache_backend, espacio "llm"):
+#   SQLite en la carpeta de datos por default, o Redis para que varias
+#   réplicas del portal reutilicen las respuestas de las otras.
+# - TTL por entrada; en SQLite, desalojo LRU cuando el tamaño supera el límite.
+# - Invalidación: cada página con caché define SCHEMA_VERSION y lo pasa como
+#   schema_version (y a input_key de utils_results). Súbelo cuando cambie el
+#   prompt o el esquema de salida de esa página: las respuestas viejas dejan de
+#   coincidir sin borrar nada (expiran por TTL/LRU).
+#
+# Variables de entorno:
+#   IMEMSA_LLM_CACHE          1 (default) | 0 para desactivar
+#   IMEMSA_LLM_CACHE_TTL      segundos (default 7 días)
+#   IMEMSA_LLM_CACHE_MAX_MB   tamaño máximo en SQLite (default 200 MB; en Redis lo fija maxmemory)
+# ==========================================================
+NAMESPACE = "llm"
+DEFAULT_TTL = 7 * 24 * 3600
+DEFAULT_MAX_MB = 200
+
+_STATS = {"hits": 0, "misses": 0, "writes": 0, "errors": 0}
+_STATS_LOCK = threading.Lock()
+
+
+def enabled() -> bool:
+    return os.getenv("IMEMSA_LLM_CACHE", "1").strip().lower() not in ("0", "false", "no", "off")
+
+
+def _ttl() -> int:
+    try:
+        return int(os.getenv("IMEMSA_LLM_CACHE_TTL", DEFAULT_TTL))
+    except ValueError:
+        return DEFAULT_TTL
+
+
+def _max_bytes() -> int:
+    try:
+        return int(float(os.getenv("IMEMSA_LLM_CACHE_MAX_MB", DEFAULT_MAX_MB)) * 1024 * 1024)
+    except ValueError:
+        return DEFAULT_MAX_MB * 1024 * 1024
+
+
+def _backend() -> utils_cache_backend.CacheBackend:
+    return utils_cache_backend.get_backend(NAMESPACE, max_bytes=_max_bytes())
+
+
+def _bump(name: str, n: int = 1) -> None:
+    with _STATS_LOCK:
+        _STATS[name] += n
+
+
+def _normalize_text(text: str) -> str:
+    # Solo diferencias que no cambian el significado: CRLF, espacios al final de línea y extremos
+    lines = str(text).replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    return "\n".join(ln.rstrip() for ln in lines).strip()
+
+
+def _normalize(obj: Any) -> Any:
+    if isinstance(obj, str):
+        return _normalize_text(obj)
+    if isinstance(obj, dict):
+        return {k: _normalize(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_normalize(v) for v in obj]
+    return obj
+
+
+def make_key(endpoint: str, model: str, prompt: Any, temperature: Optional[float], schema_version: str = "") -> str:
+    blob = json.dumps(
+        {
+            "endpoint": endpoint,
+            "model": model,
+            "prompt": _normalize(prompt),
+            "temperature": None if temperature is None else round(float(temperature), 4),
+            "schema": schema_version,
+        },
+        ensure_ascii=False,
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def get(key: str) -> Optional[Dict[str, Any]]:
+    """Respuesta guardada (dict) o None si no existe / expiró."""
+    if not enabled():
+        return None
+    try:
+        raw = _backend().get(key)
+        if raw is None:
+            _bump("misses")
+            return None
+        value = json.loads(raw)
+    except (CacheError, RuntimeError, ValueError):
+        # La caché nunca debe romper la llamada: ante cualquier problema, se va al servicio
+        _bump("errors")
+        return None
+    _bump("hits")
+    return value
+
+
+def put(key: str, value: Dict[str, Any], ttl: Optional[int] = None) -> None:
+    if not enabled():
+        return
+    try:
+        raw = json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        _backend().set(key, raw, ttl if ttl is not None else _ttl())
+        _bump("writes")
+    except (CacheError, RuntimeError, TypeError, ValueError):
+        _bump("errors")
+
+
+def clear() -> None:
+    try:
+        _backend().clear()
+    except (CacheError, RuntimeError):
+        pass
+
+
+def counters() -> Dict[str, int]:
+    """Solo los contadores del proceso (sin consultar el backend)."""
+    with _STATS_LOCK:
+        return dict(_STATS)
+
+
+def stats() -> Dict[str, Any]:
+    """Contadores del proceso + tamaño actual de la caché compartida."""
+    out: Dict[str, Any] = counters()
+    out["backend"] = utils_cache_backend.backend_kind()
+    try:
+        out.update(_backend().stats())
+    except (CacheError, RuntimeError):
+        pass
+    return out
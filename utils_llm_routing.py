@@ -0,0 +1,114 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import utils_ratelimit
+import utils_telemetry
+
+
+# ==========================================================
+# Ruteo de modelo por tamaño de entrada
+#
+# Cada herramienta tiene una tabla de cubetas por tokens de entrada estimados
+# (localmente, caracteres / 4 + imágenes). Cada cubeta fija un tier y un
+# timeout. Lo corto va al tier más rápido; solo lo pesado paga el modelo con
+# más contexto y el timeout largo.
+#
+#   route = route_for("minutas", messages)
+#   with route.recorded():      # la telemetría guarda "tier/cubeta"
+#       chat(messages, model=route.model, timeout=route.timeout, ...)
+#
+# Variables de entorno:
+#   IMEMSA_LLM_TIERS   JSON {tier: modelo} (se combina con TIERS)
+#   IMEMSA_LLM_ROUTES  JSON {herramienta: [[max_tokens | null, tier, timeout_s], ...]}
+# ==========================================================
+TIERS: Dict[str, str] = {
+    "rapido": "gpt-4.1-nano",
+    "estandar": "gpt-4o-mini",
+    "amplio": "gpt-4.1-mini",  # más contexto y mejor seguimiento en entradas largas
+}
+
+# (máximo de tokens de entrada o None = sin tope, tier, timeout en s); en orden ascendente
+ROUTES: Dict[str, List[Tuple[Optional[int], str, float]]] = {
+    "traduccion": [(1_500, "rapido", 60), (8_000, "estandar", 120), (None, "amplio", 240)],
+    "minutas": [(2_000, "rapido", 60), (8_000, "estandar", 180), (None, "amplio", 300)],
+    "nlp_operacion": [(1_500, "rapido", 45), (6_000, "estandar", 90), (None, "amplio", 180)],
+    # OCR: ~1100 tokens por imagen; la visión del tier rápido es más débil, se empieza en estándar
+    "documentos": [(4_000, "estandar", 120), (12_000, "estandar", 240), (None, "amplio", 300)],
+}
+DEFAULT_ROUTE: List[Tuple[Optional[int], str, float]] = [(None, "estandar", 120)]
+BUCKETS = ("corto", "medio", "largo")
+
+
+@dataclass(frozen=True)
+class Route:
+    tool: str
+    tier: str
+    model: str
+    timeout: float
+    bucket: str
+    est_tokens: int
+
+    @property
+    def label(self) -> str:
+        return f"{self.tier}/{self.bucket}"
+
+    @contextmanager
+    def recorded(self) -> Iterator["Route"]:
+        """Las llamadas LLM dentro del bloque quedan anotadas con esta ruta en la telemetría."""
+        with utils_telemetry.route_scope(self.label):
+            yield self
+
+
+def _env_json(name: str) -> Dict[str, Any]:
+    raw = os.getenv(name, "")
+    if not raw:
+        return {}
+    try:
+        value = json.loads(raw)
+    except ValueError:
+        return {}
+    return value if isinstance(value, dict) else {}
+
+
+def tiers() -> Dict[str, str]:
+    return {**TIERS, **_env_json("IMEMSA_LLM_TIERS")}
+
+
+def routes(tool: str) -> List[Tuple[Optional[int], str, float]]:
+    custom = _env_json("IMEMSA_LLM_ROUTES").get(tool)
+    if custom:
+        try:
+            return [(None if m is None else int(m), str(t), float(s)) for m, t, s in custom]
+        except (TypeError, ValueError):
+            pass
+    return ROUTES.get(tool, DEFAULT_ROUTE)
+
+
+def route_for(tool: str, messages: Any) -> Route:
+    """Elige tier, modelo y timeout para `tool` según los tokens estimados de `messages`."""
+    est = utils_ratelimit.estimate_prompt_tokens(messages)
+    table = routes(tool)
+    for i, (max_tokens, tier, timeout) in enumerate(table):
+        if max_tokens is None or est <= max_tokens:
+            break
+    bucket = BUCKETS[min(i, len(BUCKETS) - 1)] if len(table) > 1 else "unico"
+    return Route(
+        tool=tool,
+        tier=tier,
+        model=tiers().get(tier, TIERS["estandar"]),
+        timeout=timeout,
+        bucket=bucket,
+        est_tokens=est,
+    )
+
+
+def signature(tool: str) -> str:
+    """Huella de la tabla de rutas y tiers de `tool` (para llaves de resultados guardados)."""
+    raw = json.dumps([routes(tool), tiers()], sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:12]
@@ -0,0 +1,393 @@
+from __future__ import annotations
+
+import hmac
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+from urllib.parse import urlsplit
+
+import requests
+
+from utils_storage import data_dir
+
+
+# ==========================================================
+# Métricas de operación (texto Prometheus) + readiness (JSON)
+#
+# Registro en memoria del proceso; se alimenta de:
+#   - utils_telemetry.record()  → llamadas LLM por herramienta (resultado, latencia, espera, costo)
+#   - requests.Session.send     → fuentes externas por host (Banxico, INEGI, FRED, Monex...)
+#   - al consultar /metrics     → limitador, cola de trabajos, cachés, single-flight, sesiones
+#
+# Las rutas viven en el mismo puerto del portal; hay que arrancarlo con serve.py:
+#   streamlit run serve.py   →  GET /metrics (Prometheus), GET /readyz (JSON; 503 si no está listo)
+# Con `streamlit run app.py` el portal funciona igual, solo sin estas rutas.
+#
+# Variables de entorno:
+#   IMEMSA_METRICS            "0" para desactivar el registro
+#   IMEMSA_METRICS_TOKEN      si se define, las rutas exigen "Authorization: Bearer <token>"
+#   IMEMSA_READY_MAX_QUEUE    solicitudes en cola del limitador a partir de las cuales /readyz da 503 (default 50)
+# ==========================================================
+PREFIX = "imemsa_"
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0, 80.0)
+HTTP_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0)
+DEFAULT_READY_MAX_QUEUE = 50
+
+_STARTED = time.time()
+
+
+def enabled() -> bool:
+    return os.getenv("IMEMSA_METRICS", "1").strip().lower() not in ("0", "false", "no", "off")
+
+
+# ==========================================================
+# Registro (contadores e histogramas con etiquetas)
+# ==========================================================
+Labels = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _num(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = PREFIX + name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Labels:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [f"{self.name}{_labels(self.labelnames, k)} {_num(v)}" for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> None:
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[Labels, List[float]] = {}  # [cuentas por cubeta..., suma, total]
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0.0] * (len(self.buckets) + 2)
+            for i, upper in enumerate(self.buckets):
+                if value <= upper:
+                    row[i] += 1
+                    break
+            row[-2] += value
+            row[-1] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        lines = self.header()
+        for key, row in items:
+            cumulative = 0.0
+            for upper, n in zip(self.buckets, row):
+                cumulative += n
+                le = 'le="%s"' % _num(upper)
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {_num(cumulative)}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {_num(row[-1])}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {round(row[-2], 6)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {_num(row[-1])}")
+        return lines
+
+
+def _gauge(name: str, help: str, samples: Iterable[Tuple[Dict[str, Any], float]], kind: str = "gauge") -> List[str]:
+    """Serie calculada al consultar (valores de otros módulos)."""
+    lines = [f"# HELP {PREFIX}{name} {help}", f"# TYPE {PREFIX}{name} {kind}"]
+    for labels, value in samples:
+        lines.append(f"{PREFIX}{name}{_labels(list(labels), [str(v) for v in labels.values()])} {_num(value)}")
+    return lines
+
+
+LLM_REQUESTS = Counter("llm_requests_total", "Llamadas al modelo por herramienta y resultado.", ("tool", "outcome"))
+LLM_LATENCY = Histogram("llm_latency_seconds", "Latencia de llamadas reales al modelo (sin caché ni duplicados perdedores).", ("tool",))
+LLM_QUEUE = Histogram("llm_queue_seconds", "Espera en el limitador antes de llamar al modelo.", ("tool",))
+LLM_COST = Counter("llm_cost_usd_total", "Costo estimado de las llamadas al modelo (USD).", ("tool",))
+HTTP_REQUESTS = Counter("source_requests_total", "Solicitudes a fuentes externas por host y clase de estado.", ("source", "status"))
+HTTP_LATENCY = Histogram("source_latency_seconds", "Latencia de solicitudes a fuentes externas.", ("source",), HTTP_BUCKETS)
+_REGISTRY: List[_Metric] = [LLM_REQUESTS, LLM_LATENCY, LLM_QUEUE, LLM_COST, HTTP_REQUESTS, HTTP_LATENCY]
+
+# Último resultado por fuente externa (para /readyz): host -> (estado, epoch)
+_SOURCES: Dict[str, Tuple[str, float]] = {}
+_SOURCES_LOCK = threading.Lock()
+
+
+# ==========================================================
+# Entradas
+# ==========================================================
+def observe_llm(row: Dict[str, Any]) -> None:
+    """Registro de utils_telemetry.record(); nunca lanza."""
+    if not enabled():
+        return
+    try:
+        tool = row.get("tool") or "otro"
+        if row.get("error"):
+            outcome = "error"
+        elif row.get("cache_hit"):
+            outcome = "cache"
+        elif row.get("coalesced"):
+            outcome = "compartida"
+        elif row.get("hedge") == "perdedor":
+            outcome = "duplicado"
+        else:
+            outcome = "ok"
+        LLM_REQUESTS.inc(tool=tool, outcome=outcome)
+        if outcome in ("ok", "error"):
+            LLM_LATENCY.observe(float(row.get("latency_ms") or 0.0) / 1000, tool=tool)
+            LLM_QUEUE.observe(float(row.get("queue_ms") or 0.0) / 1000, tool=tool)
+        if row.get("cost_usd"):
+            LLM_COST.inc(float(row["cost_usd"]), tool=tool)
+    except (TypeError, ValueError):
+        pass
+
+
+def observe_source(host: str, status: str, seconds: float) -> None:
+    if not enabled():
+        return
+    host = host or "desconocido"
+    HTTP_REQUESTS.inc(source=host, status=status)
+    HTTP_LATENCY.observe(seconds, source=host)
+    with _SOURCES_LOCK:
+        _SOURCES[host] = (status, time.time())
+
+
+_ORIG_SESSION_SEND: Optional[Callable[..., requests.Response]] = None
+_INSTRUMENT_LOCK = threading.Lock()
+
+
+def instrument_requests() -> None:
+    """Mide todo lo que pasa por requests (idempotente). Va sobre Session.send, arriba de utils_http_replay."""
+    global _ORIG_SESSION_SEND
+    with _INSTRUMENT_LOCK:
+        if _ORIG_SESSION_SEND is not None:
+            return
+        orig = _ORIG_SESSION_SEND = requests.Session.send
+
+    def send(self: requests.Session, request: requests.PreparedRequest, **kwargs: Any) -> requests.Response:
+        host = urlsplit(request.url or "").hostname or ""
+        t0 = time.perf_counter()
+        try:
+            resp = orig(self, request, **kwargs)
+        except Exception:
+            observe_source(host, "error", time.perf_counter() - t0)
+            raise
+        observe_source(host, f"{resp.status_code // 100}xx", time.perf_counter() - t0)
+        return resp
+
+    requests.Session.send = send  # type: ignore[method-assign]
+
+
+# ==========================================================
+# Series calculadas al consultar
+# ==========================================================
+def _active_sessions() -> Optional[int]:
+    try:
+        from streamlit import runtime
+
+        if not runtime.exists():
+            return None
+        return int(runtime.get_instance()._session_mgr.num_active_sessions())
+    except Exception:  # noqa: BLE001 - API interna de Streamlit; si cambia, se omite la serie
+        return None
+
+
+def _collect() -> List[str]:
+    # Importes tardíos: utils_telemetry importa este módulo y utils_jobs importa utils_telemetry
+    import utils_cache_backend
+    import utils_jobs
+    import utils_llm_cache
+    import utils_singleflight
+    from utils_ratelimit import governor
+
+    lines: List[str] = []
+    lines += _gauge("up_seconds", "Segundos desde que arrancó el proceso.", [({}, round(time.time() - _STARTED, 1))])
+    sessions = _active_sessions()
+    if sessions is not None:
+        lines += _gauge("sessions_active", "Sesiones de Streamlit conectadas a este proceso.", [({}, sessions)])
+
+    g = governor().stats()
+    lines += _gauge("limiter_active", "Llamadas al modelo en vuelo (limitador de este proceso).", [({}, g["active"])])
+    lines += _gauge("limiter_queued", "Llamadas al modelo esperando turno en el limitador.", [({}, g["queued"])])
+    lines += _gauge("limiter_paused_seconds", "Pausa restante tras un 429 del proveedor.", [({}, g["paused_s"])])
+    lines += _gauge("limiter_timeouts_total", "Llamadas que agotaron su espera en la cola.", [({}, g["timeouts"])], "counter")
+
+    try:
+        jobs = utils_jobs.counts()
+        lines += _gauge("jobs", "Trabajos en segundo plano por estado (carpeta de datos compartida).",
+                        [({"status": s}, n) for s, n in sorted(jobs.items())])
+    except Exception:  # noqa: BLE001 - la base puede estar bloqueada; /readyz lo reporta
+        pass
+
+    flights = utils_singleflight.stats()
+    lines += _gauge("singleflight_total", "Solicitudes idénticas: llamadas reales vs. atendidas con la de otra sesión.",
+                    [({"role": "leader"}, flights["leaders"]), ({"role": "shared"}, flights["shared"])], "counter")
+
+    llm = utils_llm_cache.counters()
+    samples = [({"cache": "llm", "result": "hit"}, llm["hits"]), ({"cache": "llm", "result": "miss"}, llm["misses"]),
+               ({"cache": "llm", "result": "error"}, llm["errors"])]
+    for ns, row in sorted(utils_cache_backend.counters().items()):
+        samples += [({"cache": ns, "result": "memory_hit"}, row.get("memory_hits", 0)),
+                    ({"cache": ns, "result": "hit"}, row.get("shared_hits", 0)),
+                    ({"cache": ns, "result": "miss"}, row.get("misses", 0)),
+                    ({"cache": ns, "result": "error"}, row.get("errors", 0))]
+    lines += _gauge("cache_requests_total", "Consultas a cachés por resultado (hit / miss).", samples, "counter")
+    return lines
+
+
+def render() -> str:
+    """Exposición completa en formato de texto Prometheus 0.0.4."""
+    lines: List[str] = []
+    for metric in _REGISTRY:
+        lines += metric.render()
+    lines += _collect()
+    return "\n".join(lines) + "\n"
+
+
+# ==========================================================
+# Readiness
+# ==========================================================
+def _max_queue() -> int:
+    try:
+        return max(1, int(os.getenv("IMEMSA_READY_MAX_QUEUE", str(DEFAULT_READY_MAX_QUEUE))))
+    except ValueError:
+        return DEFAULT_READY_MAX_QUEUE
+
+
+def _check(fn: Callable[[], str]) -> Dict[str, Any]:
+    t0 = time.perf_counter()
+    try:
+        detail, ok = fn(), True
+    except Exception as e:  # noqa: BLE001 - cualquier falla se reporta como no lista
+        detail, ok = f"{type(e).__name__}: {e}", False
+    return {"ok": ok, "detail": detail, "ms": round((time.perf_counter() - t0) * 1000, 1)}
+
+
+def _check_data_dir() -> str:
+    probe = data_dir() / f".ready-{os.getpid()}"
+    probe.write_bytes(b"ok")
+    probe.unlink()
+    return str(data_dir())
+
+
+def _check_jobs() -> str:
+    import utils_jobs
+
+    c = utils_jobs.counts()
+    return f"{c['queued']} en cola · {c['running']} corriendo"
+
+
+def _check_cache() -> str:
+    import utils_cache_backend
+
+    utils_cache_backend.get_backend("llm").get("__ready__")
+    return utils_cache_backend.backend_kind()
+
+
+def _check_limiter() -> str:
+    from utils_ratelimit import governor
+
+    g = governor().stats()
+    if g["queued"] >= _max_queue():
+        raise RuntimeError(f"{g['queued']} llamadas en cola (máximo {_max_queue()})")
+    return f"{g['active']} en vuelo · {g['queued']} en cola"
+
+
+def readiness() -> Dict[str, Any]:
+    """Chequeos locales (no llama a servicios externos); `ready` es False si alguno falla."""
+    checks = {
+        "data_dir": _check(_check_data_dir),
+        "jobs": _check(_check_jobs),
+        "cache": _check(_check_cache),
+        "limiter": _check(_check_limiter),
+    }
+    now = time.time()
+    with _SOURCES_LOCK:
+        sources = {h: {"last_status": s, "age_s": round(now - ts, 1)} for h, (s, ts) in sorted(_SOURCES.items())}
+    return {
+        "ready": all(c["ok"] for c in checks.values()),
+        "checks": checks,
+        "openai_key": bool(os.getenv("OPENAI_API_KEY", "").strip()),
+        "sessions": _active_sessions(),
+        "sources": sources,  # informativo: última respuesta vista por host
+        "pid": os.getpid(),
+        "uptime_s": round(now - _STARTED, 1),
+    }
+
+
+# ==========================================================
+# Rutas HTTP (Starlette, vía st.App en serve.py)
+# ==========================================================
+def _authorized(headers: Any) -> bool:
+    token = os.getenv("IMEMSA_METRICS_TOKEN", "").strip()
+    if not token:
+        return True
+    # En bytes: compare_digest con str no acepta caracteres fuera de ASCII (TypeError → 500)
+    given = headers.get("authorization", "").encode("utf-8")
+    return hmac.compare_digest(given, f"Bearer {token}".encode("utf-8"))
+
+
+def routes() -> list:
+    """Rutas /metrics y /readyz; además instrumenta requests en este proceso."""
+    from starlette.responses import JSONResponse, PlainTextResponse, Response
+    from starlette.routing import Route
+
+    instrument_requests()
+
+    # Funciones síncronas: Starlette las corre en su pool de hilos (las consultas SQLite bloquean)
+    def metrics(request: Any) -> Response:
+        if not _authorized(request.headers):
+            return PlainTextResponse("unauthorized\n", status_code=401)
+        return PlainTextResponse(render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+    def ready(request: Any) -> Response:
+        if not _authorized(request.headers):
+            return JSONResponse({"error": "unauthorized"}, status_code=401)
+        body = readiness()
+        return JSONResponse(body, status_code=200 if body["ready"] else 503)
+
+    return [Route("/metrics", metrics), Route("/readyz", ready)]
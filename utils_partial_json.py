@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+import json
+from typing import Any, List, Optional, Tuple
+
+
+# ==========================================================
+# JSON parcial (para respuestas en streaming)
+#
+# parse_partial_json('{"summary": "ok", "actions": [{"a": 1}, {"a": ')
+#   → {"summary": "ok", "actions": [{"a": 1}]}
+#
+# Se corta en el último punto seguro (después de un valor terminado) y se
+# cierran los contenedores abiertos. Los escalares salen siempre completos; un
+# objeto/lista anidado aparece en cuanto tiene un miembro terminado (nunca como
+# {} o [] vacío a medias), pero el último puede faltarle llaves que aún no llegan.
+# ==========================================================
+def _scan(text: str) -> Tuple[int, List[Tuple[int, str]]]:
+    """Devuelve (inicio del objeto, [(posición de corte, cierres pendientes)])."""
+    start = text.find("{")
+    if start < 0:
+        return -1, []
+
+    stack: List[List[str]] = []  # [tipo, estado] estado: "key" | "value"
+    safe: List[Tuple[int, str]] = []
+    in_str = False
+    esc = False
+
+    def closers() -> str:
+        return "".join("}" if t == "{" else "]" for t, _ in reversed(stack))
+
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_str:
+            if esc:
+                esc = False
+            elif ch == "\\":
+                esc = True
+            elif ch == '"':
+                in_str = False
+                # Una cadena terminada es punto seguro si es valor (no llave)
+                if stack and not (stack[-1][0] == "{" and stack[-1][1] == "key"):
+                    safe.append((i + 1, closers()))
+            continue
+
+        if ch == '"':
+            in_str = True
+        elif ch in "{[":
+            stack.append([ch, "key" if ch == "{" else "value"])
+            if len(stack) == 1:
+                safe.append((i + 1, closers()))  # anidados: hasta su primer miembro terminado
+        elif ch in "}]":
+            if not stack:
+                break
+            stack.pop()
+            safe.append((i + 1, closers()))
+            if not stack:
+                break
+        elif ch == ":":
+            if stack:
+                stack[-1][1] = "value"
+        elif ch == ",":
+            # Todo lo anterior a la coma está completo (incluye números y literales)
+            safe.append((i, closers()))
+            if stack and stack[-1][0] == "{":
+                stack[-1][1] = "key"
+    return start, safe
+
+
+def parse_partial_json(text: str) -> Optional[Any]:
+    """Mejor objeto JSON válido a partir de un prefijo; None si aún no hay nada útil."""
+    text = text or ""
+    start, safe = _scan(text)
+    if start < 0:
+        return None
+    for pos, close in reversed(safe):
+        candidate = text[start:pos].rstrip().rstrip(",") + close
+        try:
+            return json.loads(candidate)
+        except ValueError:
+            continue
+    return None
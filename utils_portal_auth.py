@@ -1,3 +1,6 @@
+import hmac
+import os
+
 import streamlit as st
 
 def require_login_redirect() -> None:
@@ -12,3 +15,31 @@ def require_login_redirect() -> None:
 
     # redirección directa
     st.switch_page("app.py")
+
+
+def require_admin() -> None:
+    """
+    Páginas de administración: además del login pide la contraseña de admin
+    (st.secrets["ADMIN_PASSWORD"] o variable de entorno ADMIN_PASSWORD).
+    Si no está configurada, la página queda deshabilitada.
+    """
+    require_login_redirect()
+    if st.session_state.get("admin", False):
+        return
+
+    try:
+        expected = st.secrets.get("ADMIN_PASSWORD") if hasattr(st, "secrets") else None
+    except Exception:
+        expected = None
+    expected = str(expected or os.getenv("ADMIN_PASSWORD") or "")
+    if not expected:
+        st.info("Configura el Secret **ADMIN_PASSWORD** para habilitar esta página.")
+        st.stop()
+
+    pwd = st.text_input("Contraseña de administrador", type="password", key="admin_pw")
+    if not pwd:
+        st.stop()
+    if not hmac.compare_digest(pwd.encode("utf-8"), expected.encode("utf-8")):
+        st.error("Contraseña incorrecta.")
+        st.stop()
+    st.session_state["admin"] = True
@@ -0,0 +1,348 @@
+from __future__ import annotations
+
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from types import CodeType, FrameType
+from typing import Any, Dict, List, Optional
+
+import streamlit as st
+
+from utils_storage import data_dir
+
+
+# ==========================================================
+# Perfilador por muestreo de UNA ejecución del script (solo administradores)
+#
+#   utils_profiler.run_hook()     # en app.py y en cada página, tras el login
+#
+# Un administrador (st.session_state["admin"], ver require_admin) activa en la
+# barra lateral "Perfilar la siguiente ejecución". En la siguiente ejecución de
+# la página, run_hook() lanza un hilo que toma la pila del hilo del script
+# (sys._current_frames) cada IMEMSA_PROFILE_INTERVAL_MS hasta que la ejecución
+# termina: el frame del módulo de la página sale de la pila (fin normal,
+# st.stop(), st.rerun() o excepción). No requiere paquetes externos.
+#
+# El código a nivel de módulo (p. ej. toda la generación del Excel de
+# indicadores en la página 7) se desglosa por línea bajo el nodo de la página.
+# Los trabajos en segundo plano (utils_jobs) corren en otros hilos: su tiempo
+# se ve en las trazas (utils_tracing), no aquí.
+#
+# Resultado en la barra lateral: funciones más costosas (tiempo propio / total),
+# flame graph interactivo (diálogo) y descarga en formato "collapsed stacks"
+# (flamegraph.pl, speedscope.app). También se guarda en <datos>/profiles.
+#
+# Variables de entorno:
+#   IMEMSA_PROFILER              "0" para ocultar el perfilador
+#   IMEMSA_PROFILE_INTERVAL_MS   intervalo de muestreo (default 5)
+#   IMEMSA_PROFILE_MAX_S         tope de duración de un perfil (default 300)
+#   IMEMSA_PROFILE_KEEP          perfiles que se conservan en disco (default 20)
+# ==========================================================
+SUBDIR = "profiles"
+ARM_KEY = "_profiler_arm"
+SKIP_KEY = "_profiler_skip"
+STATE_KEY = "_profiler_state"
+TOP_HOTSPOTS = 15
+FLAME_MIN_FRACTION = 0.002  # nodos más chicos que esto no se dibujan
+
+BASE_DIR = Path(__file__).resolve().parent
+_LABELS: Dict[CodeType, str] = {}
+
+
+def enabled() -> bool:
+    return os.getenv("IMEMSA_PROFILER", "1").strip().lower() not in ("0", "false", "no", "off")
+
+
+def _env_float(name: str, default: float, lo: float) -> float:
+    try:
+        return max(lo, float(os.getenv(name, str(default))))
+    except ValueError:
+        return default
+
+
+@dataclass
+class Profile:
+    page: str
+    started: float  # epoch (s)
+    duration_ms: float
+    interval_ms: float
+    stacks: Counter = field(default_factory=Counter)  # (raíz, ..., hoja) -> muestras
+    truncated: bool = False
+    path: Optional[Path] = None
+
+    @property
+    def samples(self) -> int:
+        return sum(self.stacks.values())
+
+    @property
+    def ms_per_sample(self) -> float:
+        # Duración real entre muestras (sleep + GIL), no el intervalo pedido
+        return self.duration_ms / self.samples if self.samples else self.interval_ms
+
+    def collapsed(self) -> str:
+        """Formato de flamegraph.pl / speedscope: `raíz;...;hoja muestras` por línea."""
+        return "".join(f"{';'.join(stack)} {n}\n" for stack, n in self.stacks.most_common())
+
+    def hotspots(self, top: int = TOP_HOTSPOTS) -> List[Dict[str, Any]]:
+        own: Counter = Counter()
+        total: Counter = Counter()
+        for stack, n in self.stacks.items():
+            own[stack[-1]] += n
+            for label in set(stack):
+                total[label] += n
+        ms, samples = self.ms_per_sample, self.samples or 1
+        return [
+            {
+                "función": label,
+                "propio_ms": round(n * ms, 1),
+                "total_ms": round(total[label] * ms, 1),
+                "propio_%": round(100 * n / samples, 1),
+            }
+            for label, n in own.most_common(top)
+        ]
+
+    def flame_tree(self) -> Dict[str, Any]:
+        root: Dict[str, Any] = {"n": self.page, "v": 0, "c": {}}
+        for stack, n in self.stacks.items():
+            root["v"] += n
+            node = root
+            for label in stack:
+                node = node["c"].setdefault(label, {"n": label, "v": 0, "c": {}})
+                node["v"] += n
+        min_v = max(1, int(root["v"] * FLAME_MIN_FRACTION))
+
+        def _pack(node: Dict[str, Any]) -> Dict[str, Any]:
+            kids = sorted((k for k in node["c"].values() if k["v"] >= min_v), key=lambda k: -k["v"])
+            return {"n": node["n"], "v": node["v"], "c": [_pack(k) for k in kids]}
+
+        return _pack(root)
+
+
+@dataclass
+class _State:
+    """Por sesión (vive en st.session_state; el hilo muestreador solo reemplaza `last`)."""
+
+    sampler: Optional["_Sampler"] = None
+    last: Optional[Profile] = None
+    fresh: bool = False
+
+
+# ==========================================================
+# Muestreo
+# ==========================================================
+def _short(filename: str) -> str:
+    """Ruta legible: relativa al repo, al paquete instalado o solo el nombre."""
+    path = os.path.abspath(filename)
+    if path.startswith(str(BASE_DIR) + os.sep):
+        return os.path.relpath(path, BASE_DIR)
+    if "site-packages" + os.sep in path:
+        return path.split("site-packages" + os.sep, 1)[1]
+    return os.path.basename(path)
+
+
+def _label(code: CodeType) -> str:
+    label = _LABELS.get(code)
+    if label is None:
+        label = f"{code.co_name} ({_short(code.co_filename)}:{code.co_firstlineno})".replace(";", ",")
+        _LABELS[code] = label
+    return label
+
+
+class _Sampler(threading.Thread):
+    def __init__(self, state: _State, root: FrameType, page: str) -> None:
+        super().__init__(name=f"profiler:{page}", daemon=True)
+        self.state = state
+        self.root: Optional[FrameType] = root
+        self.page = page
+        self.tid = threading.get_ident()
+        self.interval_s = _env_float("IMEMSA_PROFILE_INTERVAL_MS", 5.0, 1.0) / 1000
+        self.max_s = _env_float("IMEMSA_PROFILE_MAX_S", 300.0, 1.0)
+
+    def run(self) -> None:
+        stacks: Counter = Counter()
+        started, t0 = time.time(), time.perf_counter()
+        truncated = False
+        page_file = _short(self.page)
+        while True:
+            time.sleep(self.interval_s)
+            frame = sys._current_frames().get(self.tid)
+            stack: List[str] = []
+            while frame is not None and frame is not self.root:
+                stack.append(_label(frame.f_code))
+                frame = frame.f_back
+            if frame is None:
+                break  # el módulo de la página ya no está en la pila: terminó la ejecución
+            stack.append(f"{page_file}:{frame.f_lineno}")
+            stack.append(_label(frame.f_code))
+            stacks[tuple(reversed(stack))] += 1
+            if time.perf_counter() - t0 > self.max_s:
+                truncated = True
+                break
+        self.root = None  # suelta el frame (y con él los globals de la página)
+
+        prof = Profile(
+            page=page_file,
+            started=started,
+            duration_ms=(time.perf_counter() - t0) * 1000,
+            interval_ms=self.interval_s * 1000,
+            stacks=stacks,
+            truncated=truncated,
+        )
+        prof.path = _save(prof)
+        self.state.last = prof
+        self.state.fresh = True
+
+
+def _save(prof: Profile) -> Optional[Path]:
+    try:
+        keep = int(_env_float("IMEMSA_PROFILE_KEEP", 20, 1))
+        folder = data_dir(SUBDIR)
+        stamp = datetime.fromtimestamp(prof.started).strftime("%Y%m%d-%H%M%S")
+        path = folder / f"{stamp}-{Path(prof.page).stem}.txt"
+        path.write_text(prof.collapsed(), encoding="utf-8")
+        for old in sorted(folder.glob("*.txt"))[:-keep]:
+            old.unlink()
+        return path
+    except OSError:
+        return None
+
+
+# ==========================================================
+# Gancho por ejecución + panel lateral
+# ==========================================================
+def _on_arm() -> None:
+    # La ejecución que provoca el propio toggle no se perfila
+    st.session_state[SKIP_KEY] = True
+
+
+def run_hook() -> None:
+    """Llamar a nivel de módulo en cada página: perfila esta ejecución si está armado."""
+    if not enabled() or not st.session_state.get("admin", False):
+        return
+    state: _State = st.session_state.setdefault(STATE_KEY, _State())
+    if state.sampler is not None and state.sampler.is_alive():
+        state.sampler.join(timeout=1.0)  # rerun rápido: el perfil anterior aún se está cerrando
+
+    if st.session_state.pop(SKIP_KEY, False):
+        pass
+    elif st.session_state.get(ARM_KEY, False):
+        st.session_state[ARM_KEY] = False
+        caller = sys._getframe(1)
+        state.sampler = _Sampler(state, caller, caller.f_code.co_filename)
+        state.sampler.start()
+
+    _panel(state)
+
+
+def _panel(state: _State) -> None:
+    running = state.sampler is not None and state.sampler.is_alive()
+    expanded = bool(st.session_state.get(ARM_KEY) or running or state.fresh)
+    with st.sidebar.expander("🔬 Perfilador (admin)", expanded=expanded):
+        st.toggle(
+            "Perfilar la siguiente ejecución",
+            key=ARM_KEY,
+            on_change=_on_arm,
+            help="La próxima vez que corra la página (clic, carga, navegación) se muestrea su pila.",
+        )
+        if running:
+            st.caption("⏺️ Perfilando esta ejecución… el resultado aparece al interactuar de nuevo.")
+            return
+        prof = state.last
+        if prof is None:
+            return
+        state.fresh = False
+        when = datetime.fromtimestamp(prof.started).strftime("%H:%M:%S")
+        note = " · truncado" if prof.truncated else ""
+        st.caption(
+            f"`{prof.page}` a las {when} · {prof.duration_ms / 1000:0.2f} s · "
+            f"{prof.samples} muestras (~{prof.ms_per_sample:0.1f} ms){note}"
+        )
+        if not prof.samples:
+            st.caption("La ejecución fue más corta que el intervalo de muestreo.")
+            return
+        st.dataframe(prof.hotspots(), hide_index=True, use_container_width=True)
+        st.download_button(
+            "⬇️ Perfil (collapsed stacks)",
+            data=prof.collapsed(),
+            file_name=prof.path.name if prof.path else "perfil.txt",
+            mime="text/plain",
+            use_container_width=True,
+            help="Se abre en speedscope.app o con flamegraph.pl.",
+        )
+        if st.button("🔥 Flame graph", use_container_width=True):
+            _show_flame(prof)
+
+
+def _flame_html(prof: Profile) -> str:
+    data = json.dumps({"tree": prof.flame_tree(), "ms": prof.ms_per_sample}, ensure_ascii=False)
+    return _FLAME_TEMPLATE.replace("__DATA__", data.replace("</", "<\\/"))
+
+
+def _embed(html: str, height: int) -> None:
+    # st.iframe (Streamlit reciente) o components.html en versiones anteriores
+    if hasattr(st, "iframe"):
+        st.iframe(html, height=height)
+    else:
+        import streamlit.components.v1 as components
+
+        components.html(html, height=height, scrolling=True)
+
+
+def _show_flame(prof: Profile) -> None:
+    dialog = getattr(st, "dialog", None)
+    if dialog is None:
+        _embed(_flame_html(prof), 520)
+        return
+
+    @dialog(f"Flame graph · {prof.page}", width="large")
+    def _body() -> None:
+        st.caption("Clic en un bloque para acercar; clic en la raíz para regresar. Ancho = tiempo.")
+        _embed(_flame_html(prof), 560)
+
+    _body()
+
+
+_FLAME_TEMPLATE = """<!doctype html>
+<html><head><meta charset="utf-8"><style>
+body{margin:0;font:12px system-ui,sans-serif;color:#1f2937}
+#tip{height:18px;padding:4px 6px;white-space:nowrap;overflow:hidden;text-overflow:ellipsis}
+#g{position:relative}
+.f{position:absolute;height:17px;box-sizing:border-box;border:1px solid #fff;border-radius:2px;
+   padding:0 3px;overflow:hidden;white-space:nowrap;text-overflow:ellipsis;cursor:pointer;line-height:15px}
+.f:hover{filter:brightness(.9)}
+</style></head><body><div id="tip">&nbsp;</div><div id="g"></div><script>
+const D=__DATA__, ROW=18, g=document.getElementById("g"), tip=document.getElementById("tip");
+function color(n){const m=n.match(/\\(([^:]*)/), f=m?m[1]:n; let h=0;
+  for(const c of f)h=(h*31+c.charCodeAt(0))|0;
+  return f.startsWith("pages")||f.startsWith("utils")||f.startsWith("services")
+    ? `hsl(${200+Math.abs(h)%40},70%,${72+Math.abs(h>>3)%12}%)`
+    : `hsl(${20+Math.abs(h)%35},85%,${68+Math.abs(h>>3)%14}%)`;}
+function draw(focus){
+  g.innerHTML=""; const W=g.clientWidth||document.body.clientWidth, total=D.tree.v; let depth=0;
+  function place(node,x,w,d,path){
+    if(w<1)return; depth=Math.max(depth,d);
+    const el=document.createElement("div"); el.className="f";
+    el.style.left=x+"px"; el.style.width=w+"px"; el.style.top=(d*ROW)+"px";
+    el.style.background=d===0?"#e5e7eb":color(node.n); el.textContent=node.n;
+    const info=`${node.n} — ${(node.v*D.ms).toFixed(1)} ms (${(100*node.v/total).toFixed(1)}%)`;
+    el.title=info; el.onmouseenter=()=>{tip.textContent=info};
+    el.onclick=(e)=>{e.stopPropagation(); draw(d===0?null:path)}; g.appendChild(el);
+    let cx=x; for(const k of node.c){const kw=w*k.v/node.v; place(k,cx,kw,d+1,path.concat([k])); cx+=kw;}
+  }
+  if(!focus){place(D.tree,0,W,0,[]);}
+  else{ // ancestros a lo ancho + subárbol enfocado
+    let node=D.tree; place({n:D.tree.n,v:D.tree.v,c:[]},0,W,0,[]);
+    focus.forEach((k,i)=>{ if(i<focus.length-1){place({n:k.n,v:k.v,c:[]},0,W,i+1,focus.slice(0,i+1));} });
+    place(focus[focus.length-1],0,W,focus.length,focus);
+  }
+  g.style.height=((depth+1)*ROW)+"px";
+}
+draw(null); window.addEventListener("resize",()=>draw(null));
+</script></body></html>
+"""
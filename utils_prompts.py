@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Union
+
+
+# ==========================================================
+# Prompts con prefijo estático (caché de prompts del proveedor)
+#
+# OpenAI reutiliza automáticamente el cómputo del prefijo más largo que ya vio
+# (a partir de ~1024 tokens, en bloques de 128): menos latencia y los tokens en
+# caché cuestan menos. Solo funciona si el inicio del prompt es IDÉNTICO byte
+# a byte entre llamadas, por eso cada herramienta arma sus mensajes así:
+#
+#   system: reglas + esquema + glosario fijo   (static_prefix, nunca cambia)
+#   user:   tono, dirección, contexto, texto…  (todo lo variable, al final)
+#
+# check_prefix() guarda el hash del prefijo de cada herramienta y avisa si
+# cambia dentro del proceso (p. ej. alguien interpoló un dato del usuario).
+#
+# Variables de entorno:
+#   IMEMSA_PROMPT_STRICT  "1" para lanzar PromptPrefixDrift en lugar de solo registrar
+# ==========================================================
+log = logging.getLogger(__name__)
+
+_LOCK = threading.Lock()
+_SEEN: Dict[str, str] = {}
+_DRIFTS: Dict[str, int] = {}
+
+
+class PromptPrefixDrift(RuntimeError):
+    """El prefijo estático de una herramienta cambió entre llamadas."""
+
+
+@dataclass(frozen=True)
+class PromptPrefix:
+    tool: str
+    text: str
+
+    @property
+    def digest(self) -> str:
+        return hashlib.sha256(self.text.encode("utf-8")).hexdigest()[:16]
+
+    @property
+    def cache_key(self) -> str:
+        """Valor para `prompt_cache_key`: agrupa en el proveedor las llamadas con este prefijo."""
+        return f"imemsa-{self.tool}-{self.digest}"
+
+    def messages(self, user: Union[str, List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """[system = prefijo estático, user = contenido variable (texto o partes con imágenes)]."""
+        check_prefix(self.tool, self.text)
+        return [{"role": "system", "content": self.text}, {"role": "user", "content": user}]
+
+
+def schema_block(schema: Any) -> str:
+    """Esquema serializado siempre igual (orden de llaves del literal, sin espacios variables)."""
+    return json.dumps(schema, ensure_ascii=False)
+
+
+def static_prefix(tool: str, *parts: str, schema: Optional[Any] = None) -> PromptPrefix:
+    """Une las partes fijas del prompt (y el esquema, al final) en un prefijo estable."""
+    blocks = [p.strip("\n") for p in parts if p]
+    if schema is not None:
+        blocks.append("Esquema EXACTO:\n" + schema_block(schema))
+    return PromptPrefix(tool=tool, text="\n\n".join(blocks))
+
+
+def check_prefix(tool: str, text: str) -> str:
+    """Registra el hash del prefijo de `tool`; si difiere del primero visto, lo reporta."""
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+    with _LOCK:
+        first = _SEEN.setdefault(tool, digest)
+        if first == digest:
+            return digest
+        _DRIFTS[tool] = _DRIFTS.get(tool, 0) + 1
+    msg = f"El prefijo estático de '{tool}' cambió ({first} → {digest}); la caché del proveedor no aplicará."
+    if os.getenv("IMEMSA_PROMPT_STRICT", "") == "1":
+        raise PromptPrefixDrift(msg)
+    log.warning(msg)
+    return digest
+
+
+def prefix_stats() -> Dict[str, Dict[str, Any]]:
+    """Hash registrado y número de desviaciones por herramienta (este proceso)."""
+    with _LOCK:
+        return {t: {"digest": d, "drifts": _DRIFTS.get(t, 0)} for t, d in _SEEN.items()}
@@ -0,0 +1,286 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, Iterator, Optional
+
+
+# ==========================================================
+# Limitador compartido para la API de OpenAI (una sola key para todo el portal)
+#
+# Toda llamada LLM pasa por governor().slot(...):
+# - Token bucket de solicitudes por minuto (RPM) y de tokens por minuto (TPM).
+# - Semáforo de concurrencia (máximo de llamadas en vuelo).
+# - Cola justa: round-robin entre sesiones, así una sesión con muchos trabajos
+#   no deja esperando a las demás.
+# - Un 429 del servicio pausa a todos durante el Retry-After.
+#
+# Variables de entorno:
+#   IMEMSA_OPENAI_RPM           solicitudes por minuto (default 500)
+#   IMEMSA_OPENAI_TPM           tokens por minuto (default 200000)
+#   IMEMSA_OPENAI_CONCURRENCY   llamadas simultáneas (default 8)
+#   IMEMSA_OPENAI_QUEUE_TIMEOUT segundos máximos en cola (default 120)
+# ==========================================================
+DEFAULT_RPM = 500
+DEFAULT_TPM = 200_000
+DEFAULT_CONCURRENCY = 8
+DEFAULT_QUEUE_TIMEOUT = 120.0
+DEFAULT_COMPLETION_TOKENS = 1024  # si la llamada no fija max_tokens
+CHARS_PER_TOKEN = 4
+IMAGE_TOKENS = 1100  # imagen "high detail" típica (no se cuenta el base64 como texto)
+
+
+class RateLimitTimeout(Exception):
+    """La llamada esperó en cola más de lo permitido (se trata como 429)."""
+
+    status_code = 429
+
+
+def _env_number(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, "") or default)
+    except ValueError:
+        return default
+
+
+class _Bucket:
+    """Token bucket: capacidad = límite por minuto, se rellena de forma continua."""
+
+    def __init__(self, per_minute: float) -> None:
+        self.capacity = max(1.0, float(per_minute))
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self.stamp = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def wait_for(self, amount: float, now: float) -> float:
+        """Segundos hasta poder tomar `amount` (0 si ya se puede)."""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount: float) -> None:
+        self.level -= min(amount, self.capacity)
+
+    def adjust(self, delta: float) -> None:
+        # Devuelve (delta > 0) o cobra (delta < 0) la diferencia entre lo estimado y lo usado
+        self.level = min(self.capacity, self.level + delta)
+
+
+@dataclass
+class Ticket:
+    owner: str
+    tokens: int
+    enqueued: float = field(default_factory=time.monotonic)
+    granted: Optional[float] = None
+    used: Optional[int] = None  # tokens reales (usage.total_tokens), si se conocen
+
+
+class Governor:
+    def __init__(
+        self,
+        rpm: float = DEFAULT_RPM,
+        tpm: float = DEFAULT_TPM,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        queue_timeout: float = DEFAULT_QUEUE_TIMEOUT,
+    ) -> None:
+        self.requests = _Bucket(rpm)
+        self.tokens = _Bucket(tpm)
+        self.concurrency = max(1, int(concurrency))
+        self.queue_timeout = queue_timeout
+        self._cv = threading.Condition()
+        self._queues: "OrderedDict[str, Deque[Ticket]]" = OrderedDict()
+        self._active = 0
+        self._paused_until = 0.0
+        self._granted = 0
+        self._timeouts = 0
+        self._wait_total = 0.0
+
+    # ---------- cola justa
+    def _head(self) -> Optional[Ticket]:
+        for q in self._queues.values():
+            if q:
+                return q[0]
+        return None
+
+    def _dequeue(self, ticket: Ticket) -> None:
+        q = self._queues.get(ticket.owner)
+        if q is None:
+            return
+        try:
+            q.remove(ticket)
+        except ValueError:
+            pass
+        if q:
+            self._queues.move_to_end(ticket.owner)  # siguiente turno para otra sesión
+        else:
+            del self._queues[ticket.owner]
+
+    def acquire(self, owner: str, tokens: int, timeout: Optional[float] = None) -> Ticket:
+        ticket = Ticket(owner=owner or "anon", tokens=max(0, int(tokens)))
+        deadline = time.monotonic() + (self.queue_timeout if timeout is None else timeout)
+        with self._cv:
+            self._queues.setdefault(ticket.owner, deque()).append(ticket)
+            while True:
+                now = time.monotonic()
+                wait: Optional[float] = None
+                if self._head() is ticket and self._active < self.concurrency:
+                    wait = max(
+                        self._paused_until - now,
+                        self.requests.wait_for(1, now),
+                        self.tokens.wait_for(ticket.tokens, now),
+                    )
+                    if wait <= 0:
+                        self.requests.take(1)
+                        self.tokens.take(ticket.tokens)
+                        self._active += 1
+                        self._granted += 1
+                        ticket.granted = now
+                        self._wait_total += now - ticket.enqueued
+                        self._dequeue(ticket)
+                        self._cv.notify_all()
+                        return ticket
+                remaining = deadline - now
+                if remaining <= 0:
+                    self._timeouts += 1
+                    self._dequeue(ticket)
+                    self._cv.notify_all()
+                    raise RateLimitTimeout(f"Sin capacidad tras {self.queue_timeout:g} s en cola.")
+                self._cv.wait(remaining if wait is None else min(wait, remaining))
+
+    def try_acquire(self, owner: str, tokens: int) -> Optional[Ticket]:
+        """Turno solo si hay capacidad inmediata y nadie en cola (p. ej. solicitudes duplicadas)."""
+        ticket = Ticket(owner=owner or "anon", tokens=max(0, int(tokens)))
+        with self._cv:
+            now = time.monotonic()
+            if (
+                self._head() is not None
+                or self._active >= self.concurrency
+                or self._paused_until > now
+                or self.requests.wait_for(1, now) > 0
+                or self.tokens.wait_for(ticket.tokens, now) > 0
+            ):
+                return None
+            self.requests.take(1)
+            self.tokens.take(ticket.tokens)
+            self._active += 1
+            self._granted += 1
+            ticket.granted = now
+            return ticket
+
+    def release(self, ticket: Ticket) -> None:
+        with self._cv:
+            if ticket.used is not None:
+                self.tokens.adjust(ticket.tokens - ticket.used)
+            self._active = max(0, self._active - 1)
+            self._cv.notify_all()
+
+    def pause(self, seconds: float) -> None:
+        """El servicio respondió 429: nadie sale de la cola durante `seconds`."""
+        with self._cv:
+            self._paused_until = max(self._paused_until, time.monotonic() + max(0.0, seconds))
+            self._cv.notify_all()
+
+    @contextmanager
+    def slot(self, tokens: int = 0, owner: Optional[str] = None) -> Iterator[Ticket]:
+        ticket = self.acquire(owner or current_owner(), tokens)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cv:
+            now = time.monotonic()
+            return {
+                "active": self._active,
+                "queued": sum(len(q) for q in self._queues.values()),
+                "sessions_waiting": sum(1 for q in self._queues.values() if q),
+                "granted": self._granted,
+                "timeouts": self._timeouts,
+                "avg_wait_s": round(self._wait_total / self._granted, 3) if self._granted else 0.0,
+                "paused_s": round(max(0.0, self._paused_until - now), 2),
+                "rpm_available": round(self.requests.level, 1),
+                "tpm_available": round(self.tokens.level, 1),
+            }
+
+
+# ==========================================================
+# Instancia del proceso + dueño de la llamada
+# ==========================================================
+_GOVERNOR: Optional[Governor] = None
+_GOVERNOR_LOCK = threading.Lock()
+_LOCAL = threading.local()
+
+
+def governor() -> Governor:
+    global _GOVERNOR
+    if _GOVERNOR is None:
+        with _GOVERNOR_LOCK:
+            if _GOVERNOR is None:
+                _GOVERNOR = Governor(
+                    rpm=_env_number("IMEMSA_OPENAI_RPM", DEFAULT_RPM),
+                    tpm=_env_number("IMEMSA_OPENAI_TPM", DEFAULT_TPM),
+                    concurrency=int(_env_number("IMEMSA_OPENAI_CONCURRENCY", DEFAULT_CONCURRENCY)),
+                    queue_timeout=_env_number("IMEMSA_OPENAI_QUEUE_TIMEOUT", DEFAULT_QUEUE_TIMEOUT),
+                )
+    return _GOVERNOR
+
+
+@contextmanager
+def owner_scope(owner: str) -> Iterator[None]:
+    """Atribuye las llamadas de este hilo a `owner` (p. ej. trabajos en segundo plano)."""
+    prev = getattr(_LOCAL, "owner", None)
+    _LOCAL.owner = owner
+    try:
+        yield
+    finally:
+        _LOCAL.owner = prev
+
+
+def current_owner() -> str:
+    """Dueño para la cola justa: owner_scope, o la sesión de Streamlit del hilo actual."""
+    owner = getattr(_LOCAL, "owner", None)
+    if owner:
+        return owner
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+        ctx = get_script_run_ctx(suppress_warning=True)
+    except Exception:
+        ctx = None
+    return getattr(ctx, "session_id", None) or "anon"
+
+
+def _prompt_tokens(content: Any) -> int:
+    if isinstance(content, str):
+        return len(content) // CHARS_PER_TOKEN
+    if isinstance(content, list):
+        return sum(_prompt_tokens(part) for part in content)
+    if isinstance(content, dict):
+        if content.get("type") == "image_url":
+            return IMAGE_TOKENS
+        return sum(_prompt_tokens(v) for k, v in content.items() if k != "role")
+    return len(json.dumps(content, ensure_ascii=False, default=str)) // CHARS_PER_TOKEN
+
+
+def estimate_prompt_tokens(messages: Any) -> int:
+    """Tokens de entrada estimados (caracteres / 4; cada imagen cuenta IMAGE_TOKENS)."""
+    return _prompt_tokens(messages or "")
+
+
+def estimate_tokens(payload: Optional[Dict[str, Any]]) -> int:
+    """Estimación barata (caracteres / 4 del prompt + tope de salida) para reservar TPM."""
+    if not payload:
+        return 0
+    prompt = _prompt_tokens(payload.get("messages") or payload.get("input") or "")
+    completion = payload.get("max_tokens") or payload.get("max_completion_tokens") or DEFAULT_COMPLETION_TOKENS
+    return prompt + int(completion)
@@ -0,0 +1,56 @@
+from __future__ import annotations
+
+import hashlib
+import json
+from typing import Any, Optional
+
+import streamlit as st
+
+
+# ==========================================================
+# Resultados por sesión (sobreviven a los reruns)
+#
+# Un clic en st.download_button o una edición en st.data_editor vuelve a
+# ejecutar la página con btn=False. Guardando el último resultado por
+# herramienta (y la llave de sus entradas) se vuelve a pintar sin llamar
+# de nuevo al modelo. Si cambian las entradas, el resultado viejo no se muestra.
+# ==========================================================
+_PREFIX = "_result::"
+
+
+def file_fingerprint(f: Any) -> Any:
+    """Identidad barata de un archivo subido (sin hashear todo el contenido si se puede)."""
+    if f is None:
+        return None
+    file_id = getattr(f, "file_id", None)
+    if file_id:
+        return [f.name, getattr(f, "size", None), file_id]
+    return [f.name, hashlib.sha256(f.getvalue()).hexdigest()]
+
+
+def input_key(*parts: Any) -> str:
+    """Hash estable de las entradas y parámetros de una herramienta."""
+    h = hashlib.sha256()
+    for p in parts:
+        if isinstance(p, (bytes, bytearray)):
+            h.update(hashlib.sha256(p).digest())
+        else:
+            h.update(json.dumps(p, ensure_ascii=False, sort_keys=True, default=str).encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+def save_result(tool: str, key: str, value: Any) -> None:
+    st.session_state[_PREFIX + tool] = {"key": key, "value": value}
+
+
+def load_result(tool: str, key: str) -> Optional[Any]:
+    """Último resultado de la herramienta si corresponde a las entradas actuales."""
+    entry = st.session_state.get(_PREFIX + tool)
+    if not entry or entry.get("key") != key:
+        return None
+    return entry.get("value")
+
+
+def clear_result(tool: str) -> None:
+    st.session_state.pop(_PREFIX + tool, None)
@@ -0,0 +1,208 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
+
+import utils_ratelimit
+import utils_telemetry
+import utils_tracing
+
+
+# ==========================================================
+# Single-flight: solicitudes idénticas en curso se hacen UNA vez
+#
+# Si dos sesiones mandan lo mismo al mismo tiempo (p. ej. un correo reenviado
+# a varios coordinadores), la segunda no llama al modelo: espera el resultado
+# de la primera y recibe el mismo. Solo aplica a llamadas EN CURSO dentro del
+# proceso; lo ya terminado lo cubre la caché en disco (utils_llm_cache).
+#
+#   result, shared = do(key, lambda: request(...))
+#   for chunk, shared in stream(key, lambda: chat_stream(...)): ...
+#
+# - do(): los seguidores esperan el Future del líder (resultado o excepción).
+# - stream(): el stream real se lee en un hilo aparte y todos los lectores
+#   reciben los mismos fragmentos desde el inicio, conforme llegan. Si la
+#   sesión que lo abrió reejecuta la página, los demás no pierden nada; solo
+#   cuando ya nadie lee se corta la respuesta.
+#
+# Variables de entorno:
+#   IMEMSA_SINGLEFLIGHT  "0" para desactivar (default "1")
+# ==========================================================
+T = TypeVar("T")
+
+_LOCK = threading.Lock()
+_CALLS: Dict[str, Future] = {}
+_STREAMS: Dict[str, "_Broadcast"] = {}
+_STATS = {"leaders": 0, "shared": 0, "aborted": 0}
+
+
+class FlightAborted(Exception):
+    """Un stream compartido se cortó porque ya nadie lo leía."""
+
+
+def enabled() -> bool:
+    return os.getenv("IMEMSA_SINGLEFLIGHT", "1").strip().lower() not in ("0", "false", "no", "off")
+
+
+def make_key(endpoint: str, payload: Any = None, files: Optional[Dict[str, Any]] = None) -> str:
+    """sha256 de endpoint + payload (JSON canónico) + bytes de archivos multipart."""
+    h = hashlib.sha256(endpoint.encode("utf-8"))
+    h.update(json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8"))
+    for name in sorted(files or {}):
+        f = files[name]
+        h.update(name.encode("utf-8"))
+        for part in f if isinstance(f, tuple) else (f,):
+            h.update(part if isinstance(part, (bytes, bytearray)) else str(part).encode("utf-8"))
+    return h.hexdigest()
+
+
+def _count(name: str) -> None:
+    with _LOCK:
+        _STATS[name] += 1
+
+
+def stats() -> Dict[str, int]:
+    """Líderes (llamadas reales), seguidores atendidos y streams abortados (este proceso)."""
+    with _LOCK:
+        return {**_STATS, "in_flight": len(_CALLS) + len(_STREAMS)}
+
+
+# ==========================================================
+# Llamadas con resultado único
+# ==========================================================
+def do(key: str, fn: Callable[[], T]) -> Tuple[T, bool]:
+    """Ejecuta fn() o espera a la ejecución idéntica en curso. Devuelve (resultado, compartido)."""
+    if not enabled():
+        return fn(), False
+    with _LOCK:
+        fut = _CALLS.get(key)
+        leader = fut is None
+        if leader:
+            fut = _CALLS[key] = Future()
+            _STATS["leaders"] += 1
+    if not leader:
+        result = fut.result()  # re-lanza la excepción del líder
+        _count("shared")
+        return result, True
+
+    try:
+        result = fn()
+    except BaseException as e:
+        fut.set_exception(e)
+        raise
+    else:
+        fut.set_result(result)
+        return result, False
+    finally:
+        with _LOCK:
+            _CALLS.pop(key, None)
+
+
+# ==========================================================
+# Streams compartidos
+# ==========================================================
+class _Broadcast:
+    """Fragmentos del stream; cada lector los recorre desde el inicio con su propio índice."""
+
+    def __init__(self) -> None:
+        self.cv = threading.Condition()
+        self.chunks: List[Any] = []
+        self.readers = 0
+        self.done = False
+        self.error: Optional[BaseException] = None
+
+    def join(self) -> None:
+        with self.cv:
+            self.readers += 1
+
+    def leave(self) -> None:
+        with self.cv:
+            self.readers -= 1
+
+    def publish(self, chunk: Any) -> bool:
+        """Agrega un fragmento; False si ya no queda nadie leyendo (el productor puede parar)."""
+        with self.cv:
+            self.chunks.append(chunk)
+            self.cv.notify_all()
+            return self.readers > 0
+
+    def close(self, error: Optional[BaseException] = None) -> None:
+        with self.cv:
+            self.done, self.error = True, error
+            self.cv.notify_all()
+
+    def follow(self) -> Iterator[Any]:
+        i = 0
+        while True:
+            with self.cv:
+                while i >= len(self.chunks) and not self.done:
+                    self.cv.wait()
+                pending, i = self.chunks[i:], len(self.chunks)
+                done, error = self.done, self.error
+            yield from pending
+            if done and i >= len(self.chunks):
+                if error is not None:
+                    raise error
+                return
+
+
+def _produce(key: str, bc: _Broadcast, open_stream: Callable[[], Iterator[Any]], ctx: Tuple[Any, ...]) -> None:
+    """Lee el stream real en su propio hilo (con el contexto de quien lo abrió) y lo reparte."""
+    tool, route, owner, trace = ctx
+    error: Optional[BaseException] = None
+    with utils_telemetry.tool_scope(tool), utils_telemetry.route_scope(route), utils_ratelimit.owner_scope(owner), \
+            utils_tracing.attach(trace):
+        it = open_stream()
+        try:
+            for chunk in it:
+                if not bc.publish(chunk):
+                    error = FlightAborted("Todos los lectores abandonaron el stream.")
+                    _count("aborted")
+                    break
+        except Exception as e:  # noqa: BLE001 - se re-lanza en cada lector
+            error = e
+        finally:
+            close = getattr(it, "close", None)
+            if close is not None:
+                close()  # cierra la respuesta HTTP si se dejó a medias
+            # Nadie nuevo se une a un stream que ya terminó
+            with _LOCK:
+                if _STREAMS.get(key) is bc:
+                    del _STREAMS[key]
+            bc.close(error)
+
+
+def stream(key: str, open_stream: Callable[[], Iterator[T]]) -> Iterator[Tuple[T, bool]]:
+    """
+    Itera open_stream() o se une al stream idéntico en curso; entrega
+    (fragmento, compartido). El stream real corre en un hilo propio: si quien
+    lo abrió deja de leer, los demás siguen recibiendo; si ya nadie lee, se corta.
+    """
+    if not enabled():
+        for chunk in open_stream():
+            yield chunk, False
+        return
+    with _LOCK:
+        bc = _STREAMS.get(key)
+        shared = bc is not None
+        if not shared:
+            bc = _STREAMS[key] = _Broadcast()
+        _STATS["shared" if shared else "leaders"] += 1
+        bc.join()
+    if not shared:
+        ctx = (
+            utils_telemetry.current_tool(), utils_telemetry.current_route(), utils_ratelimit.current_owner(),
+            utils_tracing.current(),
+        )
+        threading.Thread(
+            target=_produce, args=(key, bc, open_stream, ctx), name="imemsa-singleflight", daemon=True
+        ).start()
+    try:
+        for chunk in bc.follow():
+            yield chunk, shared
+    finally:
+        bc.leave()
@@ -0,0 +1,21 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+
+
+# ==========================================================
+# Carpeta de datos locales del portal (cachés, bases SQLite, etc.)
+# - IMEMSA_DATA_DIR la sobreescribe (p. ej. un volumen compartido entre procesos).
+# - Por defecto: <repo>/.data (ignorada en git).
+# ==========================================================
+BASE_DIR = Path(__file__).resolve().parent
+DEFAULT_DATA_DIR = BASE_DIR / ".data"
+
+
+def data_dir(*parts: str) -> Path:
+    """Ruta dentro de la carpeta de datos (se crea si no existe)."""
+    root = Path(os.getenv("IMEMSA_DATA_DIR", "").strip() or DEFAULT_DATA_DIR)
+    path = root.joinpath(*parts)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
@@ -0,0 +1,300 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import utils_ledger
+import utils_metrics
+from utils_ratelimit import current_owner
+from utils_storage import data_dir
+
+
+# ==========================================================
+# Telemetría de llamadas LLM (serie de tiempo local, un JSONL por día)
+#
+# Cada llamada del gateway (utils_llm) deja un registro con herramienta,
+# modelo, latencia (y espera en el limitador), tokens, bytes, acierto de
+# caché y clase de error.
+# La página de administración (pages/8_telemetria.py) lo agrega por
+# herramienta y por día.
+#
+# Variables de entorno:
+#   IMEMSA_TELEMETRY            "0" para desactivar
+#   IMEMSA_TELEMETRY_KEEP_DAYS  días de archivos que se conservan (default 90)
+#   IMEMSA_LLM_PRICES           JSON {modelo: [USD/1M entrada, USD/1M salida, USD/1M entrada en caché]}
+# ==========================================================
+SUBDIR = "telemetry"
+EXTRA_ATTEMPTS = ("perdedor", "duplicado_error")  # intentos duplicados que no son una solicitud
+
+# USD por 1M de tokens (entrada, salida[, entrada en caché del proveedor]). Ajusta según la lista de precios vigente.
+PRICES: Dict[str, List[float]] = {
+    "gpt-4o-mini": [0.15, 0.60, 0.075],
+    "gpt-4o": [2.50, 10.00, 1.25],
+    "gpt-4.1-nano": [0.10, 0.40, 0.025],
+    "gpt-4.1-mini": [0.40, 1.60, 0.10],
+    "gpt-4o-mini-transcribe": [1.25, 5.00],
+    "gpt-4o-transcribe": [2.50, 10.00],
+}
+
+_LOCK = threading.Lock()
+_LOCAL = threading.local()
+_PRUNED_ON: Optional[date] = None
+
+
+def enabled() -> bool:
+    return os.getenv("IMEMSA_TELEMETRY", "1") != "0"
+
+
+def _keep_days() -> int:
+    try:
+        return max(1, int(os.getenv("IMEMSA_TELEMETRY_KEEP_DAYS", "90")))
+    except ValueError:
+        return 90
+
+
+def _prices() -> Dict[str, List[float]]:
+    raw = os.getenv("IMEMSA_LLM_PRICES", "")
+    if not raw:
+        return PRICES
+    try:
+        return {**PRICES, **json.loads(raw)}
+    except ValueError:
+        return PRICES
+
+
+def cost_usd(model: str, input_tokens: int, output_tokens: int, cached_tokens: int = 0) -> float:
+    """
+    Costo estimado; los modelos con fecha (gpt-4o-mini-2024-07-18) usan el precio base.
+    `cached_tokens` (parte de la entrada servida por la caché de prompts) usa el tercer precio, si existe.
+    """
+    prices = _prices()
+    price = prices.get(model) or next(
+        (v for k, v in sorted(prices.items(), key=lambda kv: -len(kv[0])) if model.startswith(k)), None
+    )
+    if not price:
+        return 0.0
+    cached = min(cached_tokens, input_tokens) if len(price) > 2 else 0
+    total = (input_tokens - cached) * price[0] + output_tokens * price[1]
+    if cached:
+        total += cached * price[2]
+    return total / 1_000_000
+
+
+# ==========================================================
+# Herramienta que origina la llamada
+# ==========================================================
+@contextmanager
+def tool_scope(tool: str) -> Iterator[None]:
+    """Atribuye las llamadas LLM de este hilo a `tool` (los trabajos de utils_jobs lo fijan)."""
+    prev = getattr(_LOCAL, "tool", None)
+    _LOCAL.tool = tool
+    try:
+        yield
+    finally:
+        _LOCAL.tool = prev
+
+
+def current_tool() -> str:
+    return getattr(_LOCAL, "tool", None) or "otro"
+
+
+@contextmanager
+def route_scope(route: str) -> Iterator[None]:
+    """Anota en las llamadas de este hilo la ruta elegida por utils_llm_routing ("tier/bucket")."""
+    prev = getattr(_LOCAL, "route", None)
+    _LOCAL.route = route
+    try:
+        yield
+    finally:
+        _LOCAL.route = prev
+
+
+def current_route() -> str:
+    return getattr(_LOCAL, "route", None) or ""
+
+
+# ==========================================================
+# Escritura
+# ==========================================================
+def _path_for(day: date) -> Path:
+    return data_dir(SUBDIR) / f"llm-{day.isoformat()}.jsonl"
+
+
+def _prune(today: date) -> None:
+    global _PRUNED_ON
+    if _PRUNED_ON == today:
+        return
+    _PRUNED_ON = today
+    cutoff = today - timedelta(days=_keep_days())
+    for p in data_dir(SUBDIR).glob("llm-*.jsonl"):
+        try:
+            if date.fromisoformat(p.stem[4:]) < cutoff:
+                p.unlink()
+        except (ValueError, OSError):
+            continue
+
+
+def record(
+    *,
+    endpoint: str,
+    model: str,
+    latency_ms: float,
+    queue_ms: float = 0.0,
+    input_tokens: int = 0,
+    output_tokens: int = 0,
+    cached_tokens: int = 0,
+    bytes_out: int = 0,
+    bytes_in: int = 0,
+    cache_hit: bool = False,
+    stream: bool = False,
+    hedge: str = "",
+    coalesced: bool = False,
+    audio_seconds: float = 0.0,
+    images: int = 0,
+    input_hash: str = "",
+    error: str = "",
+    status: Optional[int] = None,
+) -> None:
+    """
+    Agrega un registro al JSONL del día, al libro de consumo (utils_ledger)
+    y a las métricas del proceso (utils_metrics).
+    Nunca lanza: la telemetría no debe tumbar una herramienta.
+    """
+    if not enabled() and not utils_ledger.enabled() and not utils_metrics.enabled():
+        return
+    now = time.time()
+    row: Dict[str, Any] = {
+        "ts": round(now, 3),
+        "tool": current_tool(),
+        "route": current_route(),
+        "session": current_owner(),
+        "endpoint": endpoint,
+        "model": model,
+        "latency_ms": round(latency_ms, 1),
+        "queue_ms": round(queue_ms, 1),
+        "input_tokens": int(input_tokens or 0),
+        "output_tokens": int(output_tokens or 0),
+        "cached_tokens": int(cached_tokens or 0),
+        "bytes_out": int(bytes_out or 0),
+        "bytes_in": int(bytes_in or 0),
+        "cache_hit": bool(cache_hit),
+        "stream": bool(stream),
+        "hedge": hedge,  # "" | "original"/"duplicado" (ganador de una solicitud duplicada) | "perdedor" | "duplicado_error"
+        "coalesced": bool(coalesced),  # esperó la misma solicitud de otra sesión (sin costo propio)
+        "audio_seconds": round(float(audio_seconds or 0.0), 2),
+        "images": int(images or 0),
+        "input_hash": input_hash,
+        "error": error,
+        "status": status,
+        "cost_usd": 0.0 if cache_hit or coalesced else round(cost_usd(model, input_tokens or 0, output_tokens or 0, cached_tokens or 0), 6),
+    }
+    utils_metrics.observe_llm(row)
+    utils_ledger.append(row)
+    if not enabled():
+        return
+    try:
+        today = date.fromtimestamp(now)
+        line = json.dumps(row, ensure_ascii=False) + "\n"
+        with _LOCK:
+            _prune(today)
+            with _path_for(today).open("a", encoding="utf-8") as f:
+                f.write(line)
+    except OSError:
+        pass
+
+
+def usage_tokens(usage: Any) -> Tuple[int, int]:
+    """(entrada, salida) desde `usage` de chat (prompt/completion) o de audio (input/output)."""
+    if not isinstance(usage, dict):
+        return 0, 0
+    inp = usage.get("prompt_tokens", usage.get("input_tokens", 0)) or 0
+    out = usage.get("completion_tokens", usage.get("output_tokens", 0)) or 0
+    return int(inp), int(out)
+
+
+def usage_cached_tokens(usage: Any) -> int:
+    """Tokens de entrada servidos por la caché de prompts del proveedor (chat o Responses)."""
+    if not isinstance(usage, dict):
+        return 0
+    details = usage.get("prompt_tokens_details") or usage.get("input_tokens_details") or {}
+    return int(details.get("cached_tokens") or 0) if isinstance(details, dict) else 0
+
+
+# ==========================================================
+# Lectura / agregados (página de administración)
+# ==========================================================
+def load(days: int = 30):
+    """Registros de los últimos `days` días como DataFrame (columna `day` = fecha local)."""
+    import pandas as pd
+
+    today = date.today()
+    rows: List[Dict[str, Any]] = []
+    for i in range(days):
+        p = _path_for(today - timedelta(days=i))
+        if not p.exists():
+            continue
+        with p.open(encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rows.append(json.loads(line))
+                except ValueError:
+                    continue
+    df = pd.DataFrame(rows)
+    if df.empty:
+        return df
+    df["time"] = pd.to_datetime(df["ts"], unit="s")
+    df["day"] = df["ts"].map(lambda t: datetime.fromtimestamp(t).date())
+    df["ok"] = df["error"].fillna("") == ""
+    if "cached_tokens" not in df:
+        df["cached_tokens"] = 0  # registros anteriores al campo
+    df["cached_tokens"] = df["cached_tokens"].fillna(0).astype(int)
+    df["route"] = df["route"].fillna("") if "route" in df else ""
+    df["hedge"] = df["hedge"].fillna("") if "hedge" in df else ""
+    df["coalesced"] = df["coalesced"].fillna(False).astype(bool) if "coalesced" in df else False
+    return df.sort_values("ts")
+
+
+def summarize(df, by: List[str]):
+    """
+    Llamadas, p50/p95 de latencia (sin caché, errores ni perdedores de un
+    duplicado), tokens, costo, % caché, % compartidas con otra sesión en curso,
+    % de prefijo en caché, % error y % de solicitudes duplicadas (con cuántas
+    ganó el duplicado).
+    """
+    import pandas as pd
+
+    if df.empty:
+        return pd.DataFrame()
+    live = df[df["ok"] & ~df["cache_hit"] & (df["hedge"] != "perdedor")]
+    g = df.groupby(by)
+    # Tokens enviados: los aciertos de caché y las compartidas traen el `usage` de la llamada original
+    billed = df[~df["cache_hit"] & ~df["coalesced"]].groupby(by)[["input_tokens", "output_tokens"]].sum()
+    billed = billed.reindex(g.size().index, fill_value=0)
+    out = pd.DataFrame(
+        {
+            "llamadas": g.size(),
+            "errores_%": (g["ok"].apply(lambda s: 100.0 * (~s).mean())).round(1),
+            "cache_%": (g["cache_hit"].mean() * 100).round(1),
+            "compartidas_%": (g["coalesced"].mean() * 100).round(1),
+            "tokens_entrada": billed["input_tokens"],
+            "tokens_salida": billed["output_tokens"],
+            "costo_usd": g["cost_usd"].sum().round(4),
+        }
+    )
+    lat = live.groupby(by)["latency_ms"]
+    out["p50_ms"] = lat.quantile(0.50).round(0)
+    out["p95_ms"] = lat.quantile(0.95).round(0)
+    # Parte de la entrada que el proveedor sirvió de su caché de prompts (solo llamadas reales)
+    sent = df[~df["cache_hit"]].groupby(by)
+    out["prefijo_cache_%"] = (100 * sent["cached_tokens"].sum() / sent["input_tokens"].sum().where(lambda v: v > 0)).round(1)
+    # Duplicados: los perdedores y los duplicados que fallaron son llamadas extra, no solicitudes
+    asked = df[~df["hedge"].isin(EXTRA_ATTEMPTS)].groupby(by)["hedge"]
+    out["duplicados_%"] = (asked.apply(lambda s: 100.0 * (s != "").mean())).round(1)
+    out["gana_duplicado"] = asked.apply(lambda s: int((s == "duplicado").sum()))
+    return out.reset_index()
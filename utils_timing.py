@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+import threading
+import time
+import tracemalloc
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque, List, Optional
+
+import utils_tracing
+
+
+# ==========================================================
+# Cronómetro por etapas para flujos largos (p. ej. "Generar Excel")
+# - lap(nombre) cierra la etapa que acaba de terminar.
+# - Si tracemalloc está activo (benchmark), guarda también el pico de memoria por etapa.
+# - La corrida y cada etapa quedan también como spans (utils_tracing).
+# ==========================================================
+@dataclass
+class Stage:
+    name: str
+    seconds: float
+    peak_kb: Optional[float] = None
+
+
+@dataclass
+class StageRun:
+    name: str
+    started: float
+    stages: List[Stage] = field(default_factory=list)
+    total: float = 0.0
+
+
+_RUNS: Deque[StageRun] = deque(maxlen=50)
+_LOCK = threading.Lock()
+
+
+class StageClock:
+    def __init__(self, name: str) -> None:
+        self.run = StageRun(name=name, started=time.time())
+        self._t0 = time.perf_counter()
+        self._last = self._t0
+        self._span = utils_tracing.begin(name)
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+
+    def lap(self, name: str) -> float:
+        now = time.perf_counter()
+        peak = None
+        if tracemalloc.is_tracing():
+            peak = tracemalloc.get_traced_memory()[1] / 1024.0
+            tracemalloc.reset_peak()
+        secs = now - self._last
+        self.run.stages.append(Stage(name, secs, peak))
+        utils_tracing.record_span(name, self._last, parent=self._span)
+        self._last = now
+        return secs
+
+    def finish(self) -> StageRun:
+        self.run.total = time.perf_counter() - self._t0
+        utils_tracing.end(self._span)
+        with _LOCK:
+            _RUNS.append(self.run)
+        return self.run
+
+
+def last_runs(name: Optional[str] = None) -> List[StageRun]:
+    """Corridas terminadas en este proceso (las más recientes al final)."""
+    with _LOCK:
+        runs = list(_RUNS)
+    return [r for r in runs if name is None or r.name == name]
@@ -0,0 +1,402 @@
+from __future__ import annotations
+
+import functools
+import json
+import os
+import secrets
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from datetime import date, timedelta
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple, TypeVar
+
+import requests
+
+from utils_storage import data_dir
+
+
+# ==========================================================
+# Trazas ligeras: spans anidados por clic (request_id = trace_id)
+#
+#   with span("documentos", archivo=name):        # sin traza activa → raíz nueva (un clic)
+#       with span("pdf_a_png") as sp:
+#           ...
+#           sp.set(paginas=n)
+#   @traced("documentos.extraer_json")
+#   record_span("llm chat/completions", t0, modelo=...)   # ya cronometrado (perf_counter)
+#   root = begin("Generar Excel"); ...; end(root)         # sin bloque `with` (hijos con parent=root)
+#
+# El contexto vive por hilo (como tool_scope de utils_telemetry). Los hilos
+# propios (utils_jobs, utils_singleflight, utils_hedge) lo copian con
+# current() / attach(ctx), así el trabajo en segundo plano queda bajo el clic
+# que lo lanzó. Cada span terminado se encola y un hilo lo escribe por lotes:
+# JSONL del día en <datos>/traces y, si se configura, OTLP/HTTP (JSON) a un
+# colector local (otel-collector, Jaeger, Tempo).
+#
+# Variables de entorno:
+#   IMEMSA_TRACING           "0" para desactivar
+#   IMEMSA_TRACE_FILE        "0" para no escribir JSONL (solo colector)
+#   IMEMSA_TRACE_OTLP_URL    p. ej. http://127.0.0.1:4318/v1/traces
+#   IMEMSA_TRACE_KEEP_DAYS   días de archivos que se conservan (default 14)
+# ==========================================================
+SUBDIR = "traces"
+SERVICE_NAME = "imemsa-portal"
+FLUSH_INTERVAL_S = 1.0
+QUEUE_MAX = 20_000
+OTLP_TIMEOUT_S = 2.0
+OTLP_COOLDOWN_S = 30.0
+
+T = TypeVar("T")
+Context = Tuple[str, str]  # (trace_id, span_id)
+
+_LOCAL = threading.local()
+_LOCK = threading.Lock()
+_QUEUE: Deque["Span"] = deque(maxlen=QUEUE_MAX)
+_WRITER: Optional[threading.Thread] = None
+_PRUNED_ON: Optional[date] = None
+_OTLP_DOWN_UNTIL = 0.0
+
+
+def enabled() -> bool:
+    return os.getenv("IMEMSA_TRACING", "1").strip().lower() not in ("0", "false", "no", "off")
+
+
+def _keep_days() -> int:
+    try:
+        return max(1, int(os.getenv("IMEMSA_TRACE_KEEP_DAYS", "14")))
+    except ValueError:
+        return 14
+
+
+@dataclass
+class Span:
+    trace_id: str
+    span_id: str
+    parent_id: str
+    name: str
+    start: float  # epoch (s)
+    duration_ms: float = 0.0
+    status: str = "ok"  # ok | error | cancelado (st.stop / rerun)
+    error: str = ""
+    thread: str = ""
+    attrs: Dict[str, Any] = field(default_factory=dict)
+    t0: float = field(default=0.0, repr=False)  # perf_counter al abrir (no se exporta)
+
+    def set(self, **attrs: Any) -> None:
+        self.attrs.update(attrs)
+
+
+# ==========================================================
+# Contexto por hilo
+# ==========================================================
+def _stack() -> List[Span]:
+    stack = getattr(_LOCAL, "stack", None)
+    if stack is None:
+        stack = _LOCAL.stack = []
+    return stack
+
+
+def current() -> Optional[Context]:
+    """(trace_id, span_id) activo en este hilo, para llevarlo a otro con attach()."""
+    stack = _stack()
+    if stack:
+        return stack[-1].trace_id, stack[-1].span_id
+    return getattr(_LOCAL, "remote", None)
+
+
+def request_id() -> str:
+    """trace_id activo ("" si no hay): el id que se muestra al usuario para soporte."""
+    ctx = current()
+    return ctx[0] if ctx else ""
+
+
+@contextmanager
+def attach(ctx: Optional[Context]) -> Iterator[None]:
+    """Los spans de este hilo cuelgan de `ctx` (capturado con current() en otro hilo)."""
+    prev = getattr(_LOCAL, "remote", None)
+    _LOCAL.remote = ctx
+    try:
+        yield
+    finally:
+        _LOCAL.remote = prev
+
+
+def _new_span(name: str, attrs: Dict[str, Any]) -> Span:
+    parent = current()
+    return Span(
+        trace_id=parent[0] if parent else secrets.token_hex(16),
+        span_id=secrets.token_hex(8),
+        parent_id=parent[1] if parent else "",
+        name=name,
+        start=time.time(),
+        thread=threading.current_thread().name,
+        attrs=dict(attrs),
+    )
+
+
+@contextmanager
+def span(name: str, **attrs: Any) -> Iterator[Span]:
+    """Mide el bloque como hijo del span activo (o como raíz de una traza nueva)."""
+    if not enabled():
+        yield Span("", "", "", name, 0.0)
+        return
+    sp = _new_span(name, attrs)
+    stack = _stack()
+    stack.append(sp)
+    t0 = sp.t0 = time.perf_counter()
+    try:
+        yield sp
+    except Exception as e:
+        sp.status, sp.error = "error", f"{type(e).__name__}: {e}"[:500]
+        raise
+    except BaseException:
+        sp.status = "cancelado"  # st.stop() / st.rerun() usan excepciones de control
+        raise
+    finally:
+        sp.duration_ms = round((time.perf_counter() - t0) * 1000, 2)
+        if stack and stack[-1] is sp:
+            stack.pop()
+        _emit(sp)
+
+
+def traced(name: Optional[str] = None) -> Callable[[Callable[..., T]], Callable[..., T]]:
+    """Decorador: cada llamada queda en un span (por defecto, el nombre de la función)."""
+
+    def deco(fn: Callable[..., T]) -> Callable[..., T]:
+        label = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> T:
+            with span(label):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return deco
+
+
+def begin(name: str, **attrs: Any) -> Optional[Span]:
+    """Abre un span sin volverlo el activo del hilo (flujos que no caben en un `with`); cerrar con end()."""
+    if not enabled():
+        return None
+    sp = _new_span(name, attrs)
+    sp.t0 = time.perf_counter()
+    return sp
+
+
+def end(sp: Optional[Span], error: str = "") -> None:
+    if sp is None or not sp.t0:
+        return
+    sp.duration_ms = round((time.perf_counter() - sp.t0) * 1000, 2)
+    sp.t0 = 0.0
+    if error:
+        sp.status, sp.error = "error", error[:500]
+    _emit(sp)
+
+
+def record_span(name: str, t0: float, error: str = "", parent: Optional[Span] = None, **attrs: Any) -> None:
+    """
+    Span ya cronometrado desde t0 (perf_counter) hasta ahora; útil en generadores y callbacks.
+    Cuelga del span activo del hilo o de `parent` (uno abierto con begin()).
+    """
+    if not enabled():
+        return
+    elapsed = max(0.0, time.perf_counter() - t0)
+    sp = _new_span(name, {k: v for k, v in attrs.items() if v not in (None, "")})
+    if parent is not None:
+        sp.trace_id, sp.parent_id = parent.trace_id, parent.span_id
+    sp.start -= elapsed
+    sp.duration_ms = round(elapsed * 1000, 2)
+    if error:
+        sp.status, sp.error = "error", error[:500]
+    _emit(sp)
+
+
+# ==========================================================
+# Exportación (hilo escritor por lotes)
+# ==========================================================
+def _emit(sp: Span) -> None:
+    global _WRITER
+    _QUEUE.append(sp)
+    if _WRITER is None:
+        with _LOCK:
+            if _WRITER is None:
+                _WRITER = threading.Thread(target=_writer_loop, name="imemsa-tracing", daemon=True)
+                _WRITER.start()
+
+
+def _writer_loop() -> None:
+    while True:
+        time.sleep(FLUSH_INTERVAL_S)
+        flush()
+
+
+def flush() -> int:
+    """Escribe lo pendiente (lo llama el hilo escritor; también sirve al cerrar un benchmark)."""
+    batch: List[Span] = []
+    while True:
+        try:
+            batch.append(_QUEUE.popleft())
+        except IndexError:
+            break
+    if not batch:
+        return 0
+    with _LOCK:  # un solo escritor a la vez (flush manual + hilo)
+        if os.getenv("IMEMSA_TRACE_FILE", "1") != "0":
+            _write_jsonl(batch)
+        url = os.getenv("IMEMSA_TRACE_OTLP_URL", "").strip()
+        if url:
+            _send_otlp(url, batch)
+    return len(batch)
+
+
+def _path_for(day: date):
+    return data_dir(SUBDIR) / f"spans-{day.isoformat()}.jsonl"
+
+
+def _prune(today: date) -> None:
+    global _PRUNED_ON
+    if _PRUNED_ON == today:
+        return
+    _PRUNED_ON = today
+    cutoff = today - timedelta(days=_keep_days())
+    for p in data_dir(SUBDIR).glob("spans-*.jsonl"):
+        try:
+            if date.fromisoformat(p.stem[6:]) < cutoff:
+                p.unlink()
+        except (ValueError, OSError):
+            continue
+
+
+def _as_row(sp: Span) -> Dict[str, Any]:
+    row = asdict(sp)
+    del row["t0"]
+    return row
+
+
+def _write_jsonl(batch: List[Span]) -> None:
+    try:
+        today = date.today()
+        _prune(today)
+        lines = "".join(json.dumps(_as_row(sp), ensure_ascii=False, default=str) + "\n" for sp in batch)
+        with _path_for(today).open("a", encoding="utf-8") as f:
+            f.write(lines)
+    except OSError:
+        pass
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_payload(batch: List[Span]) -> Dict[str, Any]:
+    spans = []
+    for sp in batch:
+        start_ns = int(sp.start * 1e9)
+        attrs = {**sp.attrs, "thread.name": sp.thread}
+        spans.append({
+            "traceId": sp.trace_id,
+            "spanId": sp.span_id,
+            "parentSpanId": sp.parent_id,
+            "name": sp.name,
+            "kind": 1,  # INTERNAL
+            "startTimeUnixNano": str(start_ns),
+            "endTimeUnixNano": str(start_ns + int(sp.duration_ms * 1e6)),
+            "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in attrs.items()],
+            "status": {"code": 2, "message": sp.error} if sp.status == "error" else {"code": 0},
+        })
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+            "scopeSpans": [{"scope": {"name": "utils_tracing"}, "spans": spans}],
+        }]
+    }
+
+
+def _send_otlp(url: str, batch: List[Span]) -> None:
+    # Si el colector no responde, se descarta el lote (el JSONL local queda) y se espera antes de reintentar
+    global _OTLP_DOWN_UNTIL
+    if time.monotonic() < _OTLP_DOWN_UNTIL:
+        return
+    try:
+        resp = requests.post(url, json=_otlp_payload(batch), timeout=OTLP_TIMEOUT_S)
+        if resp.status_code >= 400:
+            raise requests.HTTPError(f"HTTP {resp.status_code}")
+    except requests.RequestException:
+        _OTLP_DOWN_UNTIL = time.monotonic() + OTLP_COOLDOWN_S
+
+
+# ==========================================================
+# Lectura (página de telemetría)
+# ==========================================================
+def load(days: int = 1) -> List[Dict[str, Any]]:
+    """Spans de los últimos `days` días (incluye hoy)."""
+    out: List[Dict[str, Any]] = []
+    today = date.today()
+    for i in range(max(1, days) - 1, -1, -1):
+        p = _path_for(today - timedelta(days=i))
+        if not p.exists():
+            continue
+        with p.open(encoding="utf-8") as f:
+            for line in f:
+                try:
+                    out.append(json.loads(line))
+                except ValueError:
+                    continue
+    return out
+
+
+def find(ident: str, days: int = 7) -> List[Dict[str, Any]]:
+    """Spans de la traza con ese request_id, o de la que contiene el trabajo (job_id) indicado."""
+    ident = (ident or "").strip()
+    if not ident:
+        return []
+    spans = load(days)
+    traces = {s["trace_id"] for s in spans if s.get("trace_id") == ident or s.get("attrs", {}).get("job_id") == ident}
+    return [s for s in spans if s["trace_id"] in traces]
+
+
+def tree(spans: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Filas en orden de árbol (padre antes que hijos) con `depth` y `offset_ms` desde el inicio de la traza."""
+    by_parent: Dict[str, List[Dict[str, Any]]] = {}
+    ids = {s["span_id"] for s in spans}
+    for s in spans:
+        parent = s.get("parent_id") if s.get("parent_id") in ids else ""
+        by_parent.setdefault(parent, []).append(s)
+    t0 = min((s["start"] for s in spans), default=0.0)
+    rows: List[Dict[str, Any]] = []
+
+    def walk(parent: str, depth: int) -> None:
+        for s in sorted(by_parent.get(parent, []), key=lambda x: x["start"]):
+            rows.append({**s, "depth": depth, "offset_ms": round((s["start"] - t0) * 1000, 1)})
+            walk(s["span_id"], depth + 1)
+
+    walk("", 0)
+    return rows
+
+
+def slowest_roots(days: int = 1, limit: int = 20) -> List[Dict[str, Any]]:
+    """Trazas más lentas: duración de extremo a extremo (incluye trabajos que siguieron tras el clic)."""
+    by_trace: Dict[str, Dict[str, Any]] = {}
+    for s in load(days):
+        t = by_trace.setdefault(s["trace_id"], {"trace_id": s["trace_id"], "start": s["start"], "end": 0.0, "root": "", "spans": 0, "errors": 0})
+        t["start"] = min(t["start"], s["start"])
+        t["end"] = max(t["end"], s["start"] + s["duration_ms"] / 1000)
+        t["spans"] += 1
+        t["errors"] += s.get("status") == "error"
+        if not s.get("parent_id"):
+            t["root"] = s["name"]
+    rows = [
+        {"trace_id": t["trace_id"], "root": t["root"] or "?", "start": t["start"],
+         "total_ms": round((t["end"] - t["start"]) * 1000, 1), "spans": t["spans"], "errors": t["errors"]}
+        for t in by_trace.values()
+    ]
+    return sorted(rows, key=lambda r: -r["total_ms"])[:limit]